@@ -0,0 +1,255 @@
+"""
+Module: fake_backends
+
+Description:
+------------
+This module replaces the remote services the crawler calls with deterministic offline stand-ins, so
+benchmarks run without network access or API keys and give the same results every time. Only the
+clients are replaced: reading, tokenising, map-reduce, batching, rate limiting and metrics all run the
+real code.
+
+- The summary, hashtag and combined analysis chains return text derived from a hash of the document.
+- The embeddings client returns unit vectors seeded by a hash of the text.
+- Documents are converted by the local HTTP stub of the Azure AI Document Intelligence analyze and poll
+  endpoints the tests use (tests/document_intelligence_stub.py), which returns words derived from a hash
+  of every page. The real DocumentConversionService talks to it, so its connection pool, in-flight limit
+  and polling are measured too.
+
+Each stand-in sleeps for a configurable latency, so runs can model anything from free backends, which
+measure the crawler's own overhead, to realistic service latencies.
+
+Classes:
+--------
+- BackendLatency
+    The simulated latencies of the fake backends.
+- FakeChain
+    Stands in for a prompt | model | parser chain.
+- FakeEmbeddings
+    Stands in for the OpenAIEmbeddings client.
+
+Functions:
+----------
+- install_fake_backends(latency: BackendLatency) -> None
+    Points the crawler's agents, embedding client and document converter at the fakes.
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tests.document_intelligence_stub import StubDocumentIntelligence
+
+# Words the fake model outputs are made of
+WORDS = [
+    'report', 'budget', 'contract', 'meeting', 'project', 'invoice', 'policy', 'schedule', 'design', 'review',
+    'customer', 'supplier', 'quarter', 'summary', 'analysis', 'risk', 'plan', 'team', 'release', 'minutes',
+    'proposal', 'agreement', 'forecast', 'audit', 'training', 'research', 'product', 'market', 'strategy', 'data',
+]
+# Hashtags the fake model chooses from, so hashtag nodes are shared between files as in real crawls
+HASHTAGS = [f"{word}{index}" for word in WORDS for index in range(8)]
+
+# Simulated latencies in seconds: per model call, per thousand prompt tokens of a model call, per
+# embedding request, per document conversion and per converted page
+BackendLatency = namedtuple('BackendLatency', ['llm', 'llm_per_1k_tokens', 'embedding', 'conversion',
+                                               'conversion_per_page'], defaults=(0.0, 0.0, 0.0, 0.0, 0.0))
+# Seconds between polls of the stub's operations; Azure asks for about one second, which would swamp
+# the simulated latencies
+STUB_POLL_INTERVAL = 0.005
+
+
+def _digest(text):
+    """
+    Returns a stable hash of a text.
+    """
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+class FakeChain:
+    """
+    A class standing in for the LangChain chains of summarise_agent, hashtag_agent and analysis_agent.
+
+    Attributes:
+    ----------
+    kind : str
+        'summary', 'hashtags' or 'analysis', deciding the shape of the output.
+    latency : BackendLatency
+        The simulated latencies.
+
+    Methods:
+    -------
+    invoke(inputs):
+        Returns the fake model output for a document.
+    ainvoke(inputs):
+        Asynchronous version of invoke.
+    """
+
+    def __init__(self, kind, latency):
+        """
+        Initializes the FakeChain.
+
+        Parameters:
+        ----------
+        kind : str
+            'summary', 'hashtags' or 'analysis'.
+        latency : BackendLatency
+            The simulated latencies.
+        """
+        self.kind = kind
+        self.latency = latency
+
+    def _delay(self, document):
+        """
+        Returns the simulated duration of a call, from the approximate prompt size.
+        """
+        return self.latency.llm + self.latency.llm_per_1k_tokens * len(document) / 4000
+
+    def _output(self, document):
+        """
+        Builds the output for a document from its hash.
+        """
+        rng = random.Random(_digest(document))
+        summary = f"Summary: a {' '.join(rng.choice(WORDS) for _ in range(40))}."
+        hashtags = rng.sample(HASHTAGS, 5)
+        if self.kind == 'summary':
+            return summary
+        if self.kind == 'hashtags':
+            return ' '.join(f"#{hashtag}" for hashtag in hashtags)
+        return json.dumps({'summary': summary, 'hashtags': hashtags})
+
+    def invoke(self, inputs):
+        """
+        Returns the fake model output for a document after the simulated latency.
+
+        Parameters:
+        ----------
+        inputs : dict
+            The chain inputs, holding the document as 'working_doc'.
+
+        Returns:
+        -------
+        str
+            The output, shaped like the real model's reply.
+        """
+        time.sleep(self._delay(inputs['working_doc']))
+        return self._output(inputs['working_doc'])
+
+    async def ainvoke(self, inputs):
+        """
+        Asynchronous version of invoke.
+        """
+        await asyncio.sleep(self._delay(inputs['working_doc']))
+        return self._output(inputs['working_doc'])
+
+
+class FakeEmbeddings:
+    """
+    A class standing in for the OpenAIEmbeddings client.
+
+    Attributes:
+    ----------
+    dimensions : int
+        The number of dimensions of the embeddings.
+    latency : BackendLatency
+        The simulated latencies.
+
+    Methods:
+    -------
+    embed_documents(texts):
+        Returns one embedding per text after one request's latency.
+    embed_query(text):
+        Returns the embedding of a query.
+    """
+
+    def __init__(self, dimensions, latency):
+        """
+        Initializes the FakeEmbeddings.
+
+        Parameters:
+        ----------
+        dimensions : int
+            The number of dimensions of the embeddings.
+        latency : BackendLatency
+            The simulated latencies.
+        """
+        self.dimensions = dimensions
+        self.latency = latency
+
+    def _embedding(self, text):
+        """
+        Returns a unit vector seeded by the text.
+        """
+        rng = random.Random(_digest(text))
+        vector = [rng.gauss(0, 1) for _ in range(self.dimensions)]
+        norm = math.sqrt(sum(value * value for value in vector)) or 1
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        """
+        Returns one embedding per text after the latency of one request.
+
+        Parameters:
+        ----------
+        texts : list
+            The texts to embed.
+
+        Returns:
+        -------
+        list
+            The embeddings, as lists of floats.
+        """
+        time.sleep(self.latency.embedding)
+        return [self._embedding(text) for text in texts]
+
+    def embed_query(self, text):
+        """
+        Returns the embedding of a query after the latency of one request.
+        """
+        return self.embed_documents([text])[0]
+
+
+def install_fake_backends(latency=BackendLatency()):
+    """
+    Function: install_fake_backends
+
+    Description:
+    ------------
+    Points the crawler's agents, embedding client and document converter at the fake backends. Must be
+    called before the first file is analysed, since the shared clients are built on first use.
+
+    Parameters:
+    -----------
+    latency : BackendLatency, optional
+        The simulated latencies; no latency by default.
+
+    Returns:
+    --------
+    None
+    """
+    import summarise_agent
+    import hashtag_agent
+    import analysis_agent
+    import embed
+    import azure_doc_converter
+    from conversion_service import DocumentConversionService
+    from graph_schema import EMBEDDING_DIMENSIONS
+
+    summary_chain = FakeChain('summary', latency)
+    hashtag_chain = FakeChain('hashtags', latency)
+    analysis_chain = FakeChain('analysis', latency)
+    embeddings = FakeEmbeddings(EMBEDDING_DIMENSIONS, latency)
+    summarise_agent._summary_chain = lambda: summary_chain
+    hashtag_agent._hashtag_chain = lambda: hashtag_chain
+    analysis_agent._analysis_chain = lambda: analysis_chain
+    embed._embeddings_client = lambda: embeddings
+    embed.get_embedding_service.cache_clear()
+    stub = StubDocumentIntelligence(latency.conversion, latency.conversion_per_page)
+    conversion_service = DocumentConversionService(stub.start(), 'benchmark', poll_interval=STUB_POLL_INTERVAL)
+    azure_doc_converter.get_conversion_service = lambda: conversion_service
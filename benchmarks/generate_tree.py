@@ -0,0 +1,314 @@
+"""
+Module: generate_tree
+
+Description:
+------------
+This module writes seeded, realistic directory trees for benchmarking crawls, from a few thousand to
+millions of files. The same arguments always produce the same names, sizes, contents and modification
+times, so runs on different commits crawl identical trees. Point it at a tmpfs such as /dev/shm to take
+the disk out of the measurement.
+
+The tree has a fixed depth and fan-out. Files are spread over all of its directories. Sizes follow a
+log-normal distribution around a median, and file types follow a weighted mix of extensions. Text files
+hold words, and binary files start with the header of their format, so MIME detection sees realistic
+input. DOCX and XLSX files are valid Office Open XML archives holding words, so the local text
+extractors have real documents to read.
+
+Functions:
+----------
+- generate_tree(root: str, num_files: int, depth: int, fan_out: int, size_median: int, size_sigma: float, max_size: int, mime_mix: dict, seed: int) -> dict
+    Writes a tree and returns its file, directory and byte counts.
+- mutate_tree(root: str, fraction: float, seed: int) -> dict
+    Modifies, deletes and adds a fraction of the files of a tree, for incremental crawls.
+"""
+
+import argparse
+import io
+import math
+import os
+import random
+import time
+import zipfile
+
+# Extensions and their share of the files
+DEFAULT_MIME_MIX = {
+    '.txt': 0.25, '.md': 0.08, '.py': 0.10, '.json': 0.05, '.csv': 0.05, '.html': 0.04,
+    '.pdf': 0.12, '.docx': 0.06, '.xlsx': 0.03, '.jpg': 0.12, '.png': 0.05, '.zip': 0.05,
+}
+TEXT_EXTENSIONS = {'.txt', '.md', '.py', '.json', '.csv', '.html'}
+# Bump when the generated content changes, so runs on different trees are not compared
+TREE_VERSION = 2
+# Leading bytes of the binary formats
+HEADERS = {
+    '.pdf': b'%PDF-1.7\n',
+    '.zip': b'PK\x03\x04',
+    '.jpg': b'\xff\xd8\xff\xe0\x00\x10JFIF\x00',
+    '.png': b'\x89PNG\r\n\x1a\n',
+}
+WORDS = (
+    'the of and to in is that for it as with was on be by this are from at or an have not which but all '
+    'report budget contract meeting project invoice policy schedule design review customer supplier quarter '
+    'summary analysis risk plan team release minutes proposal agreement forecast audit training research '
+    'product market strategy data system process service value change result support account manager'
+).split()
+DIRECTORY_NAMES = ('projects', 'reports', 'archive', 'shared', 'clients', 'finance', 'design', 'notes',
+                   'photos', 'code', 'drafts', 'legal', 'admin', 'research', 'backups', 'misc')
+
+# Size of the text and binary blocks file contents are cut from
+_BLOCK_BYTES = 1024 * 1024
+# Modification times are spread over the three years before this fixed time
+_BASE_TIME = 1700000000
+_MTIME_SPREAD = 3 * 365 * 24 * 3600
+
+
+def _content_blocks(rng):
+    """
+    Builds the text and binary blocks file contents are cut from.
+    """
+    words = []
+    length = 0
+    while length < _BLOCK_BYTES:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    text = ' '.join(words).encode('ascii')[:_BLOCK_BYTES]
+    return text, rng.randbytes(_BLOCK_BYTES)
+
+
+# Minimal Office Open XML packages: the parts of each format around its text part
+_CONTENT_TYPES = ('<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/'
+                  'package/2006/content-types"><Override PartName="/{part}" ContentType="{content_type}"/></Types>')
+_RELATIONSHIPS = ('<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/'
+                  'package/2006/relationships"><Relationship Id="rId1" Type="{type}" Target="{target}"/>'
+                  '</Relationships>')
+_OOXML_RELATIONSHIP_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+_WORDPROCESSING_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+_SPREADSHEET_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+# Words per paragraph or cell of the generated documents
+_WORDS_PER_PARAGRAPH = 40
+_WORDS_PER_CELL = 3
+_CELLS_PER_ROW = 6
+
+
+def _docx_parts(words):
+    """
+    Returns the parts of a DOCX archive whose body holds the words.
+    """
+    paragraphs = ''.join(f'<w:p><w:r><w:t>{" ".join(words[start:start + _WORDS_PER_PARAGRAPH])}</w:t></w:r></w:p>'
+                         for start in range(0, len(words), _WORDS_PER_PARAGRAPH))
+    return {
+        '[Content_Types].xml': _CONTENT_TYPES.format(
+            part='word/document.xml',
+            content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml'),
+        '_rels/.rels': _RELATIONSHIPS.format(type=_OOXML_RELATIONSHIP_TYPE + 'officeDocument',
+                                             target='word/document.xml'),
+        'word/document.xml': f'<?xml version="1.0" encoding="UTF-8"?><w:document xmlns:w="{_WORDPROCESSING_NS}">'
+                             f'<w:body>{paragraphs}</w:body></w:document>',
+    }
+
+
+def _xlsx_parts(words):
+    """
+    Returns the parts of an XLSX archive with one sheet whose cells hold the words.
+    """
+    cells = [" ".join(words[start:start + _WORDS_PER_CELL]) for start in range(0, len(words), _WORDS_PER_CELL)]
+    rows = ''.join('<row>' + ''.join(f'<c t="inlineStr"><is><t>{cell}</t></is></c>'
+                                     for cell in cells[start:start + _CELLS_PER_ROW]) + '</row>'
+                   for start in range(0, len(cells), _CELLS_PER_ROW))
+    return {
+        '[Content_Types].xml': _CONTENT_TYPES.format(
+            part='xl/workbook.xml',
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml'),
+        '_rels/.rels': _RELATIONSHIPS.format(type=_OOXML_RELATIONSHIP_TYPE + 'officeDocument',
+                                             target='xl/workbook.xml'),
+        'xl/workbook.xml': f'<?xml version="1.0" encoding="UTF-8"?><workbook xmlns="{_SPREADSHEET_NS}" '
+                           f'xmlns:r="{_OOXML_RELATIONSHIP_TYPE}"><sheets>'
+                           f'<sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets></workbook>',
+        'xl/_rels/workbook.xml.rels': _RELATIONSHIPS.format(type=_OOXML_RELATIONSHIP_TYPE + 'worksheet',
+                                                            target='worksheets/sheet1.xml'),
+        'xl/worksheets/sheet1.xml': f'<?xml version="1.0" encoding="UTF-8"?><worksheet xmlns="{_SPREADSHEET_NS}">'
+                                    f'<sheetData>{rows}</sheetData></worksheet>',
+    }
+
+
+_OOXML_PARTS = {'.docx': _docx_parts, '.xlsx': _xlsx_parts}
+
+
+def _ooxml(extension, size, text, rng):
+    """
+    Returns an Office Open XML archive holding words cut from the text block, roughly size bytes long up to
+    the size of the block. Parts are stored uncompressed with a fixed timestamp, so the bytes are seeded.
+    """
+    start = rng.randrange(len(text))
+    words = text[start:start + size].decode('ascii').split()[1:] or ['empty']
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for name, part in _OOXML_PARTS[extension](words).items():
+            archive.writestr(zipfile.ZipInfo(name, date_time=(2020, 1, 1, 0, 0, 0)), part)
+    return buffer.getvalue()
+
+
+def _content(extension, size, text, binary, rng):
+    """
+    Returns size bytes of content for a file with the given extension.
+    """
+    if extension in _OOXML_PARTS:
+        return _ooxml(extension, size, text, rng)
+    header = HEADERS.get(extension, b'')
+    block = text if extension in TEXT_EXTENSIONS else binary
+    body_size = max(size - len(header), 0)
+    start = rng.randrange(len(block))
+    if start + body_size <= len(block):
+        return header + block[start:start + body_size]
+    # Large files repeat the block
+    pieces = [header, block[start:]]
+    remaining = body_size - (len(block) - start)
+    while remaining > 0:
+        pieces.append(block[:remaining])
+        remaining -= len(pieces[-1])
+    return b''.join(pieces)
+
+
+def _directories(root, depth, fan_out):
+    """
+    Returns the paths of the root and every directory of a tree with the given depth and fan-out.
+    """
+    paths = [root]
+    level = [root]
+    for _ in range(depth):
+        level = [os.path.join(parent, f"{DIRECTORY_NAMES[index % len(DIRECTORY_NAMES)]}_{index:03d}")
+                 for parent in level for index in range(fan_out)]
+        paths.extend(level)
+    return paths
+
+
+def _write_file(path, content, mtime):
+    """
+    Writes a file and sets its modification time.
+    """
+    with open(path, 'wb') as file:
+        file.write(content)
+    os.utime(path, (mtime, mtime))
+
+
+def generate_tree(root, num_files, depth=4, fan_out=8, size_median=8192, size_sigma=1.5,
+                  max_size=16 * 1024 * 1024, mime_mix=None, seed=0):
+    """
+    Function: generate_tree
+
+    Description:
+    ------------
+    Writes a seeded tree of num_files files below root. root must not exist or be empty.
+
+    Parameters:
+    -----------
+    root : str
+        The directory to create the tree in.
+    num_files : int
+        The number of files.
+    depth : int, optional
+        The number of directory levels below the root.
+    fan_out : int, optional
+        The number of subdirectories of every directory above the last level.
+    size_median : int, optional
+        The median file size in bytes.
+    size_sigma : float, optional
+        The standard deviation of the log of the file sizes; larger values give a longer tail.
+    max_size : int, optional
+        The largest file size in bytes.
+    mime_mix : dict, optional
+        The share of the files per extension. Defaults to DEFAULT_MIME_MIX.
+    seed : int, optional
+        The seed the whole tree is derived from.
+
+    Returns:
+    --------
+    dict
+        'files', 'directories' and 'bytes' written.
+    """
+    mime_mix = mime_mix or DEFAULT_MIME_MIX
+    rng = random.Random(seed)
+    text, binary = _content_blocks(rng)
+    extensions = list(mime_mix)
+    weights = [mime_mix[extension] for extension in extensions]
+
+    directories = _directories(root, depth, fan_out)
+    for path in directories:
+        os.makedirs(path, exist_ok=True)
+
+    total_bytes = 0
+    for index in range(num_files):
+        extension = rng.choices(extensions, weights)[0]
+        size = min(int(rng.lognormvariate(math.log(size_median), size_sigma)), max_size)
+        directory = directories[rng.randrange(len(directories))]
+        path = os.path.join(directory, f"{rng.choice(WORDS)}_{index:07d}{extension}")
+        mtime = _BASE_TIME - rng.uniform(0, _MTIME_SPREAD)
+        _write_file(path, _content(extension, size, text, binary, rng), mtime)
+        total_bytes += size
+    return {'files': num_files, 'directories': len(directories), 'bytes': total_bytes}
+
+
+def mutate_tree(root, fraction=0.01, seed=1):
+    """
+    Function: mutate_tree
+
+    Description:
+    ------------
+    Changes a seeded sample of the files of a tree, as happens between two crawls. A fraction of
+    the files gets new content. Half that fraction is deleted, and the same number of new files is
+    added. Changed and new files get the current time as their modification time.
+
+    Parameters:
+    -----------
+    root : str
+        The root of a tree written by generate_tree.
+    fraction : float, optional
+        The fraction of the files modified.
+    seed : int, optional
+        The seed the changes are derived from.
+
+    Returns:
+    --------
+    dict
+        'modified', 'deleted' and 'added' file counts.
+    """
+    rng = random.Random(seed)
+    text, binary = _content_blocks(rng)
+    paths = sorted(os.path.join(directory, name) for directory, _, names in os.walk(root) for name in names)
+    directories = sorted({os.path.dirname(path) for path in paths}) or [root]
+    changed = int(len(paths) * fraction)
+    sample = rng.sample(paths, min(changed + changed // 2, len(paths)))
+    modified, deleted = sample[:changed], sample[changed:]
+    now = time.time()
+
+    for path in modified:
+        extension = os.path.splitext(path)[1]
+        size = os.path.getsize(path) + rng.randrange(1, 4096)
+        _write_file(path, _content(extension, size, text, binary, rng), now)
+    # Each deleted file is replaced by a new file of the same type and size elsewhere in the tree
+    for index, path in enumerate(deleted):
+        extension = os.path.splitext(path)[1]
+        size = os.path.getsize(path)
+        os.remove(path)
+        directory = directories[rng.randrange(len(directories))]
+        new_path = os.path.join(directory, f"added_{seed}_{index:07d}{extension}")
+        _write_file(new_path, _content(extension, size, text, binary, rng), now)
+    return {'modified': len(modified), 'deleted': len(deleted), 'added': len(deleted)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a seeded directory tree for crawl benchmarks.")
+    parser.add_argument('root', help="the directory to create the tree in, for example below /dev/shm")
+    parser.add_argument('--files', type=int, default=10000)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--fan-out', type=int, default=8)
+    parser.add_argument('--size-median', type=int, default=8192)
+    parser.add_argument('--size-sigma', type=float, default=1.5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    stats = generate_tree(args.root, args.files, depth=args.depth, fan_out=args.fan_out,
+                          size_median=args.size_median, size_sigma=args.size_sigma, seed=args.seed)
+    print(f"Wrote {stats['files']} files in {stats['directories']} directories ({stats['bytes']} bytes) "
+          f"to {args.root} in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,287 @@
+"""
+Module: memory_graph
+
+Description:
+------------
+This module provides an in-process stand-in for FileSystemGraph so crawls can be benchmarked without a
+Neo4j server. It implements the bulk methods the batch writer, the file snapshot and the cleanup call,
+with the same semantics as their Cypher queries, over plain dictionaries. The cost of a real database is
+deliberately left out, so benchmarks against it measure the crawler itself.
+
+Classes:
+--------
+- InMemoryGraph
+    Holds directory, file and hashtag nodes and their CONTAINS and HAS_TAG relationships in memory.
+"""
+
+import os
+import threading
+
+
+class InMemoryGraph:
+    """
+    A class holding a file system graph in memory behind the bulk interface of FileSystemGraph.
+
+    Attributes:
+    ----------
+    directories : dict
+        Directory properties keyed by dir_id.
+    files : dict
+        File properties keyed by file_id.
+    hashtags : dict
+        The number of files linked to each hashtag.
+
+    Methods:
+    -------
+    merge_directories(rows):
+        Creates or updates directory nodes.
+    update_directories(rows):
+        Sets properties on existing directory nodes.
+    link_directories(rows):
+        Links directories to their parents.
+    merge_files(rows):
+        Creates or updates file nodes and drops their hashtag links.
+    merge_unanalysed_files(rows):
+        Creates or updates file nodes, keeping the analysis of existing ones.
+    link_files_to_directories(rows):
+        Links files to their directories.
+    link_files_to_hashtags(rows):
+        Links files to hashtags, creating the hashtags.
+    touch_files(rows):
+        Updates lastchecked on file nodes.
+    stream_file_states(root_dir_id):
+        Yields the change-detection properties of every file below a directory.
+    stream_directory_states(root_dir_id):
+        Yields the change-detection properties of a directory and the directories below it.
+    subtree_nodes(dir_id):
+        Retrieves the identifiers and paths of a directory and everything below it.
+    stream_embeddings():
+        Yields the search properties of every file with an embedding.
+    sweep_stale(root_path, current_walk_time, batch_size=10000):
+        Deletes the nodes below a path that were not seen in the latest walk.
+    remove_subtree(path, batch_size=10000):
+        Deletes a file, or a directory and everything below it.
+    cleanup_orphaned_hashtags(batch_size=10000):
+        Deletes hashtags without files.
+    close():
+        Does nothing; present for compatibility with FileSystemGraph.
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty InMemoryGraph.
+        """
+        self.directories = {}
+        self.files = {}
+        self.hashtags = {}
+        self._children = {}
+        self._parents = {}
+        self._file_hashtags = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.directories) + len(self.files)
+
+    def _link(self, parent_id, child_id):
+        """
+        Makes parent_id the container of child_id. Call with the lock held.
+        """
+        old_parent = self._parents.get(child_id)
+        if old_parent is not None and old_parent != parent_id:
+            self._children[old_parent].discard(child_id)
+        self._parents[child_id] = parent_id
+        self._children.setdefault(parent_id, set()).add(child_id)
+
+    def _unlink_tags(self, file_id):
+        """
+        Drops the hashtag links of a file. Call with the lock held.
+        """
+        for hashtag in self._file_hashtags.pop(file_id, ()):
+            self.hashtags[hashtag] -= 1
+
+    def _delete(self, node_id):
+        """
+        Deletes a node and its relationships. Call with the lock held.
+        """
+        self.directories.pop(node_id, None)
+        self.files.pop(node_id, None)
+        self._unlink_tags(node_id)
+        parent_id = self._parents.pop(node_id, None)
+        if parent_id is not None and parent_id in self._children:
+            self._children[parent_id].discard(node_id)
+        for child_id in self._children.pop(node_id, ()):
+            self._parents.pop(child_id, None)
+
+    def _subtree(self, root_id):
+        """
+        Returns the identifiers of a node and every node below it. Call with the lock held.
+        """
+        nodes = [root_id]
+        stack = [root_id]
+        while stack:
+            children = self._children.get(stack.pop(), ())
+            nodes.extend(children)
+            stack.extend(children)
+        return nodes
+
+    def merge_directories(self, rows):
+        """
+        Creates or updates a batch of directory nodes.
+        """
+        with self._lock:
+            for row in rows:
+                self.directories.setdefault(row['dir_id'], {}).update(row)
+
+    def update_directories(self, rows):
+        """
+        Sets properties on a batch of existing directory nodes.
+        """
+        with self._lock:
+            for row in rows:
+                if row['dir_id'] in self.directories:
+                    self.directories[row['dir_id']].update(row)
+
+    def link_directories(self, rows):
+        """
+        Links a batch of directories to their parent directories.
+        """
+        with self._lock:
+            for row in rows:
+                if row['dir_id'] in self.directories and row['parent_dir_id'] in self.directories:
+                    self._link(row['parent_dir_id'], row['dir_id'])
+
+    def merge_files(self, rows):
+        """
+        Creates or updates a batch of file nodes and drops their hashtag links, like the MERGE query.
+        """
+        with self._lock:
+            for row in rows:
+                self.files.setdefault(row['file_id'], {}).update(row)
+                self._unlink_tags(row['file_id'])
+
+    def merge_unanalysed_files(self, rows):
+        """
+        Creates or updates a batch of unanalysed file nodes, keeping the analysis and hashtag links of
+        existing ones.
+        """
+        with self._lock:
+            for row in rows:
+                self.files.setdefault(row['file_id'], {'num_tokens': 0, 'summary': '', 'embedded_summary': []}).update(row)
+
+    def link_files_to_directories(self, rows):
+        """
+        Links a batch of files to their directories.
+        """
+        with self._lock:
+            for row in rows:
+                if row['dir_id'] in self.directories and row['file_id'] in self.files:
+                    self._link(row['dir_id'], row['file_id'])
+
+    def link_files_to_hashtags(self, rows):
+        """
+        Links a batch of files to hashtags, creating hashtags that do not exist yet.
+        """
+        with self._lock:
+            for row in rows:
+                if row['file_id'] not in self.files:
+                    continue
+                tags = self._file_hashtags.setdefault(row['file_id'], set())
+                if row['hashtag'] not in tags:
+                    tags.add(row['hashtag'])
+                    self.hashtags[row['hashtag']] = self.hashtags.get(row['hashtag'], 0) + 1
+
+    def touch_files(self, rows):
+        """
+        Updates lastchecked on a batch of file nodes.
+        """
+        with self._lock:
+            for row in rows:
+                if row['file_id'] in self.files:
+                    self.files[row['file_id']]['lastchecked'] = row['lastchecked']
+
+    def stream_file_states(self, root_dir_id):
+        """
+        Yields (file_id, lastmodified, filesize, mime_type) for every file below a directory.
+        """
+        with self._lock:
+            nodes = self._subtree(root_dir_id) if root_dir_id in self.directories else []
+            states = [(node_id, self.files[node_id].get('lastmodified'), self.files[node_id].get('filesize'),
+                       self.files[node_id].get('mime_type'))
+                      for node_id in nodes if node_id in self.files]
+        yield from states
+
+    def stream_directory_states(self, root_dir_id):
+        """
+        Yields (dir_id, dir_mtime, child_count) for a directory and every directory below it.
+        """
+        with self._lock:
+            nodes = self._subtree(root_dir_id) if root_dir_id in self.directories else []
+            states = [(node_id, self.directories[node_id].get('dir_mtime'),
+                       self.directories[node_id].get('child_count'))
+                      for node_id in nodes if node_id in self.directories]
+        yield from states
+
+    def subtree_nodes(self, dir_id):
+        """
+        Returns (is_dir, node_id, path) tuples for a directory and every directory and file below it.
+        """
+        with self._lock:
+            nodes = self._subtree(dir_id) if dir_id in self.directories else []
+            return [(node_id in self.directories, node_id,
+                     (self.directories.get(node_id) or self.files.get(node_id) or {}).get('path'))
+                    for node_id in nodes]
+
+    def stream_embeddings(self):
+        """
+        Yields (file_id, path, filename, mime_type, hashtags, embedded_summary) for every file with an embedding.
+        """
+        with self._lock:
+            rows = [(file_id, file.get('path'), file.get('filename'), file.get('mime_type'),
+                     sorted(self._file_hashtags.get(file_id, ())), file['embedded_summary'])
+                    for file_id, file in self.files.items() if file.get('embedded_summary')]
+        yield from rows
+
+    def sweep_stale(self, root_path, current_walk_time, batch_size=10000):
+        """
+        Deletes the files and directories below a path whose lastchecked is older than the latest walk, and
+        returns the number of files and directories removed.
+        """
+        prefix = os.path.join(root_path, '')
+        removed = []
+        with self._lock:
+            for nodes in (self.files, self.directories):
+                stale = [node_id for node_id, node in nodes.items()
+                         if (node.get('path') or '').startswith(prefix)
+                         and (node.get('lastchecked') or 0) < current_walk_time]
+                for node_id in stale:
+                    self._delete(node_id)
+                removed.append(len(stale))
+        return tuple(removed)
+
+    def remove_subtree(self, path, batch_size=10000):
+        """
+        Deletes the file or directory at path and everything below it, and returns the number of nodes removed.
+        """
+        prefix = os.path.join(path, '')
+        with self._lock:
+            doomed = [node_id for nodes in (self.files, self.directories) for node_id, node in nodes.items()
+                      if node.get('path') == path or (node.get('path') or '').startswith(prefix)]
+            for node_id in doomed:
+                self._delete(node_id)
+        return len(doomed)
+
+    def cleanup_orphaned_hashtags(self, batch_size=10000):
+        """
+        Deletes hashtags no file links to, and returns how many were removed.
+        """
+        with self._lock:
+            orphaned = [hashtag for hashtag, count in self.hashtags.items() if count <= 0]
+            for hashtag in orphaned:
+                del self.hashtags[hashtag]
+        return len(orphaned)
+
+    def close(self):
+        """
+        Does nothing; the graph lives as long as the object.
+        """
+        pass
@@ -0,0 +1,344 @@
+"""
+Module: run_benchmark
+
+Description:
+------------
+This module benchmarks crawls of a generated tree with offline backends and records the results so
+they can be compared across commits. Three crawls are measured in turn:
+
+- full: the first crawl of the tree into an empty graph;
+- unchanged: a second crawl with nothing changed;
+- incremental: a crawl after mutate_tree has modified, deleted and added a fraction of the files.
+
+Each crawl reports files per second, the total time and call count of every stage recorded by
+crawl_metrics, and the peak resident memory of the process during the crawl. The files each crawl wrote
+and removed are checked against the changes made to the tree: every file in the full crawl, none in the
+unchanged crawl, and the modified and added files written and the deleted ones removed in the
+incremental crawl. A crawl that writes or removes anything else is reported, and the benchmark exits
+with status 1. The results are
+appended as one JSON line per run to a results file. Each run is compared with the last earlier run of
+the same configuration, and regressions beyond a threshold are flagged.
+
+The graph is an InMemoryGraph by default. With --graph sqlite the crawls write to an embedded SQLiteGraph
+in the benchmark's working directory. With --graph neo4j, or --graph auto when a server answers, they
+write to the Neo4j server configured by NEO4J_URI, NEO4J_USERNAME and NEO4J_PASSWORD. The benchmark
+tree is removed from that server afterwards.
+
+Functions:
+----------
+- run_benchmark(args: argparse.Namespace) -> dict
+    Runs the crawls and returns the result record.
+- compare(record: dict, previous: dict, threshold: float) -> list
+    Lists the changes between two result records and flags regressions.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'src'))
+
+from generate_tree import TREE_VERSION, generate_tree, mutate_tree
+from fake_backends import BackendLatency, install_fake_backends
+from memory_graph import InMemoryGraph
+
+PHASES = ('full', 'unchanged', 'incremental')
+
+# Settings that must match for two runs to be compared
+CONFIG_KEYS = ('files', 'depth', 'fan_out', 'size_median', 'seed', 'mutate_fraction', 'tree_version', 'graph',
+               'workers', 'async_analysis', 'prune_unchanged_dirs', 'analysis_cache', 'text_cache', 'latency')
+
+
+def _reset_peak_rss():
+    """
+    Resets the peak resident set size of the process where the kernel allows it (Linux).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss():
+    """
+    Returns the peak resident set size of the process in bytes.
+    """
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS, and cannot be reset
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _commit():
+    """
+    Returns the current commit, marked '-dirty' when the working tree has changes.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BENCHMARK_DIR,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _open_graph(kind, work_dir):
+    """
+    Returns the graph to crawl into and its kind, connecting to Neo4j for 'neo4j' and 'auto'.
+    """
+    if kind == 'memory':
+        return InMemoryGraph(), 'memory'
+    if kind == 'sqlite':
+        from sqlite_graph import SQLiteGraph
+        return SQLiteGraph(os.path.join(work_dir, 'graph.db')), 'sqlite'
+    try:
+        from file_system_graph import FileSystemGraph
+        fs_graph = FileSystemGraph(os.getenv('NEO4J_URI', 'bolt://localhost:7687'),
+                                   os.getenv('NEO4J_USERNAME', 'neo4j'), os.getenv('NEO4J_PASSWORD', ''))
+        return fs_graph, 'neo4j'
+    except Exception as e:
+        if kind == 'neo4j':
+            raise
+        print(f"No Neo4j server available ({e}); using the in-memory graph")
+        return InMemoryGraph(), 'memory'
+
+
+def _phase_result(metrics, seconds, num_files, peak_rss, expected):
+    """
+    Summarises one crawl from the metrics it recorded. expected holds the numbers of files the crawl
+    should have written and removed.
+    """
+    report = metrics.report()
+    return {
+        'seconds': seconds,
+        'files': num_files,
+        'files_per_second': num_files / seconds if seconds else 0.0,
+        'files_written': sum(report['counters'].get('files', {}).values()),
+        'files_removed': report['counters'].get('removed', {}).get('file', 0),
+        'expected_files_written': expected[0],
+        'expected_files_removed': expected[1],
+        'peak_rss_bytes': peak_rss,
+        'stages': {stage: {'count': values['count'], 'total_seconds': values['total_seconds'],
+                           'p95_seconds': values['p95_seconds'], 'errors': values['errors']}
+                   for stage, values in report['stages'].items()},
+    }
+
+
+def _check_phase(phase, result):
+    """
+    Lists the differences between the files a crawl wrote and removed and the numbers expected.
+    """
+    problems = []
+    for action in ('written', 'removed'):
+        actual, expected = result[f'files_{action}'], result[f'expected_files_{action}']
+        if actual != expected:
+            problems.append(f"{phase}: MISMATCH {actual} files {action}, expected {expected}")
+    return problems
+
+
+def run_benchmark(args):
+    """
+    Function: run_benchmark
+
+    Description:
+    ------------
+    Generates the tree, runs the full, unchanged and incremental crawls and returns the result record.
+
+    Parameters:
+    -----------
+    args : argparse.Namespace
+        The parsed command line.
+
+    Returns:
+    --------
+    dict
+        The result record with the commit, configuration and per-phase results.
+    """
+    latency = BackendLatency(args.llm_latency, args.llm_latency_per_1k_tokens, args.embedding_latency,
+                             args.conversion_latency, args.conversion_latency_per_page)
+    install_fake_backends(latency)
+    from walk_file_system import walk_file_system
+    from mime_detector import MimeDetector
+    from analysis_cache import AnalysisCache
+    from text_cache import TextCache
+    from crawl_metrics import get_metrics
+
+    work_dir = tempfile.mkdtemp(prefix='crawl-benchmark-', dir=args.dir)
+    root = os.path.join(work_dir, 'tree')
+    fs_graph, graph_kind = _open_graph(args.graph, work_dir)
+    try:
+        start = time.perf_counter()
+        tree = generate_tree(root, args.files, depth=args.depth, fan_out=args.fan_out,
+                             size_median=args.size_median, seed=args.seed)
+        print(f"Generated {tree['files']} files in {tree['directories']} directories ({tree['bytes']} bytes) "
+              f"in {time.perf_counter() - start:.1f}s")
+
+        mime_detector = MimeDetector(os.path.join(work_dir, 'mime_cache.db'))
+        analysis_cache = AnalysisCache(os.path.join(work_dir, 'analysis_cache.db')) if args.analysis_cache else None
+        text_cache = TextCache(os.path.join(work_dir, 'text_cache.db')) if args.text_cache else None
+        metrics = get_metrics()
+        phases = {}
+        num_files = tree['files']
+        for phase in PHASES:
+            expected = (num_files, 0) if phase == 'full' else (0, 0)
+            if phase == 'incremental':
+                changes = mutate_tree(root, fraction=args.mutate_fraction, seed=args.seed + 1)
+                print(f"Changed the tree: {changes}")
+                expected = (changes['modified'] + changes['added'], changes['deleted'])
+            metrics.reset()
+            if not _reset_peak_rss():
+                print("Peak RSS cannot be reset on this platform; it covers the whole process")
+            start = time.perf_counter()
+            walk_file_system(root, fs_graph, workers=args.workers, async_analysis=args.async_analysis,
+                             analysis_cache=analysis_cache, mime_detector=mime_detector,
+                             prune_unchanged_dirs=args.prune_unchanged_dirs, text_cache=text_cache)
+            phases[phase] = _phase_result(metrics, time.perf_counter() - start, num_files, _peak_rss(), expected)
+            print(f"{phase}: {phases[phase]['files_per_second']:.0f} files/s, {phases[phase]['seconds']:.2f}s, "
+                  f"peak RSS {phases[phase]['peak_rss_bytes'] / 2 ** 20:.0f} MiB")
+            for problem in _check_phase(phase, phases[phase]):
+                print(problem)
+
+        mime_detector.close()
+        if analysis_cache is not None:
+            analysis_cache.close()
+        if text_cache is not None:
+            text_cache.close()
+    finally:
+        if graph_kind == 'neo4j':
+            fs_graph.remove_subtree(root)
+        fs_graph.close()
+        if not args.keep_tree:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'timestamp': time.time(),
+        'commit': _commit(),
+        'label': args.label,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {
+            'files': args.files, 'depth': args.depth, 'fan_out': args.fan_out, 'size_median': args.size_median,
+            'seed': args.seed, 'mutate_fraction': args.mutate_fraction,
+            'tree_version': TREE_VERSION, 'graph': graph_kind,
+            'workers': args.workers, 'async_analysis': args.async_analysis,
+            'prune_unchanged_dirs': args.prune_unchanged_dirs, 'analysis_cache': args.analysis_cache,
+            'text_cache': args.text_cache,
+            'latency': list(latency),
+        },
+        'phases': phases,
+    }
+
+
+def compare(record, previous, threshold=0.1):
+    """
+    Function: compare
+
+    Description:
+    ------------
+    Lists the changes in throughput, peak memory and stage times between two runs of the same
+    configuration, flagging those worse than the threshold.
+
+    Parameters:
+    -----------
+    record : dict
+        The current result record.
+    previous : dict
+        The earlier result record.
+    threshold : float, optional
+        The relative change beyond which a slowdown or memory increase is a regression.
+
+    Returns:
+    --------
+    list
+        One line of text per compared value.
+    """
+    lines = []
+
+    def line(name, before, after, higher_is_better):
+        if not before:
+            return
+        change = (after - before) / before
+        regression = -change > threshold if higher_is_better else change > threshold
+        lines.append(f"{name:<40} {before:>14.3f} {after:>14.3f} {change:>+8.1%}{'  REGRESSION' if regression else ''}")
+
+    for phase in PHASES:
+        now, then = record['phases'].get(phase), previous['phases'].get(phase)
+        if now is None or then is None:
+            continue
+        line(f"{phase} files/s", then['files_per_second'], now['files_per_second'], True)
+        line(f"{phase} peak RSS MiB", then['peak_rss_bytes'] / 2 ** 20, now['peak_rss_bytes'] / 2 ** 20, False)
+        for stage in sorted(set(now['stages']) & set(then['stages'])):
+            line(f"{phase} {stage} s", then['stages'][stage]['total_seconds'],
+                 now['stages'][stage]['total_seconds'], False)
+    return lines
+
+
+def _load_results(path):
+    """
+    Reads the result records stored so far.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark full and incremental crawls with offline backends.")
+    parser.add_argument('--files', type=int, default=10000)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--fan-out', type=int, default=8)
+    parser.add_argument('--size-median', type=int, default=8192)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mutate-fraction', type=float, default=0.01)
+    parser.add_argument('--dir', default='/dev/shm' if os.path.isdir('/dev/shm') else None,
+                        help="where the tree is generated; a tmpfs by default where there is one")
+    parser.add_argument('--keep-tree', action='store_true')
+    parser.add_argument('--graph', choices=('memory', 'sqlite', 'neo4j', 'auto'), default='memory')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--async-analysis', action='store_true')
+    parser.add_argument('--prune-unchanged-dirs', action='store_true')
+    parser.add_argument('--analysis-cache', action='store_true')
+    parser.add_argument('--text-cache', action='store_true')
+    parser.add_argument('--llm-latency', type=float, default=0.0, help="seconds per model call")
+    parser.add_argument('--llm-latency-per-1k-tokens', type=float, default=0.0)
+    parser.add_argument('--embedding-latency', type=float, default=0.0, help="seconds per embedding request")
+    parser.add_argument('--conversion-latency', type=float, default=0.0, help="seconds per document conversion")
+    parser.add_argument('--conversion-latency-per-page', type=float, default=0.0)
+    parser.add_argument('--results', default=os.path.join(BENCHMARK_DIR, 'results.jsonl'))
+    parser.add_argument('--label', default='')
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative change reported as a regression")
+    args = parser.parse_args()
+
+    history = _load_results(args.results)
+    record = run_benchmark(args)
+    with open(args.results, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(record) + '\n')
+    print(f"Results appended to {args.results}")
+
+    config = {key: record['config'][key] for key in CONFIG_KEYS}
+    previous = [entry for entry in history if {key: entry['config'].get(key) for key in CONFIG_KEYS} == config]
+    if previous:
+        print(f"Compared with {previous[-1]['commit']} ({time.ctime(previous[-1]['timestamp'])}):")
+        for text in compare(record, previous[-1], args.threshold):
+            print(text)
+
+    if any(_check_phase(phase, result) for phase, result in record['phases'].items()):
+        sys.exit(1)
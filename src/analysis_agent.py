@@ -0,0 +1,205 @@
+"""
+Module: analysis_agent
+
+Description:
+------------
+This module defines an agent that summarises a document and creates its hashtags in a single language
+model call. The model is asked for a JSON object, which is validated before use, so the document is
+only sent (and paid for) once instead of once for the summary and once for the hashtags. A reply that
+does not validate is asked for once more; if that fails too, the summary and hashtags come from the
+separate summarise_agent and hashtag_agent calls, so a malformed reply never fails the file.
+
+Attributes/Parameters:
+----------------------
+N/A
+
+Methods/Returns:
+----------------
+analysis_agent: function
+    Processes a document and returns its summary and hashtags.
+
+aanalysis_agent: coroutine function
+    Asynchronous version of analysis_agent.
+
+parse_analysis: function
+    Validates the model's JSON response.
+"""
+
+import asyncio
+import json
+from functools import lru_cache
+from langchain_core.output_parsers import StrOutputParser
+from langchain_openai import ChatOpenAI
+from langchain_core.prompts import ChatPromptTemplate
+from extract_hashtags import normalise_hashtags
+from summarise_agent import summarise_agent, asummarise_agent
+from hashtag_agent import hashtag_agent, ahashtag_agent
+from rate_limiter import get_rate_limiter, estimate_tokens
+from crawl_metrics import get_metrics
+
+# Model and prompt identity; bump PROMPT_VERSION whenever the prompt changes so cached analyses are redone
+MODEL = "gpt-4o"
+PROMPT_VERSION = "1"
+
+# Allowance for the completion when budgeting tokens against the rate limiter
+COMPLETION_TOKENS = 768
+
+# Combined calls made for a document before falling back to the separate summary and hashtag calls
+ATTEMPTS = 2
+
+@lru_cache(maxsize=None)
+def _analysis_chain():
+    """
+    Builds the analysis chain once per process so the model client and its connection pool are reused.
+    """
+    # Define the system prompt that sets the context for the analysis.
+    system_prompt = (
+        "# ROLE:\n"
+        "You are an expert at summarisation and at finding the best hashtags to describe a document.\n\n"
+        "# TASK:\n"
+        "Review the document and provide a succinct summary and a list of hashtags.\n\n"
+        "# OUTPUT:\n"
+        "Reply with a JSON object with exactly two keys:\n"
+        ' - "summary": a string holding the summary.\n'
+        ' - "hashtags": an array of strings, each one hashtag without the # symbol.\n\n'
+        "# NOTES: \n"
+        " - Don't make anything up.\n"
+        " - Make sure the summary is clear, concise and analytical.\n"
+        " - Make sure the hashtags are meaningful and categorise the document in a useful manner.\n"
+        " - Please only reply with the JSON object and don't add any extra commentary."
+    )
+
+    # JSON mode guarantees the reply parses; parse_analysis checks its shape.
+    llm = ChatOpenAI(model=MODEL, temperature=0.3, model_kwargs={"response_format": {"type": "json_object"}})
+
+    query_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", system_prompt),
+            ("human", "Document to be analysed: {working_doc}.")
+        ]
+    )
+
+    return query_prompt | llm | StrOutputParser()
+
+def parse_analysis(raw_analysis):
+    """
+    Function: parse_analysis
+
+    Description:
+    ------------
+    Validates the model's JSON response and normalises its hashtags.
+
+    Parameters:
+    -----------
+    raw_analysis : str
+        The raw model response.
+
+    Returns:
+    --------
+    tuple
+        The summary string and the list of hashtags.
+
+    Raises:
+    -------
+    ValueError
+        If the response is not a JSON object with a string summary and a list of string hashtags.
+    """
+    try:
+        analysis = json.loads(raw_analysis)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Analysis response is not valid JSON: {e}")
+
+    if not isinstance(analysis, dict):
+        raise ValueError("Analysis response is not a JSON object")
+
+    summary = analysis.get("summary")
+    if not isinstance(summary, str) or not summary.strip():
+        raise ValueError("Analysis response has no summary")
+
+    hashtags = analysis.get("hashtags", [])
+    if not isinstance(hashtags, list) or not all(isinstance(hashtag, str) for hashtag in hashtags):
+        raise ValueError("Analysis response hashtags are not a list of strings")
+
+    return summary.strip(), normalise_hashtags(hashtags)
+
+def _parse_attempt(raw_analysis, attempt):
+    """
+    Parses a reply with parse_analysis, returning None and warning if it does not validate.
+    """
+    try:
+        return parse_analysis(raw_analysis)
+    except ValueError as e:
+        action = "retrying" if attempt + 1 < ATTEMPTS else "falling back to separate summary and hashtag calls"
+        print(f"Warning: {e}; {action}")
+        return None
+
+def analysis_agent(file_contents, num_tokens=None):
+    """
+    Function: analysis_agent
+
+    Description:
+    ------------
+    Summarises a document and creates its hashtags with a single language model call, retried once
+    if the reply does not validate and replaced by separate summary and hashtag calls after that.
+
+    Parameters:
+    -----------
+    file_contents : str
+        The document to analyse.
+    num_tokens : int, optional
+        The number of tokens in the document, used for rate limiting. Estimated when not given.
+
+    Returns:
+    --------
+    tuple
+        The summary of the document and a list of hashtags for it.
+    """
+    tokens = num_tokens if num_tokens is not None else estimate_tokens(file_contents)
+    metrics = get_metrics()
+    for attempt in range(ATTEMPTS):
+        get_rate_limiter("openai").acquire(tokens + COMPLETION_TOKENS)
+
+        # The combined call does the work of the summarise and tag stages in one request
+        with metrics.timer('analyse'):
+            raw_analysis = _analysis_chain().invoke({"working_doc": file_contents})
+        metrics.count('tokens', tokens, stage='analyse')
+        analysis = _parse_attempt(raw_analysis, attempt)
+        if analysis is not None:
+            return analysis
+    return summarise_agent(file_contents, num_tokens), hashtag_agent(file_contents, num_tokens)
+
+async def aanalysis_agent(file_contents, num_tokens=None):
+    """
+    Function: aanalysis_agent
+
+    Description:
+    ------------
+    Asynchronous version of analysis_agent. Waits on the shared rate limiter without blocking the
+    event loop.
+
+    Parameters:
+    -----------
+    file_contents : str
+        The document to analyse.
+    num_tokens : int, optional
+        The number of tokens in the document, used for rate limiting. Estimated when not given.
+
+    Returns:
+    --------
+    tuple
+        The summary of the document and a list of hashtags for it.
+    """
+    tokens = num_tokens if num_tokens is not None else estimate_tokens(file_contents)
+    metrics = get_metrics()
+    for attempt in range(ATTEMPTS):
+        await get_rate_limiter("openai").aacquire(tokens + COMPLETION_TOKENS)
+
+        with metrics.timer('analyse'):
+            raw_analysis = await _analysis_chain().ainvoke({"working_doc": file_contents})
+        metrics.count('tokens', tokens, stage='analyse')
+        analysis = _parse_attempt(raw_analysis, attempt)
+        if analysis is not None:
+            return analysis
+    summary, hashtags = await asyncio.gather(asummarise_agent(file_contents, num_tokens),
+                                             ahashtag_agent(file_contents, num_tokens))
+    return summary, hashtags
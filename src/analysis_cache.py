@@ -0,0 +1,245 @@
+"""
+Module: analysis_cache
+
+Description:
+------------
+This module provides a persistent, content-addressed cache of file analyses. Entries are keyed by the
+SHA-256 of the file's bytes together with a fingerprint of the models and prompt versions that produced
+them, so a file that is moved, renamed, copied or touched without changing its content is never sent to
+the language model again, while a prompt or model change invalidates the old entries. The cache lives in
+a local SQLite database and evicts the least recently used entries once it grows past a size limit.
+
+Classes:
+--------
+- AnalysisCache
+    The SQLite-backed cache of (num_tokens, summary, embedded_summary, hashtags) tuples.
+
+Functions:
+----------
+- content_hash(file_path: str) -> str
+    Returns the SHA-256 hex digest of a file's bytes.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from array import array
+
+# Size of the blocks files are hashed in
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+# Once the cache is over its limit, entries are evicted until it is below this fraction of it
+_EVICT_TO = 0.9
+
+
+def content_hash(file_path: str) -> str:
+    """
+    Function: content_hash
+
+    Description:
+    ------------
+    Returns the SHA-256 hex digest of a file's bytes, reading the file in blocks.
+
+    Parameters:
+    -----------
+    file_path : str
+        The path to the file.
+
+    Returns:
+    --------
+    str
+        The hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(_HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """
+    A class to cache file analyses in a local SQLite database.
+
+    Attributes:
+    ----------
+    path : str
+        The path of the SQLite database file.
+    max_bytes : int
+        The approximate maximum size of the cached entries. Least recently used entries are evicted
+        beyond it.
+    hits : int
+        The number of lookups served from the cache.
+    misses : int
+        The number of lookups not found in the cache.
+    evictions : int
+        The number of entries evicted.
+
+    Methods:
+    -------
+    key(content_digest, fingerprint):
+        Builds the cache key for content analysed with a given model/prompt fingerprint.
+    get(key):
+        Returns the cached analysis for a key, or None.
+    put(key, analysis):
+        Stores an analysis.
+    stats():
+        Returns hit/miss statistics and the size of the cache.
+    close():
+        Closes the database connection.
+    """
+
+    def __init__(self, path, max_bytes=1024 ** 3):
+        """
+        Initializes the AnalysisCache, creating the database if it does not exist.
+
+        Parameters:
+        ----------
+        path : str
+            The path of the SQLite database file.
+        max_bytes : int, optional
+            The approximate maximum size of the cached entries. Defaults to 1 GiB.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS analysis ("
+            "key TEXT PRIMARY KEY, num_tokens INTEGER, summary TEXT, hashtags TEXT, "
+            "embedding BLOB, size INTEGER, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS analysis_last_access ON analysis (last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM analysis").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def key(content_digest, fingerprint):
+        """
+        Builds the cache key for content analysed with a given model/prompt fingerprint.
+
+        Parameters:
+        ----------
+        content_digest : str
+            The SHA-256 hex digest of the content.
+        fingerprint : str
+            Identifies the models and prompt versions used for the analysis.
+
+        Returns:
+        -------
+        str
+            The cache key.
+        """
+        return hashlib.sha256(f"{content_digest}\0{fingerprint}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached analysis for a key.
+
+        Parameters:
+        ----------
+        key : str
+            The cache key.
+
+        Returns:
+        -------
+        tuple
+            (num_tokens, summary, embedded_summary, hashtags), or None if the key is not cached.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT num_tokens, summary, hashtags, embedding FROM analysis WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE analysis SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+
+        num_tokens, summary, hashtags, embedding = row
+        return num_tokens, summary, array('f', embedding).tolist(), json.loads(hashtags)
+
+    def put(self, key, analysis):
+        """
+        Stores an analysis, evicting least recently used entries if the cache grows past max_bytes.
+
+        Parameters:
+        ----------
+        key : str
+            The cache key.
+        analysis : tuple
+            (num_tokens, summary, embedded_summary, hashtags) as returned by meta_analyse.
+        """
+        num_tokens, summary, embedded_summary, hashtags = analysis
+        hashtags = json.dumps(list(hashtags or []))
+        embedding = array('f', embedded_summary or []).tobytes()
+        size = len(key) + len(summary.encode('utf-8')) + len(hashtags) + len(embedding)
+
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM analysis WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analysis (key, num_tokens, summary, hashtags, embedding, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, num_tokens, summary, hashtags, embedding, size, time.time())
+            )
+            self._total_bytes += size - (previous[0] if previous else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """
+        Deletes least recently used entries until the cache is below its eviction target.
+        Must be called with the lock held.
+        """
+        target = self.max_bytes * _EVICT_TO
+        cursor = self._conn.execute("SELECT key, size FROM analysis ORDER BY last_access")
+        evicted = []
+        for key, size in cursor:
+            if self._total_bytes <= target:
+                break
+            evicted.append((key,))
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM analysis WHERE key = ?", evicted)
+        self.evictions += len(evicted)
+
+    def stats(self):
+        """
+        Returns hit/miss statistics and the size of the cache.
+
+        Returns:
+        -------
+        dict
+            The number of hits, misses, evictions and entries, the hit rate and the cached bytes.
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': entries,
+                'bytes': self._total_bytes,
+            }
+
+    def close(self):
+        """
+        Closes the database connection.
+        """
+        with self._lock:
+            self._conn.close()
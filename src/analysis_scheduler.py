@@ -0,0 +1,251 @@
+"""
+Module: analysis_scheduler
+
+Description:
+------------
+This module decides which of the new and changed files found by a walk are analysed in this run and
+in what order. The cost of analysing each file is estimated from its size and MIME type (tokens sent to
+the language model, requests made, and the resulting spend including document conversion), the files
+are ordered by configurable priorities, and files are admitted in that order while they fit within the
+run's token, request and spend budgets. Files that do not fit are deferred: they are written to the
+graph with analysis_status 'pending' and no lastmodified, so the next run picks them up again. Until
+then they keep the summary, hashtags and embedding of their last analysis.
+
+The estimates are deliberately rough and err on the expensive side; files whose analysis turns out to
+be cached still count against the budget.
+
+Classes:
+--------
+- AnalysisCost
+    The estimated tokens, requests and spend of analysing one file.
+- AnalysisScheduler
+    Orders analysis jobs and enforces the per-run budgets.
+
+Attributes:
+-----------
+PRICES : dict
+    USD prices used for the spend estimate; each can be overridden with an environment variable.
+PRIORITIES : tuple
+    The names of the supported priority orders.
+"""
+
+import math
+import os
+from collections import namedtuple
+from map_reduce_summarise import CHUNK_TOKENS, MAX_CHUNKS, MAX_TOTAL_TOKENS, REDUCE_TOKENS
+from meta_analyse import MAX_SINGLE_PASS_TOKENS, COMBINED_ANALYSIS
+from text_extractor import LOCAL_MIME_TYPES
+
+DEBUG = os.getenv('TEST', 'False').lower() in ('true', '1', 't')  # Read DEBUG from environment variable
+
+
+def _env_price(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+PRICES = {
+    # Per million tokens for the analysis model (gpt-4o)
+    'input': _env_price('ANALYSIS_INPUT_PRICE', 2.50),
+    'output': _env_price('ANALYSIS_OUTPUT_PRICE', 10.00),
+    # Per million tokens for the embedding model (text-embedding-3-small)
+    'embedding': _env_price('EMBEDDING_PRICE', 0.02),
+    # Per page converted by Azure AI Document Intelligence (prebuilt-layout)
+    'page': _env_price('DOCUMENT_PRICE_PER_PAGE', 0.01),
+}
+
+# Tokens generated by one summary, hashtag or reduce call
+OUTPUT_TOKENS_PER_CALL = 400
+
+# Bytes per token of extracted text by MIME type, for files whose text is not stored as plain text
+BYTES_PER_TOKEN = {
+    'application/pdf': 20,
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': 10,
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': 10,
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation': 30,
+    'text/html': 6,
+}
+# Bytes per token of plain text
+TEXT_BYTES_PER_TOKEN = 4
+
+# Tokens of text recognised in an image, and tokens per converted document page
+IMAGE_TOKENS = 300
+TOKENS_PER_PAGE = 500
+
+PRIORITIES = ('subtrees', 'recent', 'oldest', 'smallest', 'largest', 'cheapest')
+
+AnalysisCost = namedtuple('AnalysisCost', ['tokens', 'requests', 'spend'])
+
+
+class AnalysisScheduler:
+    """
+    A class to order analysis jobs by priority and admit them within per-run budgets.
+
+    Attributes:
+    ----------
+    max_tokens : int
+        The most tokens a run may send for analysis, or None for no limit.
+    max_requests : int
+        The most model requests a run may make, or None for no limit.
+    max_spend : float
+        The most a run may spend in USD, or None for no limit.
+    order : tuple
+        Names from PRIORITIES, applied in turn: 'subtrees' puts files below the subtrees first (in the
+        order given), 'recent'/'oldest' sort by modification time, 'smallest'/'largest' by size and
+        'cheapest' by estimated spend. Ties keep the walk order.
+    subtrees : list
+        The absolute paths of the directories the 'subtrees' priority favours.
+    used : AnalysisCost
+        The estimated cost admitted by the last plan.
+
+    Methods:
+    -------
+    estimate(size, mime_type):
+        Estimates the cost of analysing a file.
+    plan(jobs, is_analysed):
+        Splits jobs into those analysed in this run, in priority order, and those deferred.
+    """
+
+    def __init__(self, max_tokens=None, max_requests=None, max_spend=None, order=('subtrees', 'recent'),
+                 subtrees=()):
+        """
+        Initializes the AnalysisScheduler.
+
+        Parameters:
+        ----------
+        max_tokens : int, optional
+            The most tokens a run may send for analysis.
+        max_requests : int, optional
+            The most model requests a run may make.
+        max_spend : float, optional
+            The most a run may spend in USD.
+        order : tuple, optional
+            The priority orders to apply, from PRIORITIES.
+        subtrees : list, optional
+            The directories the 'subtrees' priority favours.
+        """
+        unknown = [name for name in order if name not in PRIORITIES]
+        if unknown:
+            raise ValueError(f"Unknown analysis priorities: {', '.join(unknown)}")
+        self.max_tokens = max_tokens
+        self.max_requests = max_requests
+        self.max_spend = max_spend
+        self.order = tuple(order)
+        self.subtrees = [os.path.join(os.path.abspath(subtree), '') for subtree in subtrees]
+        self.used = AnalysisCost(0, 0, 0.0)
+
+    def estimate(self, size, mime_type):
+        """
+        Estimates the cost of analysing a file, following the path meta_analyse takes for its size.
+
+        Parameters:
+        ----------
+        size : int
+            The size of the file in bytes.
+        mime_type : str
+            The MIME type of the file.
+
+        Returns:
+        -------
+        AnalysisCost
+            The estimated tokens sent, requests made and spend in USD.
+        """
+        pages = 0
+        if mime_type.startswith('image/'):
+            pages = 1
+            tokens = IMAGE_TOKENS
+        elif mime_type in BYTES_PER_TOKEN:
+            tokens = size // BYTES_PER_TOKEN[mime_type]
+            # Text types are read directly and Office documents extracted locally; the others are converted
+            # page by page first
+            if not mime_type.startswith('text') and mime_type not in LOCAL_MIME_TYPES:
+                pages = max(1, math.ceil(tokens / TOKENS_PER_PAGE))
+        else:
+            tokens = size // TEXT_BYTES_PER_TOKEN
+        tokens = min(max(tokens, 1), MAX_TOTAL_TOKENS)
+
+        analysis_calls = 1 if COMBINED_ANALYSIS else 2
+        if tokens < MAX_SINGLE_PASS_TOKENS:
+            llm_calls = analysis_calls
+            input_tokens = tokens * analysis_calls
+        else:
+            # Map every chunk, reduce the chunk summaries, then analyse the reduced text
+            chunks = min(math.ceil(tokens / CHUNK_TOKENS), MAX_CHUNKS)
+            reduce_calls = math.ceil(chunks * OUTPUT_TOKENS_PER_CALL / REDUCE_TOKENS)
+            llm_calls = chunks + reduce_calls + analysis_calls
+            input_tokens = tokens + chunks * OUTPUT_TOKENS_PER_CALL + analysis_calls * OUTPUT_TOKENS_PER_CALL
+
+        output_tokens = llm_calls * OUTPUT_TOKENS_PER_CALL
+        spend = (input_tokens * PRICES['input'] + output_tokens * PRICES['output']
+                 + OUTPUT_TOKENS_PER_CALL * PRICES['embedding']) / 1e6 + pages * PRICES['page']
+        # One more request for the embedding of the summary
+        return AnalysisCost(input_tokens + output_tokens, llm_calls + 1, spend)
+
+    def _sort_key(self, job, cost):
+        """
+        Builds the sort key of a job from the configured priorities.
+        """
+        key = []
+        for name in self.order:
+            if name == 'subtrees':
+                key.append(next((index for index, subtree in enumerate(self.subtrees)
+                                 if job['path'].startswith(subtree)), len(self.subtrees)))
+            elif name == 'recent':
+                key.append(-job['stat'].st_mtime)
+            elif name == 'oldest':
+                key.append(job['stat'].st_mtime)
+            elif name == 'smallest':
+                key.append(job['stat'].st_size)
+            elif name == 'largest':
+                key.append(-job['stat'].st_size)
+            else:
+                key.append(cost.spend)
+        return key
+
+    def _fits(self, cost):
+        """
+        Checks whether a cost fits in what is left of the budgets.
+        """
+        return ((self.max_tokens is None or self.used.tokens + cost.tokens <= self.max_tokens)
+                and (self.max_requests is None or self.used.requests + cost.requests <= self.max_requests)
+                and (self.max_spend is None or self.used.spend + cost.spend <= self.max_spend))
+
+    def plan(self, jobs, is_analysed):
+        """
+        Splits the file jobs of a walk into those analysed in this run and those deferred. Jobs are
+        considered in priority order and each one that still fits within all budgets is admitted, so
+        cheaper jobs further down the order can use budget a large job could not. Jobs for files that
+        are not sent to a model cost nothing and are always admitted.
+
+        Parameters:
+        ----------
+        jobs : list
+            File jobs with their MIME type set.
+        is_analysed : callable
+            Returns whether files of a MIME type are sent for analysis.
+
+        Returns:
+        -------
+        tuple
+            (admitted, deferred) lists of jobs; admitted is in priority order.
+        """
+        self.used = AnalysisCost(0, 0, 0.0)
+        costs = [self.estimate(job['stat'].st_size, job['mime_type']) if is_analysed(job['mime_type']) else None
+                 for job in jobs]
+        free = AnalysisCost(0, 0, 0.0)
+        order = sorted(range(len(jobs)), key=lambda index: self._sort_key(jobs[index], costs[index] or free))
+
+        admitted, deferred = [], []
+        for index in order:
+            cost = costs[index]
+            if cost is None:
+                admitted.append(jobs[index])
+            elif self._fits(cost):
+                self.used = AnalysisCost(*(used + spent for used, spent in zip(self.used, cost)))
+                admitted.append(jobs[index])
+            else:
+                deferred.append(jobs[index])
+
+        print(f"Analysis plan: {len(admitted)} files admitted, {len(deferred)} deferred; estimated "
+              f"{self.used.tokens} tokens, {self.used.requests} requests, ${self.used.spend:.2f}")
+        return admitted, deferred
@@ -4,20 +4,50 @@ Module: azure_doc_converter
 Description:
 ------------
 This module provides functionality to convert documents using Azure AI Document Intelligence.
-It utilizes the AzureAIDocumentIntelligenceLoader from langchain_community to process and extract
-information from various document types.
+Every conversion in the process goes through one shared DocumentConversionService, which keeps a pooled
+client, limits the analyze operations in flight, splits large PDFs into page ranges converted in
+parallel and enforces a timeout per document.
 
 Methods:
 --------
 azure_doc_converter(file_path: str) -> str
+get_conversion_service() -> DocumentConversionService
 """
 
 import os
-from langchain_community.document_loaders import AzureAIDocumentIntelligenceLoader
+from functools import lru_cache
 from dotenv import load_dotenv
+from conversion_service import DocumentConversionService
+from rate_limiter import get_rate_limiter
 
 load_dotenv()
 
+@lru_cache(maxsize=None)
+def get_conversion_service():
+    """
+    Function: get_conversion_service
+
+    Description:
+    ------------
+    Returns the DocumentConversionService shared by every conversion. The resource is read from
+    AZURE_DOC_ENDPOINT and AZURE_DOC_KEY, and the service can be tuned with the AZURE_DOC_MAX_IN_FLIGHT,
+    AZURE_DOC_PAGES_PER_RANGE and AZURE_DOC_TIMEOUT environment variables. Analyze requests are throttled
+    by the "azure-document" rate limiter.
+
+    Returns:
+    --------
+    DocumentConversionService
+        The shared service.
+    """
+    return DocumentConversionService(
+        os.getenv('AZURE_DOC_ENDPOINT', "https://shandocint.cognitiveservices.azure.com/"),
+        os.getenv('AZURE_DOC_KEY'),
+        max_in_flight=int(os.getenv('AZURE_DOC_MAX_IN_FLIGHT', '8')),
+        pages_per_range=int(os.getenv('AZURE_DOC_PAGES_PER_RANGE', '50')),
+        timeout=float(os.getenv('AZURE_DOC_TIMEOUT', '600')),
+        rate_limiter=get_rate_limiter("azure-document")
+    )
+
 def azure_doc_converter(file_path):
     """
     Function: azure_doc_converter
@@ -25,7 +55,7 @@ def azure_doc_converter(file_path):
     Description:
     ------------
     Converts a document at the given file path using Azure AI Document Intelligence
-    and extracts the page content as a string.
+    and extracts the page content as a Markdown string.
 
     Parameters:
     -----------
@@ -36,22 +66,10 @@ def azure_doc_converter(file_path):
     --------
     str
         The extracted page content as a string.
-    """
-    
-    endpoint = "https://shandocint.cognitiveservices.azure.com/"
-    key = os.getenv("AZURE_DOC_KEY")
-    loader = AzureAIDocumentIntelligenceLoader(
-        api_endpoint=endpoint,
-        api_key=key,
-        file_path=file_path,
-        api_model="prebuilt-layout",
-        mode="single"
-    )
 
-    documents = loader.load()
-    
-    # Extract the page_content from the first document
-    if documents and len(documents) > 0:
-        return documents[0].page_content
-    else:
-        return ""  # Return an empty string if no content is found
+    Raises:
+    -------
+    TimeoutError
+        If the document is not converted within AZURE_DOC_TIMEOUT seconds.
+    """
+    return get_conversion_service().convert(file_path) or ""  # Return an empty string if no content is found
@@ -3,60 +3,42 @@ This module provides functionality for cleaning up the file system graph by remo
 outdated files and directories that were not present in the most recent walk.
 
 It contains a single function, clean_up_file_system, which performs the cleanup operation
-on a given FileSystemGraph instance.
+on a given storage backend. The deletes run in the database in batched
+transactions and are limited to the subtree that was crawled.
 """
 
-from file_system_graph import FileSystemGraph
+from storage_backend import StorageBackend
 
-def clean_up_file_system(current_walk_time, fs_graph):
+def clean_up_file_system(current_walk_time, fs_graph, root_dir, batch_size=10000):
     """
     Function: clean_up_file_system
-    
+
     Description:
     ------------
-    Removes files and directories from the graph that weren't present in the current walk,
-    and cleans up orphaned hashtag nodes.
-    
+    Removes files and directories below root_dir from the graph that weren't present in the current walk,
+    and cleans up orphaned hashtag nodes. Nothing is read back to the client; the counts come from the
+    update counters of the deletes.
+
     Parameters:
     -----------
     current_walk_time : float
         The timestamp of the current walk.
-    fs_graph : FileSystemGraph
-        An instance of FileSystemGraph to perform operations on the graph.
-    
+    fs_graph : StorageBackend
+        An instance of StorageBackend to perform operations on the graph.
+    root_dir : str
+        The absolute path of the directory the walk started from. Nodes outside it are left alone.
+    batch_size : int, optional
+        The number of nodes deleted per transaction.
+
     Returns:
     --------
-    None
+    tuple
+        The number of files, directories and orphaned hashtags removed.
     """
-    # Query to find files that weren't checked in the current walk
-    file_query = (
-        "MATCH (f:File) "
-        "WHERE f.lastchecked < $current_walk_time "
-        "RETURN f.file_id AS file_id"
-    )
-    
-    # Query to find directories that weren't checked in the current walk
-    dir_query = (
-        "MATCH (d:Directory) "
-        "WHERE d.lastchecked < $current_walk_time "
-        "RETURN d.dir_id AS dir_id"
-    )
-    
-    # Execute queries on directories first so that child files are removed.
-    outdated_dirs = fs_graph._execute_query(dir_query, current_walk_time=current_walk_time)
-    
-    # Remove outdated directories
-    for record in outdated_dirs:
-        fs_graph.remove_directory(record['dir_id'])
-
-    # Execute query on files after directories have already been removed
-    outdated_files = fs_graph._execute_query(file_query, current_walk_time=current_walk_time)
-    
-    # Remove outdated files
-    for record in outdated_files:
-        fs_graph.remove_file(record['file_id'])
-    
+    removed_files, removed_dirs = fs_graph.sweep_stale(root_dir, current_walk_time, batch_size=batch_size)
+
     # Clean up orphaned hashtag nodes
-    orphaned_hashtags = fs_graph.cleanup_orphaned_hashtags()
-    
-    print(f"Cleanup complete. Removed {len(outdated_files)} files, {len(outdated_dirs)} directories, and {len(orphaned_hashtags)} orphaned hashtags.")
+    removed_hashtags = fs_graph.cleanup_orphaned_hashtags(batch_size=batch_size)
+
+    print(f"Cleanup complete. Removed {removed_files} files, {removed_dirs} directories, and {removed_hashtags} orphaned hashtags.")
+    return removed_files, removed_dirs, removed_hashtags
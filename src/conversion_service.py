@@ -0,0 +1,391 @@
+"""
+Module: conversion_service
+
+Description:
+------------
+This module converts documents to text with the Azure AI Document Intelligence REST API, for the
+documents that need OCR. One DocumentConversionService is shared by the whole crawler:
+
+- its HTTP connections are pooled and kept alive, instead of building a new client per document;
+- any number of threads can convert documents at once, but no more than max_in_flight analyze
+  operations are submitted or polled at a time;
+- PDFs longer than pages_per_range pages are analysed as page ranges in parallel, through the
+  'pages' parameter of the analyze request, and the text of the ranges is joined in page order;
+- every document has a deadline. A conversion that is not done by then raises TimeoutError and stops
+  polling its outstanding ranges, so one 400-page scan cannot tie up a worker indefinitely.
+
+An analyze request posts the raw bytes of the document, asks for the content as Markdown so headings
+and tables survive the conversion, and is answered with 202 and an Operation-Location, which is polled
+until the status is 'succeeded' or 'failed'. Polls answered with 429 or 5xx are retried after their
+Retry-After. An analyze request is only retried after a 429: one that failed with a server error may
+have started an operation all the same, and would be billed twice. The service speaks plain HTTP as
+well as HTTPS, so it can be pointed at a local stub of the analyze and poll endpoints.
+
+Classes:
+--------
+- DocumentConversionService
+    Converts documents with a pooled client, an in-flight limit, page-range splitting and deadlines.
+"""
+
+import http.client
+import io
+import json
+import os
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from crawl_metrics import get_metrics
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pypdf is optional; without it PDFs are not split into page ranges
+    PdfReader = None
+
+DEBUG = os.getenv('TEST', 'False').lower() in ('true', '1', 't')  # Read DEBUG from environment variable
+
+API_VERSION = '2024-11-30'
+DEFAULT_MODEL = 'prebuilt-layout'
+OUTPUT_CONTENT_FORMAT = 'markdown'
+
+# Responses that are retried after their Retry-After, and how often
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+_ANALYZE_RETRY_STATUSES = (429,)
+_MAX_RETRIES = 5
+# Seconds waited before retrying a response without a Retry-After
+_DEFAULT_RETRY_AFTER = 2.0
+
+
+class _ConnectionPool:
+    """
+    Keeps idle keep-alive HTTP connections per origin for reuse by any thread.
+    """
+
+    def __init__(self, max_idle):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _connection(self, scheme, netloc, timeout):
+        """
+        Returns an idle connection to an origin and whether it was reused, or a new connection.
+        """
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                connection = idle.pop()
+                connection.timeout = timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+                return connection, True
+        connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return connection_class(netloc, timeout=timeout), False
+
+    def _release(self, scheme, netloc, connection):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        """
+        Sends a request on a pooled connection and returns (status, headers, body). Header names are
+        lower-cased. A reused connection the server has closed in the meantime is replaced once.
+        """
+        parts = urllib.parse.urlsplit(url)
+        target = parts.path + ('?' + parts.query if parts.query else '')
+        while True:
+            connection, reused = self._connection(parts.scheme, parts.netloc, timeout)
+            try:
+                connection.request(method, target, body=body, headers=headers or {})
+                response = connection.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                # The request never reached a server that had already dropped the idle connection
+                if reused and isinstance(e, ConnectionError):
+                    continue
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(parts.scheme, parts.netloc, connection)
+            return response.status, {name.lower(): value for name, value in response.getheaders()}, data
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+def _retry_after(headers, default):
+    """
+    Returns the seconds to wait from a Retry-After header, or the default.
+    """
+    try:
+        return float(headers['retry-after'])
+    except (KeyError, ValueError):
+        return default
+
+
+def _error_message(data):
+    """
+    Returns the message of an error response body, or the start of the body.
+    """
+    try:
+        error = json.loads(data).get('error') or {}
+        return f"{error.get('code')}: {error.get('message')}"
+    except (ValueError, AttributeError):
+        return data[:200].decode('utf-8', 'replace')
+
+
+class DocumentConversionService:
+    """
+    A class to convert documents to text with Azure AI Document Intelligence, sharing one pooled client
+    among all callers.
+
+    Attributes:
+    ----------
+    endpoint : str
+        The base URL of the Document Intelligence resource.
+    model : str
+        The analysis model, prebuilt-layout by default.
+    api_version : str
+        The REST API version.
+    max_in_flight : int
+        The maximum number of analyze operations submitted or polled at a time.
+    pages_per_range : int
+        PDFs with more pages than this are analysed in page ranges of this many pages.
+    timeout : float
+        The default number of seconds a document may take to convert.
+    poll_interval : float
+        The seconds between polls of an operation whose response has no Retry-After.
+    rate_limiter : RateLimiter
+        Throttles the analyze requests, or None.
+
+    Methods:
+    -------
+    convert(file_path, timeout):
+        Converts a document and returns its text as Markdown.
+    submit(file_path, timeout):
+        Queues a document for conversion and returns a Future of its text.
+    close():
+        Stops the worker threads and closes the pooled connections.
+    """
+
+    def __init__(self, endpoint, key, model=DEFAULT_MODEL, api_version=API_VERSION, max_in_flight=8,
+                 pages_per_range=50, timeout=600.0, poll_interval=1.0, rate_limiter=None):
+        """
+        Initializes the DocumentConversionService.
+
+        Parameters:
+        ----------
+        endpoint : str
+            The base URL of the Document Intelligence resource, or of a local stub.
+        key : str
+            The API key of the resource.
+        model : str, optional
+            The analysis model.
+        api_version : str, optional
+            The REST API version.
+        max_in_flight : int, optional
+            The maximum number of analyze operations submitted or polled at a time.
+        pages_per_range : int, optional
+            The number of pages per range PDFs are split into.
+        timeout : float, optional
+            The default number of seconds a document may take to convert.
+        poll_interval : float, optional
+            The seconds between polls when the service does not send a Retry-After.
+        rate_limiter : RateLimiter, optional
+            Throttles the analyze requests.
+
+        Raises:
+        ------
+        ValueError
+            If the key is missing or a limit is below 1.
+        """
+        if not key:
+            raise ValueError("A Document Intelligence API key is required; set AZURE_DOC_KEY")
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        if pages_per_range < 1:
+            raise ValueError("pages_per_range must be at least 1")
+        self.endpoint = endpoint.rstrip('/')
+        self.model = model
+        self.api_version = api_version
+        self.max_in_flight = max_in_flight
+        self.pages_per_range = pages_per_range
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.rate_limiter = rate_limiter
+        self._key = key
+        self._pool = _ConnectionPool(max_in_flight)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        # Page ranges are analysed on their own threads, which never wait on other futures, so documents
+        # converting on the document threads can wait for their ranges without deadlocking
+        self._ranges = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='conversion-range')
+        self._documents = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='conversion')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _page_ranges(self, data):
+        """
+        Returns the page ranges a document is analysed in, or [None] to analyse it whole. Only PDFs whose
+        pages pypdf can count are split.
+        """
+        if PdfReader is None or not data.startswith(b'%PDF'):
+            return [None]
+        try:
+            pages = len(PdfReader(io.BytesIO(data)).pages)
+        except Exception:
+            return [None]
+        if pages <= self.pages_per_range:
+            return [None]
+        return [f"{first}-{min(first + self.pages_per_range - 1, pages)}"
+                for first in range(1, pages + 1, self.pages_per_range)]
+
+    def _remaining(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("Document conversion timed out")
+        return remaining
+
+    def _request(self, method, url, deadline, body=None, headers=None, retry_statuses=_RETRY_STATUSES):
+        """
+        Sends a request, retrying responses with one of retry_statuses until the deadline.
+        """
+        headers = dict(headers or {}, **{'Ocp-Apim-Subscription-Key': self._key})
+        for attempt in range(_MAX_RETRIES + 1):
+            status, response_headers, data = self._pool.request(method, url, body, headers,
+                                                                timeout=self._remaining(deadline))
+            if status not in retry_statuses or attempt == _MAX_RETRIES:
+                return status, response_headers, data
+            delay = _retry_after(response_headers, _DEFAULT_RETRY_AFTER)
+            if DEBUG:
+                print(f"Document Intelligence answered {status}, retrying in {delay}s")
+            time.sleep(min(delay, self._remaining(deadline)))
+
+    def _analyse(self, data, pages, deadline, cancelled):
+        """
+        Runs one analyze operation on a document or a page range of it and returns the text.
+        """
+        if cancelled.is_set():
+            return None
+        if not self._slots.acquire(timeout=self._remaining(deadline)):
+            raise TimeoutError("Document conversion timed out waiting for a free slot")
+        try:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            query = {'api-version': self.api_version, 'outputContentFormat': OUTPUT_CONTENT_FORMAT}
+            if pages is not None:
+                query['pages'] = pages
+            url = (f"{self.endpoint}/documentintelligence/documentModels/{self.model}:analyze?"
+                   f"{urllib.parse.urlencode(query)}")
+            status, headers, body = self._request('POST', url, deadline, body=data,
+                                                  headers={'Content-Type': 'application/octet-stream'},
+                                                  retry_statuses=_ANALYZE_RETRY_STATUSES)
+            if status != 202 or 'operation-location' not in headers:
+                raise RuntimeError(f"Document analysis was not accepted (HTTP {status}): {_error_message(body)}")
+
+            operation = headers['operation-location']
+            interval = _retry_after(headers, self.poll_interval)
+            while not cancelled.wait(min(interval, self._remaining(deadline))):
+                status, headers, body = self._request('GET', operation, deadline)
+                if status != 200:
+                    raise RuntimeError(f"Polling document analysis failed (HTTP {status}): {_error_message(body)}")
+                result = json.loads(body)
+                if result.get('status') == 'succeeded':
+                    return (result.get('analyzeResult') or {}).get('content', '')
+                if result.get('status') == 'failed':
+                    raise RuntimeError(f"Document analysis failed: {_error_message(body)}")
+                interval = _retry_after(headers, self.poll_interval)
+            return None
+        finally:
+            self._slots.release()
+
+    def convert(self, file_path, timeout=None):
+        """
+        Converts a document and returns its text as Markdown. Large PDFs are analysed in page ranges in
+        parallel. Safe to call from any number of threads.
+
+        Parameters:
+        ----------
+        file_path : str
+            The path to the document.
+        timeout : float, optional
+            The number of seconds the conversion may take. Defaults to the timeout of the service.
+
+        Returns:
+        -------
+        str
+            The text of the document.
+
+        Raises:
+        ------
+        TimeoutError
+            If the document is not converted within the timeout.
+        RuntimeError
+            If the service rejects the document or fails to analyse it.
+        """
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        metrics = get_metrics()
+        with open(file_path, 'rb') as file:
+            data = file.read()
+
+        cancelled = threading.Event()
+        with metrics.timer('convert'):
+            ranges = self._page_ranges(data)
+            if len(ranges) == 1:
+                text = self._analyse(data, None, deadline, cancelled)
+            else:
+                if DEBUG:
+                    print(f"Converting {file_path} in {len(ranges)} page ranges")
+                futures = [self._ranges.submit(self._analyse, data, pages, deadline, cancelled) for pages in ranges]
+                done, pending = wait(futures, timeout=max(deadline - time.monotonic(), 0),
+                                     return_when=FIRST_EXCEPTION)
+                failed = next((future for future in done if future.exception() is not None), None)
+                if failed is not None or pending:
+                    # Outstanding ranges stop polling and queued ones never start
+                    cancelled.set()
+                    for future in pending:
+                        future.cancel()
+                    if failed is not None:
+                        raise failed.exception()
+                    raise TimeoutError(f"Converting {file_path} timed out")
+                text = '\n'.join(future.result() for future in futures)
+        metrics.count('bytes', len(data), stage='convert')
+        return text
+
+    def submit(self, file_path, timeout=None):
+        """
+        Queues a document for conversion on the service's threads.
+
+        Parameters:
+        ----------
+        file_path : str
+            The path to the document.
+        timeout : float, optional
+            The number of seconds the conversion may take once started.
+
+        Returns:
+        -------
+        concurrent.futures.Future
+            A Future of the text of the document.
+        """
+        return self._documents.submit(self.convert, file_path, timeout)
+
+    def close(self):
+        """
+        Stops the worker threads, cancelling queued conversions, and closes the pooled connections.
+        """
+        self._documents.shutdown(cancel_futures=True)
+        self._ranges.shutdown(cancel_futures=True)
+        self._pool.close()
@@ -0,0 +1,346 @@
+"""
+Module: crawl_journal
+
+Description:
+------------
+This module records the progress of a walk in a local SQLite database so that a walk that dies part
+way through a large tree can be resumed instead of restarted. For every crawled root the journal stores
+the generation and timestamp of the current walk, the directories whose whole subtree has been written
+to the graph, and the files that are being analysed.
+
+A resumed walk reuses the timestamp of the interrupted one, so the nodes it already wrote count as
+seen, skips the finished subtrees without reading them, and only runs the cleanup once the whole tree
+has been walked. A file is in flight from just before its analysis starts until the analysis succeeds,
+so the files whose analysis raised, or was running when a walk died, are held responsible. A file that
+failed in every walk is most likely broken or what killed them; once it has been in flight for
+max_attempts walks, it is recorded without analysis for as long as its size and mtime stay the same.
+
+Subtrees are only recorded as finished after the batch writer has flushed their rows, so the journal
+never claims more than the graph holds. A finished subtree is not read again until the walk completes,
+so changes made inside it in the meantime are picked up by the next walk.
+
+Classes:
+--------
+- CrawlJournal
+    The durable record of a walk's progress.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+DEBUG = os.getenv('TEST', 'False').lower() in ('true', '1', 't')  # Read DEBUG from environment variable
+
+
+class CrawlJournal:
+    """
+    A class to record the progress of walks in a local SQLite database.
+
+    The walker thread calls begin, is_done, directory_started and file_submitted, the analysis workers
+    call file_started and file_analysed, and the writer stage of the crawl pipeline calls directory_listed and
+    file_finished after queuing the records they refer to. A directory's subtree is finished once the
+    directory has been listed, all of its files have been written and all of its subdirectories are
+    finished.
+
+    Attributes:
+    ----------
+    path : str
+        The path of the SQLite database file.
+    max_attempts : int
+        The number of walks a file may fail in before it is skipped.
+    root_dir : str
+        The root of the current walk.
+    generation : int
+        The number of walks of root_dir begun so far, including the current one.
+    walk_time : float
+        The timestamp of the current walk.
+    resumed : bool
+        Whether the current walk continues an interrupted one.
+
+    Methods:
+    -------
+    begin(root_dir):
+        Starts or resumes the walk of a root directory and returns its timestamp.
+    is_done(path):
+        Checks whether a subtree was finished by the interrupted walk.
+    directory_started(path):
+        Records that the walker entered a directory.
+    file_submitted(dir_path):
+        Records that a file of a directory was queued for analysis.
+    file_started(file_path, stat_result):
+        Records that a file is about to be analysed; returns False if it should be skipped.
+    file_analysed(file_path):
+        Records that the analysis of a file has succeeded.
+    directory_listed(path, writer):
+        Records that a directory's own records have been queued.
+    file_finished(dir_path, writer):
+        Records that a file's record has been queued.
+    finish():
+        Marks the walk as complete.
+    close():
+        Closes the database connection.
+    """
+
+    def __init__(self, path, max_attempts=2):
+        """
+        Initializes the CrawlJournal, creating the database if it does not exist.
+
+        Parameters:
+        ----------
+        path : str
+            The path of the SQLite database file.
+        max_attempts : int, optional
+            The number of walks a file may fail in before it is skipped.
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        self.root_dir = None
+        self.generation = 0
+        self.walk_time = None
+        self.resumed = False
+        self._done = set()
+        self._outstanding = {}
+        self._completed = []
+        self._checkpoint_pending = False
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS crawls ("
+            "root TEXT PRIMARY KEY, generation INTEGER, walk_time REAL, started REAL, completed REAL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS done_directories (root TEXT, path TEXT, PRIMARY KEY (root, path))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS in_flight (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, attempts INTEGER)"
+        )
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def begin(self, root_dir):
+        """
+        Starts the walk of a root directory, or resumes it if the last walk of it did not complete.
+
+        Parameters:
+        ----------
+        root_dir : str
+            The absolute path of the root directory.
+
+        Returns:
+        -------
+        float
+            The timestamp of the walk, to be used as lastchecked for every node it writes.
+        """
+        with self._lock:
+            self.root_dir = root_dir
+            self._outstanding = {}
+            self._completed = []
+            self._checkpoint_pending = False
+            row = self._conn.execute(
+                "SELECT generation, walk_time, completed FROM crawls WHERE root = ?", (root_dir,)
+            ).fetchone()
+
+            if row is not None and row[2] is None:
+                self.generation, self.walk_time = row[0], row[1]
+                self.resumed = True
+                self._done = {path for (path,) in self._conn.execute(
+                    "SELECT path FROM done_directories WHERE root = ?", (root_dir,)
+                )}
+                print(f"Resuming walk {self.generation} of {root_dir}: {len(self._done)} directories already done")
+            else:
+                self.generation = row[0] + 1 if row is not None else 1
+                self.walk_time = time.time()
+                self.resumed = False
+                self._done = set()
+                self._conn.execute("DELETE FROM done_directories WHERE root = ?", (root_dir,))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO crawls (root, generation, walk_time, started, completed) "
+                    "VALUES (?, ?, ?, ?, NULL)",
+                    (root_dir, self.generation, self.walk_time, time.time())
+                )
+                self._conn.commit()
+        return self.walk_time
+
+    def is_done(self, path):
+        """
+        Checks whether the subtree of a directory was finished by the interrupted walk being resumed.
+
+        Parameters:
+        ----------
+        path : str
+            The absolute path of the directory.
+
+        Returns:
+        -------
+        bool
+            True if the subtree can be skipped.
+        """
+        return path in self._done
+
+    def directory_started(self, path):
+        """
+        Records that the walker entered a directory. Its parent stays unfinished until it is.
+
+        Parameters:
+        ----------
+        path : str
+            The absolute path of the directory.
+        """
+        with self._lock:
+            self._outstanding[path] = 1
+            parent = os.path.dirname(path)
+            if path != self.root_dir and parent in self._outstanding:
+                self._outstanding[parent] += 1
+
+    def file_submitted(self, dir_path):
+        """
+        Records that a file of a directory was queued for analysis. The directory stays unfinished until
+        file_finished is called for it.
+
+        Parameters:
+        ----------
+        dir_path : str
+            The absolute path of the directory containing the file.
+        """
+        with self._lock:
+            self._outstanding[dir_path] += 1
+
+    def file_started(self, file_path, stat_result):
+        """
+        Records that a file is about to be analysed. The record is committed before returning, so it
+        survives the process being killed during the analysis.
+
+        Parameters:
+        ----------
+        file_path : str
+            The absolute path of the file.
+        stat_result : os.stat_result
+            The file's stat result.
+
+        Returns:
+        -------
+        bool
+            False if the analysis of the file failed in max_attempts walks and the file has not changed
+            since, in which case it should be recorded without analysis.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime, attempts FROM in_flight WHERE path = ?", (file_path,)
+            ).fetchone()
+            unchanged = row is not None and row[0] == stat_result.st_size and row[1] == stat_result.st_mtime
+            if unchanged and row[2] >= self.max_attempts:
+                return False
+            attempts = row[2] + 1 if unchanged else 1
+            self._conn.execute(
+                "INSERT OR REPLACE INTO in_flight (path, size, mtime, attempts) VALUES (?, ?, ?, ?)",
+                (file_path, stat_result.st_size, stat_result.st_mtime, attempts)
+            )
+            self._conn.commit()
+        return True
+
+    def file_analysed(self, file_path):
+        """
+        Records that the analysis of a file has succeeded. The record is committed before returning, so
+        a walk that dies later does not hold the file responsible. It is not called when the analysis
+        raises, so the failure counts as an attempt.
+
+        Parameters:
+        ----------
+        file_path : str
+            The absolute path of the file.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM in_flight WHERE path = ?", (file_path,))
+            self._conn.commit()
+
+    def directory_listed(self, path, writer):
+        """
+        Records that the records of a directory, its unchanged files and its subdirectories have been
+        queued on the writer.
+
+        Parameters:
+        ----------
+        path : str
+            The absolute path of the directory.
+        writer : GraphBatchWriter
+            The writer the records were queued on.
+        """
+        with self._lock:
+            self._release(path, writer)
+
+    def file_finished(self, dir_path, writer):
+        """
+        Records that the record of an analysed or skipped file has been queued on the writer.
+
+        Parameters:
+        ----------
+        dir_path : str
+            The absolute path of the directory containing the file.
+        writer : GraphBatchWriter
+            The writer the record was queued on.
+        """
+        with self._lock:
+            self._release(dir_path, writer)
+
+    def _release(self, path, writer):
+        """
+        Releases one of the things a directory is waiting for, finishing it and then its ancestors as
+        they run out. Call with the lock held.
+        """
+        while path in self._outstanding:
+            self._outstanding[path] -= 1
+            if self._outstanding[path]:
+                return
+            del self._outstanding[path]
+            self._completed.append(path)
+            self._schedule_checkpoint(writer)
+            if path == self.root_dir:
+                return
+            path = os.path.dirname(path)
+
+    def _schedule_checkpoint(self, writer):
+        """
+        Arranges for the finished directories to be committed after the writer's next flush.
+        Call with the lock held.
+        """
+        if not self._checkpoint_pending:
+            self._checkpoint_pending = True
+            writer.add_checkpoint(self._checkpoint)
+
+    def _checkpoint(self):
+        """
+        Commits the directories whose records the writer has just flushed.
+        """
+        with self._lock:
+            self._checkpoint_pending = False
+            completed, self._completed = self._completed, []
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO done_directories (root, path) VALUES (?, ?)",
+                ((self.root_dir, path) for path in completed)
+            )
+            self._conn.commit()
+
+    def finish(self):
+        """
+        Marks the walk of the current root as complete, so the next walk starts afresh.
+        """
+        with self._lock:
+            self._conn.execute("UPDATE crawls SET completed = ? WHERE root = ?", (time.time(), self.root_dir))
+            self._conn.execute("DELETE FROM done_directories WHERE root = ?", (self.root_dir,))
+            self._conn.commit()
+            self._done = set()
+        if DEBUG:
+            print(f"Walk {self.generation} of {self.root_dir} complete")
+
+    def close(self):
+        """
+        Closes the database connection.
+        """
+        self._conn.close()
@@ -0,0 +1,508 @@
+"""
+Module: crawl_metrics
+
+Description:
+------------
+This module collects per-stage metrics for the crawler so a slow run can be traced to the stage that
+caused it: the walk, stat calls, MIME detection, reading, tokenising, text extraction, document
+conversion, the model calls, embedding, graph writes and the cleanup. Each stage has a latency histogram and an error count,
+and counters track files, tokens and bytes processed.
+
+Metrics are shared by every thread of the process through get_metrics(). They can be exposed in the
+Prometheus text format, written to a file for the node_exporter textfile collector or served over HTTP,
+and summarised in a JSON report at the end of a run. A sampled subset of analysed files can also be
+profiled with cProfile and tracemalloc.
+
+Classes:
+--------
+- Histogram
+    A cumulative latency histogram with fixed buckets.
+- Metrics
+    The registry of stage histograms and counters, with the exporters and the file profiler.
+
+Functions:
+----------
+- get_metrics() -> Metrics
+    Returns the Metrics shared by the whole process.
+"""
+
+import cProfile
+import http.server
+import json
+import os
+import threading
+import time
+import tracemalloc
+import zlib
+from contextlib import contextmanager
+from functools import lru_cache
+
+DEBUG = os.getenv('TEST', 'False').lower() in ('true', '1', 't')  # Read DEBUG from environment variable
+
+# Upper bounds in seconds of the latency buckets, from a cached stat call to a long model request
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Prefix of every exported metric name
+PREFIX = 'crawler'
+
+# Help text of the counters, keyed by name
+COUNTERS = {
+    'files': 'Files written to the graph, by analysis status.',
+    'tokens': 'Tokens processed, by stage.',
+    'bytes': 'Bytes processed, by stage.',
+    'errors': 'Operations that raised an exception, by stage.',
+    'analysis_cache': 'Analysis cache lookups, by result.',
+    'graph_rows': 'Rows written to the graph by the batch writer, by buffer.',
+    'text_cache': 'Extracted text cache lookups, by result.',
+    'documents': 'Documents converted to text, by extraction method.',
+    'removed': 'Nodes removed from the graph by the cleanup, by kind.',
+}
+
+
+class Histogram:
+    """
+    A class holding a cumulative latency histogram with fixed buckets. Not thread-safe on its own; the
+    owning Metrics serialises access.
+
+    Attributes:
+    ----------
+    bounds : tuple
+        The upper bounds of the buckets in seconds; a final unbounded bucket is implied.
+    counts : list
+        The number of observations in each bucket, including the unbounded one.
+    count : int
+        The number of observations.
+    sum : float
+        The total of the observations in seconds.
+    max : float
+        The largest observation in seconds.
+
+    Methods:
+    -------
+    observe(seconds):
+        Records one observation.
+    quantile(q):
+        Estimates a quantile from the buckets.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        """
+        Initializes an empty Histogram.
+
+        Parameters:
+        ----------
+        bounds : tuple, optional
+            The ascending upper bounds of the buckets in seconds.
+        """
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        """
+        Records one observation.
+
+        Parameters:
+        ----------
+        seconds : float
+            The observed latency.
+        """
+        index = 0
+        while index < len(self.bounds) and seconds > self.bounds[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """
+        Estimates a quantile by interpolating linearly within the bucket that holds it.
+
+        Parameters:
+        ----------
+        q : float
+            The quantile, between 0 and 1.
+
+        Returns:
+        -------
+        float
+            The estimated latency in seconds, or 0.0 without observations.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.bounds[index - 1] if index else 0.0
+                upper = self.bounds[index] if index < len(self.bounds) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / bucket_count, self.max)
+            seen += bucket_count
+        return self.max
+
+
+class Metrics:
+    """
+    A class to collect stage latencies and counters for a crawl and export them.
+
+    Attributes:
+    ----------
+    started : float
+        The time the metrics were created or last reset.
+    profile_sample_rate : float
+        The fraction of analysed files that are profiled; 0 disables profiling.
+    profile_dir : str
+        The directory cProfile output is written to, or None to keep only the summary.
+    profile_memory : bool
+        Whether tracemalloc records the peak memory of profiled files.
+    profiles : list
+        One dict per profiled file, as included in the report.
+
+    Methods:
+    -------
+    observe(stage, seconds):
+        Records the latency of one operation of a stage.
+    timer(stage):
+        Context manager that times a block as one operation of a stage and counts its errors.
+    count(name, amount=1, **labels):
+        Adds to a counter.
+    configure_profiling(sample_rate, profile_dir=None, memory=False):
+        Enables profiling of a sampled subset of files.
+    profile(path):
+        Context manager that profiles the analysis of a file if it is sampled.
+    prometheus_text():
+        Renders the metrics in the Prometheus text exposition format.
+    write_prometheus(path):
+        Writes the Prometheus text to a file atomically.
+    serve(port, address=''):
+        Serves the Prometheus text over HTTP from a background thread.
+    report():
+        Summarises the run as a JSON-serialisable dict.
+    write_report(path):
+        Writes the report to a JSON file.
+    reset():
+        Discards everything recorded so far.
+    """
+
+    def __init__(self):
+        """
+        Initializes empty Metrics with profiling disabled.
+        """
+        self._lock = threading.Lock()
+        self._profile_lock = threading.Lock()
+        self.profile_sample_rate = 0.0
+        self.profile_dir = None
+        self.profile_memory = False
+        self.reset()
+
+    def reset(self):
+        """
+        Discards every observation, counter and profile recorded so far.
+        """
+        with self._lock:
+            self.started = time.time()
+            self._histograms = {}
+            self._counters = {}
+            self.profiles = []
+
+    def observe(self, stage, seconds):
+        """
+        Records the latency of one operation of a stage.
+
+        Parameters:
+        ----------
+        stage : str
+            The name of the stage, for example 'read' or 'embed'.
+        seconds : float
+            The latency of the operation.
+        """
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Times the enclosed block as one operation of a stage. The latency is recorded whether or not the
+        block raises; an exception also increments the stage's error count and is re-raised.
+
+        Parameters:
+        ----------
+        stage : str
+            The name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.count('errors', stage=stage)
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def count(self, name, amount=1, **labels):
+        """
+        Adds to a counter.
+
+        Parameters:
+        ----------
+        name : str
+            The name of the counter, usually one of COUNTERS.
+        amount : int or float, optional
+            The amount to add.
+        **labels : dict
+            The labels that distinguish the series, for example stage='read'.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def configure_profiling(self, sample_rate, profile_dir=None, memory=False):
+        """
+        Enables profiling of a sampled subset of analysed files.
+
+        Parameters:
+        ----------
+        sample_rate : float
+            The fraction of files profiled. Files are sampled by a hash of their path, so the same files
+            are profiled in every run.
+        profile_dir : str, optional
+            The directory the cProfile output of each profiled file is written to, for pstats or
+            snakeviz. Created if missing.
+        memory : bool, optional
+            Whether tracemalloc is started to record the peak memory of each profiled file. Tracing
+            slows every allocation of the process while it is on.
+        """
+        self.profile_sample_rate = sample_rate
+        self.profile_dir = profile_dir
+        self.profile_memory = memory
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _sampled(self, path):
+        """
+        Decides deterministically whether a file is profiled.
+        """
+        if self.profile_sample_rate <= 0:
+            return False
+        return zlib.crc32(path.encode('utf-8', 'surrogateescape')) < self.profile_sample_rate * 2 ** 32
+
+    @contextmanager
+    def profile(self, path):
+        """
+        Profiles the enclosed analysis of a file with cProfile, and tracemalloc if enabled, when the file
+        is sampled. Only one file is profiled at a time; a sampled file that starts while another is
+        being profiled runs unprofiled. cProfile only sees the calling thread, so time spent waiting on
+        other threads, such as batched embedding requests, shows up as waiting.
+
+        Parameters:
+        ----------
+        path : str
+            The path of the file being analysed.
+        """
+        if not self._sampled(path) or not self._profile_lock.acquire(blocking=False):
+            yield
+            return
+        try:
+            profiler = cProfile.Profile()
+            if self.profile_memory:
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                entry = {'path': path, 'seconds': time.perf_counter() - start}
+                if self.profile_memory:
+                    entry['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1] - baseline
+                if self.profile_dir:
+                    entry['profile'] = os.path.join(
+                        self.profile_dir, f"{len(self.profiles):05d}-{os.path.basename(path)}.prof"
+                    )
+                    profiler.dump_stats(entry['profile'])
+                with self._lock:
+                    self.profiles.append(entry)
+                if DEBUG:
+                    print(f"Profiled {path}: {entry}")
+        finally:
+            self._profile_lock.release()
+
+    def _snapshot(self):
+        """
+        Copies the histograms and counters under the lock.
+        """
+        with self._lock:
+            histograms = {stage: (histogram.bounds, list(histogram.counts), histogram.count, histogram.sum,
+                                  histogram.max, histogram.quantile(0.5), histogram.quantile(0.95))
+                          for stage, histogram in self._histograms.items()}
+            return histograms, dict(self._counters), list(self.profiles)
+
+    def prometheus_text(self):
+        """
+        Renders the metrics in the Prometheus text exposition format.
+
+        Returns:
+        -------
+        str
+            The exposition text.
+        """
+        histograms, counters, _ = self._snapshot()
+        lines = [
+            f"# HELP {PREFIX}_stage_seconds Latency of crawl stage operations.",
+            f"# TYPE {PREFIX}_stage_seconds histogram",
+        ]
+        for stage, (bounds, counts, count, total, *_) in sorted(histograms.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(bounds + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {count}')
+
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# HELP {PREFIX}_{name}_total {COUNTERS.get(name, name)}")
+            lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+            for (series, labels), value in sorted(counters.items()):
+                if series == name:
+                    label_text = ','.join(f'{label}="{label_value}"' for label, label_value in labels)
+                    lines.append(f"{PREFIX}_{name}_total{{{label_text}}} {value}" if label_text
+                                 else f"{PREFIX}_{name}_total {value}")
+
+        lines.append(f"# HELP {PREFIX}_run_started_seconds Unix time the metrics were started.")
+        lines.append(f"# TYPE {PREFIX}_run_started_seconds gauge")
+        lines.append(f"{PREFIX}_run_started_seconds {self.started}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """
+        Writes the Prometheus text to a file, replacing it atomically so a collector never reads a
+        partial file.
+
+        Parameters:
+        ----------
+        path : str
+            The path of the file, for example in the node_exporter textfile directory.
+        """
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(self.prometheus_text())
+        os.replace(temp_path, path)
+
+    def serve(self, port, address=''):
+        """
+        Serves the Prometheus text at /metrics from a daemon thread.
+
+        Parameters:
+        ----------
+        port : int
+            The port to listen on.
+        address : str, optional
+            The address to bind, all interfaces by default.
+
+        Returns:
+        -------
+        http.server.ThreadingHTTPServer
+            The running server; call shutdown() to stop it.
+        """
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                if DEBUG:
+                    super().log_message(format, *args)
+
+        server = http.server.ThreadingHTTPServer((address, port), Handler)
+        threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+        print(f"Serving metrics on port {server.server_address[1]}")
+        return server
+
+    def report(self):
+        """
+        Summarises the run as a JSON-serialisable dict.
+
+        Returns:
+        -------
+        dict
+            'started', 'finished' and 'duration_seconds'; 'stages' with the count, errors, total, mean,
+            estimated p50 and p95, and max seconds of each stage; 'counters' keyed by name and then by
+            label values joined with ','; and 'profiles' for the profiled files.
+        """
+        histograms, counters, profiles = self._snapshot()
+        finished = time.time()
+        stages = {}
+        for stage, (_, _, count, total, maximum, p50, p95) in sorted(histograms.items()):
+            stages[stage] = {
+                'count': count,
+                'errors': counters.get(('errors', (('stage', stage),)), 0),
+                'total_seconds': total,
+                'mean_seconds': total / count if count else 0.0,
+                'p50_seconds': p50,
+                'p95_seconds': p95,
+                'max_seconds': maximum,
+            }
+        counter_report = {}
+        for (name, labels), value in sorted(counters.items()):
+            series = ','.join(str(label_value) for _, label_value in labels) or 'total'
+            counter_report.setdefault(name, {})[series] = value
+        report = {
+            'started': self.started,
+            'finished': finished,
+            'duration_seconds': finished - self.started,
+            'stages': stages,
+            'counters': counter_report,
+            'profiles': profiles,
+        }
+        if tracemalloc.is_tracing():
+            report['traced_memory_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        return report
+
+    def write_report(self, path):
+        """
+        Writes the report to a JSON file.
+
+        Parameters:
+        ----------
+        path : str
+            The path of the file.
+        """
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, indent=2)
+        print(f"Crawl report written to {path}")
+
+
+@lru_cache(maxsize=None)
+def get_metrics():
+    """
+    Function: get_metrics
+
+    Description:
+    ------------
+    Returns the Metrics shared by every stage and thread of the process.
+
+    Returns:
+    --------
+    Metrics
+        The shared metrics.
+    """
+    return Metrics()
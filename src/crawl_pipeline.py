@@ -0,0 +1,336 @@
+"""
+Module: crawl_pipeline
+
+Description:
+------------
+This module provides a staged pipeline for crawling: the calling thread produces work while walking
+the directory tree, a pool of analysis workers processes files, and a single writer thread applies the
+results to the graph. Stages are connected by bounded queues, so a slow stage applies backpressure to
+the stages in front of it, and network-bound analysis latency overlaps with file system I/O.
+
+An analysis may return a Future of its result instead of the result, for work it hands to another
+service, such as an embedding that is sent in a batch with those of other files. The worker then goes
+on with the next job, and the writer waits for the Future in turn, so many such results can be in
+flight at once while the records are still written in order.
+
+Classes:
+--------
+- CrawlPipeline
+    Runs the analysis worker pool and the writer thread.
+"""
+
+import asyncio
+import inspect
+import queue
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Marks the end of the stream on a queue
+_SENTINEL = object()
+# Stands in for a record when the writer queue stayed empty
+_IDLE = object()
+
+# How often blocked threads wake up to check whether the pipeline has been aborted
+_POLL_INTERVAL = 0.1
+
+# A Future returned by the analysis of a job, waiting in the writer for its result
+_Pending = namedtuple('_Pending', ['job', 'future'])
+
+
+class CrawlPipeline:
+    """
+    A class to run a walker -> analysis worker pool -> single writer pipeline.
+
+    The pipeline is used as a context manager. Inside the block the producer calls submit() for work
+    that needs analysis and write() for records that can go straight to the writer. Records are written
+    in the order they reach the writer queue, so a directory written before its files are submitted is
+    always written before them. Leaving the block waits for all queued work to finish. An exception
+    raised by the analysis of one job is handed to on_error, whose return value is written in place of
+    the job's result, so one bad input does not stop the others. Any other exception raised by a worker
+    or the writer, or an analysis exception without on_error, aborts the pipeline and is re-raised to
+    the producer.
+
+    If analyse is a coroutine function, the analysis stage is a single thread running an asyncio event
+    loop with up to `workers` jobs in flight, instead of a pool of `workers` threads.
+
+    If analyse returns a concurrent.futures.Future, its result is written once it resolves; an exception
+    it resolves to is handled like one raised by analyse. The writer holds up to max_pending records
+    while the Futures ahead of them resolve, and only then stops taking results from the workers.
+
+    Attributes:
+    ----------
+    analyse : callable
+        Called by the workers with each submitted job; its return value is passed to write. May be a
+        coroutine function.
+    write : callable
+        Called by the writer thread with every record, one at a time.
+    on_error : callable
+        Called by the workers with a job and the exception its analysis raised; returns the record
+        written instead. None if analysis errors abort the pipeline.
+    workers : int
+        The number of analysis worker threads, or the number of jobs in flight for a coroutine analyse.
+    queue_size : int
+        The capacity of the job queue and of the writer queue.
+    max_pending : int
+        The number of records the writer holds while waiting for the Future at their head.
+
+    Methods:
+    -------
+    submit(job):
+        Queues a job for analysis, blocking while the job queue is full.
+    write(record):
+        Queues a record for the writer, blocking while the writer queue is full.
+    """
+
+    def __init__(self, analyse, write, workers=4, queue_size=None, on_error=None, max_pending=1024):
+        """
+        Initializes the CrawlPipeline.
+
+        Parameters:
+        ----------
+        analyse : callable
+            Called by the workers with each submitted job. May be a coroutine function.
+        write : callable
+            Called by the writer thread with every record.
+        workers : int
+            The number of analysis worker threads, or the number of jobs in flight for a coroutine analyse.
+        queue_size : int, optional
+            The capacity of each queue. Defaults to four slots per worker.
+        on_error : callable, optional
+            Called with a job and the exception its analysis raised; returns the record written instead.
+            Without it, an analysis error aborts the pipeline.
+        max_pending : int, optional
+            The number of records the writer holds while waiting for the Future at their head.
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+
+        self.analyse = analyse
+        self.write_record = write
+        self.on_error = on_error
+        self.workers = workers
+        self.queue_size = queue_size or workers * 4
+        self.max_pending = max_pending
+        self._jobs = queue.Queue(maxsize=self.queue_size)
+        self._results = queue.Queue(maxsize=self.queue_size)
+        self._abort = threading.Event()
+        self._error = None
+        self._error_lock = threading.Lock()
+        self._worker_threads = []
+        self._writer_thread = None
+
+    def __enter__(self):
+        self._writer_thread = threading.Thread(target=self._writer_loop, name="crawl-writer", daemon=True)
+        self._writer_thread.start()
+        if inspect.iscoroutinefunction(self.analyse):
+            thread = threading.Thread(target=self._async_worker_thread, name="crawl-async-worker", daemon=True)
+            thread.start()
+            self._worker_threads.append(thread)
+        else:
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._worker_loop, name=f"crawl-worker-{index}", daemon=True)
+                thread.start()
+                self._worker_threads.append(thread)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            # The producer failed; stop the workers without waiting for the queued jobs
+            self._abort.set()
+
+        # Shut the stages down in order so every finished result still reaches the writer
+        for _ in self._worker_threads:
+            self._put(self._jobs, _SENTINEL, alive=self._any_worker_alive)
+        for thread in self._worker_threads:
+            thread.join()
+        self._put(self._results, _SENTINEL, alive=self._writer_thread.is_alive)
+        self._writer_thread.join()
+
+        if exc_type is None:
+            self._raise_if_failed()
+        return False
+
+    def submit(self, job):
+        """
+        Queues a job for analysis, blocking while the job queue is full.
+
+        Parameters:
+        ----------
+        job : object
+            The job passed to the analyse callable.
+        """
+        self._raise_if_failed()
+        self._put(self._jobs, job)
+        self._raise_if_failed()
+
+    def write(self, record):
+        """
+        Queues a record for the writer, blocking while the writer queue is full.
+
+        Parameters:
+        ----------
+        record : object
+            The record passed to the write callable.
+        """
+        self._raise_if_failed()
+        self._put(self._results, record, alive=self._writer_thread.is_alive)
+        self._raise_if_failed()
+
+    def _put(self, target, item, alive=None):
+        """
+        Puts an item on a queue, giving up if the consumers have exited. New jobs are dropped once the
+        pipeline is aborted, but results keep flowing to the writer so finished work is not lost.
+        """
+        while True:
+            if target is self._jobs and item is not _SENTINEL and self._abort.is_set():
+                return
+            if alive is not None and not alive():
+                return
+            try:
+                target.put(item, timeout=_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def _any_worker_alive(self):
+        return any(thread.is_alive() for thread in self._worker_threads)
+
+    def _fail(self, error):
+        """
+        Records the first error and aborts the pipeline.
+        """
+        with self._error_lock:
+            if self._error is None:
+                self._error = error
+        self._abort.set()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    def _recover(self, job, error):
+        """
+        Returns the record written for a job whose analysis raised, or re-raises without on_error.
+        """
+        if self.on_error is None:
+            raise error
+        return self.on_error(job, error)
+
+    @staticmethod
+    def _pending(job, result):
+        """
+        Pairs a Future returned by analyse with its job, so the writer can report its exception.
+        """
+        return _Pending(job, result) if isinstance(result, Future) else result
+
+    def _worker_loop(self):
+        """
+        Analyses jobs until a sentinel arrives or the pipeline is aborted.
+        """
+        while not self._abort.is_set():
+            try:
+                job = self._jobs.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if job is _SENTINEL:
+                return
+            try:
+                try:
+                    result = self.analyse(job)
+                except Exception as e:
+                    result = self._recover(job, e)
+            except BaseException as e:
+                self._fail(e)
+                return
+            self._put(self._results, self._pending(job, result), alive=self._writer_thread.is_alive)
+
+    def _next_job(self):
+        """
+        Blocks until a job arrives, returning the sentinel once the stream ends or the pipeline is aborted.
+        """
+        while not self._abort.is_set():
+            try:
+                return self._jobs.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _SENTINEL
+
+    def _async_worker_thread(self):
+        """
+        Runs the asyncio analysis stage on its own event loop.
+        """
+        asyncio.run(self._async_worker_main())
+
+    async def _async_worker_main(self):
+        """
+        Keeps up to `workers` coroutine jobs in flight until a sentinel arrives or the pipeline is aborted.
+        """
+        loop = asyncio.get_running_loop()
+        # Blocking helpers (queue hand-offs, file reads inside analyse) need a thread per job in flight
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.workers + 1))
+        slots = asyncio.Semaphore(self.workers)
+        tasks = set()
+
+        while True:
+            await slots.acquire()
+            job = await asyncio.to_thread(self._next_job)
+            if job is _SENTINEL:
+                slots.release()
+                break
+            task = asyncio.create_task(self._run_async_job(job, slots))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        await asyncio.gather(*tasks)
+
+    async def _run_async_job(self, job, slots):
+        """
+        Analyses one job on the event loop and hands the result to the writer.
+        """
+        try:
+            try:
+                result = await self.analyse(job)
+            except Exception as e:
+                result = self._recover(job, e)
+            await asyncio.to_thread(self._put, self._results, self._pending(job, result),
+                                    self._writer_thread.is_alive)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            slots.release()
+
+    def _writer_loop(self):
+        """
+        Writes records in order until a sentinel arrives. A record waits while a Future ahead of it is
+        unresolved, and the writer only blocks on that Future once max_pending records are waiting or the
+        stream has ended. Records keep being written after a worker fails.
+        """
+        waiting = deque()
+        while True:
+            try:
+                record = self._results.get(timeout=_POLL_INTERVAL if waiting else None)
+            except queue.Empty:
+                record = _IDLE
+            if record is not _IDLE and record is not _SENTINEL:
+                waiting.append(record)
+            try:
+                while waiting and (record is _SENTINEL or len(waiting) > self.max_pending
+                                   or not isinstance(waiting[0], _Pending) or waiting[0].future.done()):
+                    self.write_record(self._resolve(waiting.popleft()))
+            except BaseException as e:
+                self._fail(e)
+                return
+            if record is _SENTINEL:
+                return
+
+    def _resolve(self, record):
+        """
+        Waits for the result of a pending record, handing an exception it resolves to on_error.
+        """
+        if not isinstance(record, _Pending):
+            return record
+        try:
+            return record.future.result()
+        except Exception as e:
+            return self._recover(record.job, e)
@@ -4,32 +4,143 @@ Module: embed
 Description:
 ------------
 This module provides functionality to generate embeddings for a given text using the OpenAIEmbeddings model.
+Requests from all callers in the process go through one shared EmbeddingService, which batches them into
+embed_documents calls on a single pooled client.
 
 Functions:
 ----------
 embed(text: str) -> list:
     Generates embeddings for the input text using the OpenAIEmbeddings model.
+aembed(text: str) -> list:
+    Asynchronous version of embed.
+submit_embedding(text: str) -> Future:
+    Queues the text for embedding and returns a Future of it without waiting.
+get_embedding_service() -> EmbeddingService:
+    Returns the EmbeddingService shared by embed and aembed.
+embed_query(text: str) -> list:
+    Embeds a search query immediately, without waiting to be batched.
 """
 
+import asyncio
+import os
+from functools import lru_cache
 from langchain_openai import OpenAIEmbeddings
+from embedding_service import EmbeddingService
+from rate_limiter import get_rate_limiter, estimate_tokens
+
+MODEL = "text-embedding-3-small"
+
+@lru_cache(maxsize=None)
+def _embeddings_client():
+    """
+    Builds the embeddings client once per process so its connection pool is reused.
+    """
+    return OpenAIEmbeddings(model=MODEL)
+
+@lru_cache(maxsize=None)
+def get_embedding_service():
+    """
+    Function: get_embedding_service
+
+    Description:
+    ------------
+    Returns the EmbeddingService shared by embed and aembed. Batch limits can be tuned with the
+    EMBEDDING_BATCH_ITEMS, EMBEDDING_BATCH_TOKENS and EMBEDDING_BATCH_WAIT environment variables.
+    A batch only holds the texts queued together, so callers that embed many texts should use
+    submit_embedding and collect the results later rather than wait for each one.
+
+    Returns:
+    --------
+    EmbeddingService
+        The shared service.
+    """
+    return EmbeddingService(
+        _embeddings_client(),
+        max_batch_items=int(os.getenv('EMBEDDING_BATCH_ITEMS', '512')),
+        max_batch_tokens=int(os.getenv('EMBEDDING_BATCH_TOKENS', '200000')),
+        max_wait=float(os.getenv('EMBEDDING_BATCH_WAIT', '0.05')),
+        rate_limiter=get_rate_limiter("openai-embeddings")
+    )
 
 def embed(text: str):
     """
     Function: embed
-    
+
     Description:
     ------------
     Generates embeddings for the input text using the OpenAIEmbeddings model.
-    
+
+    Parameters:
+    ------------
+    text : str
+        The input text to be embedded.
+
+    Returns:
+    --------
+    list
+        A list of embeddings representing the input text.
+    """
+    return get_embedding_service().submit(text).result()
+
+async def aembed(text: str):
+    """
+    Function: aembed
+
+    Description:
+    ------------
+    Asynchronous version of embed. Waits for the batched request without blocking the event loop.
+
     Parameters:
     ------------
     text : str
         The input text to be embedded.
-    
+
     Returns:
     --------
     list
         A list of embeddings representing the input text.
     """
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-    return embeddings.embed_query(text)
\ No newline at end of file
+    return await asyncio.wrap_future(get_embedding_service().submit(text))
+
+def submit_embedding(text: str):
+    """
+    Function: submit_embedding
+
+    Description:
+    ------------
+    Queues the text on the shared EmbeddingService and returns at once, so the caller can go on while
+    the batch fills with the texts of other callers.
+
+    Parameters:
+    ------------
+    text : str
+        The input text to be embedded.
+
+    Returns:
+    --------
+    concurrent.futures.Future
+        Resolves to a list of embeddings representing the input text.
+    """
+    return get_embedding_service().submit(text)
+
+def embed_query(text: str):
+    """
+    Function: embed_query
+
+    Description:
+    ------------
+    Embeds a search query with the same model as the summaries. The request is sent immediately
+    instead of waiting for a batch, since a searcher is waiting on it.
+
+    Parameters:
+    ------------
+    text : str
+        The query to be embedded.
+
+    Returns:
+    --------
+    list
+        The embedding of the query.
+    """
+    get_rate_limiter("openai-embeddings").acquire(estimate_tokens(text))
+    return _embeddings_client().embed_query(text)
@@ -0,0 +1,327 @@
+"""
+Module: embedding_compression
+
+Description:
+------------
+This module searches the summary embeddings of an EmbeddingStore through a compressed copy that is small
+enough to keep in memory on machines that cannot hold the float32 matrix. Two compressions can be
+combined:
+
+- Matryoshka truncation keeps only the first dimensions of every vector and re-normalises them.
+  text-embedding-3 models are trained so that these prefixes remain useful embeddings.
+- Quantisation stores each kept dimension as an int8 (a per-dimension scale, 4x smaller than float32)
+  or as a single sign bit (32x smaller, scored by Hamming distance).
+
+The compressed codes are scanned to pick a candidate list a few times longer than k, and the candidates
+are then re-ranked with exact cosine similarities read from the store's memory-mapped float matrix, so
+only the candidate rows of the full vectors are ever paged in. evaluate_recall measures the recall@k,
+memory and latency of each configuration against an exact search, so the trade-off can be checked on
+real data before a configuration is chosen.
+
+Classes:
+--------
+- CompressedIndex
+    A truncated and/or quantised copy of an EmbeddingStore with exact re-ranking.
+
+Functions:
+----------
+- evaluate_recall(store: EmbeddingStore, configs: list, k: int, num_queries: int, seed: int) -> list
+    Measures recall@k, memory and query time of compressed indexes against exact search.
+"""
+
+import os
+import sys
+import time
+import numpy as np
+from embedding_store import EmbeddingStore
+
+DEBUG = os.getenv('TEST', 'False').lower() in ('true', '1', 't')  # Read DEBUG from environment variable
+
+QUANTISATIONS = (None, 'int8', 'binary')
+
+# Number of rows compressed or scored at once, bounding temporary memory
+_BLOCK_ROWS = 65536
+
+# Number of set bits of every byte value, for Hamming distances between packed sign bits
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint16)
+
+# Configurations compared by default: full and truncated dimensions, each float, int8 and binary
+DEFAULT_CONFIGS = [
+    dict(dimensions=dimensions, quantisation=quantisation)
+    for dimensions in (None, 512, 256)
+    for quantisation in QUANTISATIONS
+]
+
+
+class CompressedIndex:
+    """
+    A class holding a truncated and/or quantised copy of the embeddings of an EmbeddingStore.
+
+    Rows map one to one to the rows of the store. Rows appended to the store after the index was built
+    are scored exactly, and the index rebuilds itself if the store is compacted, since that renumbers
+    the rows.
+
+    Attributes:
+    ----------
+    store : EmbeddingStore
+        The store holding the full vectors.
+    dimensions : int
+        The number of leading dimensions kept.
+    quantisation : str
+        None for float32 codes, 'int8' or 'binary'.
+    rerank_factor : int
+        The number of candidates per requested result re-ranked with the full vectors; 0 disables
+        re-ranking and returns the approximate scores.
+    scale : numpy.ndarray
+        The per-dimension scale of int8 codes, or None.
+    codes : numpy.ndarray
+        The compressed rows.
+
+    Methods:
+    -------
+    build():
+        Compresses the store's current rows.
+    search(vector, k=10, mask=None):
+        Returns the k stored embeddings most similar to a query.
+    nbytes():
+        Returns the memory used by the compressed codes.
+    """
+
+    def __init__(self, store, dimensions=None, quantisation='int8', rerank_factor=10):
+        """
+        Initializes the CompressedIndex and builds it.
+
+        Parameters:
+        ----------
+        store : EmbeddingStore
+            The store holding the full vectors.
+        dimensions : int, optional
+            The number of leading dimensions kept. Defaults to all of them.
+        quantisation : str, optional
+            None, 'int8' or 'binary'.
+        rerank_factor : int, optional
+            The number of candidates per requested result re-ranked exactly; 0 disables re-ranking.
+        """
+        if quantisation not in QUANTISATIONS:
+            raise ValueError(f"Unsupported quantisation: {quantisation}")
+        if dimensions is not None and not 0 < dimensions <= store.dimensions:
+            raise ValueError(f"Cannot truncate {store.dimensions}-dimensional embeddings to {dimensions}")
+        self.store = store
+        self.dimensions = dimensions or store.dimensions
+        self.quantisation = quantisation
+        self.rerank_factor = rerank_factor
+        self.scale = None
+        self.codes = None
+        self.build()
+
+    def _truncate(self, vectors):
+        """
+        Keeps the leading dimensions of vectors and re-normalises them to unit length.
+        """
+        vectors = np.array(vectors[..., :self.dimensions], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def _encode(self, vectors):
+        """
+        Compresses truncated vectors.
+        """
+        if self.quantisation == 'int8':
+            return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+        if self.quantisation == 'binary':
+            return np.packbits(vectors > 0, axis=-1)
+        return vectors
+
+    def build(self):
+        """
+        Compresses the store's current rows, reading the matrix in blocks.
+        """
+        matrix = self.store.vectors()
+        self._generation = self.store.generation
+        self._rows = len(matrix)
+
+        if self.quantisation == 'int8':
+            # Symmetric per-dimension scale covering the largest magnitude seen in each dimension
+            max_abs = np.zeros(self.dimensions, dtype=np.float32)
+            for start in range(0, self._rows, _BLOCK_ROWS):
+                block = self._truncate(matrix[start:start + _BLOCK_ROWS])
+                np.maximum(max_abs, np.abs(block).max(axis=0), out=max_abs)
+            self.scale = np.where(max_abs == 0, 1, max_abs) / 127
+
+        blocks = [self._encode(self._truncate(matrix[start:start + _BLOCK_ROWS]))
+                  for start in range(0, self._rows, _BLOCK_ROWS)]
+        if blocks:
+            self.codes = np.concatenate(blocks)
+        else:
+            self.codes = self._encode(np.empty((0, self.dimensions), dtype=np.float32))
+        if DEBUG:
+            print(f"Compressed {self._rows} embeddings to {self.nbytes()} bytes "
+                  f"({self.dimensions} dimensions, {self.quantisation or 'float32'})")
+
+    def nbytes(self):
+        """
+        Returns the memory used by the compressed codes.
+
+        Returns:
+        -------
+        int
+            The size of the codes and scale in bytes.
+        """
+        return self.codes.nbytes + (self.scale.nbytes if self.scale is not None else 0)
+
+    def _approximate_scores(self, query):
+        """
+        Scores every indexed row against a full query vector using the codes.
+        """
+        query = self._truncate(query)
+        scores = np.empty(self._rows, dtype=np.float32)
+        for start in range(0, self._rows, _BLOCK_ROWS):
+            codes = self.codes[start:start + _BLOCK_ROWS]
+            if self.quantisation == 'int8':
+                scores[start:start + len(codes)] = codes.astype(np.float32) @ (query * self.scale)
+            elif self.quantisation == 'binary':
+                distances = _POPCOUNT[np.bitwise_xor(codes, np.packbits(query > 0))].sum(axis=1)
+                scores[start:start + len(codes)] = 1 - 2 * distances / self.dimensions
+            else:
+                scores[start:start + len(codes)] = codes @ query
+        return scores
+
+    def search(self, vector, k=10, mask=None):
+        """
+        Returns the k stored embeddings most similar to a query: a candidate list is taken from the
+        compressed codes and re-ranked with the store's full vectors.
+
+        Parameters:
+        ----------
+        vector : array-like
+            The query embedding, with the store's full dimensions.
+        k : int, optional
+            The number of results.
+        mask : numpy.ndarray, optional
+            A boolean array over the store's rows; only rows marked True are considered.
+
+        Returns:
+        -------
+        list
+            (file_id, cosine similarity) tuples, most similar first. The similarities are exact when
+            re-ranking is enabled.
+        """
+        if self.store.generation != self._generation:
+            self.build()
+        if k <= 0:
+            return []
+        query = np.array(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1
+
+        allowed = self.store.live_mask()
+        if mask is not None:
+            allowed &= mask[:len(allowed)]
+        candidates = k * self.rerank_factor if self.rerank_factor else k
+
+        scores = self._approximate_scores(query)
+        scores[~allowed[:self._rows]] = -np.inf
+        count = min(candidates, len(scores))
+        rows = np.argpartition(-scores, count - 1)[:count] if count else np.empty(0, dtype=np.int64)
+        rows = rows[scores[rows] != -np.inf]
+
+        matrix = self.store.vectors()
+        if self.rerank_factor:
+            # Sorted rows read the memory map front to back
+            rows = np.sort(rows)
+            scores = matrix[rows].astype(np.float32) @ query
+        else:
+            scores = scores[rows]
+
+        # Rows appended since the index was built are scored exactly
+        if len(allowed) > self._rows and allowed[self._rows:].any():
+            new_rows = self._rows + np.flatnonzero(allowed[self._rows:])
+            rows = np.concatenate([rows, new_rows])
+            scores = np.concatenate([scores, matrix[new_rows].astype(np.float32) @ query])
+
+        ids = self.store.row_ids()
+        order = np.argsort(-scores)[:k]
+        return [(ids[rows[i]], float(scores[i])) for i in order]
+
+
+def evaluate_recall(store, configs=None, k=10, num_queries=100, seed=0):
+    """
+    Function: evaluate_recall
+
+    Description:
+    ------------
+    Measures how well compressed indexes reproduce an exact search. Stored embeddings are sampled as
+    queries, each query's own row is excluded, and the exact top k from EmbeddingStore.knn is compared
+    with the top k of each configuration.
+
+    Parameters:
+    -----------
+    store : EmbeddingStore
+        The store to evaluate on.
+    configs : list, optional
+        Keyword arguments for CompressedIndex, one dict per configuration. Defaults to DEFAULT_CONFIGS,
+        each with and without re-ranking.
+    k : int, optional
+        The number of neighbours compared.
+    num_queries : int, optional
+        The number of stored embeddings used as queries.
+    seed : int, optional
+        The seed for sampling the queries.
+
+    Returns:
+    --------
+    list
+        One dict per configuration with 'dimensions', 'quantisation', 'rerank_factor', 'recall' (the
+        mean fraction of the exact top k found), 'bytes' (memory of the codes) and 'query_ms' (mean
+        search time).
+    """
+    if configs is None:
+        configs = [dict(config, rerank_factor=rerank_factor) for config in DEFAULT_CONFIGS for rerank_factor in (0, 10)
+                   if (config['dimensions'] or 0) < store.dimensions]
+    live_rows = np.flatnonzero(store.live_mask())
+    if len(live_rows) <= k:
+        raise ValueError(f"Need more than {k} embeddings to evaluate recall@{k}")
+    rng = np.random.default_rng(seed)
+    query_rows = rng.choice(live_rows, size=min(num_queries, len(live_rows)), replace=False)
+    queries = np.array(store.vectors()[query_rows], dtype=np.float32)
+
+    # Excludes the query's own row while it is searched
+    mask = np.ones(len(store.live_mask()), dtype=bool)
+
+    exact = []
+    for row, query in zip(query_rows, queries):
+        mask[row] = False
+        exact.append({file_id for file_id, _ in store.knn(query, k, mask=mask)[0]})
+        mask[row] = True
+
+    results = []
+    for config in configs:
+        index = CompressedIndex(store, **config)
+        found = 0
+        start = time.perf_counter()
+        for row, query, expected in zip(query_rows, queries, exact):
+            mask[row] = False
+            found += len(expected.intersection(file_id for file_id, _ in index.search(query, k, mask=mask)))
+            mask[row] = True
+        elapsed = time.perf_counter() - start
+        results.append({
+            'dimensions': index.dimensions,
+            'quantisation': index.quantisation or 'float32',
+            'rerank_factor': index.rerank_factor,
+            'recall': found / (k * len(queries)),
+            'bytes': index.nbytes(),
+            'query_ms': elapsed * 1000 / len(queries),
+        })
+    return results
+
+
+if __name__ == "__main__":
+    # Usage: python src/embedding_compression.py [embedding store path] [k]
+    store_path = sys.argv[1] if len(sys.argv) > 1 else os.getenv('EMBEDDING_STORE_PATH', 'embeddings.db')
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    with EmbeddingStore(store_path, readonly=True) as store:
+        print(f"{len(store)} embeddings, {store.stats()['bytes']} bytes in the {store.dtype} matrix")
+        print(f"{'dimensions':>10} {'codes':>8} {'rerank':>6} {'recall@' + str(k):>9} {'bytes':>12} {'ms/query':>9}")
+        for result in evaluate_recall(store, k=k):
+            print(f"{result['dimensions']:>10} {result['quantisation']:>8} {result['rerank_factor']:>6} "
+                  f"{result['recall']:>9.3f} {result['bytes']:>12} {result['query_ms']:>9.2f}")
@@ -0,0 +1,167 @@
+"""
+Module: embedding_service
+
+Description:
+------------
+This module provides a batching front end for an embeddings client. Callers from any thread submit
+single texts and get a Future back; a background thread accumulates the texts and sends them to the
+client's embed_documents in batches bounded by item count and estimated tokens.
+
+A batch can only hold the texts that are queued together, so callers should not wait for one
+embedding before submitting the next. The crawl's analysis workers submit the summary of each file and
+move on to the next file, handing the Future to the writer stage, which waits for it before writing
+the file. Hundreds of files can then be waiting for their embeddings at once, and they share one client
+and a few HTTP requests instead of one request per file.
+
+Classes:
+--------
+- EmbeddingService
+    Batches embedding requests from many callers.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from rate_limiter import estimate_tokens
+from crawl_metrics import get_metrics
+
+# Marks the end of the request stream
+_SENTINEL = object()
+
+
+class EmbeddingService:
+    """
+    A class to batch embedding requests from many callers onto one embeddings client.
+
+    Attributes:
+    ----------
+    client : object
+        The embeddings client; any object with an embed_documents(texts) method.
+    max_batch_items : int
+        The maximum number of texts per request.
+    max_batch_tokens : int
+        The maximum estimated number of tokens per request.
+    max_wait : float
+        The maximum number of seconds the first text of a batch waits for more texts to arrive.
+    rate_limiter : RateLimiter
+        Throttles the batched requests, or None.
+
+    Methods:
+    -------
+    submit(text):
+        Queues a text for embedding and returns a Future of its embedding.
+    close():
+        Sends any queued texts and stops the background thread.
+    """
+
+    def __init__(self, client, max_batch_items=512, max_batch_tokens=200000, max_wait=0.05, rate_limiter=None):
+        """
+        Initializes the EmbeddingService and starts its background thread.
+
+        Parameters:
+        ----------
+        client : object
+            The embeddings client; any object with an embed_documents(texts) method.
+        max_batch_items : int, optional
+            The maximum number of texts per request.
+        max_batch_tokens : int, optional
+            The maximum estimated number of tokens per request.
+        max_wait : float, optional
+            The maximum number of seconds the first text of a batch waits for more texts to arrive.
+        rate_limiter : RateLimiter, optional
+            Throttles the batched requests.
+        """
+        self.client = client
+        self.max_batch_items = max_batch_items
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait
+        self.rate_limiter = rate_limiter
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+        self._thread.start()
+
+    def submit(self, text):
+        """
+        Queues a text for embedding.
+
+        Parameters:
+        ----------
+        text : str
+            The text to embed.
+
+        Returns:
+        -------
+        concurrent.futures.Future
+            Resolves to the embedding of the text as a list of floats.
+        """
+        future = Future()
+        self._requests.put((text, estimate_tokens(text), future))
+        return future
+
+    def close(self):
+        """
+        Sends any queued texts and stops the background thread.
+        """
+        self._requests.put(_SENTINEL)
+        self._thread.join()
+
+    def _run(self):
+        """
+        Collects requests into batches and sends them until the service is closed.
+        """
+        carry = None
+        while True:
+            request = carry if carry is not None else self._requests.get()
+            carry = None
+            if request is _SENTINEL:
+                return
+
+            batch = [request]
+            batch_tokens = request[1]
+            deadline = time.monotonic() + self.max_wait
+            closing = False
+
+            # Keep adding requests until the batch is full or the first request has waited long enough
+            while len(batch) < self.max_batch_items:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is _SENTINEL:
+                    closing = True
+                    break
+                if batch_tokens + request[1] > self.max_batch_tokens:
+                    carry = request
+                    break
+                batch.append(request)
+                batch_tokens += request[1]
+
+            self._send(batch, batch_tokens)
+            if closing:
+                carry = _SENTINEL
+
+    def _send(self, batch, batch_tokens):
+        """
+        Sends one batch to the client and resolves its futures.
+        """
+        # Skip requests whose callers cancelled them while they were queued
+        pending = [(text, future) for text, _, future in batch if future.set_running_or_notify_cancel()]
+        if not pending:
+            return
+        metrics = get_metrics()
+        try:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(batch_tokens)
+            with metrics.timer('embed'):
+                embeddings = self.client.embed_documents([text for text, _ in pending])
+            metrics.count('tokens', batch_tokens, stage='embed')
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        for (_, future), embedding in zip(pending, embeddings):
+            future.set_result(embedding)
@@ -0,0 +1,669 @@
+"""
+Module: embedding_store
+
+Description:
+------------
+This module keeps the summary embeddings of crawled files in a compact local store alongside the graph.
+The vectors live in one contiguous float32 (or float16) matrix file that is memory-mapped, so readers
+get a NumPy view of it without copying or building Python lists of floats, and brute-force k-nearest-
+neighbour search is a blocked matrix product. A SQLite database maps each file_id to its row and
+remembers the file's path, so whole subtrees can be dropped or renamed.
+
+Vectors are stored unit-normalised, so the dot product of two rows is their cosine similarity. Updating
+a file overwrites its row in place; new files are appended, growing the matrix file geometrically.
+Deleting a file only unmaps its row, leaving a tombstone; compact() rewrites the live rows into a new
+matrix file once enough of them have accumulated. Each compaction writes a new generation of the matrix
+file and switches to it in the same SQLite transaction that renumbers the rows, so a crash never leaves
+the map pointing into the wrong file.
+
+Classes:
+--------
+- EmbeddingStore
+    The memory-mapped embedding matrix with its ID to row map.
+"""
+
+import glob
+import os
+import sqlite3
+import threading
+import numpy as np
+from graph_schema import EMBEDDING_DIMENSIONS
+
+DEBUG = os.getenv('TEST', 'False').lower() in ('true', '1', 't')  # Read DEBUG from environment variable
+
+# Element types the matrix can be stored as
+DTYPES = {'float32': np.float32, 'float16': np.float16}
+
+# The matrix file never grows by fewer rows than this
+_MIN_GROWTH_ROWS = 1024
+
+# Number of puts after which the row map is committed
+_COMMIT_EVERY = 1000
+
+# Number of rows scored at once by knn, bounding its temporary memory
+_KNN_BLOCK_ROWS = 65536
+
+
+class EmbeddingStore:
+    """
+    A class storing unit-normalised embeddings in a memory-mapped matrix with a SQLite ID to row map.
+
+    A store has one writer at a time; any number of read-only stores, in the same or other processes,
+    can search it concurrently and see new rows after reload().
+
+    Attributes:
+    ----------
+    path : str
+        The path of the SQLite database. The matrix files are stored next to it.
+    dimensions : int
+        The length of the embeddings.
+    dtype : str
+        The element type of the matrix, 'float32' or 'float16'.
+    readonly : bool
+        Whether the store was opened for reading only.
+    generation : int
+        The number of compactions so far. Row numbers only change when it does.
+
+    Methods:
+    -------
+    put(file_id, vector, path=None):
+        Stores the embedding of a file, replacing any previous one.
+    get(file_id):
+        Returns the stored embedding of a file, or None.
+    delete(file_id):
+        Removes the embedding of a file.
+    remove_subtree(path):
+        Removes the embeddings of all files at or below a path.
+    rename(old_id, file_id, path):
+        Moves an embedding to a new identifier and path.
+    retain(root_path, file_ids):
+        Removes the embeddings below root_path of files not in file_ids.
+    backfill(rows):
+        Adds the embeddings of files stored before the store existed, once.
+    vectors():
+        Returns a read-only view of the matrix rows in use.
+    live_mask():
+        Returns a boolean array marking the rows that belong to a file.
+    row_ids():
+        Returns the file_id of every row, or None for tombstones.
+    rows_for(file_ids):
+        Returns the rows of the given files.
+    rows_below(path):
+        Returns the rows of the files at or below a path.
+    knn(queries, k=10, mask=None):
+        Returns the k most similar stored embeddings for each query.
+    compact(min_dead_fraction=0.0):
+        Rewrites the matrix without tombstones.
+    flush():
+        Makes all changes durable.
+    reload():
+        Re-reads the map and matrix written by another store.
+    stats():
+        Returns the number of live and dead rows and the size of the matrix.
+    close():
+        Flushes and closes the store.
+    """
+
+    def __init__(self, path, dimensions=EMBEDDING_DIMENSIONS, dtype='float32', readonly=False):
+        """
+        Initializes the EmbeddingStore, creating it if it does not exist.
+
+        Parameters:
+        ----------
+        path : str
+            The path of the SQLite database, for example 'embeddings.db'.
+        dimensions : int, optional
+            The length of the embeddings.
+        dtype : str, optional
+            'float32', or 'float16' to halve the size of the matrix at a small loss of precision. Only
+            used when the store is created; an existing store keeps its type.
+        readonly : bool, optional
+            Whether the store is only read. A read-only store must already exist.
+        """
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported embedding dtype: {dtype}")
+        self.path = path
+        self.readonly = readonly
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._matrix = None
+
+        if readonly:
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS vectors (file_id TEXT PRIMARY KEY, row INTEGER NOT NULL UNIQUE, path TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS vectors_path ON vectors (path)")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)",
+                [('dimensions', str(dimensions)), ('dtype', dtype), ('rows', '0'), ('generation', '0')]
+            )
+            self._conn.commit()
+
+        meta = dict(self._conn.execute("SELECT key, value FROM meta"))
+        self.dimensions = int(meta['dimensions'])
+        self.dtype = meta['dtype']
+        if self.dimensions != dimensions:
+            raise ValueError(f"{path} stores {self.dimensions}-dimensional embeddings, not {dimensions}")
+        self._load(meta)
+        if not readonly:
+            self._remove_old_generations()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._rows_by_id)
+
+    def __contains__(self, file_id):
+        return file_id in self._rows_by_id
+
+    def _matrix_path(self, generation):
+        """
+        Returns the path of the matrix file of a generation.
+        """
+        return f"{self.path}-{generation}.vectors"
+
+    def _load(self, meta):
+        """
+        Maps the matrix file and reads the row map.
+        """
+        self.generation = int(meta['generation'])
+        self._rows = int(meta['rows'])
+        self._rows_by_id = {}
+        self._ids = [None] * self._rows
+        self._paths = [None] * self._rows
+        for file_id, row, path in self._conn.execute("SELECT file_id, row, path FROM vectors"):
+            self._rows_by_id[file_id] = row
+            self._ids[row] = file_id
+            self._paths[row] = path
+        self._map_matrix(self._rows)
+        self._live = np.zeros(self._capacity, dtype=bool)
+        self._live[list(self._rows_by_id.values())] = True
+
+    def _map_matrix(self, min_rows):
+        """
+        Memory-maps the matrix file, first growing it to hold at least min_rows rows if writable.
+        """
+        matrix_path = self._matrix_path(self.generation)
+        row_bytes = self.dimensions * np.dtype(DTYPES[self.dtype]).itemsize
+        size = os.path.getsize(matrix_path) if os.path.exists(matrix_path) else 0
+        capacity = size // row_bytes
+        if not self.readonly and capacity < min_rows:
+            capacity = max(min_rows, 2 * capacity, _MIN_GROWTH_ROWS)
+            with open(matrix_path, 'ab') as file:
+                file.truncate(capacity * row_bytes)
+        if self._matrix is not None and not self.readonly:
+            self._matrix.flush()
+        self._matrix = None
+        if capacity:
+            self._matrix = np.memmap(matrix_path, dtype=DTYPES[self.dtype], mode='r' if self.readonly else 'r+',
+                                     shape=(capacity, self.dimensions))
+        self._capacity = capacity
+
+    def _remove_old_generations(self):
+        """
+        Deletes matrix files left behind by a compaction.
+        """
+        current = self._matrix_path(self.generation)
+        for matrix_path in glob.glob(glob.escape(self.path) + "-*.vectors"):
+            if matrix_path != current:
+                os.remove(matrix_path)
+
+    def _normalise(self, vector):
+        """
+        Converts a vector to a unit-length float32 array of the store's dimensions.
+        """
+        vector = np.array(vector, dtype=np.float32)
+        if vector.shape != (self.dimensions,):
+            raise ValueError(f"Expected an embedding of {self.dimensions} dimensions, got {vector.shape}")
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_writable(self):
+        if self.readonly:
+            raise PermissionError(f"{self.path} was opened read-only")
+
+    def _committed(self, count=1):
+        """
+        Counts uncommitted changes and commits the map once enough have accumulated. Call with the lock held.
+        """
+        self._pending += count
+        if self._pending >= _COMMIT_EVERY:
+            self._flush()
+
+    def _flush(self):
+        """
+        Flushes the matrix before committing the map, so committed rows always hold their vectors.
+        Call with the lock held.
+        """
+        if self._matrix is not None:
+            self._matrix.flush()
+        self._conn.execute("UPDATE meta SET value = ? WHERE key = 'rows'", (str(self._rows),))
+        self._conn.commit()
+        self._pending = 0
+
+    def put(self, file_id, vector, path=None):
+        """
+        Stores the embedding of a file, replacing any previous one. An empty embedding removes it, as
+        files that are no longer analysed have none.
+
+        Parameters:
+        ----------
+        file_id : str
+            The identifier of the file node.
+        vector : list
+            The embedding.
+        path : str, optional
+            The path of the file, used by remove_subtree, retain and rows_below.
+        """
+        self._check_writable()
+        if vector is None or len(vector) == 0:
+            self.delete(file_id)
+            return
+        vector = self._normalise(vector)
+        with self._lock:
+            row = self._rows_by_id.get(file_id)
+            if row is None:
+                row = self._rows
+                if row >= self._capacity:
+                    self._map_matrix(row + 1)
+                    self._live.resize(self._capacity, refcheck=False)
+                self._rows += 1
+                self._ids.append(file_id)
+                self._paths.append(path)
+                self._rows_by_id[file_id] = row
+                self._live[row] = True
+                self._matrix[row] = vector
+                self._conn.execute("INSERT INTO vectors (file_id, row, path) VALUES (?, ?, ?)", (file_id, row, path))
+            else:
+                self._matrix[row] = vector
+                if path is not None and path != self._paths[row]:
+                    self._paths[row] = path
+                    self._conn.execute("UPDATE vectors SET path = ? WHERE file_id = ?", (path, file_id))
+            self._committed()
+
+    def get(self, file_id):
+        """
+        Returns the stored (unit-normalised) embedding of a file.
+
+        Parameters:
+        ----------
+        file_id : str
+            The identifier of the file node.
+
+        Returns:
+        -------
+        numpy.ndarray
+            A view of the file's row, or None if the file has no embedding.
+        """
+        row = self._rows_by_id.get(file_id)
+        return None if row is None else self._matrix[row]
+
+    def _unmap(self, file_ids):
+        """
+        Turns the rows of files into tombstones. Call with the lock held.
+        """
+        removed = 0
+        for file_id in file_ids:
+            row = self._rows_by_id.pop(file_id, None)
+            if row is None:
+                continue
+            self._ids[row] = None
+            self._paths[row] = None
+            self._live[row] = False
+            removed += 1
+        self._conn.executemany("DELETE FROM vectors WHERE file_id = ?", ((file_id,) for file_id in file_ids))
+        self._committed(removed)
+        return removed
+
+    def delete(self, file_id):
+        """
+        Removes the embedding of a file, leaving a tombstone in the matrix until the next compaction.
+
+        Parameters:
+        ----------
+        file_id : str
+            The identifier of the file node.
+
+        Returns:
+        -------
+        bool
+            Whether the file had an embedding.
+        """
+        self._check_writable()
+        with self._lock:
+            return self._unmap([file_id]) > 0
+
+    def remove_subtree(self, path):
+        """
+        Removes the embeddings of the file at path, or of all files below it if it is a directory.
+
+        Parameters:
+        ----------
+        path : str
+            The absolute path of the file or directory.
+
+        Returns:
+        -------
+        int
+            The number of embeddings removed.
+        """
+        self._check_writable()
+        with self._lock:
+            return self._unmap([self._ids[row] for row in self._rows_under(path)])
+
+    def rename(self, old_id, file_id, path):
+        """
+        Moves an embedding to a new identifier and path after its file was moved. A file already stored
+        under the new identifier is replaced.
+
+        Parameters:
+        ----------
+        old_id : str
+            The identifier the file had before the move.
+        file_id : str
+            The identifier of the file after the move.
+        path : str
+            The path of the file after the move.
+        """
+        self._check_writable()
+        with self._lock:
+            row = self._rows_by_id.get(old_id)
+            if row is None:
+                return
+            if file_id != old_id:
+                self._unmap([file_id])
+                del self._rows_by_id[old_id]
+                self._rows_by_id[file_id] = row
+                self._ids[row] = file_id
+            self._paths[row] = path
+            self._conn.execute("UPDATE vectors SET file_id = ?, path = ? WHERE file_id = ?", (file_id, path, old_id))
+            self._committed()
+
+    def retain(self, root_path, file_ids):
+        """
+        Removes the embeddings of files at or below root_path that are not in file_ids, for example after
+        the graph cleanup removed files that no longer exist.
+
+        Parameters:
+        ----------
+        root_path : str
+            The absolute path of the crawled root directory.
+        file_ids : iterable
+            The identifiers of the files below root_path that still exist.
+
+        Returns:
+        -------
+        int
+            The number of embeddings removed.
+        """
+        self._check_writable()
+        keep = set(file_ids)
+        with self._lock:
+            return self._unmap([self._ids[row] for row in self._rows_under(root_path) if self._ids[row] not in keep])
+
+    def _rows_under(self, path):
+        """
+        Returns the live rows whose path is path or lies below it.
+        """
+        prefix = os.path.join(path, '')
+        return [row for row, row_path in enumerate(self._paths)
+                if row_path is not None and (row_path == path or row_path.startswith(prefix))]
+
+    def vectors(self):
+        """
+        Returns the matrix rows in use, including tombstones, as a read-only view of the memory map.
+
+        Returns:
+        -------
+        numpy.ndarray
+            A (rows, dimensions) array. Combine with live_mask() to skip tombstones.
+        """
+        if self._matrix is None:
+            return np.empty((0, self.dimensions), dtype=DTYPES[self.dtype])
+        view = self._matrix[:self._rows].view(np.ndarray)
+        view.flags.writeable = False
+        return view
+
+    def live_mask(self):
+        """
+        Returns a boolean array marking the rows that belong to a file.
+
+        Returns:
+        -------
+        numpy.ndarray
+            A copy of the mask, one entry per row of vectors().
+        """
+        return self._live[:self._rows].copy()
+
+    def row_ids(self):
+        """
+        Returns the file_id of every row of vectors(), or None for tombstones.
+
+        Returns:
+        -------
+        list
+            The identifiers by row.
+        """
+        return list(self._ids)
+
+    def rows_for(self, file_ids):
+        """
+        Returns the rows of the given files, skipping files without an embedding.
+
+        Parameters:
+        ----------
+        file_ids : iterable
+            The identifiers of the file nodes.
+
+        Returns:
+        -------
+        numpy.ndarray
+            The row numbers.
+        """
+        return np.fromiter((self._rows_by_id[file_id] for file_id in file_ids if file_id in self._rows_by_id),
+                           dtype=np.int64)
+
+    def rows_below(self, path):
+        """
+        Returns the rows of the files at or below a path.
+
+        Parameters:
+        ----------
+        path : str
+            The absolute path of a file or directory.
+
+        Returns:
+        -------
+        numpy.ndarray
+            The row numbers.
+        """
+        return np.asarray(self._rows_under(path), dtype=np.int64)
+
+    def knn(self, queries, k=10, mask=None):
+        """
+        Returns the k stored embeddings most similar to each query by exact cosine similarity. The matrix
+        is scored in blocks, so memory use does not grow with the size of the store.
+
+        Parameters:
+        ----------
+        queries : array-like
+            One query vector, or a (queries, dimensions) array of them.
+        k : int, optional
+            The number of neighbours per query.
+        mask : numpy.ndarray, optional
+            A boolean array over the rows of vectors(); only rows marked True are considered.
+
+        Returns:
+        -------
+        list
+            For each query, a list of (file_id, cosine similarity) tuples, most similar first.
+        """
+        queries = np.array(queries, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[np.newaxis]
+        if k <= 0:
+            return [[] for _ in queries]
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries /= np.where(norms == 0, 1, norms)
+
+        allowed = self.live_mask()
+        if mask is not None:
+            allowed &= mask[:self._rows]
+        matrix = self.vectors()
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+
+        for start in range(0, self._rows, _KNN_BLOCK_ROWS):
+            block_allowed = allowed[start:start + _KNN_BLOCK_ROWS]
+            if not block_allowed.any():
+                continue
+            scores = queries @ matrix[start:start + _KNN_BLOCK_ROWS].astype(np.float32, copy=False).T
+            scores[:, ~block_allowed] = -np.inf
+            rows = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+            # Keep the running top k of the previous blocks and this one
+            scores = np.concatenate([best_scores, scores], axis=1)
+            rows = np.concatenate([best_rows, rows], axis=1)
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, top, axis=1)
+                rows = np.take_along_axis(rows, top, axis=1)
+            best_scores, best_rows = scores, rows
+
+        results = []
+        for scores, rows in zip(best_scores, best_rows):
+            order = np.argsort(-scores)
+            results.append([(self._ids[rows[i]], float(scores[i])) for i in order if scores[i] != -np.inf])
+        return results
+
+    def compact(self, min_dead_fraction=0.0):
+        """
+        Rewrites the matrix into a new file holding only live rows, in their current order.
+
+        Parameters:
+        ----------
+        min_dead_fraction : float, optional
+            Only compact if at least this fraction of the rows are tombstones.
+
+        Returns:
+        -------
+        int
+            The number of tombstones removed.
+        """
+        self._check_writable()
+        with self._lock:
+            dead = self._rows - len(self._rows_by_id)
+            if dead == 0 or dead < min_dead_fraction * self._rows:
+                return 0
+            live_rows = np.flatnonzero(self._live[:self._rows])
+            generation = self.generation + 1
+            matrix_path = self._matrix_path(generation)
+            compacted = np.memmap(matrix_path, dtype=DTYPES[self.dtype], mode='w+',
+                                  shape=(max(len(live_rows), 1), self.dimensions))
+            for start in range(0, len(live_rows), _KNN_BLOCK_ROWS):
+                chunk = live_rows[start:start + _KNN_BLOCK_ROWS]
+                compacted[start:start + len(chunk)] = self._matrix[chunk]
+            compacted.flush()
+            del compacted
+
+            # Renumber the rows and switch to the new file in one transaction
+            self._conn.execute("UPDATE vectors SET row = -1 - row")
+            self._conn.executemany(
+                "UPDATE vectors SET row = ? WHERE row = ?",
+                ((new_row, -1 - int(old_row)) for new_row, old_row in enumerate(live_rows))
+            )
+            self._conn.executemany(
+                "UPDATE meta SET value = ? WHERE key = ?",
+                [(str(len(live_rows)), 'rows'), (str(generation), 'generation')]
+            )
+            self._conn.commit()
+            self._pending = 0
+
+            self._matrix = None
+            old_path = self._matrix_path(self.generation)
+            self._load(dict(self._conn.execute("SELECT key, value FROM meta")))
+            os.remove(old_path)
+        if DEBUG:
+            print(f"Compacted embedding store {self.path}: removed {dead} tombstones")
+        return dead
+
+    def backfill(self, rows):
+        """
+        Adds the embeddings of files the store does not hold yet, the first time it is called for a store.
+        Files analysed before the store was created are otherwise never put, as later walks only put new
+        and changed files. Completion is recorded in the store, so an interrupted backfill carries on the
+        next time and a finished one does not consume rows again.
+
+        Parameters:
+        ----------
+        rows : iterable
+            (file_id, path, vector) tuples, for example from the graph's stream_embeddings(). It is only
+            iterated if the store has not been backfilled yet.
+
+        Returns:
+        -------
+        int
+            The number of embeddings added.
+        """
+        self._check_writable()
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM meta WHERE key = 'backfilled'").fetchone():
+                return 0
+        added = 0
+        for file_id, path, vector in rows:
+            if file_id not in self._rows_by_id:
+                self.put(file_id, vector, path)
+                added += 1
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('backfilled', '1')")
+            self._flush()
+        return added
+
+    def flush(self):
+        """
+        Makes all changes durable.
+        """
+        if self.readonly:
+            return
+        with self._lock:
+            self._flush()
+
+    def reload(self):
+        """
+        Re-reads the map and matrix, picking up rows written or compacted by another store.
+        """
+        with self._lock:
+            self._matrix = None
+            self._load(dict(self._conn.execute("SELECT key, value FROM meta")))
+
+    def stats(self):
+        """
+        Returns the number of live and dead rows and the size of the matrix.
+
+        Returns:
+        -------
+        dict
+            'live', 'dead', 'capacity' and 'bytes'.
+        """
+        return {
+            'live': len(self._rows_by_id),
+            'dead': self._rows - len(self._rows_by_id),
+            'capacity': self._capacity,
+            'bytes': self._capacity * self.dimensions * np.dtype(DTYPES[self.dtype]).itemsize,
+        }
+
+    def close(self):
+        """
+        Flushes and closes the store.
+        """
+        self.flush()
+        self._matrix = None
+        self._conn.close()
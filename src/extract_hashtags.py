@@ -19,3 +19,32 @@ def extract_hashtags(raw_hashtags):
     hashtags = [word[1:] for word in words if word.startswith('#')]
         
     return hashtags
+
+def normalise_hashtags(hashtags):
+    """
+    Function: normalise_hashtags
+
+    Description:
+    ------------
+    Cleans a list of hashtags returned by a language model.
+
+    Parameters:
+    -----------
+    hashtags : list
+        Hashtags as strings, with or without the '#' symbol.
+
+    Returns:
+    --------
+    list
+        The hashtags without the '#' symbol or inner whitespace, with empty and duplicate entries
+        removed and the original order kept.
+    """
+    cleaned = []
+    seen = set()
+    for hashtag in hashtags:
+        # Drop the leading '#' and any whitespace the model put inside the tag
+        hashtag = ''.join(str(hashtag).lstrip('#').split())
+        if hashtag and hashtag not in seen:
+            seen.add(hashtag)
+            cleaned.append(hashtag)
+    return cleaned
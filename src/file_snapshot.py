@@ -0,0 +1,185 @@
+"""
+Module: file_snapshot
+
+Description:
+------------
+This module provides an in-memory snapshot of the file nodes already stored in the graph for the
+subtree being crawled. The snapshot is loaded with a single streaming query at the start of a walk so
+that unchanged-file checks run locally instead of costing one database round trip per file. The
+mtime and child count of each directory can be loaded too, together with the entries of each
+directory, so a directory whose own mtime is unchanged can be scanned without being read again.
+
+Classes:
+--------
+- FileSnapshot
+    A compact map of file_id to (lastmodified, filesize, mime_type) and dir_id to (dir_mtime, child_count).
+"""
+
+import os
+
+
+class FileSnapshot:
+    """
+    A class holding the change-detection state of previously crawled files.
+
+    Attributes:
+    ----------
+    states : dict
+        Maps file_id to a (lastmodified, filesize, mime_type) tuple.
+    directories : dict
+        Maps dir_id to a (dir_mtime, child_count) tuple.
+    listings : dict
+        Maps the path of a directory to the (name, is_dir) pairs of its known entries.
+
+    Methods:
+    -------
+    load(fs_graph, root_dir_id, directories=False):
+        Builds a snapshot from the files (and optionally directories) stored below a directory in the graph.
+    get(file_id):
+        Returns the stored state of a file, or None if the file is unknown.
+    is_unchanged(file_id, lastmodified, filesize):
+        Checks whether a file matches its stored state.
+    mime_type(file_id):
+        Returns the stored MIME type of a file, or None if the file is unknown.
+    known_listing(dir_id, path, dir_mtime):
+        Returns the stored entries of a directory whose mtime is unchanged.
+    """
+
+    def __init__(self, states=None, directories=None, listings=None):
+        """
+        Initializes the FileSnapshot.
+
+        Parameters:
+        ----------
+        states : dict, optional
+            Maps file_id to a (lastmodified, filesize, mime_type) tuple.
+        directories : dict, optional
+            Maps dir_id to a (dir_mtime, child_count) tuple.
+        listings : dict, optional
+            Maps the path of a directory to the (name, is_dir) pairs of its known entries.
+        """
+        self.states = states if states is not None else {}
+        self.directories = directories if directories is not None else {}
+        self.listings = listings if listings is not None else {}
+
+    @classmethod
+    def load(cls, fs_graph, root_dir_id, directories=False):
+        """
+        Builds a snapshot from the files stored below a directory in the graph.
+
+        Parameters:
+        ----------
+        fs_graph : StorageBackend
+            The graph to read the file states from.
+        root_dir_id : str
+            The identifier of the directory at the top of the crawled subtree.
+        directories : bool, optional
+            Whether the directory states and the entries of every directory are loaded as well.
+
+        Returns:
+        -------
+        FileSnapshot
+            The loaded snapshot.
+        """
+        states = {}
+        for file_id, lastmodified, filesize, mime_type in fs_graph.stream_file_states(root_dir_id):
+            states[file_id] = (lastmodified, filesize, mime_type)
+        dir_states = {}
+        listings = {}
+        if directories:
+            for dir_id, dir_mtime, child_count in fs_graph.stream_directory_states(root_dir_id):
+                if dir_mtime is not None:
+                    dir_states[dir_id] = (dir_mtime, child_count)
+            for is_dir, _, path in fs_graph.subtree_nodes(root_dir_id):
+                if path:
+                    parent, name = os.path.split(path)
+                    listings.setdefault(parent, []).append((name, is_dir))
+        return cls(states, dir_states, listings)
+
+    def __len__(self):
+        return len(self.states)
+
+    def __contains__(self, file_id):
+        return file_id in self.states
+
+    def get(self, file_id):
+        """
+        Returns the stored state of a file.
+
+        Parameters:
+        ----------
+        file_id : str
+            The identifier of the file.
+
+        Returns:
+        -------
+        tuple
+            (lastmodified, filesize, mime_type), or None if the file is unknown.
+        """
+        return self.states.get(file_id)
+
+    def is_unchanged(self, file_id, lastmodified, filesize):
+        """
+        Checks whether a file matches its stored state.
+
+        Parameters:
+        ----------
+        file_id : str
+            The identifier of the file.
+        lastmodified : float
+            The current modification time of the file.
+        filesize : int
+            The current size of the file in bytes.
+
+        Returns:
+        -------
+        bool
+            True if the file is known and neither its modification time nor its size has changed.
+        """
+        state = self.states.get(file_id)
+        if state is None:
+            return False
+        stored_lastmodified, stored_filesize, _ = state
+        return stored_lastmodified == lastmodified and stored_filesize == filesize
+
+    def mime_type(self, file_id):
+        """
+        Returns the stored MIME type of a file.
+
+        Parameters:
+        ----------
+        file_id : str
+            The identifier of the file.
+
+        Returns:
+        -------
+        str
+            The stored MIME type, or None if the file is unknown.
+        """
+        state = self.states.get(file_id)
+        return state[2] if state else None
+
+    def known_listing(self, dir_id, path, dir_mtime):
+        """
+        Returns the stored entries of a directory whose mtime is unchanged. Adding, removing or renaming
+        an entry updates the mtime of its directory, so the stored entries are then still complete, apart
+        from entries the last walk ignored or filtered out.
+
+        Parameters:
+        ----------
+        dir_id : str
+            The identifier of the directory.
+        path : str
+            The path of the directory.
+        dir_mtime : float
+            The current modification time of the directory.
+
+        Returns:
+        -------
+        tuple
+            ((name, is_dir) pairs, child_count), or None if the directory is unknown or has changed.
+        """
+        state = self.directories.get(dir_id)
+        if state is None or state[0] != dir_mtime:
+            return None
+        return self.listings.get(path, []), state[1]
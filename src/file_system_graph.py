@@ -1,10 +1,13 @@
 from neo4j import GraphDatabase
 import os
 import magic
+from graph_schema import MIGRATIONS
+from crawl_metrics import get_metrics
+from storage_backend import StorageBackend
 
-class FileSystemGraph:
+class FileSystemGraph(StorageBackend):
     """
-    A class to represent a file system graph using Neo4j.
+    A class to represent a file system graph using Neo4j, as the neo4j storage backend.
 
     Attributes:
     ----------
@@ -19,6 +22,10 @@ class FileSystemGraph:
         Closes the Neo4j session and driver.
     _execute_query(query, **kwargs):
         Executes a Cypher query with the provided parameters.
+    ensure_schema():
+        Applies the schema migrations the database has not seen yet.
+    schema_version():
+        Returns the version of the schema applied to the database.
     create_file_node(file_id, dir_id, filename, filetype, filesize, fileowner, lastmodified, creationdate, mime_type, num_tokens, summary, lastchecked, hashtags, embedded_summary):
         Creates or updates a file node in the graph.
     create_or_update_directory_node(dir_id, parent_dir_id, dirname, lastchecked):
@@ -41,9 +48,57 @@ class FileSystemGraph:
         Creates a relationship between a file and a hashtag.
     get_file_hashtags(file_id):
         Retrieves all hashtags associated with a file.
+    update_file_node(file_id, properties):
+        Sets the given properties on an existing file node.
+    merge_directories(rows):
+        Creates or updates a batch of directory nodes in one transaction.
+    merge_files(rows):
+        Creates or updates a batch of file nodes in one transaction.
+    merge_unanalysed_files(rows):
+        Creates or updates a batch of unanalysed file nodes, keeping the analysis of existing ones.
+    touch_files(rows):
+        Updates lastchecked on a batch of unchanged file nodes.
+    link_directories(rows):
+        Creates a batch of parent/child directory relationships.
+    link_files_to_directories(rows):
+        Creates a batch of directory/file relationships.
+    link_files_to_hashtags(rows):
+        Creates a batch of hashtag nodes and file/hashtag relationships.
+    stream_file_states(root_dir_id):
+        Streams the change-detection properties of every file below a directory.
+    update_directories(rows):
+        Sets properties on a batch of existing directory nodes.
+    stream_directory_states(root_dir_id):
+        Streams the change-detection properties of a directory and every directory below it.
+    subtree_nodes(dir_id):
+        Retrieves the identifiers and paths of a directory and everything below it.
+    relocate_directories(rows):
+        Rewrites the identity and location properties of a batch of moved directory nodes.
+    relocate_files(rows):
+        Rewrites the identity and location properties of a batch of moved file nodes.
+    reparent_directory(dir_id, parent_dir_id):
+        Moves a directory node under a different parent directory.
+    reparent_file(file_id, dir_id):
+        Moves a file node into a different directory.
+    stream_embeddings():
+        Streams the summary embedding and search properties of every analysed file.
+    _execute_in_transactions(query, **kwargs):
+        Executes a CALL { ... } IN TRANSACTIONS query and returns its update counters.
+    sweep_stale(root_path, current_walk_time, batch_size):
+        Deletes the files and directories below a path that were not seen in the latest walk.
+    remove_subtree(path, batch_size):
+        Deletes a file, or a directory and everything below it, by path.
+    get_file_nodes(file_ids):
+        Retrieves the search properties of a batch of file nodes.
+    filter_file_ids(mime_type, hashtag):
+        Retrieves the identifiers of the files with a MIME type and/or hashtag.
+    count_nodes():
+        Returns the number of nodes in the graph.
+    has_vector_index(name):
+        Whether a vector index of the given name exists and is online.
     """
 
-    def __init__(self, uri, user, password):
+    def __init__(self, uri, user, password, ensure_schema=True):
         """
         Initializes the FileSystemGraph with a Neo4j driver and session.
 
@@ -55,9 +110,13 @@ class FileSystemGraph:
             The username for the Neo4j database.
         password : str
             The password for the Neo4j database.
+        ensure_schema : bool, optional
+            Whether pending schema migrations are applied on startup.
         """
         self.driver = GraphDatabase.driver(uri, auth=(user, password))
         self.session = self.driver.session()
+        if ensure_schema:
+            self.ensure_schema()
 
     def close(self):
         """
@@ -83,13 +142,55 @@ class FileSystemGraph:
             The result of the query execution.
         """
         try:
-            with self.driver.session() as session:
+            with get_metrics().timer('graph_query'), self.driver.session() as session:
                 result = session.write_transaction(lambda tx: list(tx.run(query, **kwargs)))
                 return result
         except Exception as e:
             print(f"Error executing query: {e}")
             raise
 
+    def schema_version(self):
+        """
+        Returns the version of the schema applied to the database.
+
+        Returns:
+        -------
+        int
+            The version of the last migration applied, or 0 for a database without schema.
+        """
+        result = self._execute_query("MATCH (v:SchemaVersion) RETURN max(v.version) AS version")
+        return (result[0]['version'] or 0) if result else 0
+
+    def ensure_schema(self):
+        """
+        Applies the schema migrations of graph_schema that the database has not seen yet, in order, and
+        records each applied version on the SchemaVersion node. Does nothing once the schema is current.
+
+        Returns:
+        -------
+        int
+            The schema version of the database.
+        """
+        version = self.schema_version()
+        for migration_version, description, statements in MIGRATIONS:
+            if migration_version <= version:
+                continue
+            print(f"Applying schema migration {migration_version}: {description}")
+            for statement in statements:
+                if 'IN TRANSACTIONS' in statement:
+                    # Batched data migrations commit on their own and run until there is nothing left to do
+                    while self._execute_in_transactions(statement, sep=os.sep).properties_set:
+                        pass
+                else:
+                    # Schema commands cannot share a transaction with data writes, so each runs on its own
+                    self._execute_query(statement)
+            self._execute_query(
+                "MERGE (v:SchemaVersion {name: 'file_system_graph'}) SET v.version = $version, v.applied = timestamp()",
+                version=migration_version
+            )
+            version = migration_version
+        return version
+
     def create_file_node(self, file_id, dir_id, filename, filetype, filesize, fileowner, lastmodified, creationdate, mime_type, num_tokens, summary, lastchecked, hashtags, embedded_summary):
         """
         Creates or updates a file node in the graph.
@@ -376,14 +477,508 @@ class FileSystemGraph:
         result = self._execute_query(query, file_id=file_id)
         return [record['hashtag'] for record in result]
 
-    def cleanup_orphaned_hashtags(self):
+    def cleanup_orphaned_hashtags(self, batch_size=10000):
         """
         Removes hashtag nodes that are no longer linked to any file nodes.
+
+        Parameters:
+        ----------
+        batch_size : int, optional
+            The number of hashtags deleted per transaction.
+
+        Returns:
+        -------
+        int
+            The number of hashtags removed.
         """
         query = (
             "MATCH (h:Hashtag) "
             "WHERE NOT (h)<-[:HAS_TAG]-() "
-            "DELETE h"
+            f"CALL {{ WITH h DELETE h }} IN TRANSACTIONS OF {int(batch_size)} ROWS"
+        )
+        return self._execute_in_transactions(query).nodes_deleted
+
+    def update_file_node(self, file_id, properties):
+        """
+        Sets the given properties on an existing file node.
+
+        Parameters:
+        ----------
+        file_id : str
+            The identifier of the file.
+        properties : dict
+            The properties to set on the file node.
+        """
+        query = (
+            "MATCH (f:File {file_id: $file_id}) "
+            "SET f += $properties"
+        )
+        self._execute_query(query, file_id=file_id, properties=properties)
+
+    def merge_directories(self, rows):
+        """
+        Creates or updates a batch of directory nodes in one transaction.
+
+        Parameters:
+        ----------
+        rows : list
+            Dictionaries holding dir_id and the directory properties to set.
+        """
+        query = (
+            "UNWIND $rows AS row "
+            "MERGE (d:Directory {dir_id: row.dir_id}) "
+            "SET d += row"
+        )
+        self._execute_query(query, rows=rows)
+
+    def merge_files(self, rows):
+        """
+        Creates or updates a batch of file nodes in one transaction.
+
+        Existing HAS_TAG relationships of the files are dropped so that the
+        hashtags linked afterwards match the freshly analysed content.
+
+        Parameters:
+        ----------
+        rows : list
+            Dictionaries holding file_id and the file properties to set.
+        """
+        query = (
+            "UNWIND $rows AS row "
+            "MERGE (f:File {file_id: row.file_id}) "
+            "SET f += row "
+            "WITH f "
+            "OPTIONAL MATCH (f)-[r:HAS_TAG]->() "
+            "DELETE r"
+        )
+        self._execute_query(query, rows=rows)
+
+    def merge_unanalysed_files(self, rows):
+        """
+        Creates or updates a batch of file nodes that were not analysed in one transaction. The summary,
+        embedding and HAS_TAG relationships of existing files are left as they are.
+
+        Parameters:
+        ----------
+        rows : list
+            Dictionaries holding file_id and the file properties to set.
+        """
+        query = (
+            "UNWIND $rows AS row "
+            "MERGE (f:File {file_id: row.file_id}) "
+            "ON CREATE SET f.num_tokens = 0, f.summary = '', f.embedded_summary = [] "
+            "SET f += row"
+        )
+        self._execute_query(query, rows=rows)
+
+    def touch_files(self, rows):
+        """
+        Updates lastchecked on a batch of unchanged file nodes.
+
+        Parameters:
+        ----------
+        rows : list
+            Dictionaries holding file_id and lastchecked.
+        """
+        query = (
+            "UNWIND $rows AS row "
+            "MATCH (f:File {file_id: row.file_id}) "
+            "SET f.lastchecked = row.lastchecked"
+        )
+        self._execute_query(query, rows=rows)
+
+    def link_directories(self, rows):
+        """
+        Creates a batch of parent/child directory relationships.
+
+        Parameters:
+        ----------
+        rows : list
+            Dictionaries holding dir_id and parent_dir_id.
+        """
+        query = (
+            "UNWIND $rows AS row "
+            "MATCH (child:Directory {dir_id: row.dir_id}), (parent:Directory {dir_id: row.parent_dir_id}) "
+            "MERGE (parent)-[:CONTAINS]->(child)"
+        )
+        self._execute_query(query, rows=rows)
+
+    def link_files_to_directories(self, rows):
+        """
+        Creates a batch of directory/file relationships.
+
+        Parameters:
+        ----------
+        rows : list
+            Dictionaries holding file_id and dir_id.
+        """
+        query = (
+            "UNWIND $rows AS row "
+            "MATCH (dir:Directory {dir_id: row.dir_id}), (f:File {file_id: row.file_id}) "
+            "MERGE (dir)-[:CONTAINS]->(f)"
+        )
+        self._execute_query(query, rows=rows)
+
+    def link_files_to_hashtags(self, rows):
+        """
+        Creates a batch of hashtag nodes and file/hashtag relationships.
+
+        Parameters:
+        ----------
+        rows : list
+            Dictionaries holding file_id and hashtag.
+        """
+        query = (
+            "UNWIND $rows AS row "
+            "MATCH (f:File {file_id: row.file_id}) "
+            "MERGE (h:Hashtag {name: row.hashtag}) "
+            "MERGE (f)-[:HAS_TAG]->(h)"
+        )
+        self._execute_query(query, rows=rows)
+
+    def stream_file_states(self, root_dir_id):
+        """
+        Streams the change-detection properties of every file below a directory.
+
+        Records are yielded as they arrive from the server, so the full result is never held in
+        memory and large properties such as embedded_summary are never transferred.
+
+        Parameters:
+        ----------
+        root_dir_id : str
+            The identifier of the directory at the top of the subtree.
+
+        Yields:
+        ------
+        tuple
+            (file_id, lastmodified, filesize, mime_type) for each file in the subtree.
+        """
+        query = (
+            "MATCH (:Directory {dir_id: $root_dir_id})-[:CONTAINS*]->(f:File) "
+            "RETURN f.file_id AS file_id, f.lastmodified AS lastmodified, "
+            "f.filesize AS filesize, f.mime_type AS mime_type"
+        )
+        with self.driver.session() as session:
+            result = session.run(query, root_dir_id=root_dir_id)
+            for record in result:
+                yield record['file_id'], record['lastmodified'], record['filesize'], record['mime_type']
+
+    def update_directories(self, rows):
+        """
+        Sets properties on a batch of existing directory nodes.
+
+        Parameters:
+        ----------
+        rows : list
+            Dictionaries holding dir_id and the directory properties to set.
+        """
+        query = (
+            "UNWIND $rows AS row "
+            "MATCH (d:Directory {dir_id: row.dir_id}) "
+            "SET d += row"
+        )
+        self._execute_query(query, rows=rows)
+
+    def stream_directory_states(self, root_dir_id):
+        """
+        Streams the change-detection properties of a directory and every directory below it.
+
+        Parameters:
+        ----------
+        root_dir_id : str
+            The identifier of the directory at the top of the subtree.
+
+        Yields:
+        ------
+        tuple
+            (dir_id, dir_mtime, child_count) for each directory in the subtree.
+        """
+        query = (
+            "MATCH (:Directory {dir_id: $root_dir_id})-[:CONTAINS*0..]->(d:Directory) "
+            "RETURN d.dir_id AS dir_id, d.dir_mtime AS dir_mtime, d.child_count AS child_count"
+        )
+        with self.driver.session() as session:
+            result = session.run(query, root_dir_id=root_dir_id)
+            for record in result:
+                yield record['dir_id'], record['dir_mtime'], record['child_count']
+
+    def subtree_nodes(self, dir_id):
+        """
+        Retrieves the identifiers and paths of a directory and every directory and file below it.
+
+        Parameters:
+        ----------
+        dir_id : str
+            The identifier of the directory at the top of the subtree.
+
+        Returns:
+        -------
+        list
+            (is_dir, node_id, path) tuples, the directory itself included.
+        """
+        query = (
+            "MATCH (:Directory {dir_id: $dir_id})-[:CONTAINS*0..]->(n) "
+            "RETURN n:Directory AS is_dir, coalesce(n.dir_id, n.file_id) AS node_id, n.path AS path"
+        )
+        result = self._execute_query(query, dir_id=dir_id)
+        return [(record['is_dir'], record['node_id'], record['path']) for record in result]
+
+    def relocate_directories(self, rows):
+        """
+        Rewrites the identity and location properties of a batch of moved directory nodes.
+
+        Parameters:
+        ----------
+        rows : list
+            Dictionaries holding old_id and the new dir_id, parent_dir_id, dirname and path.
+        """
+        query = (
+            "UNWIND $rows AS row "
+            "MATCH (d:Directory {dir_id: row.old_id}) "
+            "SET d.dir_id = row.dir_id, d.parent_dir_id = row.parent_dir_id, "
+            "d.dirname = row.dirname, d.path = row.path"
+        )
+        self._execute_query(query, rows=rows)
+
+    def relocate_files(self, rows):
+        """
+        Rewrites the identity and location properties of a batch of moved file nodes.
+
+        Parameters:
+        ----------
+        rows : list
+            Dictionaries holding old_id and the new file_id, dir_id, filename, filetype and path.
+        """
+        query = (
+            "UNWIND $rows AS row "
+            "MATCH (f:File {file_id: row.old_id}) "
+            "SET f.file_id = row.file_id, f.dir_id = row.dir_id, f.filename = row.filename, "
+            "f.filetype = row.filetype, f.path = row.path"
+        )
+        self._execute_query(query, rows=rows)
+
+    def reparent_directory(self, dir_id, parent_dir_id):
+        """
+        Replaces the CONTAINS relationship from a directory's parent with one from a new parent.
+
+        Parameters:
+        ----------
+        dir_id : str
+            The identifier of the directory.
+        parent_dir_id : str
+            The identifier of the new parent directory.
+        """
+        query = (
+            "MATCH (d:Directory {dir_id: $dir_id}), (parent:Directory {dir_id: $parent_dir_id}) "
+            "OPTIONAL MATCH (old:Directory)-[r:CONTAINS]->(d) WHERE old <> parent "
+            "DELETE r "
+            "MERGE (parent)-[:CONTAINS]->(d)"
+        )
+        self._execute_query(query, dir_id=dir_id, parent_dir_id=parent_dir_id)
+
+    def reparent_file(self, file_id, dir_id):
+        """
+        Replaces the CONTAINS relationship from a file's directory with one from a new directory.
+
+        Parameters:
+        ----------
+        file_id : str
+            The identifier of the file.
+        dir_id : str
+            The identifier of the new directory.
+        """
+        query = (
+            "MATCH (f:File {file_id: $file_id}), (dir:Directory {dir_id: $dir_id}) "
+            "OPTIONAL MATCH (old:Directory)-[r:CONTAINS]->(f) WHERE old <> dir "
+            "DELETE r "
+            "MERGE (dir)-[:CONTAINS]->(f)"
+        )
+        self._execute_query(query, file_id=file_id, dir_id=dir_id)
+
+    def stream_embeddings(self):
+        """
+        Streams the summary embedding and search properties of every file that has one.
+
+        Yields:
+        ------
+        tuple
+            (file_id, path, filename, mime_type, hashtags, embedded_summary) for each file.
+        """
+        query = (
+            "MATCH (f:File) "
+            "WHERE size(f.embedded_summary) > 0 "
+            "RETURN f.file_id AS file_id, f.path AS path, f.filename AS filename, f.mime_type AS mime_type, "
+            "[(f)-[:HAS_TAG]->(h:Hashtag) | h.name] AS hashtags, f.embedded_summary AS embedded_summary"
+        )
+        with self.driver.session() as session:
+            result = session.run(query)
+            for record in result:
+                yield (record['file_id'], record['path'], record['filename'], record['mime_type'],
+                       record['hashtags'], record['embedded_summary'])
+
+    def _execute_in_transactions(self, query, **kwargs):
+        """
+        Executes a query that uses CALL { ... } IN TRANSACTIONS. Such queries commit their own batches,
+        so they must run in an auto-commit transaction rather than through write_transaction.
+
+        Parameters:
+        ----------
+        query : str
+            The Cypher query to be executed.
+        **kwargs : dict
+            The parameters for the Cypher query.
+
+        Returns:
+        -------
+        neo4j.SummaryCounters
+            The update counters of the query, such as nodes_deleted.
+        """
+        try:
+            with get_metrics().timer('graph_query'), self.driver.session() as session:
+                return session.run(query, **kwargs).consume().counters
+        except Exception as e:
+            print(f"Error executing query: {e}")
+            raise
+
+    def sweep_stale(self, root_path, current_walk_time, batch_size=10000):
+        """
+        Deletes the files and directories below a path whose lastchecked is older than the latest walk.
+        The deletes run on the server in batches of batch_size nodes, and only nodes inside the crawled
+        subtree are considered, so trees crawled from other roots are left alone. Nodes written before
+        paths were stored get theirs from schema migration 5.
+
+        Parameters:
+        ----------
+        root_path : str
+            The absolute path of the crawled root directory. The root directory itself is not removed.
+        current_walk_time : float
+            The timestamp of the latest walk.
+        batch_size : int, optional
+            The number of nodes deleted per transaction.
+
+        Returns:
+        -------
+        tuple
+            The number of files and directories removed.
+        """
+        prefix = os.path.join(root_path, '')
+        removed = []
+        for label in ('File', 'Directory'):
+            query = (
+                f"MATCH (n:{label}) "
+                "WHERE n.path STARTS WITH $prefix AND n.lastchecked < $current_walk_time "
+                f"CALL {{ WITH n DETACH DELETE n }} IN TRANSACTIONS OF {int(batch_size)} ROWS"
+            )
+            counters = self._execute_in_transactions(query, prefix=prefix, current_walk_time=current_walk_time)
+            removed.append(counters.nodes_deleted)
+        return tuple(removed)
+
+    def remove_subtree(self, path, batch_size=10000):
+        """
+        Deletes the file or directory at path and every directory and file below it, in batches on the
+        server. Unlike remove_directory, the subtree is found through the indexed path property rather
+        than by expanding CONTAINS relationships.
+
+        Parameters:
+        ----------
+        path : str
+            The absolute path of the file or directory.
+        batch_size : int, optional
+            The number of nodes deleted per transaction.
+
+        Returns:
+        -------
+        int
+            The number of nodes removed.
+        """
+        prefix = os.path.join(path, '')
+        removed = 0
+        for label in ('File', 'Directory'):
+            query = (
+                f"MATCH (n:{label}) "
+                "WHERE n.path = $path OR n.path STARTS WITH $prefix "
+                f"CALL {{ WITH n DETACH DELETE n }} IN TRANSACTIONS OF {int(batch_size)} ROWS"
+            )
+            removed += self._execute_in_transactions(query, path=path, prefix=prefix).nodes_deleted
+        return removed
+
+    def get_file_nodes(self, file_ids):
+        """
+        Retrieves the search properties of a batch of file nodes.
+
+        Parameters:
+        ----------
+        file_ids : list
+            The identifiers of the files.
+
+        Returns:
+        -------
+        dict
+            (path, filename, mime_type) by file_id, for the files that exist.
+        """
+        query = (
+            "MATCH (f:File) WHERE f.file_id IN $file_ids "
+            "RETURN f.file_id AS file_id, f.path AS path, f.filename AS filename, f.mime_type AS mime_type"
+        )
+        result = self._execute_query(query, file_ids=list(file_ids))
+        return {record['file_id']: (record['path'], record['filename'], record['mime_type']) for record in result}
+
+    def filter_file_ids(self, mime_type=None, hashtag=None):
+        """
+        Retrieves the identifiers of the files with the given MIME type and/or hashtag.
+
+        Parameters:
+        ----------
+        mime_type : str, optional
+            Only files of this MIME type are returned.
+        hashtag : str, optional
+            Only files with this hashtag are returned.
+
+        Returns:
+        -------
+        list
+            The identifiers of the matching files.
+        """
+        conditions = []
+        if mime_type is not None:
+            conditions.append("f.mime_type = $mime_type")
+        if hashtag is not None:
+            conditions.append("EXISTS { (f)-[:HAS_TAG]->(:Hashtag {name: $hashtag}) }")
+        query = (
+            "MATCH (f:File) "
+            + ("WHERE " + " AND ".join(conditions) + " " if conditions else "") +
+            "RETURN f.file_id AS file_id"
+        )
+        result = self._execute_query(query, mime_type=mime_type, hashtag=hashtag)
+        return [record['file_id'] for record in result]
+
+    def count_nodes(self):
+        """
+        Returns the number of nodes in the graph.
+
+        Returns:
+        -------
+        int
+            The number of nodes, of every label.
+        """
+        result = self._execute_query("MATCH (n) RETURN COUNT(n) AS node_count")
+        return result[0]['node_count'] if result else 0
+
+    def has_vector_index(self, name):
+        """
+        Whether a vector index of the given name exists and has been populated.
+
+        Parameters:
+        ----------
+        name : str
+            The name of the index.
+
+        Returns:
+        -------
+        bool
+            True if the index is a VECTOR index in the ONLINE state.
+        """
+        result = self._execute_query(
+            "SHOW INDEXES YIELD name, type, state WHERE name = $name RETURN type, state", name=name
         )
-        result = self._execute_query(query)
-        return result
+        return bool(result) and result[0]['type'] == 'VECTOR' and result[0]['state'] == 'ONLINE'
@@ -13,6 +13,8 @@ Functions:
 - main(uri: str, username: str, password: str)
 """
 
+import os
+from dotenv import load_dotenv
 from file_system_graph import FileSystemGraph
 
 def create_missing_directory_relationships(fs_graph: FileSystemGraph) -> int:
@@ -100,9 +102,12 @@ def main(uri: str, username: str, password: str):
         fs_graph.close()
 
 if __name__ == "__main__":
-    # You can modify these values or use environment variables
-    DB_URI = "bolt://localhost:7687"
-    DB_USERNAME = "neo4j"
-    DB_PASSWORD = "abcd1234"
-    
+    # The repairs are Cypher, so they always run against the Neo4j server configured in the environment
+    load_dotenv(".env")
+    DB_URI = os.getenv('NEO4J_URI', 'bolt://localhost:7687')
+    DB_USERNAME = os.getenv('NEO4J_USERNAME', 'neo4j')
+    DB_PASSWORD = os.getenv('NEO4J_PASSWORD')
+    if not DB_PASSWORD:
+        raise SystemExit("Set NEO4J_PASSWORD to the password of the Neo4j database.")
+
     main(DB_URI, DB_USERNAME, DB_PASSWORD)
\ No newline at end of file
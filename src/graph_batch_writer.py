@@ -0,0 +1,301 @@
+"""
+Module: graph_batch_writer
+
+Description:
+------------
+This module provides a write buffer in front of a storage backend. Node upserts and relationship merges
+are collected in memory and flushed as batches (UNWIND queries on Neo4j), one transaction per batch,
+instead of one round trip per row. A background thread flushes rows that have waited flush_interval
+seconds, so they reach the graph even while nothing new is being buffered.
+
+Classes:
+--------
+- GraphBatchWriter
+    Buffers graph writes and flushes them in batches.
+"""
+
+import threading
+import time
+from crawl_metrics import get_metrics
+
+# Buffers in the order they must be flushed so relationship endpoints already exist.
+FLUSH_ORDER = (
+    ("directories", "merge_directories"),
+    ("directory_updates", "update_directories"),
+    ("directory_links", "link_directories"),
+    ("files", "merge_files"),
+    ("unanalysed_files", "merge_unanalysed_files"),
+    ("file_links", "link_files_to_directories"),
+    ("hashtag_links", "link_files_to_hashtags"),
+    ("touched_files", "touch_files"),
+)
+
+
+class GraphBatchWriter:
+    """
+    A class to buffer writes to a storage backend and flush them as UNWIND batches.
+
+    Attributes:
+    ----------
+    fs_graph : StorageBackend
+        The graph the buffered rows are written to.
+    batch_size : int
+        The maximum number of rows sent in one transaction. A flush is triggered once any buffer
+        reaches this size.
+    flush_interval : float
+        The maximum number of seconds rows may wait in the buffer before a flush is triggered, or None
+        to flush only full buffers.
+
+    Methods:
+    -------
+    add_directory(dir_id, parent_dir_id, dirname, lastchecked, **properties):
+        Buffers a directory upsert and the link to its parent.
+    add_file(file_id, dir_id, hashtags, **properties):
+        Buffers a file upsert, the link to its directory and its hashtag links.
+    add_unanalysed_file(file_id, dir_id, **properties):
+        Buffers an upsert that keeps a file's analysis, and the link to its directory.
+    touch_file(file_id, lastchecked):
+        Buffers a lastchecked update for an unchanged file.
+    update_directory(dir_id, **properties):
+        Buffers a property update for an existing directory.
+    add_checkpoint(callback):
+        Calls a function once everything buffered before it has been written.
+    flush():
+        Writes all buffered rows to the graph.
+    close():
+        Stops the flush timer and flushes any remaining rows.
+    """
+
+    def __init__(self, fs_graph, batch_size=1000, flush_interval=2.0):
+        """
+        Initializes the GraphBatchWriter.
+
+        Parameters:
+        ----------
+        fs_graph : StorageBackend
+            The graph the buffered rows are written to.
+        batch_size : int
+            The maximum number of rows sent in one transaction.
+        flush_interval : float
+            The maximum number of seconds rows may wait before being flushed, or None to flush only full
+            buffers.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+
+        self.fs_graph = fs_graph
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffers = {name: [] for name, _ in FLUSH_ORDER}
+        self._checkpoints = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._error = None
+        self._closed = threading.Event()
+        self._timer = None
+        if flush_interval is not None:
+            self._timer = threading.Thread(target=self._flush_periodically, name="graph-batch-writer", daemon=True)
+            self._timer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_directory(self, dir_id, parent_dir_id, dirname, lastchecked, **properties):
+        """
+        Buffers a directory upsert and the link to its parent.
+
+        Parameters:
+        ----------
+        dir_id : str
+            The unique identifier for the directory.
+        parent_dir_id : str
+            The identifier of the parent directory, or None for the root directory.
+        dirname : str
+            The name of the directory.
+        lastchecked : float
+            The timestamp of the walk that saw the directory.
+        **properties : dict
+            Any additional properties to set on the directory node.
+        """
+        row = dict(properties, dir_id=dir_id, parent_dir_id=parent_dir_id, dirname=dirname, lastchecked=lastchecked)
+        with self._lock:
+            self._buffers["directories"].append(row)
+            if parent_dir_id is not None:
+                self._buffers["directory_links"].append({"dir_id": dir_id, "parent_dir_id": parent_dir_id})
+        self._maybe_flush()
+
+    def add_file(self, file_id, dir_id, hashtags=(), **properties):
+        """
+        Buffers a file upsert, the link to its directory and its hashtag links.
+
+        Parameters:
+        ----------
+        file_id : str
+            The unique identifier for the file.
+        dir_id : str
+            The identifier of the directory containing the file.
+        hashtags : list
+            The hashtags of the file.
+        **properties : dict
+            The remaining file properties, as accepted by FileSystemGraph.create_file_node.
+        """
+        hashtags = list(hashtags or [])
+        row = dict(properties, file_id=file_id, dir_id=dir_id, hashtags=hashtags)
+        with self._lock:
+            self._buffers["files"].append(row)
+            self._buffers["file_links"].append({"file_id": file_id, "dir_id": dir_id})
+            self._buffers["hashtag_links"].extend({"file_id": file_id, "hashtag": hashtag} for hashtag in hashtags)
+        self._maybe_flush()
+
+    def add_unanalysed_file(self, file_id, dir_id, **properties):
+        """
+        Buffers an upsert of a file that was not analysed, and the link to its directory. The summary,
+        embedding and hashtags the file already has in the graph are kept.
+
+        Parameters:
+        ----------
+        file_id : str
+            The unique identifier for the file.
+        dir_id : str
+            The identifier of the directory containing the file.
+        **properties : dict
+            The file properties to set.
+        """
+        row = dict(properties, file_id=file_id, dir_id=dir_id)
+        with self._lock:
+            self._buffers["unanalysed_files"].append(row)
+            self._buffers["file_links"].append({"file_id": file_id, "dir_id": dir_id})
+        self._maybe_flush()
+
+    def touch_file(self, file_id, lastchecked):
+        """
+        Buffers a lastchecked update for an unchanged file.
+
+        Parameters:
+        ----------
+        file_id : str
+            The identifier of the file.
+        lastchecked : float
+            The timestamp of the walk that saw the file.
+        """
+        with self._lock:
+            self._buffers["touched_files"].append({"file_id": file_id, "lastchecked": lastchecked})
+        self._maybe_flush()
+
+    def update_directory(self, dir_id, **properties):
+        """
+        Buffers a property update for a directory added earlier.
+
+        Parameters:
+        ----------
+        dir_id : str
+            The identifier of the directory.
+        **properties : dict
+            The properties to set on the directory node.
+        """
+        with self._lock:
+            self._buffers["directory_updates"].append(dict(properties, dir_id=dir_id))
+        self._maybe_flush()
+
+    def add_checkpoint(self, callback):
+        """
+        Registers a function to call once every row buffered so far has been written to the graph.
+
+        Parameters:
+        ----------
+        callback : callable
+            Called without arguments after the next flush.
+        """
+        with self._lock:
+            self._checkpoints.append(callback)
+
+    def _maybe_flush(self):
+        """
+        Flushes the buffers if any of them is full or the flush interval has elapsed.
+        """
+        self._raise_timer_error()
+        with self._lock:
+            full = any(len(rows) >= self.batch_size for rows in self._buffers.values())
+            expired = self.flush_interval is not None and time.monotonic() - self._last_flush >= self.flush_interval
+        if full or expired:
+            self.flush()
+
+    def _flush_periodically(self):
+        """
+        Runs on the timer thread: flushes whatever is buffered once it has waited flush_interval seconds,
+        until the writer is closed. A failed flush stops the timer and is raised to the next caller.
+        """
+        timeout = self.flush_interval
+        while not self._closed.wait(timeout):
+            with self._lock:
+                pending = self._checkpoints or any(self._buffers.values())
+                timeout = self._last_flush + self.flush_interval - time.monotonic()
+            if timeout > 0:
+                continue
+            timeout = self.flush_interval
+            if pending:
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Error flushing buffered graph writes: {e}")
+                    self._error = e
+                    return
+
+    def _raise_timer_error(self):
+        """
+        Raises the error of a flush that failed on the timer thread, once.
+        """
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def flush(self):
+        """
+        Writes all buffered rows to the graph, in dependency order and in chunks of batch_size rows. If a
+        write fails, the rows not yet written and the pending checkpoints are put back in front of the
+        buffers before the error is raised, so a later flush writes them.
+        """
+        # Flushes are serialised so a later batch never overtakes the directories of an earlier one.
+        with self._flush_lock:
+            with self._lock:
+                buffers = self._buffers
+                checkpoints = self._checkpoints
+                self._buffers = {name: [] for name, _ in FLUSH_ORDER}
+                self._checkpoints = []
+                self._last_flush = time.monotonic()
+
+            metrics = get_metrics()
+            # The number of rows of each buffer written so far
+            written = {name: 0 for name, _ in FLUSH_ORDER}
+            try:
+                with metrics.timer('graph_write'):
+                    for name, method in FLUSH_ORDER:
+                        rows = buffers[name]
+                        while written[name] < len(rows):
+                            getattr(self.fs_graph, method)(rows[written[name]:written[name] + self.batch_size])
+                            written[name] = min(written[name] + self.batch_size, len(rows))
+                        if rows:
+                            metrics.count('graph_rows', len(rows), buffer=name)
+            except Exception:
+                with self._lock:
+                    for name, _ in FLUSH_ORDER:
+                        self._buffers[name][:0] = buffers[name][written[name]:]
+                    self._checkpoints[:0] = checkpoints
+                raise
+
+            for callback in checkpoints:
+                callback()
+
+    def close(self):
+        """
+        Stops the flush timer and flushes any remaining rows.
+        """
+        self._closed.set()
+        if self._timer is not None:
+            self._timer.join()
+        self._raise_timer_error()
+        self.flush()
@@ -0,0 +1,62 @@
+"""
+Module: graph_schema
+
+Description:
+------------
+This module defines the Neo4j schema of the file system graph as an ordered list of versioned
+migrations: uniqueness constraints on the keys every MERGE and MATCH looks nodes up by, range indexes
+on the properties the crawl filters on, and a vector index on the summary embeddings. The version that
+has been applied is stored on a SchemaVersion node, so FileSystemGraph.ensure_schema only runs the
+migrations a database has not seen yet. Every statement is idempotent, so a migration that was
+interrupted can simply be run again. Data migrations commit in batches with CALL { ... } IN
+TRANSACTIONS and are repeated until they change nothing, so a backfill that moves down the tree one
+level per run reaches every depth without expanding variable-length paths; they are given the path
+separator as $sep.
+
+To change the schema, append a migration with the next version number; never edit one that has shipped.
+
+Attributes:
+-----------
+EMBEDDING_DIMENSIONS : int
+    The length of the embedded_summary vectors (text-embedding-3-small).
+MIGRATIONS : list
+    (version, description, statements) tuples in the order they are applied.
+SCHEMA_VERSION : int
+    The version of the latest migration.
+"""
+
+EMBEDDING_DIMENSIONS = 1536
+
+MIGRATIONS = [
+    (1, "Uniqueness constraints on node keys", [
+        "CREATE CONSTRAINT file_file_id IF NOT EXISTS FOR (f:File) REQUIRE f.file_id IS UNIQUE",
+        "CREATE CONSTRAINT directory_dir_id IF NOT EXISTS FOR (d:Directory) REQUIRE d.dir_id IS UNIQUE",
+        "CREATE CONSTRAINT hashtag_name IF NOT EXISTS FOR (h:Hashtag) REQUIRE h.name IS UNIQUE",
+        "CREATE CONSTRAINT drive_drive_id IF NOT EXISTS FOR (d:Drive) REQUIRE d.drive_id IS UNIQUE",
+    ]),
+    (2, "Range indexes for cleanup, change detection and filtering", [
+        "CREATE INDEX file_lastchecked IF NOT EXISTS FOR (f:File) ON (f.lastchecked)",
+        "CREATE INDEX directory_lastchecked IF NOT EXISTS FOR (d:Directory) ON (d.lastchecked)",
+        "CREATE INDEX file_dir_id IF NOT EXISTS FOR (f:File) ON (f.dir_id)",
+        "CREATE INDEX directory_parent_dir_id IF NOT EXISTS FOR (d:Directory) ON (d.parent_dir_id)",
+        "CREATE INDEX file_mime_type IF NOT EXISTS FOR (f:File) ON (f.mime_type)",
+        "CREATE INDEX file_path IF NOT EXISTS FOR (f:File) ON (f.path)",
+        "CREATE INDEX directory_path IF NOT EXISTS FOR (d:Directory) ON (d.path)",
+    ]),
+    (3, "Vector index on summary embeddings", [
+        "CREATE VECTOR INDEX file_embedded_summary IF NOT EXISTS FOR (f:File) ON (f.embedded_summary) "
+        "OPTIONS {indexConfig: {`vector.dimensions`: " + str(EMBEDDING_DIMENSIONS) + ", "
+        "`vector.similarity_function`: 'cosine'}}",
+    ]),
+    (4, "Range index on the analysis status, for finding files with pending analyses", [
+        "CREATE INDEX file_analysis_status IF NOT EXISTS FOR (f:File) ON (f.analysis_status)",
+    ]),
+    (5, "Path on nodes written before paths were stored, derived from their parent directory's path", [
+        "MATCH (p:Directory)-[:CONTAINS]->(n) "
+        "WHERE (n:File OR n:Directory) AND n.path IS NULL AND p.path IS NOT NULL "
+        "CALL { WITH p, n SET n.path = p.path + $sep + coalesce(n.dirname, n.filename) } "
+        "IN TRANSACTIONS OF 10000 ROWS",
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
@@ -21,31 +21,32 @@ summarise_agent: function
     Returns:
     --------
     hashtags: A list of hashtags for the document.
+
+ahashtag_agent: coroutine function
+    Asynchronous version of hashtag_agent.
 """
 
 from langchain_core.output_parsers import StrOutputParser
 #from langchain_cohere import ChatCohere
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from extract_hashtags import extract_hashtags
+from extract_hashtags import extract_hashtags, normalise_hashtags
+from functools import lru_cache
+from rate_limiter import get_rate_limiter, estimate_tokens
+from crawl_metrics import get_metrics
+
+# Model and prompt identity; bump PROMPT_VERSION whenever the prompt changes so cached analyses are redone
+MODEL = "gpt-4o"
+PROMPT_VERSION = "1"
+
+# Allowance for the completion when budgeting tokens against the rate limiter
+COMPLETION_TOKENS = 256
 
-def hashtag_agent(file_contents):
+@lru_cache(maxsize=None)
+def _hashtag_chain():
     """
-    Function: hash_agent
-    
-    Description:
-    ------------
-    Processes a document and creates hashtags it using a language model.
-    
-    Parameters:
-    -----------
-    N/A
-    
-    Returns:
-    --------
-    hashtags: A list of hashtags for the document.
+    Builds the hashtag chain once per process so the model client and its connection pool are reused.
     """
-    
     # Define the system prompt that sets the context for the feedback generation.
     system_prompt = (
         "# ROLE:\n"
@@ -59,7 +60,7 @@ def hashtag_agent(file_contents):
     )
     
     # Initialize the language model with specific parameters for controlled generation.
-    llm = ChatOpenAI(model="gpt-4o",temperature=0.2)
+    llm = ChatOpenAI(model=MODEL, temperature=0.2)
     #llm = ChatCohere(model_name="command-r-plus", temperature=0.4)
     
     # Create a prompt template that includes the system prompt and placeholders for dynamic content.
@@ -75,14 +76,65 @@ def hashtag_agent(file_contents):
     output_parser = StrOutputParser()
  
     # Chain the components to process the input and generate feedback.
-    hashtag_chain = query_prompt | llm | output_parser
+    return query_prompt | llm | output_parser
+
+def hashtag_agent(file_contents, num_tokens=None):
+    """
+    Function: hash_agent
+    
+    Description:
+    ------------
+    Processes a document and creates hashtags it using a language model.
+    
+    Parameters:
+    -----------
+    file_contents : str
+        The document to tag.
+    num_tokens : int, optional
+        The number of tokens in the document, used for rate limiting. Estimated when not given.
+    
+    Returns:
+    --------
+    hashtags: A list of hashtags for the document.
+    """
+    tokens = num_tokens if num_tokens is not None else estimate_tokens(file_contents)
+    get_rate_limiter("openai").acquire(tokens + COMPLETION_TOKENS)
 
-    raw_hashtags = hashtag_chain.invoke({"working_doc": file_contents})
+    metrics = get_metrics()
+    with metrics.timer('tag'):
+        raw_hashtags = _hashtag_chain().invoke({"working_doc": file_contents})
+    metrics.count('tokens', tokens, stage='tag')
+
+    # Extract hashtags from the raw string; an empty list if no hashtags were found
+    return normalise_hashtags(extract_hashtags(raw_hashtags))
+
+async def ahashtag_agent(file_contents, num_tokens=None):
+    """
+    Function: ahashtag_agent
+    
+    Description:
+    ------------
+    Asynchronous version of hashtag_agent. Waits on the shared rate limiter without blocking the
+    event loop.
+    
+    Parameters:
+    -----------
+    file_contents : str
+        The document to tag.
+    num_tokens : int, optional
+        The number of tokens in the document, used for rate limiting. Estimated when not given.
+    
+    Returns:
+    --------
+    hashtags: A list of hashtags for the document.
+    """
+    tokens = num_tokens if num_tokens is not None else estimate_tokens(file_contents)
+    await get_rate_limiter("openai").aacquire(tokens + COMPLETION_TOKENS)
 
-    # Extract hashtags from the raw string
-    hashtags = extract_hashtags(raw_hashtags)
-    # If no hashtags were found, return an empty list
-    if not hashtags:
-        return []
+    metrics = get_metrics()
+    with metrics.timer('tag'):
+        raw_hashtags = await _hashtag_chain().ainvoke({"working_doc": file_contents})
+    metrics.count('tokens', tokens, stage='tag')
 
-    return hashtags
+    # Extract hashtags from the raw string; an empty list if no hashtags were found
+    return normalise_hashtags(extract_hashtags(raw_hashtags))
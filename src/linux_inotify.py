@@ -0,0 +1,177 @@
+"""
+Module: linux_inotify
+
+Description:
+------------
+This module is a minimal ctypes binding for the Linux inotify API, so file system events can be
+received without a third-party package. The file descriptor is non-blocking and can be waited on with
+select, so an idle watcher costs nothing but a sleeping thread.
+
+Classes:
+--------
+- Inotify
+    An inotify instance with its watches.
+- InotifyEvent
+    A decoded inotify event.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+from collections import namedtuple
+
+# Event bits, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+# Flags for inotify_init1
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# struct inotify_event without its variable-length name
+_EVENT_HEADER = struct.Struct('iIII')
+
+# Large enough for many events per read; the kernel never splits an event across reads
+_READ_SIZE = 64 * 1024
+
+InotifyEvent = namedtuple('InotifyEvent', ['wd', 'mask', 'cookie', 'name'])
+
+
+def _check(result):
+    """
+    Raises OSError with errno if a libc call failed.
+    """
+    if result < 0:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+    return result
+
+
+class Inotify:
+    """
+    A class wrapping one inotify instance.
+
+    Attributes:
+    ----------
+    fd : int
+        The inotify file descriptor.
+
+    Methods:
+    -------
+    add_watch(path, mask):
+        Watches a path and returns the watch descriptor.
+    rm_watch(wd):
+        Removes a watch.
+    read_events():
+        Returns the events that are ready, without blocking.
+    fileno():
+        Returns the file descriptor, so the instance can be passed to select.
+    close():
+        Closes the instance and drops all of its watches.
+    """
+
+    def __init__(self):
+        """
+        Initializes the Inotify instance.
+
+        Raises:
+        ------
+        OSError
+            If inotify is not available on this platform.
+        """
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            self._init1 = libc.inotify_init1
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+        except (OSError, AttributeError):
+            raise OSError(errno.ENOSYS, "inotify is not available on this platform")
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = _check(self._init1(IN_NONBLOCK | IN_CLOEXEC))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        """
+        Watches a path. Watching a path that is already watched updates its mask and returns the
+        existing watch descriptor.
+
+        Parameters:
+        ----------
+        path : str
+            The path to watch.
+        mask : int
+            The IN_* events to report.
+
+        Returns:
+        -------
+        int
+            The watch descriptor.
+        """
+        return _check(self._add_watch(self.fd, os.fsencode(path), mask))
+
+    def rm_watch(self, wd):
+        """
+        Removes a watch. The kernel reports an IN_IGNORED event for it.
+
+        Parameters:
+        ----------
+        wd : int
+            The watch descriptor.
+        """
+        _check(self._rm_watch(self.fd, wd))
+
+    def read_events(self):
+        """
+        Returns the events that are ready, without blocking.
+
+        Returns:
+        -------
+        list
+            InotifyEvent tuples; names are decoded with the file system encoding.
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, _READ_SIZE)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                events.append(InotifyEvent(wd, mask, cookie, name))
+
+    def close(self):
+        """
+        Closes the instance and drops all of its watches.
+        """
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
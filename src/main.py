@@ -11,16 +11,71 @@ Attributes:
 ------------
 DEBUG : bool
     A flag indicating whether debug mode is enabled, determined by the 'TEST' environment variable.
+PRUNE_UNCHANGED_DIRS : bool
+    Whether directories with an unchanged mtime are scanned without being read again, determined by the 'PRUNE_UNCHANGED_DIRS' environment variable.
+WATCH_MODE : bool
+    Whether the crawler keeps running and applies file system changes as they happen, determined by the
+    'WATCH_MODE' environment variable.
+ANALYSIS_PRIORITY : str
+    Comma-separated priority orders for analysing new and changed files (see analysis_scheduler),
+    determined by the 'ANALYSIS_PRIORITY' environment variable. Files are analysed in walk order when
+    neither a priority nor a budget is set.
 """
 
 import os
-from file_system_graph import FileSystemGraph
+from contextlib import ExitStack
+from storage_backend import open_storage_backend
 from walk_file_system import walk_file_system
+from watch_file_system import watch_file_system
+from analysis_cache import AnalysisCache
+from text_cache import TextCache
+from mime_detector import MimeDetector
+from embedding_store import EmbeddingStore
+from crawl_journal import CrawlJournal
+from analysis_scheduler import AnalysisScheduler
+from crawl_metrics import get_metrics
+from tree_scanner import TreeScanner, IgnoreRules, DEFAULT_IGNORE_PATTERNS
 from dotenv import load_dotenv
 from mock_filesystem import create_mock_filesystem, load_mock_fs, close_mock_fs
 
 load_dotenv(".env")
 DEBUG = os.getenv('TEST', 'False').lower() in ('true', '1', 't')  # Read TEST from environment variable
+PRUNE_UNCHANGED_DIRS = os.getenv('PRUNE_UNCHANGED_DIRS', 'False').lower() in ('true', '1', 't')
+WATCH_MODE = os.getenv('WATCH_MODE', 'False').lower() in ('true', '1', 't')
+ANALYSIS_PRIORITY = os.getenv('ANALYSIS_PRIORITY', '')
+
+def _env_number(name, kind):
+    """
+    Reads an optional numeric setting from the environment.
+    """
+    value = os.getenv(name)
+    return kind(value) if value else None
+
+def _analysis_scheduler():
+    """
+    Builds the analysis scheduler from the environment, or returns None if no priority or budget is set.
+    """
+    max_tokens = _env_number('ANALYSIS_MAX_TOKENS', int)
+    max_requests = _env_number('ANALYSIS_MAX_REQUESTS', int)
+    max_spend = _env_number('ANALYSIS_MAX_SPEND', float)
+    if not ANALYSIS_PRIORITY and max_tokens is None and max_requests is None and max_spend is None:
+        return None
+    subtrees = os.getenv('ANALYSIS_PRIORITY_SUBTREES', '')
+    return AnalysisScheduler(
+        max_tokens=max_tokens, max_requests=max_requests, max_spend=max_spend,
+        order=[name.strip() for name in (ANALYSIS_PRIORITY or 'subtrees,recent').split(',') if name.strip()],
+        subtrees=[path for path in subtrees.split(os.pathsep) if path]
+    )
+
+def _write_metrics():
+    """
+    Writes the Prometheus text and the JSON report of the run to the files named in the environment, if any.
+    """
+    metrics = get_metrics()
+    if os.getenv('METRICS_PROMETHEUS_FILE'):
+        metrics.write_prometheus(os.getenv('METRICS_PROMETHEUS_FILE'))
+    if os.getenv('METRICS_REPORT_FILE'):
+        metrics.write_report(os.getenv('METRICS_REPORT_FILE'))
 
 def main():
     """
@@ -39,27 +94,64 @@ def main():
     ------------
     None
     """
+    # Record per-stage latencies and counters, and profile a sample of the analysed files
+    metrics = get_metrics()
+    if os.getenv('METRICS_PORT'):
+        metrics.serve(int(os.getenv('METRICS_PORT')))
+    profile_sample_rate = float(os.getenv('PROFILE_SAMPLE_RATE') or 0)
+    if profile_sample_rate:
+        metrics.configure_profiling(profile_sample_rate, profile_dir=os.getenv('PROFILE_DIR') or None,
+                                    memory=os.getenv('PROFILE_MEMORY', 'False').lower() in ('true', '1', 't'))
+
+    # The caches, embedding store and journal are closed on the way out, even if the crawl fails
+    resources = ExitStack()
     try:
-        uri = "bolt://localhost:7687"
-        username = "neo4j"
-        password = "abcd1234"
-        fs_graph = FileSystemGraph(uri, username, password)
+        # Neo4j, or an embedded SQLite graph, as selected by STORAGE_BACKEND; credentials come from the environment
+        fs_graph = open_storage_backend()
 
         # Set the root directory to start the crawl
         root_dir='/Users/shanngray/AI_Projects/MetaCrawler/tests/Test_Drive'
 
         if DEBUG:
-            print(f"Connecting to database at {uri} with username {username}")
             print(f"Starting file system walk at: {root_dir}")
 
-        # Start crawling the filesystem
-        walk_file_system(root_dir, fs_graph)
+        # Reuse analyses of previously seen file content across runs
+        analysis_cache = resources.enter_context(AnalysisCache(os.getenv('ANALYSIS_CACHE_PATH', 'analysis_cache.db')))
+        # Reuse the text converted from documents, so no document is converted twice
+        text_cache = resources.enter_context(TextCache(os.getenv('TEXT_CACHE_PATH', 'text_cache.db')))
+        # Reuse MIME types of files whose device, inode, size and mtime are unchanged across runs
+        mime_detector = resources.enter_context(MimeDetector(os.getenv('MIME_CACHE_PATH', 'mime_cache.db')))
+        # Keep the summary embeddings in a memory-mapped matrix for local search and analytics
+        embedding_store = resources.enter_context(EmbeddingStore(os.getenv('EMBEDDING_STORE_PATH', 'embeddings.db'),
+                                                                 dtype=os.getenv('EMBEDDING_STORE_DTYPE', 'float32')))
+        # Resume an interrupted walk where it stopped instead of starting over
+        journal = resources.enter_context(CrawlJournal(os.getenv('CRAWL_JOURNAL_PATH', 'crawl_journal.db')))
+        # Analyse the most valuable files first and stop at the run's budget
+        scheduler = _analysis_scheduler()
+
+        # Skip version control metadata and dependencies, or use the rules of CRAWL_IGNORE_FILE
+        ignore_file = os.getenv('CRAWL_IGNORE_FILE')
+        ignore_rules = IgnoreRules.from_file(ignore_file) if ignore_file else IgnoreRules(DEFAULT_IGNORE_PATTERNS)
+        scanner = TreeScanner(ignore_rules=ignore_rules)
+
+        # Start crawling the filesystem, and keep watching it in watch mode
+        if WATCH_MODE:
+            watch_file_system(root_dir, fs_graph,
+                              reconcile_interval=float(os.getenv('RECONCILE_INTERVAL', '3600')),
+                              analysis_cache=analysis_cache, mime_detector=mime_detector, scanner=scanner,
+                              embedding_store=embedding_store, journal=journal, scheduler=scheduler,
+                              text_cache=text_cache)
+        else:
+            walk_file_system(root_dir, fs_graph, analysis_cache=analysis_cache, mime_detector=mime_detector,
+                             scanner=scanner, prune_unchanged_dirs=PRUNE_UNCHANGED_DIRS,
+                             embedding_store=embedding_store, journal=journal, scheduler=scheduler,
+                             text_cache=text_cache)
+        resources.close()
 
         if DEBUG:
             try:
-                query_result = fs_graph._execute_query("MATCH (n) RETURN COUNT(n) AS node_count")
-                if query_result:
-                    node_count = query_result[0]['node_count']  # Access the node count from the first record
+                node_count = fs_graph.count_nodes()
+                if node_count:
                     print(f"Number of nodes in the graph: {node_count}")
                 else:
                     print("No nodes found in the graph.")
@@ -73,6 +165,10 @@ def main():
             print("Database connection closed")
     except Exception as e:
         print(f"An error occurred: {e}")
+    finally:
+        resources.close()
+        # The report is most useful after a failed or slow run, so it is written either way
+        _write_metrics()
 
 if __name__ == "__main__":
     """
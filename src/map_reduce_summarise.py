@@ -0,0 +1,200 @@
+"""
+Module: map_reduce_summarise
+
+Description:
+------------
+This module summarises documents that are too long for a single language model call. The document is
+split on token boundaries into overlapping chunks, the chunks are summarised in parallel (map), and the
+chunk summaries are summarised again in groups until one text is left (reduce). The summary and hashtags
+are derived from that reduced text. Fan-out and the total number of tokens read per document are capped
+so a single huge file cannot run up an unbounded bill.
+
+Functions:
+----------
+- split_tokens(tokens: list, chunk_tokens: int, overlap: int) -> list
+    Splits a token sequence into overlapping windows.
+- map_reduce_summarise(tokens: list, encoder, combined: bool) -> tuple
+    Summarises and tags a long document.
+- amap_reduce_summarise(tokens: list, encoder, combined: bool) -> tuple
+    Asynchronous version of map_reduce_summarise.
+"""
+
+import asyncio
+import math
+from concurrent.futures import ThreadPoolExecutor
+from summarise_agent import summarise_agent, asummarise_agent
+from hashtag_agent import hashtag_agent, ahashtag_agent
+from analysis_agent import analysis_agent, aanalysis_agent
+
+# Target size of a chunk in the map step
+CHUNK_TOKENS = 8000
+# Tokens shared by consecutive chunks so sentences cut at a boundary are seen whole once
+CHUNK_OVERLAP = 200
+# Maximum number of chunks per document; chunks grow instead once this is reached
+MAX_CHUNKS = 32
+# Tokens beyond this point of a document are not summarised
+MAX_TOTAL_TOKENS = 400000
+# Maximum size of a group of summaries combined in one reduce call
+REDUCE_TOKENS = 8000
+# Maximum number of summarise calls in flight for one document
+MAX_WORKERS = 8
+
+# Separates chunk summaries when they are joined for the reduce step
+_SEPARATOR = "\n\n---\n\n"
+
+
+def split_tokens(tokens, chunk_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP):
+    """
+    Function: split_tokens
+
+    Description:
+    ------------
+    Splits a token sequence into windows of chunk_tokens tokens, each starting overlap tokens before
+    the end of the previous one.
+
+    Parameters:
+    -----------
+    tokens : list
+        The token sequence.
+    chunk_tokens : int
+        The number of tokens per window.
+    overlap : int
+        The number of tokens shared by consecutive windows.
+
+    Returns:
+    --------
+    list
+        The token windows.
+    """
+    if overlap >= chunk_tokens:
+        raise ValueError("overlap must be smaller than chunk_tokens")
+    step = chunk_tokens - overlap
+    return [tokens[start:start + chunk_tokens] for start in range(0, max(len(tokens) - overlap, 1), step)]
+
+
+def _plan_chunks(tokens, encoder, chunk_tokens, overlap, max_chunks, max_total_tokens):
+    """
+    Applies the token and fan-out limits and returns the chunk texts for the map step.
+    """
+    tokens = tokens[:max_total_tokens]
+    # Grow the chunks rather than exceed the fan-out limit
+    chunk_tokens = max(chunk_tokens, math.ceil(len(tokens) / max_chunks) + overlap)
+    return [encoder.decode(chunk) for chunk in split_tokens(tokens, chunk_tokens, overlap)]
+
+
+def _group_summaries(summaries, encoder, reduce_tokens):
+    """
+    Groups consecutive summaries so that each group fits in one reduce call.
+    """
+    groups = [[]]
+    size = 0
+    for summary in summaries:
+        summary_tokens = len(encoder.encode(summary))
+        if groups[-1] and size + summary_tokens > reduce_tokens:
+            groups.append([])
+            size = 0
+        groups[-1].append(summary)
+        size += summary_tokens
+    return [_SEPARATOR.join(group) for group in groups]
+
+
+def _reduce_level(groups, summaries, encoder, reduce_tokens):
+    """
+    Regroups the summaries of one reduce level. If summarising did not reduce the number of groups,
+    everything is joined into one group so the reduction always terminates. That group is cut to
+    reduce_tokens tokens, so the final call stays within its limit.
+    """
+    next_groups = _group_summaries(summaries, encoder, reduce_tokens)
+    if len(next_groups) < len(groups):
+        return next_groups
+    joined_tokens = encoder.encode(_SEPARATOR.join(summaries))
+    if len(joined_tokens) > reduce_tokens:
+        print(f"Warning: The summaries did not shrink; truncating {len(joined_tokens)} tokens to {reduce_tokens}")
+    return [encoder.decode(joined_tokens[:reduce_tokens])]
+
+
+def map_reduce_summarise(tokens, encoder, combined=True, chunk_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP,
+                         max_chunks=MAX_CHUNKS, max_total_tokens=MAX_TOTAL_TOKENS, reduce_tokens=REDUCE_TOKENS,
+                         max_workers=MAX_WORKERS):
+    """
+    Function: map_reduce_summarise
+
+    Description:
+    ------------
+    Summarises and tags a document that is too long for a single call. Chunks are summarised in
+    parallel, then the chunk summaries are reduced level by level until they fit in one call, which
+    produces the final summary and the hashtags.
+
+    Parameters:
+    -----------
+    tokens : list
+        The tokens of the document.
+    encoder : tiktoken.Encoding
+        The encoding the tokens were produced with.
+    combined : bool, optional
+        Whether the final summary and hashtags come from one analysis_agent call instead of separate
+        summarise_agent and hashtag_agent calls.
+    chunk_tokens, overlap, max_chunks, max_total_tokens, reduce_tokens, max_workers : int, optional
+        Override the module-level limits of the same names.
+
+    Returns:
+    --------
+    tuple
+        The summary of the document and a list of hashtags for it.
+    """
+    chunks = _plan_chunks(tokens, encoder, chunk_tokens, overlap, max_chunks, max_total_tokens)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Map: summarise every chunk
+        summaries = list(executor.map(summarise_agent, chunks))
+
+        # Reduce: summarise groups of summaries until one group is left
+        groups = _group_summaries(summaries, encoder, reduce_tokens)
+        while len(groups) > 1:
+            summaries = list(executor.map(summarise_agent, groups))
+            groups = _reduce_level(groups, summaries, encoder, reduce_tokens)
+
+    reduced_text = groups[0]
+    if combined:
+        return analysis_agent(reduced_text)
+    return summarise_agent(reduced_text), hashtag_agent(reduced_text)
+
+
+async def amap_reduce_summarise(tokens, encoder, combined=True, chunk_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP,
+                                max_chunks=MAX_CHUNKS, max_total_tokens=MAX_TOTAL_TOKENS,
+                                reduce_tokens=REDUCE_TOKENS, max_workers=MAX_WORKERS):
+    """
+    Function: amap_reduce_summarise
+
+    Description:
+    ------------
+    Asynchronous version of map_reduce_summarise, with at most max_workers calls in flight.
+
+    Parameters:
+    -----------
+    See map_reduce_summarise.
+
+    Returns:
+    --------
+    tuple
+        The summary of the document and a list of hashtags for it.
+    """
+    chunks = await asyncio.to_thread(_plan_chunks, tokens, encoder, chunk_tokens, overlap, max_chunks,
+                                     max_total_tokens)
+    slots = asyncio.Semaphore(max_workers)
+
+    async def summarise(text):
+        async with slots:
+            return await asummarise_agent(text)
+
+    summaries = await asyncio.gather(*(summarise(chunk) for chunk in chunks))
+    groups = await asyncio.to_thread(_group_summaries, summaries, encoder, reduce_tokens)
+    while len(groups) > 1:
+        summaries = await asyncio.gather(*(summarise(group) for group in groups))
+        groups = await asyncio.to_thread(_reduce_level, groups, summaries, encoder, reduce_tokens)
+
+    reduced_text = groups[0]
+    if combined:
+        return await aanalysis_agent(reduced_text)
+    summary, hashtags = await asyncio.gather(asummarise_agent(reduced_text), ahashtag_agent(reduced_text))
+    return summary, hashtags
@@ -5,25 +5,85 @@ Description:
 ------------
 This module provides functionality to analys the content of a file by reading its contents, tokenizing the text, and summarizing it using a language model.
 
+By default the summary and hashtags come from one combined analysis_agent call. Set ANALYSIS_MODE to
+"separate" to use the separate summarise_agent and hashtag_agent calls instead. Content that is empty
+or only whitespace is not sent to a model; it gets an empty summary, no hashtags and no embedding.
+
 Functions:
 ----------
 - meta_analyse(file_path: str) -> tuple:
     Analyzes the content of a file, tokenizes the text, and summarizes it.
+- ameta_analyse(file_path: str) -> tuple:
+    Asynchronous version of meta_analyse that runs the summary and hashtag requests concurrently.
+- analysis_fingerprint() -> str:
+    Identifies the models and prompt versions meta_analyse uses.
 """
 
-import tiktoken
+import asyncio
+import os
 import mimetypes
-from summarise_agent import summarise_agent
-from hashtag_agent import hashtag_agent
-from embed import embed
+from summarise_agent import summarise_agent, asummarise_agent
+from hashtag_agent import hashtag_agent, ahashtag_agent
+from embed import embed, aembed, submit_embedding
+from summarise_agent import MODEL as SUMMARY_MODEL, PROMPT_VERSION as SUMMARY_PROMPT_VERSION
+from hashtag_agent import MODEL as HASHTAG_MODEL, PROMPT_VERSION as HASHTAG_PROMPT_VERSION
+from embed import MODEL as EMBEDDING_MODEL
+from analysis_agent import analysis_agent, aanalysis_agent
+from analysis_agent import MODEL as ANALYSIS_MODEL, PROMPT_VERSION as ANALYSIS_PROMPT_VERSION
+from map_reduce_summarise import map_reduce_summarise, amap_reduce_summarise, MAX_TOTAL_TOKENS
+from token_reader import get_encoder, read_file_tokens, read_text_tokens
+
+# Documents with more tokens than this are summarised with map_reduce_summarise
+MAX_SINGLE_PASS_TOKENS = 50000
+
+# Whether summary and hashtags are produced by one combined call instead of two separate calls
+COMBINED_ANALYSIS = os.getenv('ANALYSIS_MODE', 'combined').lower() != 'separate'
+
+def analysis_fingerprint():
+    """
+    Function: analysis_fingerprint
+    
+    Description:
+    ------------
+    Identifies the models and prompt versions meta_analyse uses, so cached analyses can be told apart
+    from analyses produced by a different configuration.
+    
+    Returns:
+    --------
+    str
+        The fingerprint.
+    """
+    if COMBINED_ANALYSIS:
+        return f"analysis={ANALYSIS_MODEL}/{ANALYSIS_PROMPT_VERSION};embedding={EMBEDDING_MODEL}"
+    return (
+        f"summary={SUMMARY_MODEL}/{SUMMARY_PROMPT_VERSION};"
+        f"hashtags={HASHTAG_MODEL}/{HASHTAG_PROMPT_VERSION};"
+        f"embedding={EMBEDDING_MODEL}"
+    )
+
+def _load_content(file_path, converted_text):
+    """
+    Reads the content to analyse and tokenizes it. Reading stops after MAX_TOTAL_TOKENS tokens, the
+    most map_reduce_summarise will use, so memory stays bounded however large the file is.
+    """
+    if file_path is None and converted_text is None:
+        raise ValueError("Either file_path or converted_text must be provided")
+    
+    if file_path is not None and converted_text is not None:
+        raise ValueError("Only one of file_path or converted_text should be provided")
 
-def meta_analyse(*, file_path: str = None, converted_text: str = None):
+    if file_path:
+        return read_file_tokens(file_path, MAX_TOTAL_TOKENS)
+    return read_text_tokens(converted_text, MAX_TOTAL_TOKENS)
+
+def meta_analyse(*, file_path: str = None, converted_text: str = None, defer_embedding: bool = False):
     """
     Function: meta_analyse
     
     Description:
     ------------
     Analyzes the content of a file or converted text by tokenizing and summarizing it using a language model.
+    Documents over MAX_SINGLE_PASS_TOKENS tokens are summarised chunk by chunk with map_reduce_summarise.
     
     Parameters:
     ------------
@@ -31,41 +91,78 @@ def meta_analyse(*, file_path: str = None, converted_text: str = None):
         The path to the file that needs to be analyzed.
     converted_text : str, optional
         The pre-converted text content to be analyzed.
+    defer_embedding : bool, optional
+        Whether the embedded summary is returned as a concurrent.futures.Future instead of waited for,
+        so the caller can go on while the embedding service batches it with those of other files.
     
     Returns:
     --------
     tuple
         A tuple containing the number of tokens, summary, embedded summary, and hashtags.
     """
-    if file_path is None and converted_text is None:
-        raise ValueError("Either file_path or converted_text must be provided")
-    
-    if file_path is not None and converted_text is not None:
-        raise ValueError("Only one of file_path or converted_text should be provided")
+    content, tokens, num_tokens = _load_content(file_path, converted_text)
+    if not content or content.isspace():
+        return num_tokens, "", [], []
 
-    if file_path:
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                content = file.read()
-        except UnicodeDecodeError:
-            raise ValueError("The file is not encoded in UTF-8")
+    # Send tokens to a small LLM
+    if num_tokens < MAX_SINGLE_PASS_TOKENS:
+        if COMBINED_ANALYSIS:
+            summary, hashtags = analysis_agent(content, num_tokens)
+        else:
+            summary = summarise_agent(content, num_tokens)
+            hashtags = hashtag_agent(content, num_tokens)
     else:
-        content = converted_text
+        # Summarise the document in chunks and reduce the chunk summaries
+        summary, hashtags = map_reduce_summarise(tokens, get_encoder(), combined=COMBINED_ANALYSIS)
+    embedded_summary = submit_embedding(summary) if defer_embedding else embed(summary)
+    
+    return num_tokens, summary, embedded_summary, hashtags
 
-    # Tokenize the text using tiktoken's BPE tokenizer
-    tokenizer = tiktoken.get_encoding("cl100k_base")
+async def ameta_analyse(*, file_path: str = None, converted_text: str = None, defer_embedding: bool = False):
+    """
+    Function: ameta_analyse
     
-    tokens = tokenizer.encode(content)
-    num_tokens = len(tokens)
+    Description:
+    ------------
+    Asynchronous version of meta_analyse. Reading and tokenizing run in a worker thread, and in
+    separate mode the hashtag request runs concurrently with the summary and its embedding, so many
+    documents can be analysed on one event loop.
+    
+    Parameters:
+    ------------
+    file_path : str, optional
+        The path to the file that needs to be analyzed.
+    converted_text : str, optional
+        The pre-converted text content to be analyzed.
+    defer_embedding : bool, optional
+        As for meta_analyse.
+    
+    Returns:
+    --------
+    tuple
+        A tuple containing the number of tokens, summary, embedded summary, and hashtags.
+    """
+    content, tokens, num_tokens = await asyncio.to_thread(_load_content, file_path, converted_text)
+    if not content or content.isspace():
+        return num_tokens, "", [], []
 
-    # Send tokens to a small LLM
-    if num_tokens < 50000:
-        summary = summarise_agent(content)
-        embedded_summary = embed(summary)
-        hashtags = hashtag_agent(content)
+    async def embed_summary(summary):
+        return submit_embedding(summary) if defer_embedding else await aembed(summary)
+
+    if num_tokens >= MAX_SINGLE_PASS_TOKENS:
+        summary, hashtags = await amap_reduce_summarise(tokens, get_encoder(), combined=COMBINED_ANALYSIS)
+        embedded_summary = await embed_summary(summary)
+    elif COMBINED_ANALYSIS:
+        summary, hashtags = await aanalysis_agent(content, num_tokens)
+        embedded_summary = await embed_summary(summary)
     else:
-        # Send tokens to a large LLM
-        print("TOO MANY TOKENS!")
-        summary = "DOC WAS TOO LONG!!"
-    
-    return num_tokens, summary, embedded_summary, hashtags
\ No newline at end of file
+        async def summarise_and_embed():
+            summary = await asummarise_agent(content, num_tokens)
+            return summary, await embed_summary(summary)
+
+        (summary, embedded_summary), hashtags = await asyncio.gather(
+            summarise_and_embed(),
+            ahashtag_agent(content, num_tokens)
+        )
+
+    return num_tokens, summary, embedded_summary, hashtags
@@ -0,0 +1,161 @@
+"""
+Module: migrate_node_ids
+
+Description:
+------------
+This module migrates an existing graph from the old hash()-based node identifiers to the stable
+identifiers produced by path_identity.node_id. The old identifiers were randomised per interpreter and
+cannot be recomputed, so each node's path is rebuilt by following the CONTAINS relationships down from
+the root directory. It also stores the rebuilt path on every node. It is designed to be run once per
+crawled root; running it again is harmless.
+
+Functions:
+----------
+- migrate_node_ids(fs_graph: FileSystemGraph, root_dir: str, use_inode: bool, batch_size: int) -> tuple
+- main(uri: str, username: str, password: str, root_dir: str)
+"""
+
+import os
+from dotenv import load_dotenv
+from file_system_graph import FileSystemGraph
+from path_identity import node_id
+
+
+def _find_root_directory(fs_graph: FileSystemGraph, root_dir: str):
+    """
+    Finds the identifier of the root Directory node for root_dir.
+    """
+    query = """
+    MATCH (d:Directory)
+    WHERE d.parent_dir_id IS NULL AND d.dirname = $dirname
+    RETURN d.dir_id AS dir_id
+    """
+    result = fs_graph._execute_query(query, dirname=os.path.basename(root_dir))
+    if len(result) != 1:
+        raise ValueError(f"Expected one root directory named {os.path.basename(root_dir)!r}, found {len(result)}")
+    return result[0]['dir_id']
+
+
+def _stat_or_none(path: str, use_inode: bool):
+    """
+    Returns the stat result used for identity, or None when inode identity is off or the path is gone.
+    """
+    if not use_inode:
+        return None
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def migrate_node_ids(fs_graph: FileSystemGraph, root_dir: str, use_inode: bool = False, batch_size: int = 1000) -> tuple:
+    """
+    Rewrites the dir_id, parent_dir_id, file_id and path properties of every node below root_dir.
+
+    Parameters:
+    -----------
+    fs_graph : FileSystemGraph
+        An instance of FileSystemGraph to perform operations on the graph.
+    root_dir : str
+        The absolute path of the directory the graph was crawled from.
+    use_inode : bool, optional
+        Must match the use_inode setting that walk_file_system will be run with.
+    batch_size : int, optional
+        The number of nodes updated per transaction.
+
+    Returns:
+    --------
+    tuple
+        The number of directories and files migrated.
+    """
+    root_dir = os.path.abspath(root_dir)
+    old_root_id = _find_root_directory(fs_graph, root_dir)
+
+    dir_query = """
+    MATCH p = (:Directory {dir_id: $root_id})-[:CONTAINS*0..]->(d:Directory)
+    RETURN d.dir_id AS old_id, [n IN tail(nodes(p)) | n.dirname] AS names
+    """
+    file_query = """
+    MATCH (:Directory {dir_id: $root_id})-[:CONTAINS*0..]->(d:Directory)-[:CONTAINS]->(f:File)
+    RETURN f.file_id AS old_id, d.dir_id AS old_dir_id, f.filename AS filename
+    """
+
+    # Rebuild directory paths from the chain of dirnames below the root
+    dir_paths = {}
+    dir_rows = []
+    for record in fs_graph._execute_query(dir_query, root_id=old_root_id):
+        path = os.path.join(root_dir, *record['names'])
+        dir_paths[record['old_id']] = path
+        dir_rows.append({'old_id': record['old_id'], 'path': path})
+
+    new_dir_ids = {old_id: node_id(path, _stat_or_none(path, use_inode)) for old_id, path in dir_paths.items()}
+    for row in dir_rows:
+        path = row['path']
+        row['new_id'] = new_dir_ids[row['old_id']]
+        row['parent_id'] = None if path == root_dir else node_id(
+            os.path.dirname(path), _stat_or_none(os.path.dirname(path), use_inode))
+
+    file_rows = []
+    for record in fs_graph._execute_query(file_query, root_id=old_root_id):
+        path = os.path.join(dir_paths[record['old_dir_id']], record['filename'])
+        file_rows.append({
+            'old_id': record['old_id'],
+            'new_id': node_id(path, _stat_or_none(path, use_inode)),
+            'dir_id': new_dir_ids[record['old_dir_id']],
+            'path': path,
+        })
+
+    update_dirs = """
+    UNWIND $rows AS row
+    MATCH (d:Directory {dir_id: row.old_id})
+    SET d.dir_id = row.new_id, d.parent_dir_id = row.parent_id, d.path = row.path
+    """
+    update_files = """
+    UNWIND $rows AS row
+    MATCH (f:File {file_id: row.old_id})
+    SET f.file_id = row.new_id, f.dir_id = row.dir_id, f.path = row.path
+    """
+    for start in range(0, len(dir_rows), batch_size):
+        fs_graph._execute_query(update_dirs, rows=dir_rows[start:start + batch_size])
+    for start in range(0, len(file_rows), batch_size):
+        fs_graph._execute_query(update_files, rows=file_rows[start:start + batch_size])
+
+    print(f"Migrated {len(dir_rows)} directories and {len(file_rows)} files to stable identifiers.")
+    return len(dir_rows), len(file_rows)
+
+
+def main(uri: str, username: str, password: str, root_dir: str):
+    """
+    Main function to migrate node identifiers.
+
+    Parameters:
+    -----------
+    uri : str
+        The URI of the Neo4j database.
+    username : str
+        The username for the Neo4j database.
+    password : str
+        The password for the Neo4j database.
+    root_dir : str
+        The absolute path of the directory the graph was crawled from.
+    """
+    fs_graph = FileSystemGraph(uri, username, password)
+
+    try:
+        print(f"Migrating node identifiers below {root_dir}...")
+        migrate_node_ids(fs_graph, root_dir)
+    finally:
+        fs_graph.close()
+
+
+if __name__ == "__main__":
+    # The migration is Cypher, so it always runs against the Neo4j server configured in the environment
+    load_dotenv(".env")
+    DB_URI = os.getenv('NEO4J_URI', 'bolt://localhost:7687')
+    DB_USERNAME = os.getenv('NEO4J_USERNAME', 'neo4j')
+    DB_PASSWORD = os.getenv('NEO4J_PASSWORD')
+    if not DB_PASSWORD:
+        raise SystemExit("Set NEO4J_PASSWORD to the password of the Neo4j database.")
+    ROOT_DIR = '/Users/shanngray/AI_Projects/MetaCrawler/tests/Test_Drive'
+
+    main(DB_URI, DB_USERNAME, DB_PASSWORD, ROOT_DIR)
@@ -0,0 +1,243 @@
+"""
+Module: mime_detector
+
+Description:
+------------
+This module determines the MIME types of files cheaply enough to run on every file of a crawl. Each
+thread keeps one libmagic handle instead of loading the magic database per file, only the first few
+kilobytes of a file are read and passed to libmagic, and extensions that identify their format
+unambiguously skip libmagic altogether. Results are cached by (device, inode, size, mtime), optionally
+in a local SQLite database so they survive between runs.
+
+Classes:
+--------
+- MimeDetector
+    Detects and caches MIME types.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import magic
+from crawl_metrics import get_metrics
+
+DEBUG = os.getenv('TEST', 'False').lower() in ('true', '1', 't')  # Read DEBUG from environment variable
+
+# Number of bytes from the start of a file given to libmagic
+HEADER_BYTES = 8192
+
+# Number of new cache entries after which they are committed to the database
+_COMMIT_EVERY = 1000
+
+# Extensions whose MIME type does not depend on the content. Text formats are left to libmagic because
+# their type depends on the encoding of the content.
+EXTENSION_MIME_TYPES = {
+    '.pdf': 'application/pdf',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.bmp': 'image/bmp',
+    '.tif': 'image/tiff',
+    '.tiff': 'image/tiff',
+    '.heic': 'image/heif',
+    '.heif': 'image/heif',
+    '.webp': 'image/webp',
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    '.zip': 'application/zip',
+    '.gz': 'application/gzip',
+    '.mp3': 'audio/mpeg',
+    '.wav': 'audio/x-wav',
+    '.mp4': 'video/mp4',
+    '.mov': 'video/quicktime',
+}
+
+
+class MimeDetector:
+    """
+    A class to determine the MIME types of files with a reusable libmagic handle and a stat-keyed cache.
+
+    Attributes:
+    ----------
+    cache_path : str
+        The path of the SQLite database the cache is persisted in, or None to cache in memory only.
+    header_bytes : int
+        The number of bytes from the start of a file given to libmagic.
+    use_extensions : bool
+        Whether unambiguous extensions are trusted without reading the file.
+    hits : int
+        The number of lookups served from the cache.
+    misses : int
+        The number of lookups that had to detect the type.
+
+    Methods:
+    -------
+    detect(file_path, stat_result=None):
+        Returns the MIME type of a file.
+    stats():
+        Returns hit/miss statistics.
+    close():
+        Commits pending cache entries and closes the database connection.
+    """
+
+    def __init__(self, cache_path=None, header_bytes=HEADER_BYTES, use_extensions=True):
+        """
+        Initializes the MimeDetector, creating the cache database if it does not exist.
+
+        Parameters:
+        ----------
+        cache_path : str, optional
+            The path of the SQLite database the cache is persisted in. Results are only cached in memory
+            when not given.
+        header_bytes : int, optional
+            The number of bytes from the start of a file given to libmagic.
+        use_extensions : bool, optional
+            Whether unambiguous extensions are trusted without reading the file.
+        """
+        self.cache_path = cache_path
+        self.header_bytes = header_bytes
+        self.use_extensions = use_extensions
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._memory = {}
+        self._pending = 0
+        self._conn = None
+        if cache_path is not None:
+            self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS mime_type ("
+                "device INTEGER, inode INTEGER, size INTEGER, mtime INTEGER, mime_type TEXT, "
+                "PRIMARY KEY (device, inode, size, mtime))"
+            )
+            self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def detect(self, file_path, stat_result=None):
+        """
+        Returns the MIME type of a file.
+
+        Parameters:
+        ----------
+        file_path : str
+            The path to the file.
+        stat_result : os.stat_result, optional
+            The file's stat result, if the caller already has it.
+
+        Returns:
+        -------
+        str
+            The MIME type, or 'NA' if it cannot be determined.
+        """
+        start = time.perf_counter()
+        try:
+            if stat_result is None:
+                stat_result = os.stat(file_path)
+            key = (stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+
+            mime_type = self._lookup(key)
+            if mime_type is not None:
+                return mime_type
+
+            mime_type = self._detect_uncached(file_path)
+            self._store(key, mime_type)
+            return mime_type
+        except Exception as e:
+            get_metrics().count('errors', stage='mime')
+            if DEBUG:
+                print(f"Error determining MIME type for {file_path}: {e}")
+            return 'NA'
+        finally:
+            get_metrics().observe('mime', time.perf_counter() - start)
+
+    def _detect_uncached(self, file_path):
+        """
+        Determines the MIME type from the extension if it is unambiguous, otherwise from the file header.
+        """
+        if self.use_extensions:
+            mime_type = EXTENSION_MIME_TYPES.get(os.path.splitext(file_path)[1].lower())
+            if mime_type is not None:
+                return mime_type
+
+        with open(file_path, 'rb') as file:
+            header = file.read(self.header_bytes)
+        return self._magic().from_buffer(header)
+
+    def _magic(self):
+        """
+        Returns this thread's libmagic handle, creating it on first use. Handles are not shared between
+        threads because libmagic is not thread-safe.
+        """
+        handle = getattr(self._local, 'magic', None)
+        if handle is None:
+            handle = self._local.magic = magic.Magic(mime=True)
+        return handle
+
+    def _lookup(self, key):
+        """
+        Returns the cached MIME type for a stat key, or None.
+        """
+        with self._lock:
+            mime_type = self._memory.get(key)
+            if mime_type is None and self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT mime_type FROM mime_type WHERE device = ? AND inode = ? AND size = ? AND mtime = ?", key
+                ).fetchone()
+                if row is not None:
+                    mime_type = self._memory[key] = row[0]
+            if mime_type is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return mime_type
+
+    def _store(self, key, mime_type):
+        """
+        Caches the MIME type for a stat key, committing to the database every _COMMIT_EVERY entries.
+        """
+        with self._lock:
+            self._memory[key] = mime_type
+            if self._conn is None:
+                return
+            self._conn.execute("INSERT OR REPLACE INTO mime_type VALUES (?, ?, ?, ?, ?)", key + (mime_type,))
+            self._pending += 1
+            if self._pending >= _COMMIT_EVERY:
+                self._conn.commit()
+                self._pending = 0
+
+    def stats(self):
+        """
+        Returns hit/miss statistics.
+
+        Returns:
+        -------
+        dict
+            The number of hits and misses and the hit rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def close(self):
+        """
+        Commits pending cache entries and closes the database connection.
+        """
+        with self._lock:
+            if self._conn is not None:
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
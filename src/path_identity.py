@@ -0,0 +1,71 @@
+"""
+Module: path_identity
+
+Description:
+------------
+This module derives stable node identifiers for files and directories. Identifiers are a fixed digest
+of the normalised absolute path, optionally combined with the device and inode numbers, so the same
+file gets the same identifier in every process and every run. Python's built-in hash() cannot be used
+for this because string hashing is randomised per interpreter.
+
+Functions:
+----------
+- normalise_path(path: str) -> str:
+    Returns the canonical form of a path used for identity.
+- node_id(path: str, stat_result: os.stat_result = None) -> str:
+    Returns the stable identifier of the file or directory at path.
+"""
+
+import hashlib
+import os
+import unicodedata
+
+
+def normalise_path(path: str) -> str:
+    """
+    Function: normalise_path
+
+    Description:
+    ------------
+    Returns the canonical form of a path used for identity: absolute, without redundant separators
+    or trailing slashes, case-folded where the platform is case-insensitive, and in Unicode NFC form.
+
+    Parameters:
+    -----------
+    path : str
+        The path to normalise.
+
+    Returns:
+    --------
+    str
+        The normalised path.
+    """
+    path = os.path.normcase(os.path.abspath(path))
+    return unicodedata.normalize("NFC", path)
+
+
+def node_id(path: str, stat_result: os.stat_result = None) -> str:
+    """
+    Function: node_id
+
+    Description:
+    ------------
+    Returns the stable identifier of the file or directory at path.
+
+    Parameters:
+    -----------
+    path : str
+        The path of the file or directory.
+    stat_result : os.stat_result, optional
+        When given, the device and inode numbers are folded into the identifier so that a path
+        that is deleted and recreated as a different file gets a new identifier.
+
+    Returns:
+    --------
+    str
+        A 32 character hexadecimal digest.
+    """
+    identity = normalise_path(path)
+    if stat_result is not None:
+        identity = f"{identity}\0{stat_result.st_dev}:{stat_result.st_ino}"
+    return hashlib.blake2b(identity.encode("utf-8", "surrogateescape"), digest_size=16).hexdigest()
@@ -0,0 +1,250 @@
+"""
+Module: rate_limiter
+
+Description:
+------------
+This module provides token-bucket rate limiting for calls to model providers. Each limiter governs
+requests per minute and tokens per minute for one provider and is shared by every caller in the process,
+synchronous threads and asyncio tasks alike, so the crawler can run close to the provider's limits without
+triggering bursts of 429 responses.
+
+Limits are read from environment variables named after the provider, for example
+OPENAI_REQUESTS_PER_MINUTE and OPENAI_TOKENS_PER_MINUTE for the "openai" provider. A limit that is not set
+is not enforced.
+
+Classes:
+--------
+- TokenBucket
+    A thread-safe token bucket that refills continuously.
+- RateLimiter
+    Combines a request bucket and a token bucket for one provider.
+
+Functions:
+----------
+- get_rate_limiter(provider: str) -> RateLimiter
+    Returns the shared RateLimiter for a provider.
+- estimate_tokens(text: str) -> int
+    Returns a cheap estimate of the number of tokens in a text.
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket that refills continuously up to its capacity.
+
+    Attributes:
+    ----------
+    capacity : float
+        The maximum number of units the bucket holds, which is also the refill amount per minute.
+
+    Methods:
+    -------
+    take(amount):
+        Takes units if available and returns 0, otherwise returns the seconds to wait before retrying.
+    put_back(amount):
+        Returns previously taken units to the bucket.
+    """
+
+    def __init__(self, per_minute):
+        """
+        Initializes the TokenBucket.
+
+        Parameters:
+        ----------
+        per_minute : float
+            The number of units that become available per minute.
+        """
+        self.capacity = float(per_minute)
+        self._rate = self.capacity / 60.0
+        self._level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, amount):
+        """
+        Takes units from the bucket if enough are available.
+
+        Parameters:
+        ----------
+        amount : float
+            The number of units needed. Requests larger than the capacity are capped at the capacity so
+            they wait for a full bucket instead of waiting forever.
+
+        Returns:
+        -------
+        float
+            0 if the units were taken, otherwise the number of seconds to wait before retrying.
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._level = min(self.capacity, self._level + (now - self._updated) * self._rate)
+            self._updated = now
+            if self._level >= amount:
+                self._level -= amount
+                return 0.0
+            return (amount - self._level) / self._rate
+
+    def put_back(self, amount):
+        """
+        Returns previously taken units to the bucket.
+
+        Parameters:
+        ----------
+        amount : float
+            The number of units to return.
+        """
+        with self._lock:
+            self._level = min(self.capacity, self._level + amount)
+
+
+class RateLimiter:
+    """
+    A class to limit requests per minute and tokens per minute for one provider.
+
+    Attributes:
+    ----------
+    provider : str
+        The name of the provider.
+    requests : TokenBucket
+        The requests-per-minute bucket, or None if requests are not limited.
+    tokens : TokenBucket
+        The tokens-per-minute bucket, or None if tokens are not limited.
+
+    Methods:
+    -------
+    acquire(tokens):
+        Blocks the calling thread until one request using the given tokens is allowed.
+    aacquire(tokens):
+        Waits without blocking the event loop until one request using the given tokens is allowed.
+    """
+
+    def __init__(self, provider, requests_per_minute=None, tokens_per_minute=None):
+        """
+        Initializes the RateLimiter.
+
+        Parameters:
+        ----------
+        provider : str
+            The name of the provider.
+        requests_per_minute : float, optional
+            The maximum number of requests per minute.
+        tokens_per_minute : float, optional
+            The maximum number of tokens per minute.
+        """
+        self.provider = provider
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, tokens):
+        """
+        Takes one request and the given tokens atomically, or returns the seconds to wait.
+        """
+        with self._lock:
+            wait = self.requests.take(1) if self.requests else 0.0
+            if wait:
+                return wait
+            wait = self.tokens.take(tokens) if self.tokens else 0.0
+            if wait and self.requests:
+                # Give the request back so a caller waiting on tokens does not starve the others
+                self.requests.put_back(1)
+            return wait
+
+    def acquire(self, tokens=0):
+        """
+        Blocks the calling thread until one request using the given tokens is allowed.
+
+        Parameters:
+        ----------
+        tokens : int
+            The number of tokens the request is expected to consume.
+        """
+        while True:
+            wait = self._try_acquire(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self, tokens=0):
+        """
+        Waits without blocking the event loop until one request using the given tokens is allowed.
+
+        Parameters:
+        ----------
+        tokens : int
+            The number of tokens the request is expected to consume.
+        """
+        while True:
+            wait = self._try_acquire(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+# Average number of characters per token for English text with OpenAI tokenizers
+CHARS_PER_TOKEN = 4
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _env_limit(name):
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+def get_rate_limiter(provider: str) -> RateLimiter:
+    """
+    Function: get_rate_limiter
+
+    Description:
+    ------------
+    Returns the shared RateLimiter for a provider, creating it from the environment on first use.
+
+    Parameters:
+    -----------
+    provider : str
+        The name of the provider, for example "openai" or "openai-embeddings".
+
+    Returns:
+    --------
+    RateLimiter
+        The limiter shared by all callers of the provider in this process.
+    """
+    with _limiters_lock:
+        if provider not in _limiters:
+            prefix = provider.upper().replace("-", "_")
+            _limiters[provider] = RateLimiter(
+                provider,
+                requests_per_minute=_env_limit(f"{prefix}_REQUESTS_PER_MINUTE"),
+                tokens_per_minute=_env_limit(f"{prefix}_TOKENS_PER_MINUTE")
+            )
+        return _limiters[provider]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Function: estimate_tokens
+
+    Description:
+    ------------
+    Returns a cheap estimate of the number of tokens in a text, for budgeting requests whose exact
+    token count is not known.
+
+    Parameters:
+    -----------
+    text : str
+        The text to estimate.
+
+    Returns:
+    --------
+    int
+        The estimated number of tokens.
+    """
+    return len(text) // CHARS_PER_TOKEN + 1
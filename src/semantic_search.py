@@ -0,0 +1,404 @@
+"""
+Module: semantic_search
+
+Description:
+------------
+This module answers natural-language questions about the crawled files by vector similarity instead
+of LLM-generated Cypher. The query is embedded once and the files with the most similar summary
+embeddings are returned with their scores and paths, optionally restricted to a subtree, a MIME type
+or a hashtag. The Neo4j vector index is used when it is online; otherwise the local EmbeddingStore is
+searched if one is given, or an in-process index is built from the embeddings stored in the graph. Both
+local paths search exactly with numpy, unless the store is searched through a CompressedIndex, which
+scans truncated or quantised codes and re-ranks the best candidates exactly.
+
+Scores are cosine similarities mapped to [0, 1] as (1 + cosine) / 2, which is how the Neo4j vector
+index reports them, so both paths rank and score alike.
+
+Classes:
+--------
+- SearchResult
+    One matching file.
+- LocalVectorIndex
+    An exact in-process index over the stored summary embeddings.
+- SemanticSearch
+    Searches the graph by summary similarity.
+
+Functions:
+----------
+- main(query: str, k: int)
+    Prints the top matches for a query.
+"""
+
+import os
+import sys
+import time
+from collections import namedtuple
+import numpy as np
+from storage_backend import StorageBackend, open_storage_backend
+from embedding_store import EmbeddingStore
+from embedding_compression import CompressedIndex
+from graph_schema import EMBEDDING_DIMENSIONS
+
+DEBUG = os.getenv('TEST', 'False').lower() in ('true', '1', 't')  # Read DEBUG from environment variable
+
+# Name of the vector index created by graph_schema
+VECTOR_INDEX = "file_embedded_summary"
+
+# How many candidates per requested result the vector index returns when filters are applied, since
+# the filters run after the index lookup
+FILTER_OVERSAMPLING = 10
+
+SearchResult = namedtuple('SearchResult', ['score', 'file_id', 'path', 'filename', 'mime_type'])
+
+
+def _filter_clause(variable, subtree, mime_type, hashtag):
+    """
+    Builds the Cypher WHERE conditions for the search filters.
+    """
+    conditions = []
+    if subtree is not None:
+        conditions.append(f"{variable}.path STARTS WITH $subtree")
+    if mime_type is not None:
+        conditions.append(f"{variable}.mime_type = $mime_type")
+    if hashtag is not None:
+        conditions.append(f"EXISTS {{ ({variable})-[:HAS_TAG]->(:Hashtag {{name: $hashtag}}) }}")
+    return ("WHERE " + " AND ".join(conditions) + " ") if conditions else ""
+
+
+class LocalVectorIndex:
+    """
+    A class holding the summary embeddings of all files in memory for exact cosine search.
+
+    Attributes:
+    ----------
+    file_ids, paths, filenames, mime_types : list
+        The properties of the indexed files, by row.
+    hashtags : list
+        The set of hashtags of each indexed file, by row.
+    matrix : numpy.ndarray
+        The unit-normalised embeddings, one float32 row per file.
+
+    Methods:
+    -------
+    load(fs_graph):
+        Builds the index from the embeddings stored in the graph.
+    search(vector, k, subtree=None, mime_type=None, hashtag=None):
+        Returns the k most similar files that pass the filters.
+    """
+
+    def __init__(self, rows, dimensions=EMBEDDING_DIMENSIONS):
+        """
+        Initializes the LocalVectorIndex.
+
+        Parameters:
+        ----------
+        rows : iterable
+            (file_id, path, filename, mime_type, hashtags, embedded_summary) tuples. Rows whose embedding
+            does not have the expected dimensions are skipped.
+        dimensions : int, optional
+            The length of the embeddings.
+        """
+        self.file_ids, self.paths, self.filenames, self.mime_types, self.hashtags = [], [], [], [], []
+        vectors = []
+        for file_id, path, filename, mime_type, hashtags, embedded_summary in rows:
+            if embedded_summary is None or len(embedded_summary) != dimensions:
+                continue
+            self.file_ids.append(file_id)
+            self.paths.append(path or '')
+            self.filenames.append(filename)
+            self.mime_types.append(mime_type)
+            self.hashtags.append(set(hashtags or ()))
+            vectors.append(embedded_summary)
+
+        self.matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), dimensions)
+        norms = np.linalg.norm(self.matrix, axis=1, keepdims=True)
+        self.matrix /= np.where(norms == 0, 1, norms)
+
+    @classmethod
+    def load(cls, fs_graph):
+        """
+        Builds the index from the embeddings stored in the graph.
+
+        Parameters:
+        ----------
+        fs_graph : StorageBackend
+            The graph to read the embeddings from.
+
+        Returns:
+        -------
+        LocalVectorIndex
+            The index.
+        """
+        return cls(fs_graph.stream_embeddings())
+
+    def __len__(self):
+        return len(self.file_ids)
+
+    def _mask(self, subtree, mime_type, hashtag):
+        """
+        Returns a boolean mask of the rows that pass the filters, or None if there are no filters.
+        """
+        if subtree is None and mime_type is None and hashtag is None:
+            return None
+        return np.fromiter(
+            ((subtree is None or path.startswith(subtree))
+             and (mime_type is None or row_mime_type == mime_type)
+             and (hashtag is None or hashtag in row_hashtags)
+             for path, row_mime_type, row_hashtags in zip(self.paths, self.mime_types, self.hashtags)),
+            dtype=bool, count=len(self.file_ids)
+        )
+
+    def search(self, vector, k, subtree=None, mime_type=None, hashtag=None):
+        """
+        Returns the k most similar files that pass the filters.
+
+        Parameters:
+        ----------
+        vector : list
+            The query embedding.
+        k : int
+            The number of results.
+        subtree : str, optional
+            Only files whose path starts with this prefix are returned.
+        mime_type : str, optional
+            Only files of this MIME type are returned.
+        hashtag : str, optional
+            Only files with this hashtag are returned.
+
+        Returns:
+        -------
+        list
+            SearchResult tuples, best first.
+        """
+        if not self.file_ids or k <= 0:
+            return []
+        query = np.array(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1
+        scores = self.matrix @ query
+
+        mask = self._mask(subtree, mime_type, hashtag)
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            SearchResult(float((1 + scores[row]) / 2), self.file_ids[row], self.paths[row], self.filenames[row],
+                         self.mime_types[row])
+            for row in top if scores[row] != -np.inf
+        ]
+
+
+class SemanticSearch:
+    """
+    A class to search the crawled files by the similarity of their summaries to a query.
+
+    Attributes:
+    ----------
+    fs_graph : StorageBackend
+        The graph to search.
+    embed_query : callable
+        Embeds a query string with the same model as the summaries.
+    embedding_store : EmbeddingStore
+        The local embedding store searched when the vector index is not online, or None.
+    compressed_index : CompressedIndex
+        A compressed index over embedding_store that is searched instead of the full matrix, or None.
+
+    Methods:
+    -------
+    search(query, k=10, subtree=None, mime_type=None, hashtag=None):
+        Returns the k files whose summaries best match the query.
+    search_vector(vector, k=10, subtree=None, mime_type=None, hashtag=None):
+        Same as search, for an already embedded query.
+    refresh():
+        Re-checks the vector index and drops the in-process index so it is rebuilt on next use.
+    """
+
+    def __init__(self, fs_graph, embed_query=None, embedding_store=None, compressed_index=None):
+        """
+        Initializes the SemanticSearch.
+
+        Parameters:
+        ----------
+        fs_graph : StorageBackend
+            The graph to search.
+        embed_query : callable, optional
+            Embeds a query string. Defaults to embed.embed_query.
+        embedding_store : EmbeddingStore, optional
+            A local embedding store to search instead of loading the embeddings from the graph when the
+            vector index is not online.
+        compressed_index : CompressedIndex, optional
+            A compressed index over embedding_store to search instead of its full matrix.
+        """
+        if embed_query is None:
+            from embed import embed_query
+        self.fs_graph = fs_graph
+        self.embed_query = embed_query
+        self.embedding_store = embedding_store
+        self.compressed_index = compressed_index
+        self._use_vector_index = None
+        self._local_index = None
+
+    def refresh(self):
+        """
+        Re-checks the vector index and drops the in-process index so it is rebuilt on next use.
+        """
+        self._use_vector_index = None
+        self._local_index = None
+
+    def _vector_index_online(self):
+        """
+        Whether the Neo4j vector index exists and is populated. Checked once and remembered.
+        """
+        if self._use_vector_index is None:
+            try:
+                self._use_vector_index = self.fs_graph.has_vector_index(VECTOR_INDEX)
+            except Exception:
+                self._use_vector_index = False
+            if DEBUG:
+                print(f"Semantic search uses the {'Neo4j' if self._use_vector_index else 'in-process'} vector index")
+        return self._use_vector_index
+
+    def search(self, query, k=10, subtree=None, mime_type=None, hashtag=None):
+        """
+        Returns the k files whose summaries best match the query.
+
+        Parameters:
+        ----------
+        query : str
+            The question or search text.
+        k : int, optional
+            The number of results.
+        subtree : str, optional
+            Only files below this directory are returned.
+        mime_type : str, optional
+            Only files of this MIME type are returned.
+        hashtag : str, optional
+            Only files with this hashtag are returned.
+
+        Returns:
+        -------
+        list
+            SearchResult tuples with score, file_id, path, filename and mime_type, best first.
+        """
+        return self.search_vector(self.embed_query(query), k, subtree=subtree, mime_type=mime_type, hashtag=hashtag)
+
+    def search_vector(self, vector, k=10, subtree=None, mime_type=None, hashtag=None):
+        """
+        Returns the k files whose summary embeddings are most similar to vector.
+
+        Parameters:
+        ----------
+        See search; vector is the embedded query.
+
+        Returns:
+        -------
+        list
+            SearchResult tuples, best first.
+        """
+        if subtree is not None:
+            subtree = os.path.join(os.path.abspath(subtree), '')
+        if self._vector_index_online():
+            return self._search_vector_index(vector, k, subtree, mime_type, hashtag)
+        if self.embedding_store is not None:
+            return self._search_embedding_store(vector, k, subtree, mime_type, hashtag)
+        if self._local_index is None:
+            self._local_index = LocalVectorIndex.load(self.fs_graph)
+        return self._local_index.search(vector, k, subtree=subtree, mime_type=mime_type, hashtag=hashtag)
+
+    def _search_vector_index(self, vector, k, subtree, mime_type, hashtag):
+        """
+        Queries the Neo4j vector index. Filters are applied to an oversampled candidate list, so a very
+        selective filter can return fewer than k results.
+        """
+        filtered = subtree is not None or mime_type is not None or hashtag is not None
+        candidates = k * FILTER_OVERSAMPLING if filtered else k
+        query = (
+            "CALL db.index.vector.queryNodes($index, $candidates, $vector) YIELD node, score "
+            + _filter_clause("node", subtree, mime_type, hashtag) +
+            "RETURN score, node.file_id AS file_id, node.path AS path, node.filename AS filename, "
+            "node.mime_type AS mime_type "
+            "ORDER BY score DESC LIMIT $k"
+        )
+        result = self.fs_graph._execute_query(
+            query, index=VECTOR_INDEX, candidates=candidates, vector=[float(x) for x in vector], k=k,
+            subtree=subtree, mime_type=mime_type, hashtag=hashtag
+        )
+        return [
+            SearchResult(record['score'], record['file_id'], record['path'], record['filename'], record['mime_type'])
+            for record in result
+        ]
+
+
+    def _search_embedding_store(self, vector, k, subtree, mime_type, hashtag):
+        """
+        Searches the local embedding store. The subtree filter uses the paths kept in the store; the MIME
+        type and hashtag filters are resolved to file identifiers with one storage backend query.
+        """
+        store = self.embedding_store
+        mask = None
+        if subtree is not None:
+            mask = np.zeros(len(store.live_mask()), dtype=bool)
+            mask[store.rows_below(subtree.rstrip(os.sep))] = True
+        if mime_type is not None or hashtag is not None:
+            allowed = np.zeros(len(store.live_mask()), dtype=bool)
+            allowed[store.rows_for(self.fs_graph.filter_file_ids(mime_type=mime_type, hashtag=hashtag))] = True
+            mask = allowed if mask is None else mask & allowed
+
+        if self.compressed_index is not None:
+            neighbours = self.compressed_index.search(vector, k, mask=mask)
+        else:
+            neighbours = store.knn(vector, k, mask=mask)[0]
+        if not neighbours:
+            return []
+        properties = self.fs_graph.get_file_nodes([file_id for file_id, _ in neighbours])
+        # Files deleted from the graph since the store was last cleaned up are left out
+        return [
+            SearchResult((1 + score) / 2, file_id, *properties[file_id])
+            for file_id, score in neighbours if file_id in properties
+        ]
+
+
+def main(query: str, k: int = 10):
+    """
+    Main function to print the files that best match a query. The graph is opened with the storage
+    backend and credentials configured in the environment.
+
+    Parameters:
+    -----------
+    query : str
+        The search text.
+    k : int, optional
+        The number of results.
+    """
+    fs_graph = open_storage_backend()
+    # Search the crawler's local embedding store when the vector index is not available
+    store_path = os.getenv('EMBEDDING_STORE_PATH', 'embeddings.db')
+    embedding_store = EmbeddingStore(store_path, readonly=True) if os.path.exists(store_path) else None
+    # Optionally search it through truncated and/or quantised codes to save memory
+    compression = os.getenv('EMBEDDING_COMPRESSION', 'none').lower()
+    compressed_index = None
+    if embedding_store is not None and compression != 'none':
+        dimensions = os.getenv('EMBEDDING_SEARCH_DIMENSIONS')
+        compressed_index = CompressedIndex(embedding_store, dimensions=int(dimensions) if dimensions else None,
+                                           quantisation=None if compression == 'float32' else compression)
+
+    try:
+        search = SemanticSearch(fs_graph, embedding_store=embedding_store, compressed_index=compressed_index)
+        start = time.perf_counter()
+        results = search.search(query, k)
+        elapsed = time.perf_counter() - start
+        for result in results:
+            print(f"{result.score:.3f}  {result.path}")
+        print(f"{len(results)} results in {elapsed * 1000:.0f} ms")
+    finally:
+        if embedding_store is not None:
+            embedding_store.close()
+        fs_graph.close()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv(".env")
+    main(" ".join(sys.argv[1:]) or "What hashtags are related to loans.")
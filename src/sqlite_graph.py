@@ -0,0 +1,788 @@
+"""
+Module: sqlite_graph
+
+Description:
+------------
+This module provides the sqlite storage backend: the file system graph in an embedded SQLite database
+in WAL mode, written in-process instead of over Bolt. It suits single-host deployments and CI
+benchmarks, where a Neo4j server is more than the crawl needs and its round trips dominate the cost of
+writing.
+
+Directories and files are rows keyed by dir_id and file_id. Their properties are kept as a JSON object
+and merged with json_patch, which gives the semantics of Cypher's SET n += row, including the removal of
+properties set to null. The path, lastchecked and mime_type properties are indexed through generated
+columns. The summary embedding is kept apart as a float32 blob, so property merges never re-parse it.
+The CONTAINS relationship is the parent_id column of the contained row, so a node has one container;
+HAS_TAG is the file_hashtags table. Foreign keys keep both consistent: a moved node's contents follow its
+new identifier, and deleting a node unlinks its contents and drops its hashtag links, as DETACH DELETE
+does.
+
+Subtree operations walk parent_id with recursive common table expressions. Stale sweeps and subtree
+deletes select their nodes through the indexed path instead, like the Neo4j backend, and delete them in
+batches so no single transaction grows with the tree.
+
+Writes go through one connection guarded by a lock. Streams read through a connection of their own, so
+they see a consistent snapshot while the writer goes on. Needs SQLite 3.31 or later with the JSON
+functions.
+
+Classes:
+--------
+- SQLiteGraph
+    The file system graph in an embedded SQLite database.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from array import array
+from contextlib import contextmanager
+from crawl_metrics import get_metrics
+from storage_backend import StorageBackend
+
+DEBUG = os.getenv('TEST', 'False').lower() in ('true', '1', 't')  # Read DEBUG from environment variable
+
+# Version of the schema below, recorded as the database's user_version
+SCHEMA_VERSION = 1
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS directories ("
+    "dir_id TEXT PRIMARY KEY, "
+    "parent_id TEXT REFERENCES directories (dir_id) ON UPDATE CASCADE ON DELETE SET NULL, "
+    "properties TEXT NOT NULL DEFAULT '{}', "
+    "path TEXT GENERATED ALWAYS AS (json_extract(properties, '$.path')) VIRTUAL, "
+    "lastchecked REAL GENERATED ALWAYS AS (json_extract(properties, '$.lastchecked')) VIRTUAL)",
+    "CREATE INDEX IF NOT EXISTS directory_parent ON directories (parent_id)",
+    "CREATE INDEX IF NOT EXISTS directory_path ON directories (path)",
+    "CREATE TABLE IF NOT EXISTS files ("
+    "file_id TEXT PRIMARY KEY, "
+    "parent_id TEXT REFERENCES directories (dir_id) ON UPDATE CASCADE ON DELETE SET NULL, "
+    "properties TEXT NOT NULL DEFAULT '{}', "
+    "embedded_summary BLOB, "
+    "path TEXT GENERATED ALWAYS AS (json_extract(properties, '$.path')) VIRTUAL, "
+    "lastchecked REAL GENERATED ALWAYS AS (json_extract(properties, '$.lastchecked')) VIRTUAL, "
+    "mime_type TEXT GENERATED ALWAYS AS (json_extract(properties, '$.mime_type')) VIRTUAL)",
+    "CREATE INDEX IF NOT EXISTS file_parent ON files (parent_id)",
+    "CREATE INDEX IF NOT EXISTS file_path ON files (path)",
+    "CREATE INDEX IF NOT EXISTS file_mime_type ON files (mime_type)",
+    "CREATE TABLE IF NOT EXISTS hashtags (name TEXT PRIMARY KEY) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS file_hashtags ("
+    "file_id TEXT REFERENCES files (file_id) ON UPDATE CASCADE ON DELETE CASCADE, "
+    "name TEXT, "
+    "PRIMARY KEY (file_id, name)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS file_hashtag_name ON file_hashtags (name)",
+)
+
+# Selects a directory and every directory below it as the subtree table; takes :dir_id. UNION rather
+# than UNION ALL, so a parent_id cycle cannot recurse forever.
+_SUBTREE = (
+    "WITH RECURSIVE subtree (dir_id) AS ("
+    "SELECT dir_id FROM directories WHERE dir_id = :dir_id "
+    "UNION SELECT d.dir_id FROM directories d JOIN subtree s ON d.parent_id = s.dir_id) "
+)
+
+
+def _encode_embedding(embedding):
+    """
+    Packs an embedding into a float32 blob, keeping None as NULL.
+    """
+    if embedding is None:
+        return None
+    return array('f', (float(value) for value in embedding)).tobytes()
+
+
+def _decode_embedding(blob):
+    """
+    Unpacks a float32 blob into a list of floats.
+    """
+    if blob is None:
+        return None
+    embedding = array('f')
+    embedding.frombytes(blob)
+    return embedding.tolist()
+
+
+def _json_rows(rows, key):
+    """
+    Returns copies of rows with one value encoded as JSON text, for json_set(..., json(:key)). Bound
+    floats would be rendered with 15 significant digits, which truncates timestamps.
+    """
+    return [dict(row, **{key: json.dumps(row[key])}) for row in rows]
+
+
+def _path_range(path):
+    """
+    Returns the bounds of the paths below path, so prefix matches can use the path index.
+    """
+    prefix = os.path.join(path, '')
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class SQLiteGraph(StorageBackend):
+    """
+    A class to represent a file system graph in an embedded SQLite database, as the sqlite storage backend.
+
+    Attributes:
+    ----------
+    path : str
+        The path of the SQLite database file.
+
+    Methods:
+    -------
+    close():
+        Closes the database connection.
+    schema_version():
+        Returns the version of the schema of the database.
+    ensure_schema():
+        Creates the tables and indexes the database does not have yet.
+    merge_directories(rows):
+        Creates or updates a batch of directory nodes in one transaction.
+    update_directories(rows):
+        Sets properties on a batch of existing directory nodes.
+    link_directories(rows):
+        Links a batch of directories to their parent directories.
+    merge_files(rows):
+        Creates or updates a batch of file nodes and drops their hashtag links.
+    merge_unanalysed_files(rows):
+        Creates or updates a batch of unanalysed file nodes, keeping the analysis of existing ones.
+    link_files_to_directories(rows):
+        Links a batch of files to their directories.
+    link_files_to_hashtags(rows):
+        Links a batch of files to hashtags, creating the hashtags.
+    touch_files(rows):
+        Updates lastchecked on a batch of unchanged file nodes.
+    stream_file_states(root_dir_id):
+        Streams the change-detection properties of every file below a directory.
+    stream_directory_states(root_dir_id):
+        Streams the change-detection properties of a directory and every directory below it.
+    stream_embeddings():
+        Streams the summary embedding and search properties of every analysed file.
+    subtree_nodes(dir_id):
+        Retrieves the identifiers and paths of a directory and everything below it.
+    relocate_directories(rows):
+        Rewrites the identity and location properties of a batch of moved directory nodes.
+    relocate_files(rows):
+        Rewrites the identity and location properties of a batch of moved file nodes.
+    reparent_directory(dir_id, parent_dir_id):
+        Moves a directory node under a different parent directory.
+    reparent_file(file_id, dir_id):
+        Moves a file node into a different directory.
+    get_file_node(file_id):
+        Retrieves the properties of a file node.
+    get_file_nodes(file_ids):
+        Retrieves the search properties of a batch of file nodes.
+    get_file_hashtags(file_id):
+        Retrieves the hashtags linked to a file.
+    filter_file_ids(mime_type, hashtag):
+        Retrieves the identifiers of the files with a MIME type and/or hashtag.
+    update_file_node(file_id, properties):
+        Sets properties on an existing file node.
+    remove_file(file_id):
+        Deletes a file node and its links.
+    sweep_stale(root_path, current_walk_time, batch_size):
+        Deletes the files and directories below a path that were not seen in the latest walk.
+    remove_subtree(path, batch_size):
+        Deletes a file, or a directory and everything below it, by path.
+    cleanup_orphaned_hashtags(batch_size):
+        Deletes hashtags no file links to.
+    count_nodes():
+        Returns the number of directory, file and hashtag nodes.
+    wipe_database():
+        Deletes every node and link.
+    """
+
+    def __init__(self, path, ensure_schema=True):
+        """
+        Initializes the SQLiteGraph, creating the database if it does not exist.
+
+        Parameters:
+        ----------
+        path : str
+            The path of the SQLite database file.
+        ensure_schema : bool, optional
+            Whether missing tables and indexes are created on startup.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only risks the last transactions on power loss, which the next walk rewrites
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        if ensure_schema:
+            self.ensure_schema()
+
+    def close(self):
+        """
+        Closes the database connection.
+        """
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Runs the statements of the block in one transaction on the write connection.
+        """
+        with self._lock, get_metrics().timer('graph_query'), self._conn:
+            yield self._conn
+
+    def _query(self, query, params=()):
+        """
+        Runs a read query on the write connection and returns all its rows.
+        """
+        with self._lock, get_metrics().timer('graph_query'):
+            return self._conn.execute(query, params).fetchall()
+
+    def _stream(self, query, params=()):
+        """
+        Yields the rows of a read query from a connection of its own, so the writer is not held up.
+        """
+        conn = sqlite3.connect(self.path)
+        try:
+            yield from conn.execute(query, params)
+        finally:
+            conn.close()
+
+    def schema_version(self):
+        """
+        Returns the version of the schema of the database.
+
+        Returns:
+        -------
+        int
+            The user_version of the database, or 0 for a database without schema.
+        """
+        return self._query("PRAGMA user_version")[0][0]
+
+    def ensure_schema(self):
+        """
+        Creates the tables and indexes the database does not have yet and records the schema version.
+
+        Returns:
+        -------
+        int
+            The schema version of the database.
+        """
+        version = self.schema_version()
+        if version >= SCHEMA_VERSION:
+            return version
+        if DEBUG:
+            print(f"Creating the SQLite graph schema version {SCHEMA_VERSION} in {self.path}")
+        with self._transaction() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        return SCHEMA_VERSION
+
+    def merge_directories(self, rows):
+        """
+        Creates or updates a batch of directory nodes in one transaction.
+
+        Parameters:
+        ----------
+        rows : list
+            Dictionaries holding dir_id and the directory properties to set.
+        """
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO directories (dir_id, properties) VALUES (?, ?) "
+                "ON CONFLICT (dir_id) DO UPDATE SET properties = json_patch(properties, excluded.properties)",
+                [(row['dir_id'], json.dumps(row)) for row in rows]
+            )
+
+    def update_directories(self, rows):
+        """
+        Sets properties on a batch of existing directory nodes.
+
+        Parameters:
+        ----------
+        rows : list
+            Dictionaries holding dir_id and the directory properties to set.
+        """
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE directories SET properties = json_patch(properties, ?) WHERE dir_id = ?",
+                [(json.dumps(row), row['dir_id']) for row in rows]
+            )
+
+    def link_directories(self, rows):
+        """
+        Links a batch of directories to their parent directories, where both exist.
+
+        Parameters:
+        ----------
+        rows : list
+            Dictionaries holding dir_id and parent_dir_id.
+        """
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE directories SET parent_id = :parent_dir_id WHERE dir_id = :dir_id "
+                "AND EXISTS (SELECT 1 FROM directories WHERE dir_id = :parent_dir_id)",
+                rows
+            )
+
+    def _file_parameters(self, file_id, properties):
+        """
+        Splits the embedding off a file's properties and returns the parameters of a file write.
+        """
+        properties = dict(properties)
+        has_embedding = 'embedded_summary' in properties
+        embedding = _encode_embedding(properties.pop('embedded_summary', None))
+        return {'file_id': file_id, 'properties': json.dumps(properties), 'embedded_summary': embedding,
+                'has_embedding': has_embedding}
+
+    def merge_files(self, rows):
+        """
+        Creates or updates a batch of file nodes in one transaction.
+
+        Existing hashtag links of the files are dropped so that the
+        hashtags linked afterwards match the freshly analysed content.
+
+        Parameters:
+        ----------
+        rows : list
+            Dictionaries holding file_id and the file properties to set.
+        """
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO files (file_id, properties, embedded_summary) "
+                "VALUES (:file_id, :properties, :embedded_summary) "
+                "ON CONFLICT (file_id) DO UPDATE SET properties = json_patch(properties, excluded.properties), "
+                "embedded_summary = CASE WHEN :has_embedding THEN excluded.embedded_summary ELSE embedded_summary END",
+                [self._file_parameters(row['file_id'], row) for row in rows]
+            )
+            conn.executemany("DELETE FROM file_hashtags WHERE file_id = ?", [(row['file_id'],) for row in rows])
+
+    def merge_unanalysed_files(self, rows):
+        """
+        Creates or updates a batch of file nodes that were not analysed in one transaction. The summary,
+        embedding and hashtag links of existing files are left as they are.
+
+        Parameters:
+        ----------
+        rows : list
+            Dictionaries holding file_id and the file properties to set.
+        """
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO files (file_id, properties) "
+                "VALUES (:file_id, json_patch('{\"num_tokens\": 0, \"summary\": \"\"}', :properties)) "
+                "ON CONFLICT (file_id) DO UPDATE SET properties = json_patch(properties, :properties)",
+                [{'file_id': row['file_id'], 'properties': json.dumps(row)} for row in rows]
+            )
+
+    def link_files_to_directories(self, rows):
+        """
+        Links a batch of files to their directories, where both exist.
+
+        Parameters:
+        ----------
+        rows : list
+            Dictionaries holding file_id and dir_id.
+        """
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE files SET parent_id = :dir_id WHERE file_id = :file_id "
+                "AND EXISTS (SELECT 1 FROM directories WHERE dir_id = :dir_id)",
+                rows
+            )
+
+    def link_files_to_hashtags(self, rows):
+        """
+        Links a batch of files to hashtags, creating the hashtags that do not exist yet.
+
+        Parameters:
+        ----------
+        rows : list
+            Dictionaries holding file_id and hashtag.
+        """
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO hashtags (name) "
+                "SELECT :hashtag WHERE EXISTS (SELECT 1 FROM files WHERE file_id = :file_id)",
+                rows
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO file_hashtags (file_id, name) "
+                "SELECT :file_id, :hashtag WHERE EXISTS (SELECT 1 FROM files WHERE file_id = :file_id)",
+                rows
+            )
+
+    def touch_files(self, rows):
+        """
+        Updates lastchecked on a batch of unchanged file nodes.
+
+        Parameters:
+        ----------
+        rows : list
+            Dictionaries holding file_id and lastchecked.
+        """
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE files SET properties = json_set(properties, '$.lastchecked', json(:lastchecked)) "
+                "WHERE file_id = :file_id",
+                _json_rows(rows, 'lastchecked')
+            )
+
+    def stream_file_states(self, root_dir_id):
+        """
+        Streams the change-detection properties of every file below a directory.
+
+        Parameters:
+        ----------
+        root_dir_id : str
+            The identifier of the directory at the top of the subtree.
+
+        Yields:
+        ------
+        tuple
+            (file_id, lastmodified, filesize, mime_type) for each file in the subtree.
+        """
+        yield from self._stream(
+            _SUBTREE + "SELECT f.file_id, json_extract(f.properties, '$.lastmodified'), "
+            "json_extract(f.properties, '$.filesize'), f.mime_type "
+            "FROM files f JOIN subtree s ON f.parent_id = s.dir_id",
+            {'dir_id': root_dir_id}
+        )
+
+    def stream_directory_states(self, root_dir_id):
+        """
+        Streams the change-detection properties of a directory and every directory below it.
+
+        Parameters:
+        ----------
+        root_dir_id : str
+            The identifier of the directory at the top of the subtree.
+
+        Yields:
+        ------
+        tuple
+            (dir_id, dir_mtime, child_count) for each directory in the subtree.
+        """
+        yield from self._stream(
+            _SUBTREE + "SELECT d.dir_id, json_extract(d.properties, '$.dir_mtime'), "
+            "json_extract(d.properties, '$.child_count') "
+            "FROM directories d JOIN subtree s ON d.dir_id = s.dir_id",
+            {'dir_id': root_dir_id}
+        )
+
+    def stream_embeddings(self):
+        """
+        Streams the summary embedding and search properties of every file that has one.
+
+        Yields:
+        ------
+        tuple
+            (file_id, path, filename, mime_type, hashtags, embedded_summary) for each file.
+        """
+        rows = self._stream(
+            "SELECT f.file_id, f.path, json_extract(f.properties, '$.filename'), f.mime_type, "
+            "(SELECT json_group_array(name) FROM file_hashtags WHERE file_id = f.file_id), f.embedded_summary "
+            "FROM files f WHERE length(f.embedded_summary) > 0"
+        )
+        for file_id, path, filename, mime_type, hashtags, embedding in rows:
+            yield file_id, path, filename, mime_type, json.loads(hashtags), _decode_embedding(embedding)
+
+    def subtree_nodes(self, dir_id):
+        """
+        Retrieves the identifiers and paths of a directory and every directory and file below it.
+
+        Parameters:
+        ----------
+        dir_id : str
+            The identifier of the directory at the top of the subtree.
+
+        Returns:
+        -------
+        list
+            (is_dir, node_id, path) tuples, the directory itself included.
+        """
+        rows = self._query(
+            _SUBTREE + "SELECT 1, dir_id, path FROM directories WHERE dir_id IN (SELECT dir_id FROM subtree) "
+            "UNION ALL SELECT 0, file_id, path FROM files WHERE parent_id IN (SELECT dir_id FROM subtree)",
+            {'dir_id': dir_id}
+        )
+        return [(bool(is_dir), node_id, path) for is_dir, node_id, path in rows]
+
+    def relocate_directories(self, rows):
+        """
+        Rewrites the identity and location properties of a batch of moved directory nodes. The contents
+        of a directory follow its new identifier through the foreign keys.
+
+        Parameters:
+        ----------
+        rows : list
+            Dictionaries holding old_id and the new dir_id, parent_dir_id, dirname and path.
+        """
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE directories SET dir_id = :dir_id, properties = json_set(properties, "
+                "'$.dir_id', :dir_id, '$.parent_dir_id', :parent_dir_id, '$.dirname', :dirname, '$.path', :path) "
+                "WHERE dir_id = :old_id",
+                rows
+            )
+
+    def relocate_files(self, rows):
+        """
+        Rewrites the identity and location properties of a batch of moved file nodes. The hashtag links
+        of a file follow its new identifier through the foreign keys.
+
+        Parameters:
+        ----------
+        rows : list
+            Dictionaries holding old_id and the new file_id, dir_id, filename, filetype and path.
+        """
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE files SET file_id = :file_id, properties = json_set(properties, "
+                "'$.file_id', :file_id, '$.dir_id', :dir_id, '$.filename', :filename, '$.filetype', :filetype, "
+                "'$.path', :path) "
+                "WHERE file_id = :old_id",
+                rows
+            )
+
+    def reparent_directory(self, dir_id, parent_dir_id):
+        """
+        Moves a directory node under a different parent directory.
+
+        Parameters:
+        ----------
+        dir_id : str
+            The identifier of the directory.
+        parent_dir_id : str
+            The identifier of the new parent directory.
+        """
+        self.link_directories([{'dir_id': dir_id, 'parent_dir_id': parent_dir_id}])
+
+    def reparent_file(self, file_id, dir_id):
+        """
+        Moves a file node into a different directory.
+
+        Parameters:
+        ----------
+        file_id : str
+            The identifier of the file.
+        dir_id : str
+            The identifier of the new directory.
+        """
+        self.link_files_to_directories([{'file_id': file_id, 'dir_id': dir_id}])
+
+    def get_file_node(self, file_id):
+        """
+        Retrieves a file node from the graph.
+
+        Parameters:
+        ----------
+        file_id : str
+            The identifier of the file.
+
+        Returns:
+        -------
+        dict
+            The file node as a dictionary, or None if not found.
+        """
+        rows = self._query("SELECT properties, embedded_summary FROM files WHERE file_id = ?", (file_id,))
+        if not rows:
+            return None
+        properties, embedding = rows[0]
+        node = json.loads(properties)
+        if embedding is not None:
+            node['embedded_summary'] = _decode_embedding(embedding)
+        return node
+
+    def get_file_nodes(self, file_ids):
+        """
+        Retrieves the search properties of a batch of file nodes.
+
+        Parameters:
+        ----------
+        file_ids : list
+            The identifiers of the files.
+
+        Returns:
+        -------
+        dict
+            (path, filename, mime_type) by file_id, for the files that exist.
+        """
+        rows = self._query(
+            "SELECT file_id, path, json_extract(properties, '$.filename'), mime_type FROM files "
+            "WHERE file_id IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(file_ids)),)
+        )
+        return {file_id: (path, filename, mime_type) for file_id, path, filename, mime_type in rows}
+
+    def get_file_hashtags(self, file_id):
+        """
+        Retrieves all hashtags associated with a file.
+
+        Parameters:
+        ----------
+        file_id : str
+            The identifier of the file.
+
+        Returns:
+        -------
+        list
+            A list of hashtags associated with the file.
+        """
+        return [name for name, in self._query("SELECT name FROM file_hashtags WHERE file_id = ?", (file_id,))]
+
+    def filter_file_ids(self, mime_type=None, hashtag=None):
+        """
+        Retrieves the identifiers of the files with the given MIME type and/or hashtag.
+
+        Parameters:
+        ----------
+        mime_type : str, optional
+            Only files of this MIME type are returned.
+        hashtag : str, optional
+            Only files with this hashtag are returned.
+
+        Returns:
+        -------
+        list
+            The identifiers of the matching files.
+        """
+        conditions = []
+        if mime_type is not None:
+            conditions.append("mime_type = :mime_type")
+        if hashtag is not None:
+            conditions.append("file_id IN (SELECT file_id FROM file_hashtags WHERE name = :hashtag)")
+        query = "SELECT file_id FROM files" + (" WHERE " + " AND ".join(conditions) if conditions else "")
+        return [file_id for file_id, in self._query(query, {'mime_type': mime_type, 'hashtag': hashtag})]
+
+    def update_file_node(self, file_id, properties):
+        """
+        Sets the given properties on an existing file node.
+
+        Parameters:
+        ----------
+        file_id : str
+            The identifier of the file.
+        properties : dict
+            The properties to set on the file node.
+        """
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE files SET properties = json_patch(properties, :properties), "
+                "embedded_summary = CASE WHEN :has_embedding THEN :embedded_summary ELSE embedded_summary END "
+                "WHERE file_id = :file_id",
+                self._file_parameters(file_id, properties)
+            )
+
+    def remove_file(self, file_id):
+        """
+        Removes a file node and its hashtag links.
+
+        Parameters:
+        ----------
+        file_id : str
+            The identifier of the file to be removed.
+        """
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+
+    def _delete_in_batches(self, table, key, condition, params, batch_size):
+        """
+        Deletes the rows of a table that meet a condition, batch_size rows per transaction, and returns
+        how many were deleted.
+        """
+        query = (
+            f"DELETE FROM {table} WHERE {key} IN "
+            f"(SELECT {key} FROM {table} WHERE {condition} LIMIT {int(batch_size)})"
+        )
+        removed = 0
+        while True:
+            with self._transaction() as conn:
+                deleted = conn.execute(query, params).rowcount
+            removed += deleted
+            if deleted < batch_size:
+                return removed
+
+    def sweep_stale(self, root_path, current_walk_time, batch_size=10000):
+        """
+        Deletes the files and directories below a path whose lastchecked is older than the latest walk.
+        Only nodes inside the crawled subtree are considered, so trees crawled from other roots are left
+        alone.
+
+        Parameters:
+        ----------
+        root_path : str
+            The absolute path of the crawled root directory. The root directory itself is not removed.
+        current_walk_time : float
+            The timestamp of the latest walk.
+        batch_size : int, optional
+            The number of nodes deleted per transaction.
+
+        Returns:
+        -------
+        tuple
+            The number of files and directories removed.
+        """
+        prefix, upper = _path_range(root_path)
+        params = {'prefix': prefix, 'upper': upper, 'current_walk_time': current_walk_time}
+        condition = "path >= :prefix AND path < :upper AND lastchecked < :current_walk_time"
+        return (self._delete_in_batches('files', 'file_id', condition, params, batch_size),
+                self._delete_in_batches('directories', 'dir_id', condition, params, batch_size))
+
+    def remove_subtree(self, path, batch_size=10000):
+        """
+        Deletes the file or directory at path and every directory and file below it, found through the
+        indexed path.
+
+        Parameters:
+        ----------
+        path : str
+            The absolute path of the file or directory.
+        batch_size : int, optional
+            The number of nodes deleted per transaction.
+
+        Returns:
+        -------
+        int
+            The number of nodes removed.
+        """
+        prefix, upper = _path_range(path)
+        params = {'path': path, 'prefix': prefix, 'upper': upper}
+        condition = "path = :path OR (path >= :prefix AND path < :upper)"
+        return (self._delete_in_batches('files', 'file_id', condition, params, batch_size)
+                + self._delete_in_batches('directories', 'dir_id', condition, params, batch_size))
+
+    def cleanup_orphaned_hashtags(self, batch_size=10000):
+        """
+        Removes hashtags that are no longer linked to any file.
+
+        Parameters:
+        ----------
+        batch_size : int, optional
+            The number of hashtags deleted per transaction.
+
+        Returns:
+        -------
+        int
+            The number of hashtags removed.
+        """
+        condition = "NOT EXISTS (SELECT 1 FROM file_hashtags WHERE file_hashtags.name = hashtags.name)"
+        return self._delete_in_batches('hashtags', 'name', condition, {}, batch_size)
+
+    def count_nodes(self):
+        """
+        Returns the number of nodes in the graph.
+
+        Returns:
+        -------
+        int
+            The number of directories, files and hashtags.
+        """
+        return self._query(
+            "SELECT (SELECT COUNT(*) FROM directories) + (SELECT COUNT(*) FROM files) + (SELECT COUNT(*) FROM hashtags)"
+        )[0][0]
+
+    def wipe_database(self):
+        """
+        Wipes the entire database by deleting all nodes and links.
+        """
+        with self._transaction() as conn:
+            for table in ('file_hashtags', 'hashtags', 'files', 'directories'):
+                conn.execute(f"DELETE FROM {table}")
@@ -0,0 +1,329 @@
+"""
+Module: storage_backend
+
+Description:
+------------
+This module defines the storage interface the crawler writes its graph through, and opens the
+backend chosen by the environment. The interface covers the operations the walker, the batch writer,
+the watcher, the cleanup and semantic search actually use: bulk upserts of directories, files and
+hashtags, the CONTAINS and HAS_TAG links between them, change-detection and embedding streams, moves,
+stale sweeps and subtree deletes. Every bulk method takes a list of row dictionaries, as buffered by
+GraphBatchWriter, so a backend can write a whole batch in one round trip or transaction.
+
+Two backends implement it:
+
+- neo4j: FileSystemGraph, which runs Cypher against a Neo4j server over Bolt;
+- sqlite: SQLiteGraph, an embedded SQLite database in WAL mode for single-host deployments and CI
+  benchmarks, where in-process writes are far cheaper than server round trips.
+
+Classes:
+--------
+- StorageBackend
+    The abstract storage interface of the file system graph.
+
+Functions:
+----------
+- open_storage_backend(ensure_schema: bool) -> StorageBackend
+    Opens the backend selected by STORAGE_BACKEND with the credentials or path from the environment.
+"""
+
+import os
+from abc import ABC, abstractmethod
+
+DEBUG = os.getenv('TEST', 'False').lower() in ('true', '1', 't')  # Read DEBUG from environment variable
+
+# Backends open_storage_backend can open, by STORAGE_BACKEND value
+STORAGE_BACKENDS = ('neo4j', 'sqlite')
+
+
+class StorageBackend(ABC):
+    """
+    The storage interface of the file system graph.
+
+    Directories and files are nodes identified by dir_id and file_id, holding the properties of the rows
+    written to them. A directory CONTAINS its subdirectories and files, and a file HAS_TAG hashtags.
+    Merges add to and overwrite the properties of existing nodes, as Cypher's SET n += row does, and
+    links only connect nodes that exist.
+
+    Methods:
+    -------
+    close():
+        Releases the connections of the backend.
+    merge_directories(rows):
+        Creates or updates a batch of directory nodes.
+    update_directories(rows):
+        Sets properties on a batch of existing directory nodes.
+    link_directories(rows):
+        Links a batch of directories to their parent directories.
+    merge_files(rows):
+        Creates or updates a batch of file nodes and drops their hashtag links.
+    merge_unanalysed_files(rows):
+        Creates or updates a batch of file nodes, keeping the analysis of existing ones.
+    link_files_to_directories(rows):
+        Links a batch of files to their directories.
+    link_files_to_hashtags(rows):
+        Links a batch of files to hashtags, creating the hashtags.
+    touch_files(rows):
+        Updates lastchecked on a batch of unchanged file nodes.
+    stream_file_states(root_dir_id):
+        Yields the change-detection properties of every file below a directory.
+    stream_directory_states(root_dir_id):
+        Yields the change-detection properties of a directory and every directory below it.
+    stream_embeddings():
+        Yields the summary embedding and search properties of every analysed file.
+    subtree_nodes(dir_id):
+        Retrieves the identifiers and paths of a directory and everything below it.
+    relocate_directories(rows):
+        Rewrites the identity and location properties of a batch of moved directory nodes.
+    relocate_files(rows):
+        Rewrites the identity and location properties of a batch of moved file nodes.
+    reparent_directory(dir_id, parent_dir_id):
+        Moves a directory node under a different parent directory.
+    reparent_file(file_id, dir_id):
+        Moves a file node into a different directory.
+    get_file_node(file_id):
+        Retrieves the properties of a file node.
+    get_file_nodes(file_ids):
+        Retrieves the search properties of a batch of file nodes.
+    get_file_hashtags(file_id):
+        Retrieves the hashtags linked to a file.
+    filter_file_ids(mime_type, hashtag):
+        Retrieves the identifiers of the files with a MIME type and/or hashtag.
+    update_file_node(file_id, properties):
+        Sets properties on an existing file node.
+    remove_file(file_id):
+        Deletes a file node and its links.
+    sweep_stale(root_path, current_walk_time, batch_size):
+        Deletes the files and directories below a path that were not seen in the latest walk.
+    remove_subtree(path, batch_size):
+        Deletes a file, or a directory and everything below it, by path.
+    cleanup_orphaned_hashtags(batch_size):
+        Deletes hashtags no file links to.
+    count_nodes():
+        Returns the number of nodes in the graph.
+    wipe_database():
+        Deletes every node and link.
+    has_vector_index(name):
+        Whether the backend has an online vector index of the given name.
+    """
+
+    @abstractmethod
+    def close(self):
+        """
+        Releases the connections of the backend.
+        """
+
+    @abstractmethod
+    def merge_directories(self, rows):
+        """
+        Creates or updates a batch of directory nodes from dictionaries holding dir_id and the properties to set.
+        """
+
+    @abstractmethod
+    def update_directories(self, rows):
+        """
+        Sets properties on a batch of existing directory nodes from dictionaries holding dir_id.
+        """
+
+    @abstractmethod
+    def link_directories(self, rows):
+        """
+        Links a batch of directories to their parents from dictionaries holding dir_id and parent_dir_id.
+        """
+
+    @abstractmethod
+    def merge_files(self, rows):
+        """
+        Creates or updates a batch of file nodes from dictionaries holding file_id and the properties to set,
+        and drops their hashtag links so the hashtags linked afterwards match the new analysis.
+        """
+
+    @abstractmethod
+    def merge_unanalysed_files(self, rows):
+        """
+        Creates or updates a batch of file nodes that were not analysed, from dictionaries holding file_id
+        and the properties to set. The summary, embedding and hashtag links of existing files are kept;
+        new files get an empty summary and no tokens.
+        """
+
+    @abstractmethod
+    def link_files_to_directories(self, rows):
+        """
+        Links a batch of files to their directories from dictionaries holding file_id and dir_id.
+        """
+
+    @abstractmethod
+    def link_files_to_hashtags(self, rows):
+        """
+        Links a batch of files to hashtags from dictionaries holding file_id and hashtag, creating the hashtags.
+        """
+
+    @abstractmethod
+    def touch_files(self, rows):
+        """
+        Updates lastchecked on a batch of file nodes from dictionaries holding file_id and lastchecked.
+        """
+
+    @abstractmethod
+    def stream_file_states(self, root_dir_id):
+        """
+        Yields (file_id, lastmodified, filesize, mime_type) for every file below a directory.
+        """
+
+    @abstractmethod
+    def stream_directory_states(self, root_dir_id):
+        """
+        Yields (dir_id, dir_mtime, child_count) for a directory and every directory below it.
+        """
+
+    @abstractmethod
+    def stream_embeddings(self):
+        """
+        Yields (file_id, path, filename, mime_type, hashtags, embedded_summary) for every file with an embedding.
+        """
+
+    @abstractmethod
+    def subtree_nodes(self, dir_id):
+        """
+        Returns (is_dir, node_id, path) tuples for a directory and every directory and file below it.
+        """
+
+    @abstractmethod
+    def relocate_directories(self, rows):
+        """
+        Rewrites dir_id, parent_dir_id, dirname and path of a batch of moved directories, found by old_id.
+        Their links are kept.
+        """
+
+    @abstractmethod
+    def relocate_files(self, rows):
+        """
+        Rewrites file_id, dir_id, filename, filetype and path of a batch of moved files, found by old_id.
+        Their links are kept.
+        """
+
+    @abstractmethod
+    def reparent_directory(self, dir_id, parent_dir_id):
+        """
+        Replaces the link from a directory's parent with one from a new parent.
+        """
+
+    @abstractmethod
+    def reparent_file(self, file_id, dir_id):
+        """
+        Replaces the link from a file's directory with one from a new directory.
+        """
+
+    @abstractmethod
+    def get_file_node(self, file_id):
+        """
+        Returns the properties of a file node as a dictionary, or None if there is no such file.
+        """
+
+    @abstractmethod
+    def get_file_nodes(self, file_ids):
+        """
+        Returns {file_id: (path, filename, mime_type)} for the files of a batch that exist.
+        """
+
+    @abstractmethod
+    def get_file_hashtags(self, file_id):
+        """
+        Returns the names of the hashtags linked to a file.
+        """
+
+    @abstractmethod
+    def filter_file_ids(self, mime_type=None, hashtag=None):
+        """
+        Returns the identifiers of the files with the given MIME type and/or hashtag.
+        """
+
+    @abstractmethod
+    def update_file_node(self, file_id, properties):
+        """
+        Sets the given properties on an existing file node.
+        """
+
+    @abstractmethod
+    def remove_file(self, file_id):
+        """
+        Deletes a file node and its links.
+        """
+
+    @abstractmethod
+    def sweep_stale(self, root_path, current_walk_time, batch_size=10000):
+        """
+        Deletes the files and directories below root_path whose lastchecked is older than current_walk_time,
+        in batches of batch_size nodes, and returns the number of files and directories removed.
+        """
+
+    @abstractmethod
+    def remove_subtree(self, path, batch_size=10000):
+        """
+        Deletes the file or directory at path and everything below it, and returns the number of nodes removed.
+        """
+
+    @abstractmethod
+    def cleanup_orphaned_hashtags(self, batch_size=10000):
+        """
+        Deletes hashtags no file links to, and returns how many were removed.
+        """
+
+    @abstractmethod
+    def count_nodes(self):
+        """
+        Returns the number of nodes in the graph.
+        """
+
+    @abstractmethod
+    def wipe_database(self):
+        """
+        Deletes every node and link.
+        """
+
+    def has_vector_index(self, name):
+        """
+        Whether the backend has an online vector index of the given name that semantic search can query.
+        Backends without one are searched through the local embedding store or an in-process index.
+        """
+        return False
+
+
+def open_storage_backend(ensure_schema=True):
+    """
+    Function: open_storage_backend
+
+    Description:
+    ------------
+    Opens the storage backend selected by the STORAGE_BACKEND environment variable, 'neo4j' by default.
+    Neo4j is reached at NEO4J_URI with NEO4J_USERNAME and NEO4J_PASSWORD, which has no default. The
+    SQLite database is kept at SQLITE_GRAPH_PATH. Only the driver of the selected backend is imported.
+
+    Parameters:
+    -----------
+    ensure_schema : bool, optional
+        Whether pending schema migrations are applied on startup.
+
+    Returns:
+    --------
+    StorageBackend
+        The opened backend.
+    """
+    backend = os.getenv('STORAGE_BACKEND', 'neo4j').lower()
+    if backend == 'sqlite':
+        from sqlite_graph import SQLiteGraph
+        path = os.getenv('SQLITE_GRAPH_PATH', 'graph.db')
+        if DEBUG:
+            print(f"Opening the SQLite graph at {path}")
+        return SQLiteGraph(path, ensure_schema=ensure_schema)
+    if backend == 'neo4j':
+        from file_system_graph import FileSystemGraph
+        uri = os.getenv('NEO4J_URI', 'bolt://localhost:7687')
+        username = os.getenv('NEO4J_USERNAME', 'neo4j')
+        password = os.getenv('NEO4J_PASSWORD')
+        if not password:
+            raise ValueError("NEO4J_PASSWORD is not set")
+        if DEBUG:
+            print(f"Connecting to database at {uri} with username {username}")
+        return FileSystemGraph(uri, username, password, ensure_schema=ensure_schema)
+    raise ValueError(f"Unknown STORAGE_BACKEND '{backend}', expected one of {', '.join(STORAGE_BACKENDS)}")
@@ -21,30 +21,31 @@ summarise_agent: function
     Returns:
     --------
     summary: A brief summary of the document.
+
+asummarise_agent: coroutine function
+    Asynchronous version of summarise_agent.
 """
 
 from langchain_core.output_parsers import StrOutputParser
 #from langchain_cohere import ChatCohere
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from functools import lru_cache
+from rate_limiter import get_rate_limiter, estimate_tokens
+from crawl_metrics import get_metrics
+
+# Model and prompt identity; bump PROMPT_VERSION whenever the prompt changes so cached analyses are redone
+MODEL = "gpt-4o"
+PROMPT_VERSION = "1"
+
+# Allowance for the completion when budgeting tokens against the rate limiter
+COMPLETION_TOKENS = 512
 
-def summarise_agent(file_contents):
+@lru_cache(maxsize=None)
+def _summary_chain():
     """
-    Function: summarise_agent
-    
-    Description:
-    ------------
-    Processes a document and summarises it using a language model.
-    
-    Parameters:
-    -----------
-    N/A
-    
-    Returns:
-    --------
-    summary: A brief summary of the document.
+    Builds the summary chain once per process so the model client and its connection pool are reused.
     """
-    
     # Define the system prompt that sets the context for the feedback generation.
     system_prompt = (
         "# ROLE:\n"
@@ -58,7 +59,7 @@ def summarise_agent(file_contents):
     )
     
     # Initialize the language model with specific parameters for controlled generation.
-    llm = ChatOpenAI(model="gpt-4o", temperature=0.4)
+    llm = ChatOpenAI(model=MODEL, temperature=0.4)
     #llm = ChatCohere(model_name="command-r-plus", temperature=0.4)
     
     # Create a prompt template that includes the system prompt and placeholders for dynamic content.
@@ -74,8 +75,63 @@ def summarise_agent(file_contents):
     output_parser = StrOutputParser()
  
     # Chain the components to process the input and generate feedback.
-    summary_chain = query_prompt | llm | output_parser
+    return query_prompt | llm | output_parser
+
+def summarise_agent(file_contents, num_tokens=None):
+    """
+    Function: summarise_agent
+    
+    Description:
+    ------------
+    Processes a document and summarises it using a language model.
+    
+    Parameters:
+    -----------
+    file_contents : str
+        The document to summarise.
+    num_tokens : int, optional
+        The number of tokens in the document, used for rate limiting. Estimated when not given.
+    
+    Returns:
+    --------
+    summary: A brief summary of the document.
+    """
+    tokens = num_tokens if num_tokens is not None else estimate_tokens(file_contents)
+    get_rate_limiter("openai").acquire(tokens + COMPLETION_TOKENS)
+
+    metrics = get_metrics()
+    with metrics.timer('summarise'):
+        summary = _summary_chain().invoke({"working_doc": file_contents})
+    metrics.count('tokens', tokens, stage='summarise')
+
+    return summary
+
+async def asummarise_agent(file_contents, num_tokens=None):
+    """
+    Function: asummarise_agent
+    
+    Description:
+    ------------
+    Asynchronous version of summarise_agent. Waits on the shared rate limiter without blocking the
+    event loop.
+    
+    Parameters:
+    -----------
+    file_contents : str
+        The document to summarise.
+    num_tokens : int, optional
+        The number of tokens in the document, used for rate limiting. Estimated when not given.
+    
+    Returns:
+    --------
+    summary: A brief summary of the document.
+    """
+    tokens = num_tokens if num_tokens is not None else estimate_tokens(file_contents)
+    await get_rate_limiter("openai").aacquire(tokens + COMPLETION_TOKENS)
 
-    summary = summary_chain.invoke({"working_doc": file_contents})
+    metrics = get_metrics()
+    with metrics.timer('summarise'):
+        summary = await _summary_chain().ainvoke({"working_doc": file_contents})
+    metrics.count('tokens', tokens, stage='summarise')
 
     return summary
@@ -0,0 +1,192 @@
+"""
+Module: text_cache
+
+Description:
+------------
+This module provides a persistent, content-addressed cache of the text extracted from documents.
+Entries are keyed by the SHA-256 of the document's bytes, so a document is converted once however often
+it is moved, copied or re-analysed; in particular, a change of model or prompt that invalidates the
+analysis cache does not send the document to Azure AI Document Intelligence again. The text is stored
+zlib-compressed together with the method that produced it, in a local SQLite database that evicts the
+least recently used entries once it grows past a size limit.
+
+Classes:
+--------
+- TextCache
+    The SQLite-backed cache of extracted document text.
+"""
+
+import sqlite3
+import threading
+import time
+import zlib
+
+# zlib level of the stored text; extracted text compresses about fourfold at this level
+_COMPRESSION_LEVEL = 6
+
+# Once the cache is over its limit, entries are evicted until it is below this fraction of it
+_EVICT_TO = 0.9
+
+
+class TextCache:
+    """
+    A class to cache extracted document text in a local SQLite database.
+
+    Attributes:
+    ----------
+    path : str
+        The path of the SQLite database file.
+    max_bytes : int
+        The approximate maximum size of the compressed entries. Least recently used entries are evicted
+        beyond it.
+    hits : int
+        The number of lookups served from the cache.
+    misses : int
+        The number of lookups not found in the cache.
+    evictions : int
+        The number of entries evicted.
+
+    Methods:
+    -------
+    get(content_digest):
+        Returns the cached text and extraction method for a document's content, or None.
+    put(content_digest, text, source):
+        Stores the text extracted from a document.
+    stats():
+        Returns hit/miss statistics and the size of the cache.
+    close():
+        Closes the database connection.
+    """
+
+    def __init__(self, path, max_bytes=1024 ** 3):
+        """
+        Initializes the TextCache, creating the database if it does not exist.
+
+        Parameters:
+        ----------
+        path : str
+            The path of the SQLite database file.
+        max_bytes : int, optional
+            The approximate maximum size of the compressed entries. Defaults to 1 GiB.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS text ("
+            "digest TEXT PRIMARY KEY, source TEXT, content BLOB, size INTEGER, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS text_last_access ON text (last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM text").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, content_digest):
+        """
+        Returns the cached text of a document.
+
+        Parameters:
+        ----------
+        content_digest : str
+            The SHA-256 hex digest of the document's bytes.
+
+        Returns:
+        -------
+        tuple
+            (text, source), where source names the extraction method, or None if the document is not cached.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source, content FROM text WHERE digest = ?", (content_digest,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE text SET last_access = ? WHERE digest = ?", (time.time(), content_digest))
+            self._conn.commit()
+
+        source, content = row
+        return zlib.decompress(content).decode('utf-8'), source
+
+    def put(self, content_digest, text, source):
+        """
+        Stores the text extracted from a document, evicting least recently used entries if the cache grows
+        past max_bytes.
+
+        Parameters:
+        ----------
+        content_digest : str
+            The SHA-256 hex digest of the document's bytes.
+        text : str
+            The extracted text.
+        source : str
+            The extraction method, so entries of an outdated local extractor can be told apart.
+        """
+        content = zlib.compress(text.encode('utf-8', 'surrogatepass'), _COMPRESSION_LEVEL)
+        size = len(content_digest) + len(source) + len(content)
+
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM text WHERE digest = ?", (content_digest,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO text (digest, source, content, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                (content_digest, source, content, size, time.time())
+            )
+            self._total_bytes += size - (previous[0] if previous else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """
+        Deletes least recently used entries until the cache is below its eviction target.
+        Must be called with the lock held.
+        """
+        target = self.max_bytes * _EVICT_TO
+        cursor = self._conn.execute("SELECT digest, size FROM text ORDER BY last_access")
+        evicted = []
+        for digest, size in cursor:
+            if self._total_bytes <= target:
+                break
+            evicted.append((digest,))
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM text WHERE digest = ?", evicted)
+        self.evictions += len(evicted)
+
+    def stats(self):
+        """
+        Returns hit/miss statistics and the size of the cache.
+
+        Returns:
+        -------
+        dict
+            The number of hits, misses, evictions and entries, the hit rate and the cached bytes.
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM text").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': entries,
+                'bytes': self._total_bytes,
+            }
+
+    def close(self):
+        """
+        Closes the database connection.
+        """
+        with self._lock:
+            self._conn.close()
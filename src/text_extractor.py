@@ -0,0 +1,394 @@
+"""
+Module: text_extractor
+
+Description:
+------------
+This module converts documents to text for analysis, locally where it can and with Azure AI Document
+Intelligence only where it must. Born-digital documents already hold their text:
+
+- DOCX, XLSX and PPTX files are zip archives of XML parts. Their text is read with zipfile and
+  iterparse, one XML element at a time, so memory stays flat however large the part is.
+- PDF files are read through their text layer with pypdf, when it is installed.
+
+A document is sent to Azure when there is no local extractor for its type (images), when local
+extraction fails, or when it finds no text worth analysing: an Office file of pictures, or a PDF most of
+whose pages are scanned images. Azure's OCR is then the only way to get at the text.
+
+With a TextCache, the text of every document is stored by content hash, so no document is converted
+twice. Cached text from an older version of the local extractors is extracted again; cached Azure
+conversions are kept.
+
+Functions:
+----------
+- extract_text(file_path: str, mime_type: str, max_chars: int) -> str
+    Extracts the text of a document locally, or returns None if it must be converted by Azure.
+- convert_document(file_path: str, mime_type: str, text_cache: TextCache, digest: str) -> str
+    Returns the text of a document from the cache, the local extractors or Azure, in that order.
+"""
+
+import os
+import posixpath
+import re
+import zipfile
+from itertools import islice
+import xml.etree.ElementTree as ET
+from crawl_metrics import get_metrics
+from analysis_cache import content_hash
+from azure_doc_converter import azure_doc_converter
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pypdf is optional; without it every PDF is converted by Azure
+    PdfReader = None
+
+DEBUG = os.getenv('TEST', 'False').lower() in ('true', '1', 't')  # Read DEBUG from environment variable
+
+# Bump when the output of the local extractors changes, so their cached text is extracted again
+EXTRACTOR_VERSION = 1
+LOCAL_SOURCE = f"local-v{EXTRACTOR_VERSION}"
+AZURE_SOURCE = "azure"
+
+DOCX = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+PPTX = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+PDF = 'application/pdf'
+
+# Extraction stops after this many characters; analysis never reads further
+MAX_TEXT_CHARS = 4 * 1024 * 1024
+# XML parts larger than this uncompressed are not parsed, so a zip bomb cannot tie up a worker
+MAX_PART_BYTES = 256 * 1024 * 1024
+# Fewer non-blank characters than this is no text worth analysing
+MIN_TEXT_CHARS = 32
+_NON_BLANK = re.compile(r'\S')
+# A PDF page with fewer non-blank characters than this is taken to be a scanned image
+MIN_PAGE_CHARS = 16
+
+
+class _TextBuffer:
+    """
+    Collects extracted text up to a maximum number of characters.
+    """
+
+    def __init__(self, max_chars):
+        self.max_chars = max_chars
+        self.parts = []
+        self.size = 0
+
+    @property
+    def full(self):
+        return self.size >= self.max_chars
+
+    def add(self, text):
+        if text:
+            self.parts.append(text)
+            self.size += len(text)
+
+    def value(self):
+        return ''.join(self.parts)[:self.max_chars]
+
+
+def _local_name(tag):
+    """
+    Returns an XML tag without its namespace, so transitional and strict OOXML parse alike.
+    """
+    return tag.rpartition('}')[2]
+
+
+def _iterparse(archive, part):
+    """
+    Yields (local name, element) for the end of every element of an XML part of a zip archive.
+    """
+    if archive.getinfo(part).file_size > MAX_PART_BYTES:
+        raise ValueError(f"{part} is larger than {MAX_PART_BYTES} bytes")
+    with archive.open(part) as stream:
+        for _, element in ET.iterparse(stream, events=('end',)):
+            yield _local_name(element.tag), element
+
+
+def _relationship_id(element):
+    """
+    Returns the r:id attribute of an element, whichever relationships namespace it uses.
+    """
+    return next((value for name, value in element.attrib.items() if name.endswith('}id')), None)
+
+
+def _relationships(archive, part):
+    """
+    Returns the internal relationship targets of a part by relationship id, as archive paths.
+    """
+    directory, name = posixpath.split(part)
+    rels_part = posixpath.join(directory, '_rels', name + '.rels')
+    targets = {}
+    if rels_part not in archive.NameToInfo:
+        return targets
+    for tag, element in _iterparse(archive, rels_part):
+        if tag != 'Relationship' or element.get('TargetMode') == 'External':
+            continue
+        target = element.get('Target', '')
+        targets[element.get('Id')] = (target.lstrip('/') if target.startswith('/')
+                                      else posixpath.normpath(posixpath.join(directory, target)))
+    return targets
+
+
+def _ordered_parts(archive, main_part, list_tag):
+    """
+    Returns (name, part) for the sheets or slides listed in a workbook or presentation part, in document order.
+    """
+    targets = _relationships(archive, main_part)
+    parts = []
+    for tag, element in _iterparse(archive, main_part):
+        if tag == list_tag:
+            part = targets.get(_relationship_id(element))
+            if part in archive.NameToInfo:
+                parts.append((element.get('name'), part))
+    return parts
+
+
+def _paragraph_text(archive, part, text, paragraph_tag):
+    """
+    Adds the text runs of a WordprocessingML or DrawingML part, one line per paragraph.
+    """
+    for tag, element in _iterparse(archive, part):
+        if tag == 't':
+            text.add(element.text)
+        elif tag == 'tab':
+            text.add('\t')
+        elif tag in ('br', 'cr'):
+            text.add('\n')
+        elif tag == paragraph_tag:
+            text.add('\n')
+            element.clear()
+            if text.full:
+                return
+
+
+def _docx_text(archive, text):
+    """
+    Adds the text of the body, footnotes and endnotes of a DOCX archive.
+    """
+    for part in ('word/document.xml', 'word/footnotes.xml', 'word/endnotes.xml'):
+        if part in archive.NameToInfo and not text.full:
+            _paragraph_text(archive, part, text, 'p')
+
+
+def _pptx_text(archive, text):
+    """
+    Adds the text of the slides of a PPTX archive, in presentation order.
+    """
+    for _, part in _ordered_parts(archive, 'ppt/presentation.xml', 'sldId'):
+        if text.full:
+            return
+        _paragraph_text(archive, part, text, 'p')
+        text.add('\n')
+
+
+def _string_item_text(item):
+    """
+    Returns the text of a shared string or inline string: its plain text or its rich text runs, leaving
+    out the phonetic runs (rPh) that repeat it in another script.
+    """
+    parts = []
+    for child in item:
+        name = _local_name(child.tag)
+        if name == 't':
+            parts.append(child.text or '')
+        elif name == 'r':
+            parts.extend(run.text or '' for run in child if _local_name(run.tag) == 't')
+    return ''.join(parts)
+
+
+def _shared_strings(archive):
+    """
+    Returns the shared strings table of an XLSX archive.
+    """
+    strings = []
+    if 'xl/sharedStrings.xml' not in archive.NameToInfo:
+        return strings
+    for tag, element in _iterparse(archive, 'xl/sharedStrings.xml'):
+        if tag == 'si':
+            strings.append(_string_item_text(element))
+            element.clear()
+    return strings
+
+
+def _cell_value(cell, strings):
+    """
+    Returns the displayed value of a worksheet cell.
+    """
+    cell_type = cell.get('t')
+    if cell_type == 'inlineStr':
+        return ''.join(_string_item_text(child) for child in cell if _local_name(child.tag) == 'is')
+    value = next((child.text for child in cell if _local_name(child.tag) == 'v'), None)
+    if value is None:
+        return ''
+    if cell_type == 's':
+        index = int(value)
+        return strings[index] if index < len(strings) else ''
+    if cell_type == 'b':
+        return 'TRUE' if value == '1' else 'FALSE'
+    return value
+
+
+def _xlsx_text(archive, text):
+    """
+    Adds the cells of the sheets of an XLSX archive, one tab-separated line per row, in workbook order.
+    """
+    strings = _shared_strings(archive)
+    for name, part in _ordered_parts(archive, 'xl/workbook.xml', 'sheet'):
+        if text.full:
+            return
+        text.add(f"{name}\n")
+        cells = []
+        for tag, element in _iterparse(archive, part):
+            if tag == 'c':
+                cells.append(_cell_value(element, strings))
+            elif tag == 'row':
+                line = '\t'.join(cells).rstrip('\t')
+                if line:
+                    text.add(line + '\n')
+                cells = []
+                element.clear()
+                if text.full:
+                    break
+        text.add('\n')
+
+
+_OOXML_EXTRACTORS = {
+    DOCX: _docx_text,
+    XLSX: _xlsx_text,
+    PPTX: _pptx_text,
+}
+
+# MIME types whose text is always read locally, unless the document has none. PDFs are not among them,
+# as whether they have a text layer cannot be told without reading them.
+LOCAL_MIME_TYPES = frozenset(_OOXML_EXTRACTORS)
+
+
+def _pdf_text(file_path, max_chars):
+    """
+    Returns the text layer of a PDF, or None if most of its pages have none.
+    """
+    reader = PdfReader(file_path)
+    if reader.is_encrypted and not reader.decrypt(''):
+        return None
+    text = _TextBuffer(max_chars)
+    pages = 0
+    text_pages = 0
+    for page in reader.pages:
+        page_text = page.extract_text() or ''
+        pages += 1
+        if len(''.join(page_text.split())) >= MIN_PAGE_CHARS:
+            text_pages += 1
+        text.add(page_text + '\n')
+        if text.full:
+            break
+    if text_pages * 2 < pages:
+        return None
+    return text.value()
+
+
+def extract_text(file_path, mime_type, max_chars=MAX_TEXT_CHARS):
+    """
+    Function: extract_text
+
+    Description:
+    ------------
+    Extracts the text of a document locally: Office Open XML documents with streaming XML parsers, and
+    PDFs through their text layer when pypdf is installed.
+
+    Parameters:
+    -----------
+    file_path : str
+        The path to the document.
+    mime_type : str
+        The MIME type of the document.
+    max_chars : int, optional
+        The number of characters after which extraction stops.
+
+    Returns:
+    --------
+    str
+        The extracted text, or None if the document has no local extractor or, for a PDF, no text layer
+        on most of its pages.
+
+    Raises:
+    -------
+    zipfile.BadZipFile, xml.etree.ElementTree.ParseError, ValueError
+        If the document is damaged or one of its parts is implausibly large.
+    """
+    if mime_type in _OOXML_EXTRACTORS:
+        text = _TextBuffer(max_chars)
+        with zipfile.ZipFile(file_path) as archive:
+            _OOXML_EXTRACTORS[mime_type](archive, text)
+        return text.value()
+    if mime_type == PDF and PdfReader is not None:
+        return _pdf_text(file_path, max_chars)
+    return None
+
+
+def _has_text(text):
+    """
+    Whether extracted text holds enough characters to be worth analysing. The non-blank characters are
+    matched one at a time and counting stops at MIN_TEXT_CHARS, so long documents are neither split nor
+    copied.
+    """
+    return text is not None and sum(1 for _ in islice(_NON_BLANK.finditer(text), MIN_TEXT_CHARS)) >= MIN_TEXT_CHARS
+
+
+def convert_document(file_path, mime_type, text_cache=None, digest=None):
+    """
+    Function: convert_document
+
+    Description:
+    ------------
+    Returns the text of a document for analysis. The text cache is consulted first, then the local
+    extractors, and Azure AI Document Intelligence is only called for documents they cannot read or
+    find no text in. The result is cached by content hash.
+
+    Parameters:
+    -----------
+    file_path : str
+        The path to the document.
+    mime_type : str
+        The MIME type of the document.
+    text_cache : TextCache, optional
+        The cache of extracted text.
+    digest : str, optional
+        The SHA-256 hex digest of the document, if the caller has already computed it.
+
+    Returns:
+    --------
+    str
+        The text of the document.
+    """
+    metrics = get_metrics()
+    if text_cache is not None:
+        digest = digest or content_hash(file_path)
+        cached = text_cache.get(digest)
+        hit = cached is not None and cached[1] in (LOCAL_SOURCE, AZURE_SOURCE)
+        metrics.count('text_cache', result='hit' if hit else 'miss')
+        if hit:
+            if DEBUG:
+                print(f"Text cache hit: {file_path}")
+            return cached[0]
+
+    text = None
+    try:
+        with metrics.timer('extract'):
+            text = extract_text(file_path, mime_type)
+        if text is not None:
+            metrics.count('bytes', os.path.getsize(file_path), stage='extract')
+    except Exception as e:
+        if DEBUG:
+            print(f"Local extraction of {file_path} failed, converting it with Azure: {e}")
+
+    if _has_text(text):
+        source = LOCAL_SOURCE
+    else:
+        text = azure_doc_converter(file_path)
+        source = AZURE_SOURCE
+    metrics.count('documents', method='local' if source == LOCAL_SOURCE else 'azure')
+
+    if text_cache is not None:
+        text_cache.put(digest, text, source)
+    return text
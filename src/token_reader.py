@@ -0,0 +1,224 @@
+"""
+Module: token_reader
+
+Description:
+------------
+This module reads and tokenizes text with bounded memory. The tiktoken encoder is loaded once per
+process. Files are decoded and encoded in chunks, large files through a memory map, and reading stops as
+soon as a token limit is reached, so peak memory depends on the limit rather than on the size of the file.
+A byte-based estimate is available for triage before any file content is read.
+
+Functions:
+----------
+- get_encoder() -> tiktoken.Encoding
+    Returns the process-wide cl100k_base encoder.
+- estimate_file_tokens(num_bytes: int) -> int
+    Estimates the number of tokens in a file of the given size without reading it.
+- read_file_tokens(file_path: str, max_tokens: int) -> tuple
+    Reads and tokenizes a UTF-8 file up to a token limit.
+- read_text_tokens(text: str, max_tokens: int) -> tuple
+    Tokenizes text up to a token limit.
+"""
+
+import codecs
+import mmap
+import os
+import time
+from functools import lru_cache
+import tiktoken
+from crawl_metrics import get_metrics
+
+# Average number of UTF-8 bytes per cl100k_base token for prose
+BYTES_PER_TOKEN = 4
+# Size of the pieces text is decoded and encoded in
+CHUNK_BYTES = 1024 * 1024
+# Files larger than this are read through a memory map instead of buffered reads
+MMAP_THRESHOLD = 16 * 1024 * 1024
+# Text without any whitespace is encoded anyway once this many characters have accumulated
+MAX_CARRY_CHARS = 4 * CHUNK_BYTES
+
+
+@lru_cache(maxsize=None)
+def get_encoder():
+    """
+    Function: get_encoder
+
+    Description:
+    ------------
+    Returns the cl100k_base encoder, loading it only once per process.
+
+    Returns:
+    --------
+    tiktoken.Encoding
+        The encoder.
+    """
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def estimate_file_tokens(num_bytes: int) -> int:
+    """
+    Function: estimate_file_tokens
+
+    Description:
+    ------------
+    Estimates the number of tokens in a text file of the given size without reading it.
+
+    Parameters:
+    -----------
+    num_bytes : int
+        The size of the file in bytes.
+
+    Returns:
+    --------
+    int
+        The estimated number of tokens.
+    """
+    return num_bytes // BYTES_PER_TOKEN
+
+
+def _iter_file_bytes(file):
+    """
+    Yields the bytes of an open binary file in CHUNK_BYTES pieces, through a memory map for large files.
+    """
+    size = os.fstat(file.fileno()).st_size
+    if size > MMAP_THRESHOLD:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for start in range(0, size, CHUNK_BYTES):
+                yield mapped[start:start + CHUNK_BYTES]
+    else:
+        for block in iter(lambda: file.read(CHUNK_BYTES), b''):
+            yield block
+
+
+def _encode_pieces(pieces, max_tokens):
+    """
+    Encodes an iterable of text pieces until more than max_tokens tokens have been produced.
+
+    Each piece is cut at its last whitespace character and the remainder is carried into the next
+    piece, so words are never split across encode calls and the count matches encoding the whole text.
+    Returns the text and tokens read so far and whether the input was cut short.
+    """
+    encoder = get_encoder()
+    texts = []
+    tokens = []
+    carry = ''
+
+    for piece in pieces:
+        piece = carry + piece
+        cut = max(piece.rfind(' '), piece.rfind('\n'))
+        if cut <= 0:
+            if len(piece) < MAX_CARRY_CHARS:
+                carry = piece
+                continue
+            cut = len(piece)
+        piece, carry = piece[:cut], piece[cut:]
+        texts.append(piece)
+        tokens.extend(encoder.encode(piece, disallowed_special=()))
+        if len(tokens) > max_tokens:
+            return ''.join(texts), tokens, True
+
+    if carry:
+        texts.append(carry)
+        tokens.extend(encoder.encode(carry, disallowed_special=()))
+    return ''.join(texts), tokens, len(tokens) > max_tokens
+
+
+def read_file_tokens(file_path: str, max_tokens: int):
+    """
+    Function: read_file_tokens
+
+    Description:
+    ------------
+    Reads and tokenizes a UTF-8 file, stopping once more than max_tokens tokens have been read.
+
+    Parameters:
+    -----------
+    file_path : str
+        The path to the file.
+    max_tokens : int
+        The number of tokens after which reading stops.
+
+    Returns:
+    --------
+    tuple
+        The text read, its tokens, and the number of tokens in the whole file. The last one is exact
+        when the whole file was read and estimated from the unread bytes otherwise.
+
+    Raises:
+    -------
+    ValueError
+        If the file is not encoded in UTF-8.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    bytes_read = 0
+    # Time spent reading and decoding blocks; the rest of the call is tokenising
+    read_seconds = 0.0
+
+    def pieces(file):
+        nonlocal bytes_read, read_seconds
+        blocks = _iter_file_bytes(file)
+        while True:
+            start = time.perf_counter()
+            block = next(blocks, None)
+            if block is None:
+                break
+            bytes_read += len(block)
+            piece = decoder.decode(block)
+            read_seconds += time.perf_counter() - start
+            yield piece
+        yield decoder.decode(b'', final=True)
+
+    metrics = get_metrics()
+    start = time.perf_counter()
+    try:
+        with open(file_path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            text, tokens, truncated = _encode_pieces(pieces(file), max_tokens)
+    except UnicodeDecodeError:
+        metrics.count('errors', stage='read')
+        raise ValueError("The file is not encoded in UTF-8")
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe('read', read_seconds)
+        metrics.observe('tokenise', elapsed - read_seconds)
+    metrics.count('bytes', bytes_read, stage='read')
+    metrics.count('tokens', len(tokens), stage='tokenise')
+
+    num_tokens = len(tokens)
+    if truncated:
+        num_tokens += estimate_file_tokens(size - bytes_read)
+    return text, tokens, num_tokens
+
+
+def read_text_tokens(text: str, max_tokens: int):
+    """
+    Function: read_text_tokens
+
+    Description:
+    ------------
+    Tokenizes already loaded text, stopping once more than max_tokens tokens have been produced.
+
+    Parameters:
+    -----------
+    text : str
+        The text to tokenize.
+    max_tokens : int
+        The number of tokens after which tokenizing stops.
+
+    Returns:
+    --------
+    tuple
+        The text tokenized, its tokens, and the number of tokens in the whole text (estimated from
+        the remaining characters when tokenizing stopped early).
+    """
+    chunk_chars = CHUNK_BYTES
+    pieces = (text[start:start + chunk_chars] for start in range(0, len(text), chunk_chars))
+    metrics = get_metrics()
+    with metrics.timer('tokenise'):
+        read_text, tokens, truncated = _encode_pieces(pieces, max_tokens)
+    metrics.count('tokens', len(tokens), stage='tokenise')
+
+    num_tokens = len(tokens)
+    if truncated:
+        num_tokens += (len(text) - len(read_text)) // BYTES_PER_TOKEN
+    return read_text, tokens, num_tokens
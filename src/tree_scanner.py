@@ -0,0 +1,422 @@
+"""
+Module: tree_scanner
+
+Description:
+------------
+This module walks a directory tree with os.scandir. File types come from the directory entries and each
+file is stat'ed at most once, entries are streamed as they are read instead of being collected into
+per-directory lists first, and subtrees can be skipped, either because they match gitignore-style ignore
+rules or because a caller-supplied check finds them already crawled. A caller can also supply the
+listing of a directory it knows to be unchanged, which is then used instead of reading the directory
+again. Files can also be filtered by size and extension.
+
+Classes:
+--------
+- IgnoreRules
+    Gitignore-style include/exclude rules.
+- TreeScanner
+    Walks a directory tree and yields scan events.
+
+Functions:
+----------
+- count_entries(path: str) -> int
+    Counts the entries of a directory without stat'ing them.
+"""
+
+import os
+import re
+import time
+from contextlib import nullcontext
+from crawl_metrics import get_metrics
+
+DEBUG = os.getenv('TEST', 'False').lower() in ('true', '1', 't')  # Read DEBUG from environment variable
+
+# Version control metadata and installed dependencies, which never hold the user's own documents.
+# Directories such as build/, dist/ or .cache/ can, so they are crawled unless a rules file given by
+# CRAWL_IGNORE_FILE excludes them; such a file replaces these defaults, so it should repeat them
+DEFAULT_IGNORE_PATTERNS = [
+    '.git/',
+    '.hg/',
+    '.svn/',
+    'node_modules/',
+    '.venv/',
+    'venv/',
+    '.tox/',
+]
+
+
+def _translate(pattern):
+    """
+    Translates the glob part of a gitignore pattern into a regular expression matched against a
+    '/'-separated path relative to the root of the scan.
+    """
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            parts.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            parts.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            parts.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            parts.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            body = pattern[i + 1:end]
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            parts.append('[' + body.replace('\\', '\\\\') + ']')
+            i = end + 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return ''.join(parts)
+
+
+class IgnoreRules:
+    """
+    A class holding gitignore-style rules that decide which paths a scan skips.
+
+    Supported syntax: blank lines and lines starting with '#' are ignored, '!' re-includes paths an
+    earlier rule excluded, a trailing '/' restricts a rule to directories, a pattern containing '/' is
+    anchored to the root of the scan (otherwise it matches at any depth), and '*', '?', '[...]' and '**'
+    glob as in .gitignore. The last matching rule wins. As in git, a file cannot be re-included if one of
+    its parent directories is excluded, because excluded directories are never read.
+
+    Attributes:
+    ----------
+    patterns : list
+        The rule lines the rules were built from.
+
+    Methods:
+    -------
+    from_file(path):
+        Reads the rules from a file in .gitignore format.
+    is_ignored(rel_path, is_dir):
+        Checks whether a path is excluded by the rules.
+    """
+
+    def __init__(self, patterns=()):
+        """
+        Initializes the IgnoreRules.
+
+        Parameters:
+        ----------
+        patterns : list, optional
+            Rule lines in .gitignore format.
+        """
+        self.patterns = list(patterns)
+        self._rules = []
+        for line in self.patterns:
+            line = line.rstrip('\n').rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            anchored = '/' in line
+            line = line.lstrip('/')
+            if not line:
+                continue
+            prefix = '' if anchored else '(?:.*/)?'
+            self._rules.append((re.compile(prefix + _translate(line) + '$'), negate, dir_only))
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Reads the rules from a file in .gitignore format.
+
+        Parameters:
+        ----------
+        path : str
+            The path to the rules file.
+
+        Returns:
+        -------
+        IgnoreRules
+            The rules.
+        """
+        with open(path, 'r', encoding='utf-8') as file:
+            return cls(file.readlines())
+
+    def is_ignored(self, rel_path, is_dir):
+        """
+        Checks whether a path is excluded by the rules.
+
+        Parameters:
+        ----------
+        rel_path : str
+            The path relative to the root of the scan, with '/' separators.
+        is_dir : bool
+            Whether the path is a directory.
+
+        Returns:
+        -------
+        bool
+            True if the last rule matching the path excludes it.
+        """
+        ignored = False
+        for regex, negate, dir_only in self._rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                ignored = not negate
+        return ignored
+
+
+class _ListedEntry:
+    """
+    A directory entry known from an earlier scan, standing in for the os.DirEntry scandir would return.
+    Its type is taken from the listing; stat calls go to the file system.
+    """
+
+    __slots__ = ('name', 'path', '_is_dir')
+
+    def __init__(self, directory, name, is_dir):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self._is_dir = is_dir
+
+    def is_dir(self, follow_symlinks=True):
+        return self._is_dir
+
+    def is_file(self, follow_symlinks=True):
+        return not self._is_dir
+
+    def stat(self, follow_symlinks=True):
+        return os.stat(self.path, follow_symlinks=follow_symlinks)
+
+
+def count_entries(path):
+    """
+    Function: count_entries
+
+    Description:
+    ------------
+    Counts the entries of a directory. Only the directory itself is read; its entries are not stat'ed.
+
+    Parameters:
+    -----------
+    path : str
+        The path to the directory.
+
+    Returns:
+    --------
+    int
+        The number of entries.
+    """
+    with os.scandir(path) as entries:
+        return sum(1 for _ in entries)
+
+
+class TreeScanner:
+    """
+    A class to walk a directory tree with os.scandir.
+
+    scan() yields tuples describing the tree in depth-first order:
+
+    ('directory', path, stat_result)
+        A directory is about to be read. Its parent has always been yielded before it.
+    ('file', path, stat_result)
+        A file of the directory being read passed the ignore rules and filters.
+    ('listed', path, child_count)
+        A directory has been read completely and all of its subdirectories have been yielded;
+        child_count counts all of its entries, including ignored and filtered ones.
+    ('pruned', path, stat_result)
+        A directory was skipped together with its subtree because the prune check accepted it.
+    ('unreadable', path, error)
+        A directory could not be read, so its entries and subtree are unknown; error is the OSError.
+        No 'listed' event follows, and entries yielded before the error are kept.
+
+    Like os.walk, symbolic links to directories are not followed.
+
+    Attributes:
+    ----------
+    ignore_rules : IgnoreRules
+        The rules deciding which files and directories are skipped, or None.
+    min_file_size : int
+        The size in bytes below which files are skipped, or None.
+    max_file_size : int
+        The size in bytes above which files are skipped, or None.
+    include_extensions : set
+        If set, only files with these extensions are yielded.
+    exclude_extensions : set
+        Files with these extensions are skipped.
+
+    Methods:
+    -------
+    scan(root_dir, prune=None, files=True, listing=None):
+        Walks the tree below root_dir.
+    accepts(rel_path, is_dir, stat_result=None):
+        Checks whether a single path passes the ignore rules and filters.
+    """
+
+    def __init__(self, ignore_rules=None, min_file_size=None, max_file_size=None, include_extensions=None,
+                 exclude_extensions=None):
+        """
+        Initializes the TreeScanner.
+
+        Parameters:
+        ----------
+        ignore_rules : IgnoreRules, optional
+            The rules deciding which files and directories are skipped.
+        min_file_size : int, optional
+            The size in bytes below which files are skipped.
+        max_file_size : int, optional
+            The size in bytes above which files are skipped.
+        include_extensions : list, optional
+            If given, only files with these extensions (e.g. '.md') are yielded.
+        exclude_extensions : list, optional
+            Files with these extensions are skipped.
+        """
+        self.ignore_rules = ignore_rules
+        self.min_file_size = min_file_size
+        self.max_file_size = max_file_size
+        self.include_extensions = self._normalise_extensions(include_extensions)
+        self.exclude_extensions = self._normalise_extensions(exclude_extensions) or set()
+
+    @staticmethod
+    def _normalise_extensions(extensions):
+        """
+        Lower-cases extensions and gives them a leading dot.
+        """
+        if extensions is None:
+            return None
+        return {ext.lower() if ext.startswith('.') else '.' + ext.lower() for ext in extensions}
+
+    def _accepts_name(self, name):
+        """
+        Applies the extension filters, which need no stat.
+        """
+        ext = os.path.splitext(name)[1].lower()
+        if self.include_extensions is not None and ext not in self.include_extensions:
+            return False
+        return ext not in self.exclude_extensions
+
+    def _accepts_size(self, size):
+        """
+        Applies the size filters.
+        """
+        if self.min_file_size is not None and size < self.min_file_size:
+            return False
+        return self.max_file_size is None or size <= self.max_file_size
+
+    def accepts(self, rel_path, is_dir, stat_result=None):
+        """
+        Checks whether a single path passes the ignore rules and, for files, the filters. Only the path
+        itself is checked, not its parent directories.
+
+        Parameters:
+        ----------
+        rel_path : str
+            The path relative to the root of the scan, with '/' separators.
+        is_dir : bool
+            Whether the path is a directory.
+        stat_result : os.stat_result, optional
+            The file's stat result; the size filters are only applied when it is given.
+
+        Returns:
+        -------
+        bool
+            True if scan() would yield the path.
+        """
+        if self.ignore_rules is not None and self.ignore_rules.is_ignored(rel_path, is_dir):
+            return False
+        if is_dir:
+            return True
+        if not self._accepts_name(rel_path.rsplit('/', 1)[-1]):
+            return False
+        return stat_result is None or self._accepts_size(stat_result.st_size)
+
+    def scan(self, root_dir, prune=None, files=True, listing=None):
+        """
+        Walks the tree below root_dir, yielding the scan events described in the class docstring.
+
+        Parameters:
+        ----------
+        root_dir : str
+            The directory to start from. It is never pruned.
+        prune : callable, optional
+            Called as prune(path, stat_result) for every directory below the root; if it returns True
+            the directory and its subtree are skipped and a 'pruned' event is yielded instead.
+        files : bool, optional
+            Whether files are yielded. Without them, only directories are stat'ed.
+        listing : callable, optional
+            Called as listing(path, stat_result) for every directory about to be read. If it returns
+            (entries, child_count), where entries are (name, is_dir) pairs, the directory is not read and
+            those entries are scanned instead: subdirectories are still descended into and files still
+            stat'ed and filtered. It must only do so for directories whose entries have not changed.
+
+        Yields:
+        ------
+        tuple
+            The scan events.
+        """
+        metrics = get_metrics()
+        root_stat = os.stat(root_dir)
+        yield 'directory', root_dir, root_stat
+        # Directories still to be read, as (path, path relative to the root, stat result)
+        stack = [(root_dir, '', root_stat)]
+
+        while stack:
+            path, rel_dir, dir_stat = stack.pop()
+            subdirs = []
+            child_count = 0
+            known = listing(path, dir_stat) if listing is not None else None
+            try:
+                if known is None:
+                    entries_context = os.scandir(path)
+                else:
+                    entries_context = nullcontext([_ListedEntry(path, name, is_dir) for name, is_dir in known[0]])
+                with entries_context as entries:
+                    for entry in entries:
+                        child_count += 1
+                        rel_path = rel_dir + entry.name
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if self.ignore_rules is None or not self.ignore_rules.is_ignored(rel_path, True):
+                                    subdirs.append((entry.path, rel_path + '/', entry.stat(follow_symlinks=False)))
+                                continue
+                            if not files or not entry.is_file():
+                                continue
+                            if self.ignore_rules is not None and self.ignore_rules.is_ignored(rel_path, False):
+                                continue
+                            if not self._accepts_name(entry.name):
+                                continue
+                            start = time.perf_counter()
+                            stat_result = entry.stat()
+                            metrics.observe('stat', time.perf_counter() - start)
+                        except OSError as e:
+                            metrics.count('errors', stage='stat')
+                            # Entries can vanish mid-scan and symbolic links can be broken
+                            if DEBUG:
+                                print(f"Skipping {entry.path}: {e}")
+                            continue
+                        if self._accepts_size(stat_result.st_size):
+                            yield 'file', entry.path, stat_result
+            except OSError as e:
+                metrics.count('errors', stage='scandir')
+                if DEBUG:
+                    print(f"Skipping unreadable directory {path}: {e}")
+                yield 'unreadable', path, e
+                continue
+            if known is not None:
+                # Ignored and filtered entries are not in a known listing, but count towards the directory
+                child_count = known[1]
+
+            # Reverse so the subdirectories are visited in directory order
+            for subdir, rel_subdir, stat_result in reversed(subdirs):
+                if prune is not None and prune(subdir, stat_result):
+                    yield 'pruned', subdir, stat_result
+                    continue
+                yield 'directory', subdir, stat_result
+                stack.append((subdir, rel_subdir, stat_result))
+
+            yield 'listed', path, child_count
@@ -7,34 +7,428 @@ This module provides functionality to traverse a file system starting from a spe
 
 Functions:
 ----------
-- walk_file_system(root_dir: str, fs_graph: FileSystemGraph) -> None:
+- walk_file_system(root_dir: str, fs_graph: StorageBackend, batch_size: int, flush_interval: float, use_inode: bool, workers: int, queue_size: int, async_analysis: bool, analysis_cache: AnalysisCache, mime_detector: MimeDetector, scanner: TreeScanner, prune_unchanged_dirs: bool, parent_dir_id: str, clean_up: bool, embedding_store: EmbeddingStore, journal: CrawlJournal, scheduler: AnalysisScheduler, text_cache: TextCache) -> None:
     Walks through the file system starting from root_dir and adds files and directories to the graph database.
+- crawl_files(file_paths: list, fs_graph: StorageBackend, ...) -> None:
+    Analyses individual files and adds them to the graph database without walking or cleaning up.
+- analyse_file(file_path: str, mime_type: str, text_cache: TextCache, digest: str, defer_embedding: bool) -> tuple:
+    Runs the content analysis appropriate for a file's MIME type.
+- aanalyse_file(file_path: str, mime_type: str, text_cache: TextCache, digest: str, defer_embedding: bool) -> tuple:
+    Asynchronous version of analyse_file.
 """
 
+import asyncio
+import functools
 import os
+import stat
 import time  # Import time module
-from file_system_graph import FileSystemGraph
-from get_mime_type import get_mime_type
-from meta_analyse import meta_analyse
+from concurrent.futures import Future
+from storage_backend import StorageBackend
+from graph_batch_writer import GraphBatchWriter
+from crawl_pipeline import CrawlPipeline
+from file_snapshot import FileSnapshot
+from path_identity import node_id
+from mime_detector import MimeDetector
+from tree_scanner import TreeScanner
+from meta_analyse import meta_analyse, ameta_analyse, analysis_fingerprint
+from analysis_cache import AnalysisCache, content_hash
+from embedding_store import EmbeddingStore
+from crawl_journal import CrawlJournal
+from analysis_scheduler import AnalysisScheduler
+from crawl_metrics import get_metrics
 from clean_up_file_system import clean_up_file_system
-from azure_doc_converter import azure_doc_converter  # Import the Azure document converter function
+from text_cache import TextCache
+from text_extractor import convert_document
 
 DEBUG = os.getenv('TEST', 'False').lower() in ('true', '1', 't')  # Read DEBUG from environment variable
 
-def walk_file_system(root_dir: str, fs_graph: FileSystemGraph):
+# MIME types that are converted to text before analysis: locally where possible, otherwise with Azure AI
+# Document Intelligence (see text_extractor)
+CONVERTIBLE_MIME_TYPES = [
+    'application/pdf',
+    'image/jpeg', 'image/png', 'image/bmp', 'image/tiff', 'image/heif',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    'text/html'
+]
+
+def analyse_file(file_path: str, mime_type: str, text_cache: TextCache = None, digest: str = None,
+                 defer_embedding: bool = False):
+    """
+    Function: analyse_file
+    
+    Description:
+    ------------
+    Runs the content analysis appropriate for a file's MIME type. Text files are analysed directly,
+    convertible documents are converted to text first and everything else is left unanalysed.
+    
+    Parameters:
+    ------------
+    file_path : str
+        The path to the file to analyse.
+    mime_type : str
+        The MIME type of the file.
+    text_cache : TextCache, optional
+        A cache of converted document text keyed by file content, consulted before any conversion.
+    digest : str, optional
+        The SHA-256 hex digest of the file, if it has already been computed.
+    defer_embedding : bool, optional
+        Whether the embedded summary is returned as a concurrent.futures.Future (see meta_analyse).
+    
+    Returns:
+    --------
+    tuple
+        A tuple containing the number of tokens, summary, embedded summary, and hashtags.
+    """
+    if mime_type.startswith('text'):
+        return meta_analyse(file_path=file_path, defer_embedding=defer_embedding)
+    elif mime_type in CONVERTIBLE_MIME_TYPES:
+        converted_text = convert_document(file_path, mime_type, text_cache, digest)
+        return meta_analyse(converted_text=converted_text, defer_embedding=defer_embedding)
+    else:
+        return 0, "", [], []
+
+async def aanalyse_file(file_path: str, mime_type: str, text_cache: TextCache = None, digest: str = None,
+                        defer_embedding: bool = False):
+    """
+    Function: aanalyse_file
+    
+    Description:
+    ------------
+    Asynchronous version of analyse_file. Document conversion runs in a worker thread and the
+    model calls run on the event loop.
+    
+    Parameters:
+    ------------
+    file_path : str
+        The path to the file to analyse.
+    mime_type : str
+        The MIME type of the file.
+    text_cache : TextCache, optional
+        As for analyse_file.
+    digest : str, optional
+        As for analyse_file.
+    defer_embedding : bool, optional
+        As for analyse_file.
+    
+    Returns:
+    --------
+    tuple
+        A tuple containing the number of tokens, summary, embedded summary, and hashtags.
+    """
+    if mime_type.startswith('text'):
+        return await ameta_analyse(file_path=file_path, defer_embedding=defer_embedding)
+    elif mime_type in CONVERTIBLE_MIME_TYPES:
+        converted_text = await asyncio.to_thread(convert_document, file_path, mime_type, text_cache, digest)
+        return await ameta_analyse(converted_text=converted_text, defer_embedding=defer_embedding)
+    else:
+        return 0, "", [], []
+
+def _is_analysed(mime_type: str):
+    """
+    Whether files of this MIME type are sent for content analysis.
+    """
+    return mime_type.startswith('text') or mime_type in CONVERTIBLE_MIME_TYPES
+
+def _skip_analysis(job, journal):
+    """
+    Records in the crawl journal that a file is about to be analysed, and returns True if it should not
+    be because its analysis failed or was running when a walk died in each of the earlier attempts.
+    """
+    if journal is None or journal.file_started(job['path'], job['stat']):
+        return False
+    print(f"Skipping analysis of {job['path']}: it failed in {journal.max_attempts} walks")
+    return True
+
+def _analyse_job(job, mime_detector, analysis_cache=None, journal=None, text_cache=None):
+    """
+    Analysis stage of the crawl pipeline: turns a file job into a file record for the writer.
+    The analysis cache is consulted before any conversion or model call, and the text cache before
+    any conversion. The embedding of the summary is not waited for, so the record of an analysed file
+    is usually a Future the writer stage resolves.
+    """
+    # Debug: Log file being processed
+    if DEBUG:
+        print(f"Processing file: {job['path']}")
+
+    # Only get MIME type for new files
+    mime_type = job['mime_type'] = job['mime_type'] or mime_detector.detect(job['path'], job['stat'])
+
+    if _is_analysed(mime_type) and _skip_analysis(job, journal):
+        return _unanalysed_file_record(job, mime_type, 'skipped')
+    if not _is_analysed(mime_type):
+        return _file_record(job, mime_type, analyse_file(job['path'], mime_type))
+
+    metrics = get_metrics()
+    digest = key = None
+    with metrics.timer('file'), metrics.profile(job['path']):
+        if analysis_cache is not None:
+            digest = content_hash(job['path'])
+            key = analysis_cache.key(digest, analysis_fingerprint())
+            analysis = analysis_cache.get(key)
+            metrics.count('analysis_cache', result='miss' if analysis is None else 'hit')
+            if analysis is not None:
+                if DEBUG:
+                    print(f"Analysis cache hit: {job['path']}")
+                return _analysed_file_record(job, mime_type, analysis)
+        analysis = analyse_file(job['path'], mime_type, text_cache, digest, defer_embedding=True)
+    return _analysed_file_record(job, mime_type, analysis, key)
+
+async def _aanalyse_job(job, mime_detector, analysis_cache=None, journal=None, text_cache=None):
+    """
+    Asynchronous analysis stage of the crawl pipeline.
+    """
+    if DEBUG:
+        print(f"Processing file: {job['path']}")
+
+    mime_type = job['mime_type'] = (job['mime_type']
+                                    or await asyncio.to_thread(mime_detector.detect, job['path'], job['stat']))
+
+    if _is_analysed(mime_type) and await asyncio.to_thread(_skip_analysis, job, journal):
+        return _unanalysed_file_record(job, mime_type, 'skipped')
+    if not _is_analysed(mime_type):
+        return _file_record(job, mime_type, await aanalyse_file(job['path'], mime_type))
+
+    # Jobs interleave on the event loop, so they are timed but not profiled
+    metrics = get_metrics()
+    digest = key = None
+    with metrics.timer('file'):
+        if analysis_cache is not None:
+            digest = await asyncio.to_thread(content_hash, job['path'])
+            key = analysis_cache.key(digest, analysis_fingerprint())
+            analysis = await asyncio.to_thread(analysis_cache.get, key)
+            metrics.count('analysis_cache', result='miss' if analysis is None else 'hit')
+            if analysis is not None:
+                if DEBUG:
+                    print(f"Analysis cache hit: {job['path']}")
+                return _analysed_file_record(job, mime_type, analysis)
+        analysis = await aanalyse_file(job['path'], mime_type, text_cache, digest, defer_embedding=True)
+    return _analysed_file_record(job, mime_type, analysis, key)
+
+def _file_record(job, mime_type, analysis, analysis_status='analysed'):
+    """
+    Builds the writer record for an analysed file job.
+    """
+    num_tokens, summary, embedded_summary, hashtags = analysis
+    return ('file', dict(
+        job['properties'],
+        analysis_status=analysis_status,
+        file_id=job['file_id'],
+        dir_id=job['dir_id'],
+        path=job['path'],
+        mime_type=mime_type,
+        num_tokens=num_tokens,
+        summary=summary,
+        hashtags=hashtags,
+        embedded_summary=embedded_summary
+    ))
+
+def _analysed_file_record(job, mime_type, analysis, cache_key=None):
+    """
+    Builds the writer record for a file whose analysis succeeded. While the embedding of its summary is
+    a Future, the record is a Future as well, resolved once the embedding arrives. The writer stage
+    puts the analysis in the analysis cache under cache_key, if given, and clears the file in the crawl
+    journal; a file whose analysis or embedding raised stays in flight, so the journal skips it once it
+    keeps failing.
+    """
+    num_tokens, summary, embedded_summary, hashtags = analysis
+    if not isinstance(embedded_summary, Future):
+        return ('analysed_file', (_file_record(job, mime_type, analysis)[1], cache_key, analysis))
+
+    record = Future()
+
+    def embedded(future):
+        try:
+            analysis = (num_tokens, summary, future.result(), hashtags)
+            record.set_result(_analysed_file_record(job, mime_type, analysis, cache_key))
+        except Exception as e:
+            record.set_exception(e)
+
+    embedded_summary.add_done_callback(embedded)
+    return record
+
+def _failed_file_record(job, error):
+    """
+    Builds the writer record for a file job whose analysis raised, so the rest of the crawl goes on.
+    """
+    print(f"Warning: Could not analyse {job['path']}: {type(error).__name__}: {error}")
+    return _unanalysed_file_record(job, job['mime_type'], 'failed')
+
+def _unanalysed_file_record(job, mime_type, analysis_status):
+    """
+    Builds the writer record for a file job that is not analysed in this walk: 'pending' when it was
+    deferred by the scheduler, 'failed' when its analysis raised, 'skipped' when its analysis failed in
+    as many walks as the crawl journal allows. Its lastmodified is left empty, so the next walk treats
+    the file as changed. The record carries no analysis, so a file analysed by an earlier walk keeps its
+    summary, hashtags and embedding until then.
+    """
+    return ('unanalysed_file', dict(
+        job['properties'],
+        lastmodified=None,
+        analysis_status=analysis_status,
+        file_id=job['file_id'],
+        dir_id=job['dir_id'],
+        path=job['path'],
+        mime_type=mime_type
+    ))
+
+def _write_record(writer: GraphBatchWriter, record, embedding_store: EmbeddingStore = None,
+                  journal: CrawlJournal = None, analysis_cache: AnalysisCache = None):
+    """
+    Writer stage of the crawl pipeline: queues a record on the batch writer, stores the file's
+    embedding in the embedding store and analysis in the analysis cache, and reports progress to the
+    crawl journal, if there are any.
+    """
+    kind, payload = record
+    if kind == 'analysed_file':
+        payload, cache_key, analysis = payload
+        if cache_key is not None:
+            analysis_cache.put(cache_key, analysis)
+        if journal is not None:
+            journal.file_analysed(payload['path'])
+        kind = 'file'
+    if kind == 'directory':
+        writer.add_directory(**payload)
+    elif kind == 'directory_state':
+        dir_id, properties = payload
+        writer.update_directory(dir_id, **properties)
+    elif kind == 'touch':
+        writer.touch_file(*payload)
+    elif kind == 'listed':
+        journal.directory_listed(payload, writer)
+    elif kind == 'file':
+        writer.add_file(**payload)
+        get_metrics().count('files', status=payload['analysis_status'])
+        if embedding_store is not None:
+            embedding_store.put(payload['file_id'], payload['embedded_summary'], payload['path'])
+        if journal is not None:
+            journal.file_finished(os.path.dirname(payload['path']), writer)
+        if DEBUG:
+            print(f"File node queued: {payload['path']}")  # Debug: Log queued file
+    elif kind == 'unanalysed_file':
+        # The embedding store keeps the file's earlier embedding, like the graph
+        writer.add_unanalysed_file(**payload)
+        get_metrics().count('files', status=payload['analysis_status'])
+        if journal is not None:
+            journal.file_finished(os.path.dirname(payload['path']), writer)
+    else:
+        raise ValueError(f"Unknown record kind: {kind}")
+
+def _file_job(path, file_stats, file_id, dir_id, mime_type, current_walk_time):
+    """
+    Builds the analysis job for a new or changed file.
+    """
+    file = os.path.basename(path)
+    return {
+        'file_id': file_id,
+        'dir_id': dir_id,
+        'path': path,
+        'mime_type': mime_type,
+        'stat': file_stats,
+        'properties': {
+            'filename': file,
+            'filetype': os.path.splitext(file)[1],
+            'filesize': file_stats.st_size,
+            'fileowner': file_stats.st_uid,
+            'lastmodified': file_stats.st_mtime,
+            'lastchecked': current_walk_time,
+            'creationdate': file_stats.st_ctime
+        }
+    }
+
+def _crawl_pipeline(writer: GraphBatchWriter, mime_detector: MimeDetector, analysis_cache: AnalysisCache,
+                    workers: int, queue_size: int, async_analysis: bool, embedding_store: EmbeddingStore = None,
+                    journal: CrawlJournal = None, text_cache: TextCache = None):
+    """
+    Builds the pipeline that analyses file jobs and feeds the records to the writer.
+    """
+    return CrawlPipeline(
+        analyse=functools.partial(_aanalyse_job if async_analysis else _analyse_job,
+                                  mime_detector=mime_detector, analysis_cache=analysis_cache, journal=journal,
+                                  text_cache=text_cache),
+        write=lambda record: _write_record(writer, record, embedding_store, journal, analysis_cache),
+        workers=workers,
+        queue_size=queue_size,
+        on_error=_failed_file_record
+    )
+
+def walk_file_system(root_dir: str, fs_graph: StorageBackend, batch_size: int = 1000, flush_interval: float = 2.0,
+                     use_inode: bool = False, workers: int = 4, queue_size: int = None,
+                     async_analysis: bool = False, analysis_cache: AnalysisCache = None,
+                     mime_detector: MimeDetector = None, scanner: TreeScanner = None,
+                     prune_unchanged_dirs: bool = False, parent_dir_id: str = None, clean_up: bool = True,
+                     embedding_store: EmbeddingStore = None, journal: CrawlJournal = None,
+                     scheduler: AnalysisScheduler = None, text_cache: TextCache = None):
     """
     Function: walk_file_system
     
     Description:
     ------------
     Walks through the file system starting from root_dir and adds files and directories to the graph database.
+    The walk runs as a pipeline: this thread walks the tree with a TreeScanner, a pool of workers analyses new and changed
+    files, and a single writer thread feeds the results to a GraphBatchWriter, which sends them as UNWIND
+    batches. The state of previously crawled files is preloaded into a FileSnapshot so unchanged files are
+    detected without querying the graph. A file whose analysis raises is written with analysis_status
+    'failed' and no lastmodified, so the walk goes on and the next walk tries the file again; errors
+    writing to the graph still stop the walk.
     
     Parameters:
     ------------
     root_dir : str
         The root directory from which to start the file system traversal.
-    fs_graph : FileSystemGraph
-        An instance of FileSystemGraph to which the files and directories will be added.
+    fs_graph : StorageBackend
+        An instance of StorageBackend to which the files and directories will be added.
+    batch_size : int, optional
+        The maximum number of rows written per transaction. A batch_size of 1 writes every row immediately.
+    flush_interval : float, optional
+        The maximum number of seconds a buffered row waits before it is written.
+    use_inode : bool, optional
+        Whether node identifiers also include the device and inode numbers, not just the path.
+    workers : int, optional
+        The number of analysis worker threads, or the number of files analysed concurrently when
+        async_analysis is set.
+    queue_size : int, optional
+        The capacity of the pipeline queues. Defaults to four slots per worker.
+    async_analysis : bool, optional
+        Whether files are analysed on a single asyncio event loop instead of a pool of threads. Model
+        calls are throttled by the shared per-provider rate limiters in either mode.
+    analysis_cache : AnalysisCache, optional
+        A cache of previous analyses keyed by file content, consulted before any file is converted or
+        sent to a model.
+    mime_detector : MimeDetector, optional
+        Determines the MIME types of new files. A detector caching in memory only is used when not given.
+    scanner : TreeScanner, optional
+        Walks the tree, applying its ignore rules and size/extension filters. Files and directories it
+        skips are removed from the graph by the cleanup. Defaults to a scanner without rules or filters.
+    prune_unchanged_dirs : bool, optional
+        Whether directories whose mtime is the same as in the last walk are scanned from their entries
+        in the graph instead of being read again. Adding, removing or renaming an entry changes the mtime
+        of its directory, so every directory is decided on its own: subdirectories are still descended
+        into and files are still stat'ed and checked for changes. Only entries the last walk ignored or
+        filtered out are missed, for example a file that has grown past min_file_size in place; a walk
+        without pruning picks those up.
+    parent_dir_id : str, optional
+        The identifier of the directory containing root_dir, when a subtree of an already crawled tree
+        is walked. root_dir is linked to it and may be empty.
+    clean_up : bool, optional
+        Whether nodes that were not seen in this walk are removed afterwards. Must be off when only part
+        of a crawled tree is walked. The nodes stored below a directory that cannot be read are kept.
+    embedding_store : EmbeddingStore, optional
+        A local store the summary embeddings are written to as well. A store that has never been
+        backfilled first takes every embedding already in the graph. The cleanup removes the embeddings
+        of deleted files from it too, and compacts it once a quarter of its rows are tombstones.
+    journal : CrawlJournal, optional
+        Records the progress of the walk so it can be resumed if it dies: a resumed walk reuses the
+        interrupted walk's timestamp, skips the subtrees it finished and skips files whose analysis
+        failed, or was running when a walk died, in every earlier attempt. The cleanup only runs once a walk completes. Ignored when clean_up is off.
+    scheduler : AnalysisScheduler, optional
+        Orders the analysis of new and changed files by priority and enforces the run's token, request
+        and spend budgets; files over budget are written with analysis_status 'pending' and analysed
+        by a later walk. Analysis then starts once the tree has been walked, instead of during the walk.
+    text_cache : TextCache, optional
+        A cache of the text converted from documents, keyed by content. Documents are converted once,
+        even when a change of model or prompt invalidates the analysis cache.
     
     Returns:
     --------
@@ -44,105 +438,204 @@ def walk_file_system(root_dir: str, fs_graph: FileSystemGraph):
     if not os.path.exists(root_dir):
         print(f"Error: The specified root directory does not exist: {root_dir}")
         return
-    if not os.listdir(root_dir):
+    if parent_dir_id is None and not os.listdir(root_dir):
         print(f"Warning: The specified root directory is empty: {root_dir}")
         return
 
+    # Load lastmodified/size/MIME type of every known file below the root in one streaming query
+    metrics = get_metrics()
+    walk_start = time.perf_counter()
+    root_dir = os.path.abspath(root_dir)
+    if not clean_up:
+        journal = None
+    # A resumed walk keeps the timestamp of the interrupted one, so the nodes it wrote count as seen
+    current_walk_time = journal.begin(root_dir) if journal is not None else time.time()
+    root_dir_id = node_id(root_dir, os.stat(root_dir) if use_inode else None)
+    with metrics.timer('snapshot'):
+        snapshot = FileSnapshot.load(fs_graph, root_dir_id, directories=prune_unchanged_dirs)
+    if DEBUG:
+        print(f"Loaded snapshot of {len(snapshot)} known files")
+
+    if mime_detector is None:
+        mime_detector = MimeDetector()
+    if scanner is None:
+        scanner = TreeScanner()
+    if embedding_store is not None:
+        # Unchanged files are never put, so a new store first takes the embeddings already in the graph
+        backfilled = embedding_store.backfill((file_id, path, embedding) for file_id, path, _, _, _, embedding
+                                              in fs_graph.stream_embeddings())
+        if DEBUG and backfilled:
+            print(f"Backfilled {backfilled} embeddings from the graph")
+    # Modification times of directories that have been entered but not read completely yet
+    dir_mtimes = {}
+
+    with GraphBatchWriter(fs_graph, batch_size=batch_size, flush_interval=flush_interval) as writer:
+        pipeline = _crawl_pipeline(writer, mime_detector, analysis_cache, workers, queue_size, async_analysis,
+                                   embedding_store, journal, text_cache)
+        with pipeline:
+            # Identifiers of the directories seen so far, so children can look up their parent's ID
+            dir_ids = {root_dir: root_dir_id}
+
+            def directory_id(path, stat_result):
+                if path not in dir_ids:
+                    dir_ids[path] = node_id(path, stat_result if use_inode else None)
+                return dir_ids[path]
+
+            def known_listing(path, stat_result):
+                # Each directory is decided on its own; its files and subdirectories are still checked
+                return snapshot.known_listing(directory_id(path, stat_result), path, stat_result.st_mtime)
+
+            def skipped_subtree(path, stat_result):
+                return journal is not None and journal.is_done(path)
+
+            # File jobs held back for the scheduler until the walk is complete
+            scheduled_jobs = []
+
+            for event, path, value in scanner.scan(root_dir, prune=skipped_subtree,
+                                                   listing=known_listing if prune_unchanged_dirs else None):
+                if event == 'directory':
+                    dir_id = directory_id(path, value)
+                    if journal is not None:
+                        journal.directory_started(path)
+                    # Queue the directory node and the link to its parent ahead of its files
+                    pipeline.write(('directory', dict(
+                        dir_id=dir_id,
+                        parent_dir_id=parent_dir_id if path == root_dir else dir_ids[os.path.dirname(path)],
+                        dirname=os.path.basename(path),
+                        lastchecked=current_walk_time,
+                        path=path
+                    )))
+                    # Recorded once the directory has been read, for comparison in the next walk
+                    dir_mtimes[path] = value.st_mtime
+                    if DEBUG:
+                        print(f"Directory node queued: {path}")  # Debug: Log queued directory
+
+                elif event == 'listed':
+                    pipeline.write(('directory_state', (dir_ids[path], dict(
+                        dir_mtime=dir_mtimes.pop(path),
+                        child_count=value
+                    ))))
+                    if journal is not None:
+                        pipeline.write(('listed', path))
+
+                elif event == 'unreadable':
+                    # Its entries are unknown, so the nodes stored below it count as seen rather than
+                    # being removed by the cleanup, and the directory state is left for the next walk
+                    print(f"Warning: Could not read directory {path}, keeping its known contents: {value}")
+                    dir_mtimes.pop(path, None)
+                    for is_dir, stored_id, _ in fs_graph.subtree_nodes(dir_ids[path]):
+                        if not is_dir:
+                            pipeline.write(('touch', (stored_id, current_walk_time)))
+                        elif stored_id != dir_ids[path]:
+                            pipeline.write(('directory_state', (stored_id, dict(lastchecked=current_walk_time))))
+                    if journal is not None:
+                        pipeline.write(('listed', path))
+
+                elif event == 'pruned':
+                    # Finished by the interrupted walk, whose timestamp this walk reuses
+                    if DEBUG:
+                        print(f"Directory finished before the walk was resumed: {path}")
+
+                else:
+                    file_stats = value
+                    file_id = node_id(path, file_stats if use_inode else None)
+                    last_modified_time = file_stats.st_mtime
+
+                    # Check if the file has been modified since the last time it was processed
+                    if snapshot.is_unchanged(file_id, last_modified_time, file_stats.st_size):
+                        # File hasn't changed, just update lastchecked
+                        pipeline.write(('touch', (file_id, current_walk_time)))
+                        continue
+
+                    if journal is not None:
+                        journal.file_submitted(os.path.dirname(path))
+                    job = _file_job(path, file_stats, file_id, dir_ids[os.path.dirname(path)],
+                                    snapshot.mime_type(file_id), current_walk_time)
+                    if scheduler is None:
+                        pipeline.submit(job)
+                        continue
+                    # The scheduler needs the MIME type to estimate the cost
+                    job['mime_type'] = job['mime_type'] or mime_detector.detect(path, file_stats)
+                    scheduled_jobs.append(job)
+
+            if scheduler is not None:
+                admitted, deferred = scheduler.plan(scheduled_jobs, _is_analysed)
+                for job in deferred:
+                    pipeline.write(_unanalysed_file_record(job, job['mime_type'], 'pending'))
+                for job in admitted:
+                    pipeline.submit(job)
+
+    if analysis_cache is not None and DEBUG:
+        print(f"Analysis cache: {analysis_cache.stats()}")
+    if DEBUG:
+        print(f"MIME type cache: {mime_detector.stats()}")
+
+    # After walking (and flushing the writer), remove nodes that weren't checked in this walk
+    if clean_up:
+        with metrics.timer('cleanup'):
+            removed_files, removed_dirs, removed_hashtags = clean_up_file_system(current_walk_time, fs_graph, root_dir)
+            metrics.count('removed', removed_files, kind='file')
+            metrics.count('removed', removed_dirs, kind='directory')
+            metrics.count('removed', removed_hashtags, kind='hashtag')
+            if embedding_store is not None:
+                # Keep only the embeddings of files that are still in the graph
+                live_file_ids = (state[0] for state in fs_graph.stream_file_states(root_dir_id))
+                removed = embedding_store.retain(root_dir, live_file_ids)
+                embedding_store.compact(min_dead_fraction=0.25)
+                if DEBUG:
+                    print(f"Removed {removed} embeddings from the store: {embedding_store.stats()}")
+    if embedding_store is not None:
+        embedding_store.flush()
+    if journal is not None:
+        journal.finish()
+    metrics.observe('walk', time.perf_counter() - walk_start)
+
+def crawl_files(file_paths, fs_graph: StorageBackend, batch_size: int = 1000, flush_interval: float = 2.0,
+                use_inode: bool = False, workers: int = 4, queue_size: int = None, async_analysis: bool = False,
+                analysis_cache: AnalysisCache = None, mime_detector: MimeDetector = None,
+                embedding_store: EmbeddingStore = None, text_cache: TextCache = None):
+    """
+    Function: crawl_files
+    
+    Description:
+    ------------
+    Analyses individual files and adds them to the graph database through the same pipeline as
+    walk_file_system, without walking their directories or cleaning up. Used to apply incremental
+    changes; the directories containing the files must already be in the graph. Paths that no longer
+    exist or are not regular files are skipped.
+    
+    Parameters:
+    ------------
+    file_paths : list
+        The absolute paths of the new or changed files.
+    fs_graph : StorageBackend
+        An instance of StorageBackend to which the files will be added.
+    batch_size, flush_interval, use_inode, workers, queue_size, async_analysis, analysis_cache, mime_detector,
+    embedding_store, text_cache :
+        As for walk_file_system.
+    
+    Returns:
+    --------
+    None
+    """
     current_walk_time = time.time()
+    if mime_detector is None:
+        mime_detector = MimeDetector()
+
+    with GraphBatchWriter(fs_graph, batch_size=batch_size, flush_interval=flush_interval) as writer:
+        with _crawl_pipeline(writer, mime_detector, analysis_cache, workers, queue_size, async_analysis,
+                             embedding_store, text_cache=text_cache) as pipeline:
+            for path in file_paths:
+                try:
+                    file_stats = os.stat(path)
+                    dir_path = os.path.dirname(path)
+                    dir_id = node_id(dir_path, os.stat(dir_path) if use_inode else None)
+                except OSError:
+                    continue
+                if not stat.S_ISREG(file_stats.st_mode):
+                    continue
+                file_id = node_id(path, file_stats if use_inode else None)
+                pipeline.submit(_file_job(path, file_stats, file_id, dir_id, None, current_walk_time))
 
-    for root, dirs, files in os.walk(root_dir):
-        dir_id = hash(root)
-        
-        # Process directory
-        if root == root_dir:
-            parent_dir_id = None  # No parent for the root directory
-        else:
-            parent_dir_id = hash(os.path.dirname(root))
-
-        # Create or update the directory node
-        dir_result = fs_graph.create_or_update_directory_node(
-            dir_id=dir_id,
-            parent_dir_id=parent_dir_id,
-            dirname=os.path.basename(root),
-            lastchecked=current_walk_time
-        )
-        print(f"Directory node created/updated: {dir_result}")  # Debug: Log result of directory node creation
-
-        # Link directory to its parent (if it's not the root directory)
-        if parent_dir_id is not None:
-            fs_graph.link_directory_to_directory(dir_id, parent_dir_id)
-            print(f"Linked directory {dir_id} to parent {parent_dir_id}")  # Debug: Log linking of directories
-
-        # Iterate over files and create file nodes
-        for file in files:
-            file_path = os.path.join(root, file)
-            file_id = hash(file_path)
-            file_stats = os.stat(file_path)
-            last_modified_time = file_stats.st_mtime
-
-            # Initialize num_tokens and summary with default values
-            num_tokens = 0
-            summary = ""
-            embedded_summary = []
-            hashtags = []
-
-            # Check if the file has been modified since the last time it was processed
-            existing_file_node = fs_graph.get_file_node(file_id=file_id)
-            if existing_file_node and existing_file_node['lastmodified'] == last_modified_time:
-                # File hasn't changed, just update lastchecked
-                fs_graph.update_file_node(file_id, {'lastchecked': current_walk_time})
-                continue
-
-            # Debug: Log file being processed
-            if DEBUG:
-                print(f"Processing file: {file_path}")
-
-            # Only get MIME type for new files
-            mime_type = get_mime_type(file_path) if not existing_file_node else existing_file_node['mime_type']
-
-            if mime_type.startswith('text'):
-                num_tokens, summary, embedded_summary, hashtags = meta_analyse(file_path=file_path)
-            elif mime_type in [
-                'application/pdf',
-                'image/jpeg', 'image/png', 'image/bmp', 'image/tiff', 'image/heif',
-                'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                'application/vnd.openxmlformats-officedocument.presentationml.presentation',
-                'text/html'
-            ]:
-                converted_text = azure_doc_converter(file_path)
-                num_tokens, summary, embedded_summary, hashtags = meta_analyse(converted_text=converted_text)
-            else:
-                num_tokens, summary, embedded_summary, hashtags = 0, "", [], []
-
-            file_result = fs_graph.create_file_node(
-                file_id=hash(file_path),
-                dir_id=hash(root),
-                filename=file,
-                filetype=os.path.splitext(file)[1],
-                filesize=file_stats.st_size,
-                fileowner=file_stats.st_uid,
-                hashtags=hashtags,
-                lastmodified=last_modified_time,
-                lastchecked=current_walk_time,
-                creationdate=file_stats.st_ctime,
-                mime_type=mime_type,
-                num_tokens=num_tokens,
-                summary=summary,
-                embedded_summary=embedded_summary 
-            )
-            
-            if DEBUG:
-                print(f"File node created/updated: {file_result}")  # Debug: Log result of file node creation
-
-            # After creating the file node
-            if hashtags:
-                for hashtag in hashtags:
-                    fs_graph.create_hashtag_node(hashtag)
-                    fs_graph.link_file_to_hashtag(file_id, hashtag)
-
-            # Link file to its directory
-            fs_graph.link_file_to_directory(file_id=file_id, dir_id=dir_id)
-
-    # After walking, remove nodes that weren't checked in this walk
-    clean_up_file_system(current_walk_time, fs_graph)
+    if embedding_store is not None:
+        embedding_store.flush()
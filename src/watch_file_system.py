@@ -0,0 +1,532 @@
+"""
+Module: watch_file_system
+
+Description:
+------------
+This module keeps the graph up to date in a long-running process instead of re-walking the whole tree.
+After one initial walk, every directory below the root is watched with Linux inotify. Events are
+debounced and coalesced, then applied incrementally: new and modified files are analysed, deleted files
+and directories are removed, new directories are walked, and moved files and directories only have their
+identifiers, paths and parent relationships rewritten, without being analysed again. A reconciliation
+walk runs periodically, and whenever the kernel's event queue overflows, to catch anything that was
+missed. While nothing changes the process sleeps in select.
+
+Classes:
+--------
+- ChangeSet
+    Coalesces a burst of file system events.
+- FileSystemWatcher
+    Watches a crawled tree and applies its changes to the graph.
+
+Functions:
+----------
+- watch_file_system(root_dir: str, fs_graph: StorageBackend, **options) -> None
+    Crawls root_dir and then keeps the graph in sync with it until interrupted.
+"""
+
+import errno
+import os
+import select
+import time
+from storage_backend import StorageBackend
+from path_identity import node_id
+from tree_scanner import TreeScanner
+from walk_file_system import walk_file_system, crawl_files
+from linux_inotify import (Inotify, IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_MOVED_FROM, IN_MOVED_TO,
+                           IN_DELETE_SELF, IN_MOVE_SELF, IN_Q_OVERFLOW, IN_IGNORED, IN_ISDIR, IN_ONLYDIR,
+                           IN_DONT_FOLLOW, IN_EXCL_UNLINK)
+
+DEBUG = os.getenv('TEST', 'False').lower() in ('true', '1', 't')  # Read DEBUG from environment variable
+
+# Events that change what is stored in the graph. IN_CLOSE_WRITE rather than IN_MODIFY, so a file is
+# analysed once after it has been written instead of after every write.
+WATCH_MASK = (IN_CLOSE_WRITE | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF
+              | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+# Options of walk_file_system that crawl_files accepts too
+_CRAWL_FILES_OPTIONS = ('batch_size', 'flush_interval', 'use_inode', 'workers', 'queue_size', 'async_analysis',
+                        'analysis_cache', 'mime_detector', 'embedding_store', 'text_cache')
+
+
+def _is_within(path, directory):
+    """
+    Whether path is directory or lies below it.
+    """
+    return path == directory or path.startswith(directory + os.sep)
+
+
+def _rebase(path, old_dir, new_dir):
+    """
+    Moves path from below old_dir to the same place below new_dir, if it lies below old_dir.
+    """
+    if _is_within(path, old_dir):
+        return new_dir + path[len(old_dir):]
+    return path
+
+
+class ChangeSet:
+    """
+    A class coalescing a burst of file system events into the updates to apply.
+
+    Repeated events for the same path collapse into one update, files created or changed and then
+    deleted are dropped, and pending updates follow their paths when a file or directory is moved.
+    IN_MOVED_FROM/IN_MOVED_TO pairs are matched by cookie; a move whose other half never arrives is a
+    move out of the tree (a deletion) or into it (a creation).
+
+    Attributes:
+    ----------
+    moves : list
+        (old_path, new_path, is_dir) tuples, in the order the moves happened.
+    deleted : dict
+        Maps deleted paths to whether they were directories.
+    created_dirs : set
+        New directories, whose subtrees need walking.
+    changed_files : set
+        New or modified files, which need analysing.
+
+    Methods:
+    -------
+    file_changed(path):
+        Records a new or modified file.
+    directory_created(path):
+        Records a new directory.
+    removed(path, is_dir):
+        Records a deleted file or directory.
+    moved_from(cookie, path, is_dir):
+        Records the first half of a move.
+    moved_to(cookie, path, is_dir):
+        Records the second half of a move and returns the path moved from, or None.
+    finish():
+        Turns moves whose second half never arrived into deletions.
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty ChangeSet.
+        """
+        self.moves = []
+        self.deleted = {}
+        self.created_dirs = set()
+        self.changed_files = set()
+        self._pending_moves = {}
+
+    def __bool__(self):
+        return bool(self.moves or self.deleted or self.created_dirs or self.changed_files or self._pending_moves)
+
+    def file_changed(self, path):
+        self.changed_files.add(path)
+
+    def directory_created(self, path):
+        self.created_dirs.add(path)
+
+    def removed(self, path, is_dir):
+        # Nothing below a deleted path needs analysing any more
+        self.changed_files = {p for p in self.changed_files if not _is_within(p, path)}
+        self.created_dirs = {p for p in self.created_dirs if not _is_within(p, path)}
+        self.deleted[path] = is_dir
+
+    def moved_from(self, cookie, path, is_dir):
+        self._pending_moves[cookie] = (path, is_dir)
+
+    def moved_to(self, cookie, path, is_dir):
+        source = self._pending_moves.pop(cookie, None)
+        if source is None:
+            # Moved in from outside the tree
+            if is_dir:
+                self.directory_created(path)
+            else:
+                self.file_changed(path)
+            return None
+        old_path = source[0]
+        self.changed_files = {_rebase(p, old_path, path) for p in self.changed_files}
+        self.created_dirs = {_rebase(p, old_path, path) for p in self.created_dirs}
+        # The moved node replaces whatever was deleted at its destination
+        self.deleted.pop(path, None)
+        self.moves.append((old_path, path, is_dir))
+        return old_path
+
+    def finish(self):
+        """
+        Turns moves whose second half never arrived, i.e. moves out of the tree, into deletions.
+        """
+        for path, is_dir in self._pending_moves.values():
+            self.removed(path, is_dir)
+        self._pending_moves.clear()
+
+
+class FileSystemWatcher:
+    """
+    A class to keep the graph in sync with a crawled tree through inotify events.
+
+    Attributes:
+    ----------
+    root_dir : str
+        The absolute path of the watched tree.
+    fs_graph : StorageBackend
+        The graph the changes are applied to.
+    debounce : float
+        The number of seconds without new events after which a burst of events is applied.
+    max_delay : float
+        The maximum number of seconds an event waits before being applied during a continuous burst.
+    reconcile_interval : float
+        The number of seconds between reconciliation walks.
+    walk_options : dict
+        Keyword arguments for walk_file_system, also used for incremental updates.
+
+    Methods:
+    -------
+    run(stop_event=None):
+        Crawls the tree, then applies its changes until stop_event is set.
+    """
+
+    def __init__(self, root_dir, fs_graph, debounce=1.0, max_delay=10.0, reconcile_interval=3600.0, **walk_options):
+        """
+        Initializes the FileSystemWatcher.
+
+        Parameters:
+        ----------
+        root_dir : str
+            The root of the tree to watch.
+        fs_graph : StorageBackend
+            The graph the changes are applied to.
+        debounce : float, optional
+            The number of seconds without new events after which a burst of events is applied.
+        max_delay : float, optional
+            The maximum number of seconds an event waits before being applied during a continuous burst.
+        reconcile_interval : float, optional
+            The number of seconds between reconciliation walks.
+        **walk_options : dict
+            Keyword arguments for walk_file_system, such as scanner, use_inode or analysis_cache.
+        """
+        self.root_dir = os.path.abspath(root_dir)
+        self.fs_graph = fs_graph
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.reconcile_interval = reconcile_interval
+        self.walk_options = walk_options
+        self._scanner = walk_options.get('scanner') or TreeScanner()
+        self._use_inode = walk_options.get('use_inode', False)
+        self._embedding_store = walk_options.get('embedding_store')
+        self._inotify = None
+        # Watch descriptor to watched directory path, and the reverse
+        self._watches = {}
+        self._watched_paths = {}
+        self._reconcile_due = False
+        self._watch_limit_reported = False
+
+    def run(self, stop_event=None):
+        """
+        Crawls the tree, then waits for file system events and applies them until stop_event is set.
+
+        Parameters:
+        ----------
+        stop_event : threading.Event, optional
+            Stops the watcher when set; it is checked at least once a second. Without it the watcher
+            runs until interrupted.
+        """
+        with Inotify() as inotify:
+            self._inotify = inotify
+            # Watch before the initial walk so nothing that changes during it is missed
+            self._watch_tree(self.root_dir)
+            self._walk()
+
+            changes = ChangeSet()
+            first_event = last_event = None
+            while stop_event is None or not stop_event.is_set():
+                now = time.monotonic()
+                timeout = self._last_reconcile + self.reconcile_interval - now
+                if changes:
+                    timeout = min(timeout, last_event + self.debounce - now, first_event + self.max_delay - now)
+                if stop_event is not None:
+                    timeout = min(timeout, 1.0)
+
+                ready, _, _ = select.select([inotify], [], [], max(timeout, 0))
+                if ready:
+                    for event in inotify.read_events():
+                        self._handle_event(event, changes)
+                    last_event = time.monotonic()
+                    first_event = first_event or last_event
+
+                now = time.monotonic()
+                if changes and (now - last_event >= self.debounce or now - first_event >= self.max_delay):
+                    self._apply(changes)
+                    changes = ChangeSet()
+                    first_event = last_event = None
+                if self._reconcile_due or now - self._last_reconcile >= self.reconcile_interval:
+                    if changes:
+                        self._apply(changes)
+                        changes = ChangeSet()
+                        first_event = last_event = None
+                    if DEBUG:
+                        print("Reconciling the graph with a full walk")
+                    self._watch_tree(self.root_dir)
+                    self._walk()
+        self._inotify = None
+
+    def _walk(self):
+        """
+        Runs a full walk of the tree, including the cleanup of nodes that no longer exist.
+        """
+        walk_file_system(self.root_dir, self.fs_graph, **self.walk_options)
+        self._last_reconcile = time.monotonic()
+        self._reconcile_due = False
+
+    def _relative(self, path):
+        """
+        Returns path relative to the root with '/' separators, as the ignore rules expect.
+        """
+        return os.path.relpath(path, self.root_dir).replace(os.sep, '/')
+
+    def _watch_tree(self, path):
+        """
+        Adds watches for a directory and every directory below it that the scanner does not ignore.
+        """
+        for kind, dir_path, _ in self._scanner.scan(path, files=False):
+            if kind != 'directory':
+                continue
+            try:
+                wd = self._inotify.add_watch(dir_path, WATCH_MASK)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    if not self._watch_limit_reported:
+                        print("Out of inotify watches; raise fs.inotify.max_user_watches. "
+                              "Changes in unwatched directories are picked up by reconciliation walks.")
+                        self._watch_limit_reported = True
+                elif DEBUG:
+                    print(f"Cannot watch {dir_path}: {e}")
+                continue
+            self._watches[wd] = dir_path
+            self._watched_paths[dir_path] = wd
+
+    def _unwatch_tree(self, path):
+        """
+        Removes the watches for a directory and everything below it.
+        """
+        for dir_path in [p for p in self._watched_paths if _is_within(p, path)]:
+            wd = self._watched_paths.pop(dir_path)
+            self._watches.pop(wd, None)
+            try:
+                self._inotify.rm_watch(wd)
+            except OSError:
+                pass  # The kernel already dropped the watch
+
+    def _rebase_watches(self, old_path, new_path):
+        """
+        Updates the paths of the watches below a moved directory; the watches themselves stay valid.
+        """
+        for dir_path in [p for p in self._watched_paths if _is_within(p, old_path)]:
+            wd = self._watched_paths.pop(dir_path)
+            moved_path = _rebase(dir_path, old_path, new_path)
+            self._watches[wd] = moved_path
+            self._watched_paths[moved_path] = wd
+
+    def _handle_event(self, event, changes):
+        """
+        Records one inotify event in the change set.
+        """
+        if event.mask & IN_Q_OVERFLOW:
+            # Events were lost; only a full walk can tell what changed
+            self._reconcile_due = True
+            return
+        if event.mask & IN_IGNORED:
+            dir_path = self._watches.pop(event.wd, None)
+            if dir_path is not None and self._watched_paths.get(dir_path) == event.wd:
+                del self._watched_paths[dir_path]
+            return
+
+        dir_path = self._watches.get(event.wd)
+        if dir_path is None:
+            return
+        if event.mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            # The parent directory's watch reports these, except for the root itself
+            if dir_path == self.root_dir:
+                print(f"Warning: The watched root directory was moved or deleted: {self.root_dir}")
+                self._reconcile_due = True
+            return
+
+        path = os.path.join(dir_path, event.name)
+        is_dir = bool(event.mask & IN_ISDIR)
+        if not self._scanner.accepts(self._relative(path), is_dir):
+            return
+
+        if event.mask & IN_CREATE:
+            # New files are picked up by IN_CLOSE_WRITE once they have been written
+            if is_dir:
+                changes.directory_created(path)
+                self._watch_tree(path)
+        elif event.mask & IN_CLOSE_WRITE:
+            changes.file_changed(path)
+        elif event.mask & IN_DELETE:
+            changes.removed(path, is_dir)
+        elif event.mask & IN_MOVED_FROM:
+            changes.moved_from(event.cookie, path, is_dir)
+        elif event.mask & IN_MOVED_TO:
+            old_path = changes.moved_to(event.cookie, path, is_dir)
+            if is_dir:
+                if old_path is not None:
+                    self._rebase_watches(old_path, path)
+                else:
+                    self._watch_tree(path)
+
+    def _id(self, path):
+        """
+        Returns the node identifier of an existing path.
+        """
+        return node_id(path, os.stat(path) if self._use_inode else None)
+
+    def _apply(self, changes):
+        """
+        Applies a coalesced change set to the graph.
+        """
+        changes.finish()
+        if DEBUG:
+            print(f"Applying {len(changes.moves)} moves, {len(changes.deleted)} deletions, "
+                  f"{len(changes.created_dirs)} new directories and {len(changes.changed_files)} changed files")
+
+        for old_path, new_path, is_dir in changes.moves:
+            try:
+                self._move(old_path, new_path, is_dir)
+            except OSError:
+                # The destination changed again before it could be read; remove it and crawl it afresh
+                changes.deleted[old_path] = is_dir
+                if os.path.isdir(new_path):
+                    changes.created_dirs.add(new_path)
+                elif os.path.exists(new_path):
+                    changes.changed_files.add(new_path)
+
+        for path, is_dir in changes.deleted.items():
+            # Deleted paths cannot be stat'ed, so they are removed by path rather than by identifier
+            if is_dir:
+                self._unwatch_tree(path)
+            self.fs_graph.remove_subtree(path)
+            if self._embedding_store is not None:
+                self._embedding_store.remove_subtree(path)
+        if changes.deleted:
+            self.fs_graph.cleanup_orphaned_hashtags()
+
+        # Walk new directories, skipping those below another new directory
+        created_dirs = sorted(changes.created_dirs)
+        for index, path in enumerate(created_dirs):
+            if any(_is_within(path, other) for other in created_dirs[:index]) or not os.path.isdir(path):
+                continue
+            try:
+                parent_dir_id = self._id(os.path.dirname(path))
+            except OSError:
+                continue
+            walk_file_system(path, self.fs_graph, parent_dir_id=parent_dir_id, clean_up=False, **self.walk_options)
+
+        changed_files = [path for path in changes.changed_files
+                         if not any(_is_within(path, directory) for directory in created_dirs)]
+        if changed_files:
+            options = {name: value for name, value in self.walk_options.items() if name in _CRAWL_FILES_OPTIONS}
+            crawl_files(changed_files, self.fs_graph, **options)
+        elif self._embedding_store is not None:
+            self._embedding_store.flush()
+
+    def _move(self, old_path, new_path, is_dir):
+        """
+        Rewrites the identifiers, paths and parent relationship of a moved file or directory.
+        """
+        new_parent_id = self._id(os.path.dirname(new_path))
+        new_id = self._id(new_path)
+        # With inode identity the moved node kept its inode, so its old identifier uses the same stat
+        old_id = node_id(old_path, os.stat(new_path) if self._use_inode else None)
+
+        if not is_dir:
+            if new_id != old_id:
+                self.fs_graph.remove_file(new_id)  # An overwritten destination
+            self.fs_graph.relocate_files([{
+                'old_id': old_id,
+                'file_id': new_id,
+                'dir_id': new_parent_id,
+                'filename': os.path.basename(new_path),
+                'filetype': os.path.splitext(new_path)[1],
+                'path': new_path,
+            }])
+            self.fs_graph.reparent_file(new_id, new_parent_id)
+            if self._embedding_store is not None:
+                self._embedding_store.rename(old_id, new_id, new_path)
+            return
+
+        if new_id != old_id:
+            self.fs_graph.remove_subtree(new_path)  # An empty directory that was replaced
+            if self._embedding_store is not None:
+                self._embedding_store.remove_subtree(new_path)
+        dir_rows = []
+        file_rows = []
+        new_dir_ids = {}
+        # Parents before children, so each row can look up the new identifier of its parent
+        nodes = sorted(self.fs_graph.subtree_nodes(old_id), key=lambda node: (not node[0], (node[2] or '').count(os.sep)))
+        for node_is_dir, node_old_id, path in nodes:
+            if path is None or not _is_within(path, old_path):
+                continue
+            moved_path = _rebase(path, old_path, new_path)
+            moved_id = self._id(moved_path)
+            parent_id = new_dir_ids.get(os.path.dirname(moved_path), new_parent_id)
+            if node_is_dir:
+                new_dir_ids[moved_path] = moved_id
+                dir_rows.append({
+                    'old_id': node_old_id,
+                    'dir_id': moved_id,
+                    'parent_dir_id': parent_id,
+                    'dirname': os.path.basename(moved_path),
+                    'path': moved_path,
+                })
+            else:
+                file_rows.append({
+                    'old_id': node_old_id,
+                    'file_id': moved_id,
+                    'dir_id': parent_id,
+                    'filename': os.path.basename(moved_path),
+                    'filetype': os.path.splitext(moved_path)[1],
+                    'path': moved_path,
+                })
+
+        batch_size = self.walk_options.get('batch_size', 1000)
+        for start in range(0, len(dir_rows), batch_size):
+            self.fs_graph.relocate_directories(dir_rows[start:start + batch_size])
+        for start in range(0, len(file_rows), batch_size):
+            self.fs_graph.relocate_files(file_rows[start:start + batch_size])
+        self.fs_graph.reparent_directory(new_id, new_parent_id)
+        if self._embedding_store is not None:
+            for row in file_rows:
+                self._embedding_store.rename(row['old_id'], row['file_id'], row['path'])
+
+
+def watch_file_system(root_dir: str, fs_graph: StorageBackend, debounce: float = 1.0, max_delay: float = 10.0,
+                      reconcile_interval: float = 3600.0, stop_event=None, **walk_options):
+    """
+    Function: watch_file_system
+
+    Description:
+    ------------
+    Crawls root_dir with walk_file_system and then keeps the graph in sync with it through inotify
+    events until stop_event is set or the process is interrupted. Only available on Linux.
+
+    Parameters:
+    -----------
+    root_dir : str
+        The root directory to crawl and watch.
+    fs_graph : StorageBackend
+        An instance of StorageBackend to which the changes will be applied.
+    debounce : float, optional
+        The number of seconds without new events after which a burst of events is applied.
+    max_delay : float, optional
+        The maximum number of seconds an event waits before being applied during a continuous burst.
+    reconcile_interval : float, optional
+        The number of seconds between full reconciliation walks.
+    stop_event : threading.Event, optional
+        Stops the watcher when set.
+    **walk_options : dict
+        Keyword arguments for walk_file_system.
+
+    Returns:
+    --------
+    None
+    """
+    watcher = FileSystemWatcher(root_dir, fs_graph, debounce=debounce, max_delay=max_delay,
+                                reconcile_interval=reconcile_interval, **walk_options)
+    try:
+        watcher.run(stop_event)
+    except KeyboardInterrupt:
+        print("Stopped watching")
@@ -3,8 +3,14 @@ Module: wipe_database
 
 Description:
 ------------
-This script wipes the entire database by deleting all nodes and relationships.
+This script wipes the entire database by deleting all nodes and relationships, in the storage backend
+configured by STORAGE_BACKEND.
 """
+from dotenv import load_dotenv
+from storage_backend import open_storage_backend
+
+load_dotenv(".env")
+
 def main():
     """
     Function: main
@@ -22,10 +28,7 @@ def main():
     None
     """
     try:
-        uri = "bolt://localhost:7687"
-        username = "neo4j"
-        password = "abcd1234"
-        fs_graph = FileSystemGraph(uri, username, password)
+        fs_graph = open_storage_backend(ensure_schema=False)
 
         fs_graph.wipe_database()
         print("Database wiped successfully.")
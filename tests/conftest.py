@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The crawler's modules live flat in src/ and are imported as top-level modules
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+sys.path.insert(0, ROOT_DIR)
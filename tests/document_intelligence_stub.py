@@ -0,0 +1,255 @@
+"""
+Module: document_intelligence_stub
+
+Description:
+------------
+This module serves the analyze and poll endpoints of Azure AI Document Intelligence on a local port, so
+DocumentConversionService can be tested, and benchmarked, without network access or an Azure resource.
+
+A document is split into pages of bytes_per_page bytes. Each page converts to a line starting with
+'Page <number>:' followed by words derived from a hash of the page, roughly one word per 20 bytes, so the
+text of page ranges can be compared with the text of the whole document. An operation reports 'running'
+until its latency has passed. The stub can also throttle the first analyze requests with 429, answer
+the first analyze requests or polls with 503, and fail every operation, and it records what it was
+asked for.
+
+Classes:
+--------
+- StubDocumentIntelligence
+    A local HTTP server mimicking the analyze and poll endpoints.
+"""
+
+import hashlib
+import http.server
+import json
+import math
+import random
+import socket
+import threading
+import time
+import urllib.parse
+
+# Words the converted pages are made of
+WORDS = [
+    'report', 'budget', 'contract', 'meeting', 'project', 'invoice', 'policy', 'schedule', 'design', 'review',
+    'customer', 'supplier', 'quarter', 'summary', 'analysis', 'risk', 'plan', 'team', 'release', 'minutes',
+]
+
+
+class StubDocumentIntelligence:
+    """
+    A class serving the analyze and poll endpoints of Azure AI Document Intelligence locally.
+
+    Attributes:
+    ----------
+    latency : float
+        The seconds every operation takes.
+    latency_per_page : float
+        The seconds every analysed page adds to an operation.
+    bytes_per_page : int
+        The number of bytes of a document per page.
+    throttle : int
+        The number of analyze requests answered with 429 before any is accepted.
+    analyze_errors : int
+        The number of analyze requests answered with 503 after starting their operation anyway.
+    poll_errors : int
+        The number of polls answered with 503.
+    fail : bool
+        Whether every operation ends with the status 'failed'.
+    endpoint : str
+        The base URL of the stub, once started.
+    requests : int
+        The number of analyze requests received, throttled ones included.
+    page_ranges : list
+        The 'pages' parameter of every accepted analyze request, or None where there was none.
+    output_formats : list
+        The 'outputContentFormat' parameter of every accepted analyze request, or None where there was none.
+    polls : int
+        The number of polls received, failed ones included.
+    running : int
+        The number of operations accepted and not yet reported as finished.
+    max_running : int
+        The largest number of operations running at once.
+
+    Methods:
+    -------
+    start():
+        Starts serving on a free local port and returns the endpoint.
+    close():
+        Stops serving.
+    """
+
+    def __init__(self, latency=0.0, latency_per_page=0.0, bytes_per_page=3000, throttle=0, analyze_errors=0,
+                 poll_errors=0, fail=False):
+        """
+        Initializes the StubDocumentIntelligence.
+
+        Parameters:
+        ----------
+        latency : float, optional
+            The seconds every operation takes.
+        latency_per_page : float, optional
+            The seconds every analysed page adds to an operation.
+        bytes_per_page : int, optional
+            The number of bytes of a document per page.
+        throttle : int, optional
+            The number of analyze requests answered with 429 before any is accepted.
+        analyze_errors : int, optional
+            The number of analyze requests answered with 503 after starting their operation anyway.
+        poll_errors : int, optional
+            The number of polls answered with 503.
+        fail : bool, optional
+            Whether every operation ends with the status 'failed'.
+        """
+        self.latency = latency
+        self.latency_per_page = latency_per_page
+        self.bytes_per_page = bytes_per_page
+        self.throttle = throttle
+        self.analyze_errors = analyze_errors
+        self.poll_errors = poll_errors
+        self.fail = fail
+        self.endpoint = None
+        self.requests = 0
+        self.page_ranges = []
+        self.output_formats = []
+        self.polls = 0
+        self.running = 0
+        self.max_running = 0
+        self._operations = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _page_text(self, data, number):
+        """
+        Returns the converted text of one page of a document.
+        """
+        page = data[(number - 1) * self.bytes_per_page:number * self.bytes_per_page]
+        rng = random.Random(hashlib.blake2b(page, digest_size=16).digest())
+        return f"Page {number}: " + ' '.join(rng.choice(WORDS) for _ in range(len(page) // 20 + 1))
+
+    def _analyse(self, data, pages, output_format):
+        """
+        Registers an analyze operation and returns its identifier, or None if the request is throttled.
+        """
+        page_count = max(math.ceil(len(data) / self.bytes_per_page), 1)
+        selected = set()
+        for part in (pages or f"1-{page_count}").split(','):
+            first, _, last = part.partition('-')
+            selected.update(range(int(first), min(int(last or first), page_count) + 1))
+        content = '\n'.join(self._page_text(data, number) for number in sorted(selected))
+        ready = time.monotonic() + self.latency + self.latency_per_page * len(selected)
+        with self._lock:
+            self.requests += 1
+            if self.requests <= self.throttle:
+                return None
+            self.page_ranges.append(pages)
+            self.output_formats.append(output_format)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            operation_id = f"{self.requests:08d}"
+            self._operations[operation_id] = (ready, content)
+        return operation_id
+
+    def _poll(self, operation_id):
+        """
+        Returns the result body of an operation, None if there is no such operation, or False if the poll
+        fails.
+        """
+        with self._lock:
+            self.polls += 1
+            if self.polls <= self.poll_errors:
+                return False
+            operation = self._operations.get(operation_id)
+        if operation is None:
+            return None
+        ready, content = operation
+        if time.monotonic() < ready:
+            return {'status': 'running'}
+        with self._lock:
+            if self._operations.pop(operation_id, None) is not None:
+                self.running -= 1
+        if self.fail:
+            return {'status': 'failed', 'error': {'code': 'InvalidContent', 'message': 'The document is corrupted.'}}
+        return {'status': 'succeeded', 'analyzeResult': {'content': content}}
+
+    def start(self):
+        """
+        Starts serving on a free local port.
+
+        Returns:
+        -------
+        str
+            The endpoint to point the conversion service at.
+        """
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                # Replies are small; without this every poll would wait for a delayed ACK
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def _reply(self, status, body=b'', headers=()):
+                lines = [f"{self.protocol_version} {status} {self.responses[status][0]}"]
+                lines.extend(f"{name}: {value}" for name, value in headers)
+                lines.append(f"Content-Length: {len(body)}")
+                # Headers and body go out in one write
+                self.wfile.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+                self.log_request(status)
+
+            def do_POST(self):
+                url = urllib.parse.urlsplit(self.path)
+                data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if not url.path.endswith(':analyze'):
+                    self._reply(404)
+                    return
+                query = urllib.parse.parse_qs(url.query)
+                operation_id = stub._analyse(data, query.get('pages', [None])[0],
+                                             query.get('outputContentFormat', [None])[0])
+                if operation_id is None:
+                    self._reply(429, headers=[('Retry-After', '0')])
+                    return
+                with stub._lock:
+                    failed = len(stub.page_ranges) <= stub.analyze_errors
+                if failed:
+                    self._reply(503, headers=[('Retry-After', '0')])
+                    return
+                model_path = url.path[:-len(':analyze')]
+                self._reply(202, headers=[('Operation-Location',
+                                           f"{stub.endpoint}{model_path}/analyzeResults/{operation_id}?{url.query}")])
+
+            def do_GET(self):
+                result = stub._poll(urllib.parse.urlsplit(self.path).path.rsplit('/', 1)[-1])
+                if result is False:
+                    self._reply(503, headers=[('Retry-After', '0')])
+                elif result is None:
+                    self._reply(404)
+                else:
+                    self._reply(200, json.dumps(result).encode('utf-8'), [('Content-Type', 'application/json')])
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self.endpoint = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.05}, name='stub-document-intelligence',
+                         daemon=True).start()
+        return self.endpoint
+
+    def close(self):
+        """
+        Stops serving.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
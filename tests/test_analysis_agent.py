@@ -0,0 +1,87 @@
+import asyncio
+import json
+
+import pytest
+
+import analysis_agent
+import meta_analyse
+from analysis_agent import parse_analysis
+
+
+class ScriptedChain:
+    """
+    Replies to each call with the next of a list of raw model responses.
+    """
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = 0
+
+    def invoke(self, inputs):
+        self.calls += 1
+        return self.replies.pop(0)
+
+    async def ainvoke(self, inputs):
+        return self.invoke(inputs)
+
+
+@pytest.fixture
+def chain(monkeypatch):
+    """
+    Replaces the combined and the separate model calls; set chain.replies before use.
+    """
+    chain = ScriptedChain([])
+    monkeypatch.setattr(analysis_agent, '_analysis_chain', lambda: chain)
+    monkeypatch.setattr(analysis_agent, 'summarise_agent', lambda text, num_tokens=None: 'Separate summary.')
+    monkeypatch.setattr(analysis_agent, 'hashtag_agent', lambda text, num_tokens=None: ['separate'])
+
+    async def asummarise_agent(text, num_tokens=None):
+        return 'Separate summary.'
+
+    async def ahashtag_agent(text, num_tokens=None):
+        return ['separate']
+
+    monkeypatch.setattr(analysis_agent, 'asummarise_agent', asummarise_agent)
+    monkeypatch.setattr(analysis_agent, 'ahashtag_agent', ahashtag_agent)
+    return chain
+
+
+def _reply(summary='A budget.', hashtags=('Budget', '#finance')):
+    return json.dumps({'summary': summary, 'hashtags': list(hashtags)})
+
+
+def test_parse_analysis_normalises_hashtags():
+    summary, hashtags = parse_analysis(_reply(summary='  A budget.  '))
+    assert summary == 'A budget.'
+    assert all(not hashtag.startswith('##') for hashtag in hashtags)
+    assert len(hashtags) == 2
+
+
+@pytest.mark.parametrize('raw', ['not JSON', '["a list"]', json.dumps({'summary': ' ', 'hashtags': []}),
+                                 json.dumps({'summary': 'A budget.', 'hashtags': 'budget'})])
+def test_parse_analysis_rejects_malformed_replies(raw):
+    with pytest.raises(ValueError):
+        parse_analysis(raw)
+
+
+@pytest.mark.parametrize('run', [analysis_agent.analysis_agent,
+                                 lambda text: asyncio.run(analysis_agent.aanalysis_agent(text))])
+def test_malformed_reply_is_retried_once(chain, run):
+    chain.replies = ['not JSON', _reply()]
+    assert run('A document.')[0] == 'A budget.'
+    assert chain.calls == 2
+
+
+@pytest.mark.parametrize('run', [analysis_agent.analysis_agent,
+                                 lambda text: asyncio.run(analysis_agent.aanalysis_agent(text))])
+def test_second_malformed_reply_falls_back_to_separate_calls(chain, run):
+    chain.replies = ['not JSON', json.dumps({'summary': '', 'hashtags': []})]
+    assert run('A document.') == ('Separate summary.', ['separate'])
+    assert chain.calls == 2
+
+
+@pytest.mark.parametrize('text', ['', ' \n\t\n '])
+def test_empty_content_is_not_sent_to_a_model(chain, text):
+    assert meta_analyse.meta_analyse(converted_text=text)[1:] == ("", [], [])
+    assert asyncio.run(meta_analyse.ameta_analyse(converted_text=text))[1:] == ("", [], [])
+    assert chain.calls == 0
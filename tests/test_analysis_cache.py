@@ -0,0 +1,66 @@
+import itertools
+
+import pytest
+
+import analysis_cache
+from analysis_cache import AnalysisCache, content_hash
+
+ANALYSIS = (120, "A quarterly budget report.", [0.25, -0.5, 1.0], ['budget', 'report'])
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Makes every cache access one second later than the last, so LRU order does not depend on timer
+    resolution.
+    """
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(analysis_cache.time, 'time', lambda: float(next(ticks)))
+
+
+def test_content_hash_ignores_name_and_location(tmp_path):
+    first = tmp_path / 'report.txt'
+    second = tmp_path / 'copy' / 'renamed.txt'
+    second.parent.mkdir()
+    first.write_bytes(b'same content')
+    second.write_bytes(b'same content')
+    assert content_hash(str(first)) == content_hash(str(second))
+    second.write_bytes(b'other content')
+    assert content_hash(str(first)) != content_hash(str(second))
+
+
+def test_analysis_round_trip_and_persistence(tmp_path):
+    path = str(tmp_path / 'analysis.db')
+    key = AnalysisCache.key('digest', 'gpt-4o/v1')
+    with AnalysisCache(path) as cache:
+        assert cache.get(key) is None
+        cache.put(key, ANALYSIS)
+        assert cache.get(key) == ANALYSIS
+    with AnalysisCache(path) as cache:
+        assert cache.get(key) == ANALYSIS
+        assert cache.stats()['entries'] == 1
+
+
+def test_analysis_key_depends_on_fingerprint(tmp_path):
+    with AnalysisCache(str(tmp_path / 'analysis.db')) as cache:
+        cache.put(AnalysisCache.key('digest', 'gpt-4o/v1'), ANALYSIS)
+        assert cache.get(AnalysisCache.key('digest', 'gpt-4o/v2')) is None
+        assert cache.stats()['hits'] == 0
+        assert cache.stats()['misses'] == 1
+
+
+def test_analysis_evicts_least_recently_used(tmp_path, clock):
+    with AnalysisCache(str(tmp_path / 'analysis.db'), max_bytes=10 ** 6) as cache:
+        keys = [AnalysisCache.key(str(index), 'v1') for index in range(3)]
+        cache.put(keys[0], ANALYSIS)
+        cache.put(keys[1], ANALYSIS)
+        entry_bytes = cache.stats()['bytes'] // 2
+        # Room for two entries after eviction, which stops at 90% of the limit
+        cache.max_bytes = int(entry_bytes * 2.3)
+        cache.get(keys[0])
+        cache.put(keys[2], ANALYSIS)
+        assert cache.get(keys[1]) is None
+        assert cache.get(keys[0]) == ANALYSIS
+        assert cache.get(keys[2]) == ANALYSIS
+        assert cache.stats()['evictions'] == 1
+        assert cache.stats()['bytes'] <= cache.max_bytes
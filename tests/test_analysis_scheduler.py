@@ -0,0 +1,80 @@
+from types import SimpleNamespace
+
+import pytest
+
+from analysis_scheduler import AnalysisScheduler, PRICES
+from map_reduce_summarise import MAX_TOTAL_TOKENS
+from meta_analyse import MAX_SINGLE_PASS_TOKENS
+
+
+def _job(path, size, mtime, mime_type='text/plain'):
+    return {'path': path, 'stat': SimpleNamespace(st_size=size, st_mtime=mtime), 'mime_type': mime_type}
+
+
+def _analysed(mime_type):
+    return mime_type != 'application/octet-stream'
+
+
+def _paths(jobs):
+    return [job['path'] for job in jobs]
+
+
+def test_estimate_grows_with_size_and_conversion():
+    scheduler = AnalysisScheduler()
+    small = scheduler.estimate(4000, 'text/plain')
+    large = scheduler.estimate(MAX_SINGLE_PASS_TOKENS * 8, 'text/plain')
+    assert small.tokens < large.tokens
+    assert small.requests < large.requests
+    assert small.spend < large.spend
+    # Converted documents pay for their pages as well
+    pdf = scheduler.estimate(20000, 'application/pdf')
+    text = scheduler.estimate(20000 // 20 * 4, 'text/plain')
+    assert pdf.spend == pytest.approx(text.spend + 2 * PRICES['page'])
+    # The tokens read from one document are capped
+    assert scheduler.estimate(10 ** 12, 'text/plain') == scheduler.estimate(MAX_TOTAL_TOKENS * 8, 'text/plain')
+
+
+def test_unlimited_plan_admits_everything_in_priority_order():
+    jobs = [_job('/data/old.txt', 100, 1.0), _job('/data/new.txt', 100, 3.0), _job('/data/mid.txt', 100, 2.0)]
+    admitted, deferred = AnalysisScheduler(order=('recent',)).plan(jobs, _analysed)
+    assert _paths(admitted) == ['/data/new.txt', '/data/mid.txt', '/data/old.txt']
+    assert deferred == []
+    admitted, _ = AnalysisScheduler(order=('smallest', 'oldest')).plan(
+        jobs + [_job('/data/tiny.txt', 10, 5.0)], _analysed)
+    assert _paths(admitted) == ['/data/tiny.txt', '/data/old.txt', '/data/mid.txt', '/data/new.txt']
+
+
+def test_subtrees_come_first(tmp_path):
+    jobs = [_job(f"{tmp_path}/a/1.txt", 100, 3.0), _job(f"{tmp_path}/b/1.txt", 100, 1.0),
+            _job(f"{tmp_path}/c/1.txt", 100, 2.0)]
+    scheduler = AnalysisScheduler(order=('subtrees', 'recent'), subtrees=[f"{tmp_path}/c", f"{tmp_path}/b"])
+    admitted, _ = scheduler.plan(jobs, _analysed)
+    assert _paths(admitted) == [f"{tmp_path}/c/1.txt", f"{tmp_path}/b/1.txt", f"{tmp_path}/a/1.txt"]
+
+
+@pytest.mark.parametrize('budget', ['max_tokens', 'max_requests', 'max_spend'])
+def test_jobs_beyond_a_budget_are_deferred(budget):
+    jobs = [_job(f"/data/{index}.txt", 4000, float(-index)) for index in range(5)]
+    cost = AnalysisScheduler().estimate(4000, 'text/plain')
+    limit = {'max_tokens': cost.tokens, 'max_requests': cost.requests, 'max_spend': cost.spend}[budget] * 3
+    scheduler = AnalysisScheduler(order=('recent',), **{budget: limit})
+    admitted, deferred = scheduler.plan(jobs, _analysed)
+    assert _paths(admitted) == ['/data/0.txt', '/data/1.txt', '/data/2.txt']
+    assert _paths(deferred) == ['/data/3.txt', '/data/4.txt']
+    assert scheduler.used.requests == cost.requests * 3
+
+
+def test_smaller_jobs_use_budget_a_large_job_cannot():
+    jobs = [_job('/data/large.txt', 4 * 10 ** 6, 3.0), _job('/data/small.txt', 4000, 2.0),
+            _job('/data/blob.bin', 10 ** 9, 1.0, 'application/octet-stream')]
+    scheduler = AnalysisScheduler(max_tokens=AnalysisScheduler().estimate(4000, 'text/plain').tokens,
+                                  order=('recent',))
+    admitted, deferred = scheduler.plan(jobs, _analysed)
+    # Files that are not analysed cost nothing
+    assert _paths(admitted) == ['/data/small.txt', '/data/blob.bin']
+    assert _paths(deferred) == ['/data/large.txt']
+
+
+def test_unknown_priority_is_rejected():
+    with pytest.raises(ValueError):
+        AnalysisScheduler(order=('largest', 'alphabetical'))
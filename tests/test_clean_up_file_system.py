@@ -0,0 +1,98 @@
+import os
+import shutil
+
+import pytest
+
+import walk_file_system
+from clean_up_file_system import clean_up_file_system
+from path_identity import node_id
+from sqlite_graph import SQLiteGraph
+from walk_file_system import walk_file_system as walk
+
+
+class PlainTextDetector:
+    """
+    Detects every file as plain text, without libmagic.
+    """
+
+    def detect(self, path, stat_result=None):
+        return 'text/plain'
+
+    def stats(self):
+        return {}
+
+
+@pytest.fixture(autouse=True)
+def analysed(monkeypatch):
+    """
+    Replaces the model calls with a fake analysis tagging every file with its own name.
+    """
+    def analyse_file(file_path, mime_type, text_cache=None, digest=None, defer_embedding=False):
+        return 3, 'A summary.', [1.0, 0.0], [os.path.splitext(os.path.basename(file_path))[0]]
+
+    monkeypatch.setattr(walk_file_system, 'analyse_file', analyse_file)
+
+
+@pytest.fixture
+def graph(tmp_path):
+    graph = SQLiteGraph(str(tmp_path / 'graph.db'))
+    yield graph
+    graph.close()
+
+
+@pytest.fixture
+def roots(tmp_path):
+    """
+    Two crawled roots whose paths share a prefix: data/ with a.txt, sub/b.txt and old/c.txt, and
+    data2/ with d.txt.
+    """
+    data = tmp_path / 'data'
+    (data / 'sub').mkdir(parents=True)
+    (data / 'old').mkdir()
+    (tmp_path / 'data2').mkdir()
+    for path in (data / 'a.txt', data / 'sub' / 'b.txt', data / 'old' / 'c.txt', tmp_path / 'data2' / 'd.txt'):
+        path.write_text(f"The content of {path.name}.")
+    return data, tmp_path / 'data2'
+
+
+def _walk(root, graph):
+    walk(str(root), graph, mime_detector=PlainTextDetector())
+
+
+def test_only_nodes_missing_from_the_crawled_root_are_removed(graph, roots, capsys):
+    data, data2 = roots
+    _walk(data, graph)
+    _walk(data2, graph)
+    count = graph.count_nodes()
+    os.remove(data / 'sub' / 'b.txt')
+    shutil.rmtree(data / 'old')
+    _walk(data, graph)
+    assert 'Removed 2 files, 1 directories, and 2 orphaned hashtags' in capsys.readouterr().out
+    assert graph.count_nodes() == count - 5
+    assert sorted(path for _, _, path in graph.subtree_nodes(node_id(str(data)))) == \
+        [str(data), str(data / 'a.txt'), str(data / 'sub')]
+    # data2 shares the prefix of data's path but is not below it
+    assert graph.get_file_node(node_id(str(data2 / 'd.txt'))) is not None
+    assert graph.get_file_node(node_id(str(data / 'sub' / 'b.txt'))) is None
+
+
+@pytest.mark.parametrize('batch_size', [1, 10000])
+def test_deletes_run_in_batches(graph, roots, batch_size):
+    data, data2 = roots
+    _walk(data, graph)
+    _walk(data2, graph)
+    # Nothing below data was seen by a walk at this time, apart from data itself
+    assert clean_up_file_system(float('inf'), graph, str(data), batch_size=batch_size) == (3, 2, 3)
+    assert [path for _, _, path in graph.subtree_nodes(node_id(str(data)))] == [str(data)]
+    assert graph.get_file_node(node_id(str(data2 / 'd.txt'))) is not None
+
+
+def test_remove_subtree_is_scoped_by_path(graph, roots):
+    data, data2 = roots
+    _walk(data, graph)
+    _walk(data2, graph)
+    assert graph.remove_subtree(str(data / 'sub')) == 2
+    assert graph.remove_subtree(str(data / 'a.txt')) == 1
+    assert graph.get_file_node(node_id(str(data / 'old' / 'c.txt'))) is not None
+    assert graph.get_file_node(node_id(str(data2 / 'd.txt'))) is not None
+    assert graph.cleanup_orphaned_hashtags() == 2
@@ -0,0 +1,105 @@
+import math
+import time
+from concurrent.futures import wait
+
+import pytest
+
+import conversion_service
+from conversion_service import DocumentConversionService
+from tests.document_intelligence_stub import StubDocumentIntelligence
+
+POLL_INTERVAL = 0.005
+
+
+class FakePdfReader:
+    """
+    Counts one page per 3000 bytes, as the stub does, so page ranges can be tested without real PDFs.
+    """
+
+    def __init__(self, stream):
+        self.pages = range(math.ceil(len(stream.getvalue()) / 3000))
+
+
+@pytest.fixture
+def document(tmp_path):
+    path = tmp_path / 'report.pdf'
+    path.write_bytes(b'%PDF' + bytes(range(256)) * 100)  # 25604 bytes, 9 pages
+    return str(path)
+
+
+def _service(stub, **kwargs):
+    return DocumentConversionService(stub.endpoint, 'test-key', poll_interval=POLL_INTERVAL, **kwargs)
+
+
+def test_convert_returns_text(document):
+    with StubDocumentIntelligence() as stub, _service(stub) as service:
+        text = service.convert(document)
+    assert text.startswith('Page 1: ')
+    assert stub.requests == 1
+    assert stub.output_formats == ['markdown']
+
+
+def test_in_flight_operations_are_capped(tmp_path):
+    paths = []
+    for index in range(6):
+        path = tmp_path / f"{index}.txt"
+        path.write_bytes(bytes([index]) * 100)
+        paths.append(str(path))
+    with StubDocumentIntelligence(latency=0.1) as stub, _service(stub, max_in_flight=2) as service:
+        futures = [service.submit(path) for path in paths]
+        wait(futures)
+        assert all(future.result() for future in futures)
+    assert stub.requests == 6
+    assert stub.max_running == 2
+
+
+def test_page_ranges_are_stitched_in_order(document, monkeypatch):
+    with StubDocumentIntelligence() as stub, _service(stub) as service:
+        whole = service.convert(document)
+    monkeypatch.setattr(conversion_service, 'PdfReader', FakePdfReader)
+    with StubDocumentIntelligence(latency_per_page=0.01) as stub, _service(stub, pages_per_range=2) as service:
+        split = service.convert(document)
+    assert sorted(stub.page_ranges) == ['1-2', '3-4', '5-6', '7-8', '9-9']
+    assert split == whole
+    assert [line.split(':')[0] for line in split.split('\n')] == [f"Page {number}" for number in range(1, 10)]
+
+
+def test_slow_document_times_out(document):
+    with StubDocumentIntelligence(latency=5) as stub, _service(stub) as service:
+        started = time.monotonic()
+        with pytest.raises(TimeoutError):
+            service.convert(document, timeout=0.3)
+        assert time.monotonic() - started < 2
+
+
+def test_throttled_request_is_retried(document):
+    with StubDocumentIntelligence(throttle=2) as stub, _service(stub) as service:
+        text = service.convert(document)
+    assert text.startswith('Page 1: ')
+    assert stub.requests == 3
+
+
+def test_failed_poll_is_retried(document):
+    with StubDocumentIntelligence(poll_errors=2) as stub, _service(stub) as service:
+        assert service.convert(document).startswith('Page 1: ')
+    assert stub.requests == 1
+    assert stub.polls == 3
+
+
+def test_failed_analyze_request_is_not_sent_again(document):
+    with StubDocumentIntelligence(analyze_errors=1) as stub, _service(stub) as service:
+        with pytest.raises(RuntimeError, match='HTTP 503'):
+            service.convert(document)
+    assert stub.requests == 1
+
+
+def test_failed_operation_raises(document):
+    with StubDocumentIntelligence(fail=True) as stub, _service(stub) as service:
+        with pytest.raises(RuntimeError, match='corrupted'):
+            service.convert(document)
+
+
+@pytest.mark.parametrize('key', [None, ''])
+def test_missing_key_is_rejected(key):
+    with pytest.raises(ValueError, match='AZURE_DOC_KEY'):
+        DocumentConversionService('http://127.0.0.1:9', key)
@@ -0,0 +1,136 @@
+import os
+
+import pytest
+
+from crawl_journal import CrawlJournal
+
+ROOT = '/data'
+
+
+class FakeWriter:
+    """
+    Holds the journal's checkpoints until the test says the rows before them were flushed.
+    """
+
+    def __init__(self):
+        self.checkpoints = []
+
+    def add_checkpoint(self, callback):
+        self.checkpoints.append(callback)
+
+    def flush(self):
+        checkpoints, self.checkpoints = self.checkpoints, []
+        for callback in checkpoints:
+            callback()
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / 'journal.db')
+
+
+@pytest.fixture
+def stat_result(tmp_path):
+    path = tmp_path / 'big.pdf'
+    path.write_bytes(b'%PDF' * 100)
+    return os.stat(path)
+
+
+def _walk_directory(journal, writer, path, files=()):
+    """
+    Reports a directory and its files to the journal the way the walk does.
+    """
+    journal.directory_started(path)
+    for _ in files:
+        journal.file_submitted(path)
+    journal.directory_listed(path, writer)
+    for _ in files:
+        journal.file_finished(path, writer)
+
+
+def test_interrupted_walk_resumes_with_flushed_subtrees_done(journal_path):
+    writer = FakeWriter()
+    journal = CrawlJournal(journal_path)
+    walk_time = journal.begin(ROOT)
+    assert not journal.resumed
+    journal.directory_started(ROOT)
+    _walk_directory(journal, writer, f"{ROOT}/a", files=['1.txt', '2.txt'])
+    _walk_directory(journal, writer, f"{ROOT}/b")
+    writer.flush()
+    # Listed, but its rows never reached the graph
+    _walk_directory(journal, writer, f"{ROOT}/c")
+    journal.close()
+
+    journal = CrawlJournal(journal_path)
+    assert journal.begin(ROOT) == walk_time
+    assert journal.resumed
+    assert journal.is_done(f"{ROOT}/a")
+    assert journal.is_done(f"{ROOT}/b")
+    assert not journal.is_done(f"{ROOT}/c")
+    assert not journal.is_done(ROOT)
+    journal.close()
+
+
+def test_directory_waits_for_its_files_and_subdirectories(journal_path):
+    writer = FakeWriter()
+    with CrawlJournal(journal_path) as journal:
+        journal.begin(ROOT)
+        journal.directory_started(ROOT)
+        journal.directory_started(f"{ROOT}/a")
+        journal.file_submitted(f"{ROOT}/a")
+        journal.directory_listed(f"{ROOT}/a", writer)
+        journal.directory_listed(ROOT, writer)
+        writer.flush()
+    with CrawlJournal(journal_path) as journal:
+        journal.begin(ROOT)
+        assert not journal.is_done(f"{ROOT}/a")
+        assert not journal.is_done(ROOT)
+
+
+def test_completed_walk_starts_afresh(journal_path):
+    writer = FakeWriter()
+    with CrawlJournal(journal_path) as journal:
+        first = journal.begin(ROOT)
+        _walk_directory(journal, writer, ROOT)
+        writer.flush()
+        journal.finish()
+    with CrawlJournal(journal_path) as journal:
+        assert journal.begin(ROOT) != first
+        assert not journal.resumed
+        assert journal.generation == 2
+        assert not journal.is_done(ROOT)
+
+
+def test_file_in_flight_during_failed_walks_is_skipped(journal_path, stat_result):
+    path = f"{ROOT}/big.pdf"
+    for attempt in range(2):
+        with CrawlJournal(journal_path, max_attempts=2) as journal:
+            journal.begin(ROOT)
+            assert journal.file_started(path, stat_result)
+            # The walk dies during the analysis
+    with CrawlJournal(journal_path, max_attempts=2) as journal:
+        journal.begin(ROOT)
+        assert not journal.file_started(path, stat_result)
+
+
+def test_finished_analysis_is_not_blamed(journal_path, stat_result):
+    path = f"{ROOT}/big.pdf"
+    for attempt in range(3):
+        with CrawlJournal(journal_path, max_attempts=2) as journal:
+            journal.begin(ROOT)
+            assert journal.file_started(path, stat_result)
+            journal.file_analysed(path)
+            # The walk dies before the file's record is flushed
+
+
+def test_changed_file_gets_a_fresh_start(journal_path, stat_result, tmp_path):
+    path = f"{ROOT}/big.pdf"
+    for attempt in range(2):
+        with CrawlJournal(journal_path, max_attempts=2) as journal:
+            journal.begin(ROOT)
+            journal.file_started(path, stat_result)
+    changed = tmp_path / 'changed.pdf'
+    changed.write_bytes(b'%PDF' * 200)
+    with CrawlJournal(journal_path, max_attempts=2) as journal:
+        journal.begin(ROOT)
+        assert journal.file_started(path, os.stat(changed))
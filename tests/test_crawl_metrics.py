@@ -0,0 +1,136 @@
+import json
+import os
+import urllib.error
+import urllib.request
+
+import pytest
+
+import walk_file_system
+from crawl_metrics import Histogram, Metrics, get_metrics
+from sqlite_graph import SQLiteGraph
+from walk_file_system import walk_file_system as walk
+
+
+class PlainTextDetector:
+    """
+    Detects every file as plain text, without libmagic.
+    """
+
+    def detect(self, path, stat_result=None):
+        return 'text/plain'
+
+    def stats(self):
+        return {}
+
+
+def test_histogram_buckets_and_quantiles():
+    histogram = Histogram(bounds=(0.1, 1, 10))
+    for seconds in (0.05, 0.5, 0.5, 5, 50):
+        histogram.observe(seconds)
+    assert histogram.counts == [1, 2, 1, 1]
+    assert (histogram.count, histogram.max) == (5, 50)
+    assert histogram.sum == pytest.approx(56.05)
+    # The median falls three quarters of the way into the (0.1, 1] bucket
+    assert histogram.quantile(0.5) == pytest.approx(0.1 + 0.9 * 0.75)
+    assert histogram.quantile(1) == 50
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_timer_records_latency_and_errors():
+    metrics = Metrics()
+    with metrics.timer('read'):
+        pass
+    with pytest.raises(OSError):
+        with metrics.timer('read'):
+            raise OSError('unreadable')
+    metrics.count('bytes', 100, stage='read')
+    metrics.count('bytes', 20, stage='read')
+    report = metrics.report()
+    assert report['stages']['read']['count'] == 2
+    assert report['stages']['read']['errors'] == 1
+    assert report['counters'] == {'bytes': {'read': 120}, 'errors': {'read': 1}}
+    metrics.reset()
+    assert metrics.report()['stages'] == {}
+
+
+def test_prometheus_text_is_cumulative(tmp_path):
+    metrics = Metrics()
+    metrics.observe('embed', 0.0002)
+    metrics.observe('embed', 200)
+    metrics.count('files', status='analysed')
+    text = metrics.prometheus_text()
+    lines = text.splitlines()
+    assert 'crawler_stage_seconds_bucket{stage="embed",le="0.0001"} 0' in lines
+    assert 'crawler_stage_seconds_bucket{stage="embed",le="0.0005"} 1' in lines
+    assert 'crawler_stage_seconds_bucket{stage="embed",le="120.0"} 1' in lines
+    assert 'crawler_stage_seconds_bucket{stage="embed",le="+Inf"} 2' in lines
+    assert 'crawler_stage_seconds_count{stage="embed"} 2' in lines
+    assert '# TYPE crawler_files_total counter' in lines
+    assert 'crawler_files_total{status="analysed"} 1' in lines
+
+    path = str(tmp_path / 'crawler.prom')
+    metrics.write_prometheus(path)
+    with open(path, encoding='utf-8') as file:
+        assert file.read() == text
+    assert os.listdir(tmp_path) == ['crawler.prom']
+
+
+def test_serve_exposes_the_metrics():
+    metrics = Metrics()
+    metrics.count('removed', 3, kind='file')
+    server = metrics.serve(0, address='127.0.0.1')
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert 'crawler_removed_total{kind="file"} 3' in response.read().decode('utf-8')
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{url}/other")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_sampled_files_are_profiled(tmp_path):
+    metrics = Metrics()
+    metrics.configure_profiling(1.0, profile_dir=str(tmp_path / 'profiles'))
+    with metrics.profile('/data/a.txt'):
+        # A file that starts while another is profiled runs unprofiled
+        with metrics.profile('/data/b.txt'):
+            sum(range(1000))
+    assert [entry['path'] for entry in metrics.profiles] == ['/data/a.txt']
+    assert os.path.exists(metrics.profiles[0]['profile'])
+
+    metrics.configure_profiling(0.0)
+    with metrics.profile('/data/c.txt'):
+        pass
+    assert len(metrics.profiles) == 1
+
+
+def test_walk_counts_files_and_graph_rows(tmp_path, monkeypatch):
+    def analyse_file(file_path, mime_type, text_cache=None, digest=None, defer_embedding=False):
+        if file_path.endswith('bad.txt'):
+            raise ValueError('model unavailable')
+        return 3, 'A summary.', [1.0, 0.0], ['budget']
+
+    monkeypatch.setattr(walk_file_system, 'analyse_file', analyse_file)
+    root = tmp_path / 'tree'
+    root.mkdir()
+    (root / 'good.txt').write_text('A quarterly budget.')
+    (root / 'bad.txt').write_text('A contract.')
+
+    metrics = get_metrics()
+    metrics.reset()
+    graph = SQLiteGraph(str(tmp_path / 'graph.db'))
+    try:
+        walk(str(root), graph, mime_detector=PlainTextDetector())
+    finally:
+        graph.close()
+    report_path = str(tmp_path / 'report.json')
+    metrics.write_report(report_path)
+    with open(report_path, encoding='utf-8') as file:
+        report = json.load(file)
+    assert report['counters']['files'] == {'analysed': 1, 'failed': 1}
+    rows = report['counters']['graph_rows']
+    assert (rows['files'], rows['unanalysed_files'], rows['hashtag_links']) == (1, 1, 1)
+    assert report['stages']['file']['count'] == 2
+    assert report['stages']['graph_write']['count'] >= 1
@@ -0,0 +1,117 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from crawl_pipeline import CrawlPipeline
+
+
+def _analyse(job):
+    if job % 3 == 0:
+        raise ValueError(f"bad job {job}")
+    return ('ok', job)
+
+
+async def _aanalyse(job):
+    return _analyse(job)
+
+
+def _run(analyse, jobs, **options):
+    written = []
+    lock = threading.Lock()
+
+    def write(record):
+        with lock:
+            written.append(record)
+
+    with CrawlPipeline(analyse, write, workers=3, **options) as pipeline:
+        for job in jobs:
+            pipeline.submit(job)
+    return written
+
+
+def test_results_reach_the_writer():
+    written = _run(lambda job: ('ok', job), range(1, 50))
+    assert sorted(written) == [('ok', job) for job in range(1, 50)]
+
+
+def test_records_written_directly_keep_their_order():
+    written = []
+    with CrawlPipeline(lambda job: job, written.append, workers=2) as pipeline:
+        for index in range(20):
+            pipeline.write(index)
+    assert written == list(range(20))
+
+
+@pytest.mark.parametrize('analyse', [_analyse, _aanalyse])
+def test_analysis_errors_are_written_through_on_error(analyse):
+    written = _run(analyse, range(1, 31), on_error=lambda job, error: ('failed', job, str(error)))
+    assert sorted(record for record in written if record[0] == 'ok') == \
+        [('ok', job) for job in range(1, 31) if job % 3]
+    assert sorted(record for record in written if record[0] == 'failed') == \
+        [('failed', job, f"bad job {job}") for job in range(3, 31, 3)]
+
+
+@pytest.mark.parametrize('analyse', [_analyse, _aanalyse])
+def test_analysis_error_without_on_error_aborts(analyse):
+    with pytest.raises(ValueError, match='bad job'):
+        _run(analyse, range(1, 31))
+
+
+def test_writer_error_aborts_despite_on_error():
+    def write(record):
+        raise OSError('graph unavailable')
+
+    with pytest.raises(OSError, match='graph unavailable'):
+        with CrawlPipeline(lambda job: job, write, on_error=lambda job, error: None) as pipeline:
+            for job in range(100):
+                pipeline.submit(job)
+
+
+def test_workers_must_be_positive():
+    with pytest.raises(ValueError):
+        CrawlPipeline(_analyse, print, workers=0)
+
+
+def test_futures_are_written_in_order_without_blocking_the_workers():
+    futures = {}
+    analysed = threading.Event()
+
+    def analyse(job):
+        futures[job] = Future()
+        if len(futures) == 100:
+            analysed.set()
+        return futures[job]
+
+    written = []
+    with CrawlPipeline(analyse, written.append, workers=1,
+                       on_error=lambda job, error: ('failed', job)) as pipeline:
+        pipeline.write('first')
+        for job in range(100):
+            pipeline.submit(job)
+        # The single worker got through every job although none of its results has arrived
+        assert analysed.wait(5)
+        assert written == ['first']
+        for job in reversed(range(100)):
+            if job == 7:
+                futures[job].set_exception(ValueError('embedding failed'))
+            else:
+                futures[job].set_result(('ok', job))
+    assert written == ['first'] + [('failed', job) if job == 7 else ('ok', job) for job in range(100)]
+
+
+def test_writer_waits_once_max_pending_records_are_held():
+    future = Future()
+    written = []
+    with CrawlPipeline(lambda job: future if job == 0 else job, written.append, workers=1,
+                       max_pending=3) as pipeline:
+        for job in range(5):
+            pipeline.submit(job)
+        deadline = time.monotonic() + 5
+        while pipeline._results.qsize() < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Jobs 0 to 3 are held, so job 4 stays on the queue
+        assert written == []
+        future.set_result('zero')
+    assert written == ['zero', 1, 2, 3, 4]
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from embedding_compression import CompressedIndex, evaluate_recall
+from embedding_store import EmbeddingStore
+
+DIMENSIONS = 64
+
+
+@pytest.fixture
+def store(tmp_path):
+    rng = np.random.default_rng(0)
+    with EmbeddingStore(str(tmp_path / 'embeddings.db'), dimensions=DIMENSIONS) as store:
+        for index in range(200):
+            store.put(f"f{index}", rng.normal(size=DIMENSIONS), f"/data/{index}.txt")
+        yield store
+
+
+def _exact(store, query, k, mask=None):
+    return [file_id for file_id, _ in store.knn(query, k, mask=mask)[0]]
+
+
+@pytest.mark.parametrize('dimensions', [None, 32])
+@pytest.mark.parametrize('quantisation', [None, 'int8', 'binary'])
+def test_reranked_search_matches_exact_search(store, dimensions, quantisation):
+    index = CompressedIndex(store, dimensions=dimensions, quantisation=quantisation)
+    query = store.get('f7') + 0.1 * store.get('f8')
+    results = index.search(query, k=5)
+    assert results[0][0] == 'f7'
+    if quantisation != 'binary':
+        assert [file_id for file_id, _ in results] == _exact(store, query, 5)
+    # Re-ranked scores are the exact cosine similarities, best first
+    exact = store.vectors() @ (query / np.linalg.norm(query))
+    rows = store.rows_for([file_id for file_id, _ in results])
+    assert [score for _, score in results] == pytest.approx(list(exact[rows]), abs=1e-5)
+    assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+
+
+def test_codes_shrink_with_truncation_and_quantisation(store):
+    full = CompressedIndex(store, quantisation=None).nbytes()
+    assert full == 200 * DIMENSIONS * 4
+    assert CompressedIndex(store, dimensions=32, quantisation=None).nbytes() == full // 2
+    assert CompressedIndex(store, quantisation='int8').nbytes() == full // 4 + DIMENSIONS * 4
+    assert CompressedIndex(store, quantisation='binary').nbytes() == full // 32
+
+
+def test_approximate_search_finds_the_nearest_rows(store):
+    index = CompressedIndex(store, quantisation='int8', rerank_factor=0)
+    results = index.search(store.get('f3'), k=1)
+    assert results[0][0] == 'f3'
+    assert results[0][1] == pytest.approx(1, abs=0.02)
+
+
+def test_mask_and_deleted_rows_are_excluded(store):
+    index = CompressedIndex(store)
+    query = store.get('f3')
+    store.delete('f3')
+    assert 'f3' not in [file_id for file_id, _ in index.search(query, k=5)]
+    mask = np.zeros(len(store.live_mask()), dtype=bool)
+    mask[store.rows_for(['f1', 'f2'])] = True
+    assert sorted(file_id for file_id, _ in index.search(query, k=5, mask=mask)) == ['f1', 'f2']
+    assert index.search(query, k=0) == []
+
+
+def test_rows_added_or_renumbered_after_the_build_are_found(store):
+    index = CompressedIndex(store, quantisation='binary')
+    query = np.ones(DIMENSIONS)
+    store.put('new', query, '/data/new.txt')
+    assert index.search(query, k=1) == [('new', pytest.approx(1))]
+
+    for file_id in ('f0', 'f1', 'f2'):
+        store.delete(file_id)
+    store.compact()
+    assert index.search(query, k=1) == [('new', pytest.approx(1))]
+    assert len(index.codes) == len(store)
+
+
+def test_invalid_configurations_are_rejected(store):
+    with pytest.raises(ValueError):
+        CompressedIndex(store, quantisation='int4')
+    with pytest.raises(ValueError):
+        CompressedIndex(store, dimensions=DIMENSIONS + 1)
+
+
+def test_evaluate_recall_reports_each_configuration(store):
+    results = evaluate_recall(store, configs=[dict(quantisation='int8', rerank_factor=10),
+                                              dict(dimensions=8, quantisation='binary', rerank_factor=0)],
+                              k=5, num_queries=20)
+    assert [(result['dimensions'], result['quantisation']) for result in results] == [(DIMENSIONS, 'int8'),
+                                                                                      (8, 'binary')]
+    assert results[0]['recall'] == 1
+    assert 0 <= results[1]['recall'] < 1
+    assert results[1]['bytes'] < results[0]['bytes']
+    with pytest.raises(ValueError):
+        evaluate_recall(store, k=200)
@@ -0,0 +1,142 @@
+import numpy as np
+import pytest
+
+from embedding_store import EmbeddingStore
+
+DIMENSIONS = 4
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / 'embeddings.db')
+
+
+def _vector(*values):
+    return np.array(values, dtype=np.float32)
+
+
+def test_put_stores_unit_vectors(store_path):
+    with EmbeddingStore(store_path, dimensions=DIMENSIONS) as store:
+        store.put('f1', [3.0, 4.0, 0.0, 0.0], '/data/a.txt')
+        assert np.allclose(store.get('f1'), [0.6, 0.8, 0.0, 0.0])
+        assert store.get('missing') is None
+        assert len(store) == 1
+
+
+def test_put_replaces_in_place(store_path):
+    with EmbeddingStore(store_path, dimensions=DIMENSIONS) as store:
+        store.put('f1', [1.0, 0.0, 0.0, 0.0], '/data/a.txt')
+        store.put('f1', [0.0, 1.0, 0.0, 0.0])
+        assert np.allclose(store.get('f1'), [0.0, 1.0, 0.0, 0.0])
+        assert store.stats()['dead'] == 0
+        assert list(store.rows_below('/data')) == [0]
+
+
+def test_wrong_dimensions_are_rejected(store_path):
+    with EmbeddingStore(store_path, dimensions=DIMENSIONS) as store:
+        with pytest.raises(ValueError):
+            store.put('f1', [1.0, 0.0])
+    with pytest.raises(ValueError):
+        EmbeddingStore(store_path, dimensions=DIMENSIONS + 1)
+
+
+def test_delete_leaves_a_tombstone_until_compaction(store_path):
+    with EmbeddingStore(store_path, dimensions=DIMENSIONS) as store:
+        for index in range(4):
+            store.put(f"f{index}", np.eye(DIMENSIONS)[index], f"/data/{index}.txt")
+        assert store.delete('f1')
+        assert not store.delete('f1')
+        # An empty embedding removes the file too
+        store.put('f2', [])
+        assert store.row_ids() == ['f0', None, None, 'f3']
+        assert list(store.live_mask()) == [True, False, False, True]
+        assert store.compact(min_dead_fraction=0.75) == 0
+
+        assert store.compact() == 2
+        assert store.generation == 1
+        assert store.row_ids() == ['f0', 'f3']
+        assert np.allclose(store.get('f3'), np.eye(DIMENSIONS)[3])
+        assert (store.stats()['live'], store.stats()['dead']) == (2, 0)
+    with EmbeddingStore(store_path, dimensions=DIMENSIONS) as store:
+        assert store.generation == 1
+        assert store.row_ids() == ['f0', 'f3']
+        assert np.allclose(store.get('f0'), np.eye(DIMENSIONS)[0])
+
+
+def test_remove_subtree_and_retain_use_paths(store_path):
+    with EmbeddingStore(store_path, dimensions=DIMENSIONS) as store:
+        store.put('a1', [1.0, 0.0, 0.0, 0.0], '/data/a/1.txt')
+        store.put('a2', [1.0, 0.0, 0.0, 0.0], '/data/a/2.txt')
+        store.put('ab', [1.0, 0.0, 0.0, 0.0], '/data/ab.txt')
+        store.put('b1', [1.0, 0.0, 0.0, 0.0], '/data/b/1.txt')
+        store.put('x1', [1.0, 0.0, 0.0, 0.0], '/other/1.txt')
+
+        # A sibling sharing the name prefix is not below the directory
+        assert store.remove_subtree('/data/a') == 2
+        assert store.get('ab') is not None
+
+        assert store.retain('/data', ['b1']) == 1
+        assert store.get('ab') is None
+        assert store.get('b1') is not None
+        assert store.get('x1') is not None
+
+
+def test_rename_moves_the_embedding(store_path):
+    with EmbeddingStore(store_path, dimensions=DIMENSIONS) as store:
+        store.put('old', [0.0, 0.0, 1.0, 0.0], '/data/old.txt')
+        store.rename('old', 'new', '/data/moved/new.txt')
+        assert store.get('old') is None
+        assert np.allclose(store.get('new'), [0.0, 0.0, 1.0, 0.0])
+        assert store.remove_subtree('/data/moved') == 1
+
+
+def test_knn_orders_by_cosine_similarity(store_path):
+    with EmbeddingStore(store_path, dimensions=DIMENSIONS) as store:
+        store.put('x', [1.0, 0.0, 0.0, 0.0], '/data/x.txt')
+        store.put('xy', [1.0, 1.0, 0.0, 0.0], '/data/xy.txt')
+        store.put('y', [0.0, 1.0, 0.0, 0.0], '/other/y.txt')
+        store.put('z', [0.0, 0.0, 1.0, 0.0], '/data/z.txt')
+        store.delete('z')
+
+        [neighbours] = store.knn(_vector(2.0, 0.5, 0.0, 0.0), k=3)
+        assert [file_id for file_id, _ in neighbours] == ['x', 'xy', 'y']
+        assert neighbours[0][1] == pytest.approx(2.0 / np.sqrt(4.25))
+
+        mask = np.zeros(len(store.vectors()), dtype=bool)
+        mask[store.rows_below('/other')] = True
+        assert store.knn([[1.0, 0.0, 0.0, 0.0], [0.0, 0.0, 1.0, 0.0]], k=2, mask=mask) == \
+            [[('y', 0.0)], [('y', 0.0)]]
+        assert store.knn(_vector(1.0, 0.0, 0.0, 0.0), k=0) == [[]]
+
+
+def test_backfill_runs_once(store_path):
+    rows = [('f1', '/data/1.txt', [1.0, 0.0, 0.0, 0.0]), ('f2', '/data/2.txt', [0.0, 1.0, 0.0, 0.0])]
+    with EmbeddingStore(store_path, dimensions=DIMENSIONS) as store:
+        store.put('f1', [0.0, 0.0, 0.0, 1.0], '/data/1.txt')
+        assert store.backfill(rows) == 1
+        # The newer embedding is kept
+        assert np.allclose(store.get('f1'), [0.0, 0.0, 0.0, 1.0])
+        store.delete('f2')
+    with EmbeddingStore(store_path, dimensions=DIMENSIONS) as store:
+        assert store.backfill(iter(rows)) == 0
+        assert store.get('f2') is None
+
+
+def test_readonly_store_sees_new_rows_after_reload(store_path):
+    writer = EmbeddingStore(store_path, dimensions=DIMENSIONS)
+    writer.put('f1', [1.0, 0.0, 0.0, 0.0], '/data/1.txt')
+    writer.flush()
+    reader = EmbeddingStore(store_path, dimensions=DIMENSIONS, readonly=True)
+    try:
+        with pytest.raises(PermissionError):
+            reader.put('f2', [0.0, 1.0, 0.0, 0.0])
+        writer.put('f2', [0.0, 1.0, 0.0, 0.0], '/data/2.txt')
+        writer.delete('f1')
+        writer.compact()
+        writer.flush()
+        reader.reload()
+        assert reader.row_ids() == ['f2']
+        assert np.allclose(reader.get('f2'), [0.0, 1.0, 0.0, 0.0])
+    finally:
+        reader.close()
+        writer.close()
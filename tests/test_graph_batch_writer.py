@@ -0,0 +1,151 @@
+import threading
+import time
+
+import pytest
+
+from graph_batch_writer import FLUSH_ORDER, GraphBatchWriter
+
+
+class RecordingGraph:
+    """
+    Records the batches each backend method receives, in call order.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.flushed = threading.Event()
+
+    def __getattr__(self, method):
+        if method not in dict(FLUSH_ORDER).values():
+            raise AttributeError(method)
+
+        def record(rows):
+            self.calls.append((method, list(rows)))
+            self.flushed.set()
+        return record
+
+
+def _methods(graph):
+    return [method for method, _ in graph.calls]
+
+
+def test_rows_are_buffered_until_flush():
+    graph = RecordingGraph()
+    writer = GraphBatchWriter(graph, batch_size=100, flush_interval=None)
+    writer.add_directory('d1', None, 'root', 1.0, path='/root')
+    writer.add_file('f1', 'd1', ['budget'], filename='a.txt', path='/root/a.txt')
+    assert graph.calls == []
+    writer.close()
+    assert _methods(graph) == ['merge_directories', 'merge_files', 'link_files_to_directories',
+                               'link_files_to_hashtags']
+
+
+def test_flush_follows_dependency_order():
+    graph = RecordingGraph()
+    with GraphBatchWriter(graph, flush_interval=None) as writer:
+        writer.touch_file('f0', 2.0)
+        writer.add_file('f1', 'd2', ['budget', 'report'], filename='a.txt')
+        writer.add_unanalysed_file('f2', 'd2', filename='b.txt', analysis_status='pending')
+        writer.update_directory('d1', child_count=1)
+        writer.add_directory('d2', 'd1', 'sub', 2.0)
+        writer.add_directory('d1', None, 'root', 2.0)
+    order = [name for _, name in FLUSH_ORDER]
+    methods = _methods(graph)
+    assert methods == sorted(methods, key=order.index)
+    assert dict(graph.calls)['link_directories'] == [{'dir_id': 'd2', 'parent_dir_id': 'd1'}]
+    assert dict(graph.calls)['link_files_to_hashtags'] == [{'file_id': 'f1', 'hashtag': 'budget'},
+                                                           {'file_id': 'f1', 'hashtag': 'report'}]
+    assert 'hashtags' not in dict(graph.calls)['merge_unanalysed_files'][0]
+
+
+def test_full_buffer_flushes_in_batches():
+    graph = RecordingGraph()
+    writer = GraphBatchWriter(graph, batch_size=3, flush_interval=None)
+    for index in range(2):
+        writer.touch_file(f"f{index}", 1.0)
+    assert graph.calls == []
+    writer.touch_file('f2', 1.0)
+    assert [len(rows) for _, rows in graph.calls] == [3]
+    for index in range(3, 10):
+        writer.touch_file(f"f{index}", 1.0)
+    writer.close()
+    assert sum(len(rows) for _, rows in graph.calls) == 10
+    assert all(len(rows) <= 3 for _, rows in graph.calls)
+
+
+def test_checkpoint_runs_after_the_rows_before_it_are_written():
+    graph = RecordingGraph()
+    seen = []
+    writer = GraphBatchWriter(graph, flush_interval=None)
+    writer.add_directory('d1', None, 'root', 1.0)
+    writer.add_checkpoint(lambda: seen.append(list(graph.calls)))
+    assert seen == []
+    writer.flush()
+    assert seen == [[('merge_directories', [{'dir_id': 'd1', 'parent_dir_id': None, 'dirname': 'root',
+                                              'lastchecked': 1.0}])]]
+    writer.close()
+    assert len(seen) == 1
+
+
+def test_idle_rows_are_flushed_by_the_timer():
+    graph = RecordingGraph()
+    writer = GraphBatchWriter(graph, flush_interval=0.05)
+    try:
+        writer.touch_file('f1', 1.0)
+        assert graph.flushed.wait(2)
+        assert graph.calls == [('touch_files', [{'file_id': 'f1', 'lastchecked': 1.0}])]
+    finally:
+        writer.close()
+
+
+def test_timer_flush_error_is_raised_to_the_next_caller():
+    class FailingGraph(RecordingGraph):
+        def touch_files(self, rows):
+            raise RuntimeError('connection lost')
+
+    writer = GraphBatchWriter(FailingGraph(), flush_interval=0.05)
+    writer.touch_file('f1', 1.0)
+    deadline = time.monotonic() + 2
+    while writer._timer.is_alive() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    with pytest.raises(RuntimeError, match='connection lost'):
+        writer.touch_file('f2', 1.0)
+    # The row that was buffered meanwhile is still written on close, which fails again
+    with pytest.raises(RuntimeError, match='connection lost'):
+        writer.close()
+
+
+def test_failed_flush_keeps_the_unwritten_rows_and_checkpoints():
+    class FlakyGraph(RecordingGraph):
+        calls_before_failure = 1
+
+        def merge_unanalysed_files(self, rows):
+            self.calls_before_failure -= 1
+            if self.calls_before_failure == -1:
+                raise RuntimeError('connection lost')
+            self.calls.append(('merge_unanalysed_files', [row['file_id'] for row in rows]))
+
+    graph = FlakyGraph()
+    seen = []
+    writer = GraphBatchWriter(graph, flush_interval=None)
+    writer.add_directory('d1', None, 'root', 1.0)
+    for index in range(3):
+        writer.add_unanalysed_file(f"f{index}", 'd1', filename=f"{index}.txt")
+    writer.add_checkpoint(lambda: seen.append('checkpoint'))
+    # The second chunk fails
+    writer.batch_size = 2
+    with pytest.raises(RuntimeError, match='connection lost'):
+        writer.flush()
+    assert graph.calls[1:] == [('merge_unanalysed_files', ['f0', 'f1'])]
+    assert seen == []
+    writer.touch_file('f0', 2.0)
+    writer.close()
+    # Only the rows that were not written are sent again, ahead of the rows buffered since
+    assert graph.calls[2] == ('merge_unanalysed_files', ['f2'])
+    assert _methods(graph)[3:] == ['link_files_to_directories', 'link_files_to_directories', 'touch_files']
+    assert seen == ['checkpoint']
+
+
+def test_batch_size_must_be_positive():
+    with pytest.raises(ValueError):
+        GraphBatchWriter(RecordingGraph(), batch_size=0)
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+import map_reduce_summarise
+from map_reduce_summarise import _SEPARATOR, amap_reduce_summarise, map_reduce_summarise as summarise, split_tokens
+
+
+class WordEncoder:
+    """
+    Treats every word as one token.
+    """
+
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return ' '.join(tokens)
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """
+    Replaces the model calls with ones that keep the first two words of a text, and records the texts
+    each agent was given.
+    """
+    calls = {'summarise': [], 'analysis': []}
+
+    def summarise_agent(text):
+        calls['summarise'].append(text)
+        return ' '.join(text.split()[:2])
+
+    def analysis_agent(text):
+        calls['analysis'].append(text)
+        return f"Summary of: {text}", ['tag']
+
+    async def asummarise_agent(text):
+        return summarise_agent(text)
+
+    async def aanalysis_agent(text):
+        return analysis_agent(text)
+
+    for name, agent in [('summarise_agent', summarise_agent), ('analysis_agent', analysis_agent),
+                        ('asummarise_agent', asummarise_agent), ('aanalysis_agent', aanalysis_agent)]:
+        monkeypatch.setattr(map_reduce_summarise, name, agent)
+    return calls
+
+
+def _words(count):
+    return [f"w{index}" for index in range(count)]
+
+
+def test_split_tokens_overlaps_and_covers_everything():
+    windows = split_tokens(list(range(25)), chunk_tokens=10, overlap=3)
+    assert windows == [list(range(0, 10)), list(range(7, 17)), list(range(14, 24)), list(range(21, 25))]
+    assert split_tokens([], 10, 3) == [[]]
+    with pytest.raises(ValueError):
+        split_tokens(list(range(25)), chunk_tokens=3, overlap=3)
+
+
+@pytest.mark.parametrize('run', [summarise, lambda *args, **kwargs: asyncio.run(amap_reduce_summarise(*args, **kwargs))])
+def test_chunks_are_summarised_and_reduced_in_order(calls, run):
+    summary, hashtags = run(_words(100), WordEncoder(), chunk_tokens=10, overlap=0, reduce_tokens=6)
+    assert calls['summarise'][:10] == [' '.join(_words(100)[start:start + 10]) for start in range(0, 100, 10)]
+    # Ten two-word summaries, reduced three at a time until one group is left
+    assert len(calls['summarise']) == 10 + 4 + 2
+    reduced = 'w0 w1' + _SEPARATOR + 'w90 w91'
+    assert calls['analysis'] == [reduced]
+    assert (summary, hashtags) == (f"Summary of: {reduced}", ['tag'])
+
+
+def test_fan_out_and_tokens_read_are_capped(calls):
+    summarise(_words(1000), WordEncoder(), chunk_tokens=10, overlap=0, max_chunks=4, max_total_tokens=400,
+              reduce_tokens=100)
+    map_calls = calls['summarise'][:4]
+    assert [len(text.split()) for text in map_calls] == [100] * 4
+    assert map_calls[-1].split()[-1] == 'w399'
+    assert len(calls['summarise']) == 4
+
+
+def test_reduction_that_does_not_shrink_is_truncated(calls, monkeypatch):
+    # Summaries as long as their input never reduce the number of groups
+    monkeypatch.setattr(map_reduce_summarise, 'summarise_agent', lambda text: text)
+    summarise(_words(40), WordEncoder(), chunk_tokens=10, overlap=0, reduce_tokens=15)
+    assert len(calls['analysis'][0].split()) == 15
@@ -0,0 +1,96 @@
+import os
+import threading
+
+import pytest
+
+import mime_detector
+from mime_detector import MimeDetector
+
+
+class FakeMagic:
+    """
+    Stands in for a libmagic handle, recording the handles created and the headers they were given.
+    """
+
+    handles = []
+
+    def __init__(self, mime=False):
+        self.headers = []
+        self.thread = threading.current_thread()
+        FakeMagic.handles.append(self)
+
+    def from_buffer(self, header):
+        self.headers.append(header)
+        return 'text/plain' if header else 'inode/x-empty'
+
+
+@pytest.fixture
+def handles(monkeypatch):
+    FakeMagic.handles = []
+    monkeypatch.setattr(mime_detector.magic, 'Magic', FakeMagic)
+    return FakeMagic.handles
+
+
+def _headers(handles):
+    return [header for handle in handles for header in handle.headers]
+
+
+def test_only_the_header_is_read(tmp_path, handles):
+    path = tmp_path / 'large.txt'
+    path.write_bytes(b'x' * 100000)
+    assert MimeDetector(header_bytes=512).detect(str(path)) == 'text/plain'
+    assert [len(header) for header in _headers(handles)] == [512]
+
+
+def test_results_are_cached_until_the_file_changes(tmp_path, handles):
+    path = tmp_path / 'notes.txt'
+    path.write_text('Notes.')
+    detector = MimeDetector()
+    for _ in range(3):
+        assert detector.detect(str(path), os.stat(path)) == 'text/plain'
+    assert detector.stats()['hits'] == 2
+    path.write_text('Longer notes.')
+    detector.detect(str(path))
+    assert len(_headers(handles)) == 2
+    assert detector.stats()['misses'] == 2
+
+
+def test_unambiguous_extensions_skip_libmagic(tmp_path, handles):
+    path = tmp_path / 'scan.PDF'
+    path.write_bytes(b'not really a PDF')
+    assert MimeDetector().detect(str(path)) == 'application/pdf'
+    assert MimeDetector(use_extensions=False).detect(str(path)) == 'text/plain'
+    assert len(_headers(handles)) == 1
+
+
+def test_each_thread_keeps_one_handle(tmp_path, handles):
+    paths = []
+    for index in range(20):
+        path = tmp_path / f"{index}.txt"
+        path.write_text(f"File {index}.")
+        paths.append(str(path))
+    detector = MimeDetector()
+    threads = [threading.Thread(target=lambda part=part: [detector.detect(path) for path in part])
+               for part in (paths[:10], paths[10:])]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(handles) == 2
+    assert {handle.thread for handle in handles} == set(threads)
+    assert len(_headers(handles)) == 20
+
+
+def test_cache_persists_between_runs(tmp_path, handles):
+    path = tmp_path / 'notes.txt'
+    path.write_text('Notes.')
+    with MimeDetector(cache_path=str(tmp_path / 'mime.db')) as detector:
+        detector.detect(str(path))
+    with MimeDetector(cache_path=str(tmp_path / 'mime.db')) as detector:
+        assert detector.detect(str(path)) == 'text/plain'
+        assert detector.stats()['hits'] == 1
+    assert len(_headers(handles)) == 1
+
+
+def test_missing_file_is_na(tmp_path, handles):
+    assert MimeDetector().detect(str(tmp_path / 'missing.txt')) == 'NA'
@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+import unicodedata
+
+from path_identity import node_id, normalise_path
+
+
+def test_identifiers_do_not_depend_on_the_process(tmp_path):
+    path = str(tmp_path / 'report.txt')
+    script = f"import path_identity; print(path_identity.node_id({path!r}))"
+    src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+    ids = {subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                          env=dict(os.environ, PYTHONPATH=src, PYTHONHASHSEED=str(seed))).stdout.strip()
+           for seed in (1, 2)}
+    assert ids == {node_id(path)}
+
+
+def test_equivalent_paths_share_an_identifier(tmp_path):
+    path = str(tmp_path / 'café.txt')
+    decomposed = unicodedata.normalize('NFD', path)
+    assert decomposed != path
+    assert normalise_path(decomposed) == normalise_path(path)
+    assert node_id(f"{tmp_path}//café.txt") == node_id(path) == node_id(decomposed)
+    assert node_id(f"{tmp_path}/") == node_id(str(tmp_path))
+    assert node_id(str(tmp_path / 'other.txt')) != node_id(path)
+
+
+def test_inode_identity_changes_when_a_path_is_recreated(tmp_path):
+    path = tmp_path / 'report.txt'
+    path.write_text('First.')
+    first = os.stat(path)
+    # Hold on to the old file so the new one cannot reuse its inode
+    os.link(path, tmp_path / 'kept.txt')
+    path.unlink()
+    path.write_text('Second.')
+    assert node_id(str(path), first) != node_id(str(path), os.stat(path))
+    assert node_id(str(path), first) != node_id(str(path))
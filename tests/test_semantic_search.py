@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+
+from embedding_compression import CompressedIndex
+from embedding_store import EmbeddingStore
+from graph_schema import EMBEDDING_DIMENSIONS
+from semantic_search import LocalVectorIndex, SemanticSearch
+from sqlite_graph import SQLiteGraph
+
+# (file_id, relative path, MIME type, hashtags)
+FILES = [
+    ('budget', 'finance/budget.txt', 'text/plain', ['finance']),
+    ('loans', 'finance/loans.pdf', 'application/pdf', ['finance', 'loans']),
+    ('contract', 'legal/contract.pdf', 'application/pdf', ['legal']),
+    ('notes', 'legal/notes.txt', 'text/plain', []),
+]
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    return {file_id: rng.normal(size=EMBEDDING_DIMENSIONS) for file_id, *_ in FILES}
+
+
+@pytest.fixture
+def query(vectors):
+    # Closest to the budget, then the loans
+    return vectors['budget'] + 0.5 * vectors['loans']
+
+
+@pytest.fixture
+def root(tmp_path):
+    return tmp_path / 'data'
+
+
+@pytest.fixture
+def graph(tmp_path, root, vectors):
+    graph = SQLiteGraph(str(tmp_path / 'graph.db'))
+    graph.merge_files([
+        {'file_id': file_id, 'path': str(root / path), 'filename': path.split('/')[-1], 'mime_type': mime_type,
+         'embedded_summary': list(vectors[file_id])}
+        for file_id, path, mime_type, _ in FILES
+    ])
+    graph.link_files_to_hashtags([{'file_id': file_id, 'hashtag': hashtag}
+                                  for file_id, _, _, hashtags in FILES for hashtag in hashtags])
+    yield graph
+    graph.close()
+
+
+@pytest.fixture
+def store(tmp_path, root, vectors):
+    with EmbeddingStore(str(tmp_path / 'embeddings.db')) as store:
+        for file_id, path, *_ in FILES:
+            store.put(file_id, vectors[file_id], str(root / path))
+        yield store
+
+
+@pytest.fixture(params=['graph', 'store', 'compressed'])
+def search(request, graph, store):
+    """
+    Searches the graph through each of the local paths: the in-process index built from the graph, the
+    embedding store and a compressed index over the store.
+    """
+    if request.param == 'graph':
+        return SemanticSearch(graph, embed_query=_unused)
+    if request.param == 'store':
+        return SemanticSearch(graph, embed_query=_unused, embedding_store=store)
+    compressed = CompressedIndex(store, dimensions=256, quantisation='int8')
+    return SemanticSearch(graph, embed_query=_unused, embedding_store=store, compressed_index=compressed)
+
+
+def _unused(query):
+    raise AssertionError('The tests search with embedded queries')
+
+
+def _ids(results):
+    return [result.file_id for result in results]
+
+
+def test_results_are_ranked_by_cosine_similarity(search, query, vectors, root):
+    results = search.search_vector(query, k=10)
+    expected = sorted(vectors, reverse=True, key=lambda file_id: np.dot(vectors[file_id], query)
+                      / np.linalg.norm(vectors[file_id]) / np.linalg.norm(query))
+    assert _ids(results) == expected
+    best = results[0]
+    assert (best.path, best.filename, best.mime_type) == (str(root / 'finance/budget.txt'), 'budget.txt', 'text/plain')
+    # Cosine similarities mapped to [0, 1]
+    cosine = np.dot(vectors['budget'], query) / np.linalg.norm(vectors['budget']) / np.linalg.norm(query)
+    assert best.score == pytest.approx((1 + cosine) / 2, abs=1e-5)
+    assert _ids(search.search_vector(query, k=2)) == expected[:2]
+
+
+def test_filters_restrict_the_results(search, query, root):
+    assert sorted(_ids(search.search_vector(query, subtree=str(root / 'legal')))) == ['contract', 'notes']
+    assert _ids(search.search_vector(query, mime_type='application/pdf')) == ['loans', 'contract']
+    assert _ids(search.search_vector(query, hashtag='finance')) == ['budget', 'loans']
+    assert _ids(search.search_vector(query, subtree=str(root / 'finance'), mime_type='application/pdf')) == ['loans']
+    assert search.search_vector(query, hashtag='missing') == []
+
+
+def test_files_removed_from_the_graph_are_left_out(graph, store, query):
+    graph.remove_file('budget')
+    search = SemanticSearch(graph, embed_query=_unused, embedding_store=store)
+    assert _ids(search.search_vector(query, k=2)) == ['loans']
+
+
+def test_local_index_skips_embeddings_of_other_dimensions(vectors, query):
+    index = LocalVectorIndex([
+        ('budget', '/data/budget.txt', 'budget.txt', 'text/plain', ['finance'], list(vectors['budget'])),
+        ('short', '/data/short.txt', 'short.txt', 'text/plain', [], [1.0, 0.0]),
+        ('empty', '/data/empty.txt', 'empty.txt', 'text/plain', [], None),
+    ])
+    assert len(index) == 1
+    assert _ids(index.search(query, 5)) == ['budget']
+    assert index.search(query, 0) == []
+    assert LocalVectorIndex([]).search(query, 5) == []
+
+
+def test_query_text_is_embedded_once(graph, vectors, query):
+    queries = []
+
+    def embed_query(text):
+        queries.append(text)
+        return query
+
+    search = SemanticSearch(graph, embed_query=embed_query)
+    assert search.search('What loans are there?', k=1)[0].file_id == 'budget'
+    assert queries == ['What loans are there?']
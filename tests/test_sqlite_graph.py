@@ -0,0 +1,132 @@
+import pytest
+
+from graph_batch_writer import GraphBatchWriter
+from sqlite_graph import SCHEMA_VERSION, SQLiteGraph
+from storage_backend import StorageBackend
+
+ROOT = '/data'
+DIRECTORY_PATHS = {'root': ROOT, 'sub': f"{ROOT}/sub", 'other': '/other'}
+
+
+@pytest.fixture
+def graph(tmp_path):
+    graph = SQLiteGraph(str(tmp_path / 'graph.db'))
+    yield graph
+    graph.close()
+
+
+def _file(dir_id, name, lastchecked, **properties):
+    """
+    Returns the properties the walk writes for an analysed file.
+    """
+    return dict(filename=name, path=f"{DIRECTORY_PATHS[dir_id]}/{name}", filetype='txt',
+                mime_type='text/plain', lastmodified=1.0, filesize=10, lastchecked=lastchecked, **properties)
+
+
+def _write_tree(graph, lastchecked=1.0):
+    """
+    Writes /data with a.txt and sub/b.txt, and /other with c.txt, through the batch writer.
+    """
+    with GraphBatchWriter(graph, flush_interval=None) as writer:
+        writer.add_directory('root', None, 'data', lastchecked, path=ROOT)
+        writer.add_directory('sub', 'root', 'sub', lastchecked, path=f"{ROOT}/sub")
+        writer.add_directory('other', None, 'other', lastchecked, path='/other')
+        writer.add_file('a', 'root', ['budget', 'report'],
+                        **_file('root', 'a.txt', lastchecked, summary='A budget.', num_tokens=5,
+                                embedded_summary=[1.0, 0.0]))
+        writer.add_file('b', 'sub', ['report'],
+                        **_file('sub', 'b.txt', lastchecked, summary='A report.', num_tokens=7,
+                                embedded_summary=[0.0, 1.0]))
+        writer.add_file('c', 'other', ['misc'], **_file('other', 'c.txt', lastchecked, summary='Other.'))
+
+
+def test_implements_the_storage_backend(graph):
+    assert isinstance(graph, StorageBackend)
+    assert graph.schema_version() == SCHEMA_VERSION
+    assert graph.ensure_schema() == SCHEMA_VERSION
+
+
+def test_batch_writes_build_the_tree(graph):
+    _write_tree(graph)
+    assert graph.count_nodes() == 3 + 3 + 3
+    assert sorted(graph.get_file_hashtags('a')) == ['budget', 'report']
+    node = graph.get_file_node('b')
+    assert node['summary'] == 'A report.'
+    assert node['embedded_summary'] == [0.0, 1.0]
+    assert sorted(graph.stream_file_states('root')) == [('a', 1.0, 10, 'text/plain'), ('b', 1.0, 10, 'text/plain')]
+    assert sorted(graph.filter_file_ids(hashtag='report')) == ['a', 'b']
+    assert graph.filter_file_ids(mime_type='text/plain', hashtag='misc') == ['c']
+    assert graph.get_file_nodes(['a', 'missing']) == {'a': (f"{ROOT}/a.txt", 'a.txt', 'text/plain')}
+
+
+def test_reanalysis_replaces_hashtags(graph):
+    _write_tree(graph)
+    with GraphBatchWriter(graph, flush_interval=None) as writer:
+        writer.add_file('a', 'root', ['invoice'], **_file('root', 'a.txt', 2.0, summary='An invoice.'))
+    assert graph.get_file_hashtags('a') == ['invoice']
+    # The embedding is kept when the new row does not carry one
+    assert graph.get_file_node('a')['embedded_summary'] == [1.0, 0.0]
+    assert graph.cleanup_orphaned_hashtags() == 1
+    assert graph.count_nodes() == 3 + 3 + 3
+
+
+def test_unanalysed_files_keep_their_analysis(graph):
+    _write_tree(graph)
+    with GraphBatchWriter(graph, flush_interval=None) as writer:
+        writer.add_unanalysed_file('a', 'root', filename='a.txt', path=f"{ROOT}/a.txt", lastmodified=None,
+                                   lastchecked=2.0)
+        writer.add_unanalysed_file('d', 'root', filename='d.txt', path=f"{ROOT}/d.txt", lastmodified=None,
+                                   lastchecked=2.0)
+    node = graph.get_file_node('a')
+    assert (node['summary'], node['num_tokens']) == ('A budget.', 5)
+    # A null property is removed, so the next walk sees the file as changed
+    assert 'lastmodified' not in node
+    assert node['embedded_summary'] == [1.0, 0.0]
+    assert sorted(graph.get_file_hashtags('a')) == ['budget', 'report']
+    new = graph.get_file_node('d')
+    assert (new['summary'], new['num_tokens']) == ('', 0)
+    assert 'embedded_summary' not in new
+
+
+def test_sweep_stale(graph):
+    _write_tree(graph)
+    # The latest walk saw both directories and a.txt, but not b.txt
+    with GraphBatchWriter(graph, flush_interval=None) as writer:
+        writer.add_directory('root', None, 'data', 2.0, path=ROOT)
+        writer.add_directory('sub', 'root', 'sub', 2.0, path=f"{ROOT}/sub")
+        writer.touch_file('a', 2.0)
+    assert graph.sweep_stale(ROOT, 2.0) == (1, 0)
+    assert graph.get_file_node('b') is None
+    assert graph.get_file_node('a')['lastchecked'] == 2.0
+    # Nodes outside the crawled root are left alone
+    assert graph.get_file_node('c') is not None
+    assert graph.sweep_stale(ROOT, 3.0) == (1, 1)
+    assert graph.count_nodes() == 2 + 1 + 3
+
+
+def test_remove_subtree_and_orphaned_hashtags(graph):
+    _write_tree(graph)
+    assert graph.remove_subtree(f"{ROOT}/sub") == 2
+    assert graph.subtree_nodes('root') == [(True, 'root', ROOT), (False, 'a', f"{ROOT}/a.txt")]
+    assert graph.remove_subtree('/other') == 2
+    assert graph.cleanup_orphaned_hashtags() == 1
+    assert graph.count_nodes() == 1 + 1 + 2
+
+
+def test_stream_embeddings(graph):
+    _write_tree(graph)
+    rows = sorted(graph.stream_embeddings())
+    assert rows == [('a', f"{ROOT}/a.txt", 'a.txt', 'text/plain', ['budget', 'report'], [1.0, 0.0]),
+                    ('b', f"{ROOT}/sub/b.txt", 'b.txt', 'text/plain', ['report'], [0.0, 1.0])]
+
+
+def test_relocate_keeps_contents_and_hashtags(graph):
+    _write_tree(graph)
+    graph.relocate_directories([{'old_id': 'sub', 'dir_id': 'moved', 'parent_dir_id': 'root',
+                                 'dirname': 'moved', 'path': f"{ROOT}/moved"}])
+    graph.relocate_files([{'old_id': 'b', 'file_id': 'b2', 'dir_id': 'moved', 'filename': 'b.txt',
+                           'filetype': 'txt', 'path': f"{ROOT}/moved/b.txt"}])
+    assert [node_id for _, node_id, _ in graph.subtree_nodes('moved')] == ['moved', 'b2']
+    assert graph.get_file_hashtags('b2') == ['report']
+    graph.remove_file('b2')
+    assert graph.cleanup_orphaned_hashtags() == 0
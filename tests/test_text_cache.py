@@ -0,0 +1,43 @@
+import itertools
+
+import pytest
+
+import text_cache
+from text_cache import TextCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Makes every cache access one second later than the last, so LRU order does not depend on timer
+    resolution.
+    """
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(text_cache.time, 'time', lambda: float(next(ticks)))
+
+
+def test_text_round_trip_and_persistence(tmp_path):
+    path = str(tmp_path / 'text.db')
+    text = "Page 1: budget\n" * 1000 + "non-ASCII: é中"
+    with TextCache(path) as cache:
+        assert cache.get('digest') is None
+        cache.put('digest', text, 'local-pypdf')
+        assert cache.get('digest') == (text, 'local-pypdf')
+    with TextCache(path) as cache:
+        assert cache.get('digest') == (text, 'local-pypdf')
+        # Stored compressed
+        assert cache.stats()['bytes'] < len(text)
+
+
+def test_text_evicts_least_recently_used(tmp_path, clock):
+    with TextCache(str(tmp_path / 'text.db')) as cache:
+        cache.put('a', 'document one', 'azure')
+        cache.put('b', 'document two', 'azure')
+        entry_bytes = cache.stats()['bytes'] // 2
+        # Room for two entries after eviction, which stops at 90% of the limit
+        cache.max_bytes = int(entry_bytes * 2.3)
+        cache.get('a')
+        cache.put('c', 'document six', 'azure')
+        assert cache.get('b') is None
+        assert cache.get('a') == ('document one', 'azure')
+        assert cache.stats()['evictions'] == 1
@@ -0,0 +1,119 @@
+import zipfile
+
+import pytest
+
+import text_extractor
+from text_cache import TextCache
+from text_extractor import AZURE_SOURCE, DOCX, LOCAL_SOURCE, PPTX, XLSX, convert_document, extract_text
+
+W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+A = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+S = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+P = 'http://schemas.openxmlformats.org/presentationml/2006/main'
+R = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PR = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+
+def _archive(path, parts):
+    with zipfile.ZipFile(path, 'w') as archive:
+        for name, content in parts.items():
+            archive.writestr(name, content)
+    return str(path)
+
+
+def _rels(targets):
+    return (f'<Relationships xmlns="{PR}">'
+            + ''.join(f'<Relationship Id="{rid}" Target="{target}"/>' for rid, target in targets.items())
+            + '</Relationships>')
+
+
+def _docx(path, paragraphs):
+    body = ''.join(f'<w:p><w:r><w:t>{text}</w:t></w:r></w:p>' for text in paragraphs)
+    return _archive(path, {'word/document.xml': f'<w:document xmlns:w="{W}"><w:body>{body}</w:body></w:document>'})
+
+
+def test_docx_paragraphs_become_lines(tmp_path):
+    path = _docx(tmp_path / 'a.docx', ['Quarterly budget', 'Second paragraph'])
+    assert extract_text(path, DOCX) == 'Quarterly budget\nSecond paragraph\n'
+    assert extract_text(path, DOCX, max_chars=10) == 'Quarterly '
+
+
+def test_xlsx_rows_follow_workbook_order(tmp_path):
+    sheet = (f'<worksheet xmlns="{S}"><sheetData>'
+             '<row><c t="s"><v>0</v></c><c><v>42</v></c></row>'
+             '<row><c t="inlineStr"><is><t>inline</t></is></c><c t="b"><v>1</v></c></row>'
+             '</sheetData></worksheet>')
+    path = _archive(tmp_path / 'a.xlsx', {
+        'xl/workbook.xml': (f'<workbook xmlns="{S}" xmlns:r="{R}"><sheets>'
+                            '<sheet name="Second" r:id="rId2"/><sheet name="First" r:id="rId1"/>'
+                            '</sheets></workbook>'),
+        'xl/_rels/workbook.xml.rels': _rels({'rId1': 'worksheets/sheet1.xml', 'rId2': 'worksheets/sheet2.xml'}),
+        'xl/sharedStrings.xml': (f'<sst xmlns="{S}"><si><r><t>Bud</t></r><r><t>get</t></r>'
+                                 '<rPh><t>ignored</t></rPh></si></sst>'),
+        'xl/worksheets/sheet1.xml': sheet,
+        'xl/worksheets/sheet2.xml': f'<worksheet xmlns="{S}"><sheetData/></worksheet>',
+    })
+    assert extract_text(path, XLSX) == 'Second\n\nFirst\nBudget\t42\ninline\tTRUE\n\n'
+
+
+def test_pptx_slides_follow_presentation_order(tmp_path):
+    def slide(text):
+        return f'<p:sld xmlns:p="{P}" xmlns:a="{A}"><a:p><a:r><a:t>{text}</a:t></a:r></a:p></p:sld>'
+
+    path = _archive(tmp_path / 'a.pptx', {
+        'ppt/presentation.xml': (f'<p:presentation xmlns:p="{P}" xmlns:r="{R}"><p:sldIdLst>'
+                                 '<p:sldId r:id="rId2"/><p:sldId r:id="rId1"/></p:sldIdLst></p:presentation>'),
+        'ppt/_rels/presentation.xml.rels': _rels({'rId1': 'slides/slide1.xml', 'rId2': '/ppt/slides/slide2.xml'}),
+        'ppt/slides/slide1.xml': slide('Last'),
+        'ppt/slides/slide2.xml': slide('First'),
+    })
+    assert extract_text(path, PPTX) == 'First\n\nLast\n\n'
+
+
+def test_documents_without_a_local_extractor():
+    assert extract_text('/data/a.txt', 'text/plain') is None
+
+
+@pytest.mark.parametrize('text,expected', [(None, False), ('', False), (' x ' * 31, False),
+                                           ('\n' * 10 ** 6 + 'x' * 32, True), ('word ' * 10 ** 6, True)])
+def test_has_text_counts_non_blank_characters(text, expected):
+    assert text_extractor._has_text(text) is expected
+
+
+@pytest.fixture
+def azure(monkeypatch):
+    """
+    Replaces the Azure conversion, returning the paths it was called with.
+    """
+    paths = []
+
+    def azure_doc_converter(file_path):
+        paths.append(file_path)
+        return 'Text read by Azure.'
+
+    monkeypatch.setattr(text_extractor, 'azure_doc_converter', azure_doc_converter)
+    return paths
+
+
+def test_local_text_is_cached(tmp_path, azure):
+    path = _docx(tmp_path / 'a.docx', ['A quarterly budget with enough text to be analysed.'])
+    with TextCache(str(tmp_path / 'text.db')) as cache:
+        text = convert_document(path, DOCX, text_cache=cache, digest='digest')
+        assert text.startswith('A quarterly budget')
+        assert cache.get('digest') == (text, LOCAL_SOURCE)
+        assert convert_document(path, DOCX, text_cache=cache, digest='digest') == text
+    assert azure == []
+
+
+@pytest.mark.parametrize('content', [['Too short.'], None])
+def test_documents_without_local_text_go_to_azure(tmp_path, azure, content):
+    path = str(tmp_path / 'a.docx')
+    if content is None:
+        (tmp_path / 'a.docx').write_bytes(b'not a zip archive')
+    else:
+        _docx(path, content)
+    with TextCache(str(tmp_path / 'text.db')) as cache:
+        assert convert_document(path, DOCX, text_cache=cache, digest='digest') == 'Text read by Azure.'
+        assert cache.get('digest') == ('Text read by Azure.', AZURE_SOURCE)
+        convert_document(path, DOCX, text_cache=cache, digest='digest')
+    assert azure == [path]
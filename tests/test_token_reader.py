@@ -0,0 +1,62 @@
+import pytest
+
+import token_reader
+from token_reader import get_encoder, read_file_tokens, read_text_tokens
+
+TEXT = ''.join(f"Line {index}: the quarterly budget, in € and 円.\n" for index in range(200))
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    """
+    Reads in pieces of a few bytes, so multi-byte characters and words straddle the pieces.
+    """
+    monkeypatch.setattr(token_reader, 'CHUNK_BYTES', 37)
+    monkeypatch.setattr(token_reader, 'MAX_CARRY_CHARS', 4 * 37)
+
+
+@pytest.fixture
+def document(tmp_path):
+    path = tmp_path / 'report.txt'
+    path.write_text(TEXT, encoding='utf-8')
+    return str(path)
+
+
+@pytest.mark.parametrize('mmap_threshold', [token_reader.MMAP_THRESHOLD, 0])
+def test_chunked_read_matches_encoding_the_whole_file(document, small_chunks, monkeypatch, mmap_threshold):
+    monkeypatch.setattr(token_reader, 'MMAP_THRESHOLD', mmap_threshold)
+    expected = get_encoder().encode(TEXT, disallowed_special=())
+    assert read_file_tokens(document, max_tokens=10 ** 9) == (TEXT, expected, len(expected))
+
+
+def test_reading_stops_after_max_tokens(document, small_chunks):
+    total = len(get_encoder().encode(TEXT, disallowed_special=()))
+    text, tokens, num_tokens = read_file_tokens(document, max_tokens=50)
+    assert 50 < len(tokens) < total // 2
+    assert TEXT.startswith(text)
+    assert tokens == get_encoder().encode(text, disallowed_special=())
+    # The rest of the file is estimated from its size
+    assert num_tokens > len(tokens)
+
+
+def test_text_without_whitespace_is_still_encoded(tmp_path, small_chunks):
+    path = tmp_path / 'blob.txt'
+    path.write_text('x' * 1000)
+    text, tokens, num_tokens = read_file_tokens(str(path), max_tokens=10 ** 9)
+    assert text == 'x' * 1000
+    assert num_tokens == len(tokens) > 0
+
+
+def test_non_utf8_file_is_rejected(tmp_path):
+    path = tmp_path / 'latin1.txt'
+    path.write_bytes('Budget: 100 €'.encode('utf-8') + b' caf\xe9')
+    with pytest.raises(ValueError, match='UTF-8'):
+        read_file_tokens(str(path), max_tokens=10 ** 9)
+
+
+def test_read_text_tokens(small_chunks):
+    expected = get_encoder().encode(TEXT, disallowed_special=())
+    assert read_text_tokens(TEXT, max_tokens=10 ** 9) == (TEXT, expected, len(expected))
+    text, tokens, num_tokens = read_text_tokens(TEXT, max_tokens=50)
+    assert TEXT.startswith(text)
+    assert len(tokens) < num_tokens
@@ -0,0 +1,156 @@
+import os
+
+import pytest
+
+from tree_scanner import DEFAULT_IGNORE_PATTERNS, IgnoreRules, TreeScanner, count_entries
+
+
+@pytest.mark.parametrize('patterns,rel_path,is_dir,ignored', [
+    (['*.log'], 'debug.log', False, True),
+    (['*.log'], 'deep/down/debug.log', False, True),
+    (['*.log'], 'debug.log.txt', False, False),
+    # A pattern containing a slash is anchored to the root
+    (['docs/*.md'], 'docs/a.md', False, True),
+    (['docs/*.md'], 'x/docs/a.md', False, False),
+    (['/build'], 'build', True, True),
+    (['/build'], 'src/build', True, False),
+    # A trailing slash only matches directories
+    (['build/'], 'build', True, True),
+    (['build/'], 'build', False, False),
+    (['**/tmp'], 'a/b/tmp', True, True),
+    (['a/**/z.txt'], 'a/z.txt', False, True),
+    (['a/**/z.txt'], 'a/b/c/z.txt', False, True),
+    (['*'], 'a/b', False, True),
+    (['file?.txt'], 'file1.txt', False, True),
+    (['file?.txt'], 'file10.txt', False, False),
+    (['file[0-2].txt'], 'file2.txt', False, True),
+    (['file[!0-2].txt'], 'file2.txt', False, False),
+    # The last matching rule wins
+    (['*.log', '!keep.log'], 'keep.log', False, False),
+    (['!keep.log', '*.log'], 'keep.log', False, True),
+    (['# comment', '', '   '], 'comment', False, False),
+])
+def test_ignore_rules(patterns, rel_path, is_dir, ignored):
+    assert IgnoreRules(patterns).is_ignored(rel_path, is_dir) is ignored
+
+
+def test_rules_file(tmp_path):
+    path = tmp_path / 'crawlignore'
+    path.write_text('# Build output\nbuild/\n*.tmp\n!important.tmp\n')
+    rules = IgnoreRules.from_file(str(path))
+    assert rules.is_ignored('build', True)
+    assert rules.is_ignored('a/b.tmp', False)
+    assert not rules.is_ignored('important.tmp', False)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """
+    root/
+        a.txt, big.txt, notes.md, debug.log
+        .git/config
+        docs/b.txt, docs/keep.log
+        docs/drafts/c.txt
+        node_modules/lib.js
+    """
+    root = tmp_path / 'root'
+    for directory in ('.git', 'docs/drafts', 'node_modules'):
+        (root / directory).mkdir(parents=True)
+    for name, size in [('a.txt', 10), ('big.txt', 5000), ('notes.md', 10), ('debug.log', 10), ('.git/config', 10),
+                       ('docs/b.txt', 10), ('docs/keep.log', 10), ('docs/drafts/c.txt', 10),
+                       ('node_modules/lib.js', 10)]:
+        (root / name).write_bytes(b'x' * size)
+    return root
+
+
+def _events(scanner, root, **options):
+    return [(event, os.path.relpath(path, root)) for event, path, _ in scanner.scan(str(root), **options)]
+
+
+def _files(events):
+    return sorted(path for event, path in events if event == 'file')
+
+
+def test_scan_yields_directories_before_their_contents(tree):
+    events = _events(TreeScanner(IgnoreRules(DEFAULT_IGNORE_PATTERNS)), tree)
+    assert _files(events) == ['a.txt', 'big.txt', 'debug.log', os.path.join('docs', 'b.txt'),
+                              os.path.join('docs', 'drafts', 'c.txt'), os.path.join('docs', 'keep.log'), 'notes.md']
+    # Version control metadata and dependencies are skipped by default
+    assert not any(path.startswith(('.git', 'node_modules')) for _, path in events)
+    for index, (event, path) in enumerate(events):
+        if event in ('file', 'directory') and path != '.':
+            assert ('directory', os.path.dirname(path) or '.') in events[:index]
+        if event == 'listed':
+            # Its subdirectories have all been yielded, their contents may follow
+            later = [other for other_event, other in events[index + 1:] if other_event == 'directory']
+            assert not any(os.path.dirname(other) == (path if path != '.' else '') for other in later)
+    assert events[0] == ('directory', '.')
+    assert events[-1] == ('listed', os.path.join('docs', 'drafts'))
+
+
+def test_listed_counts_every_entry(tree):
+    scanner = TreeScanner(IgnoreRules(DEFAULT_IGNORE_PATTERNS + ['*.log', 'docs/']))
+    counts = {os.path.relpath(path, tree): value for event, path, value in scanner.scan(str(tree))
+              if event == 'listed'}
+    assert counts == {'.': count_entries(str(tree))}
+    assert count_entries(str(tree)) == 7
+
+
+def test_filters(tree):
+    scanner = TreeScanner(IgnoreRules(DEFAULT_IGNORE_PATTERNS + ['*.log', '!docs/keep.log', 'drafts/']),
+                          max_file_size=1000,
+                          exclude_extensions=['MD'])
+    assert _files(_events(scanner, tree)) == ['a.txt', os.path.join('docs', 'b.txt'), os.path.join('docs', 'keep.log')]
+    scanner = TreeScanner(include_extensions=['log'], min_file_size=1)
+    assert _files(_events(scanner, tree)) == ['debug.log', os.path.join('docs', 'keep.log')]
+    assert scanner.accepts('x/y.log', False) and not scanner.accepts('x/y.txt', False)
+    assert _files(_events(scanner, tree, files=False)) == []
+
+
+def test_excluded_directory_cannot_be_re_included(tree):
+    events = _events(TreeScanner(IgnoreRules(['docs/', '!docs/b.txt'])), tree)
+    assert not any(path.startswith('docs') for _, path in events)
+
+
+def test_pruned_subtree_is_not_read(tree):
+    events = _events(TreeScanner(), tree, prune=lambda path, stat_result: path.endswith('docs'))
+    assert ('pruned', 'docs') in events
+    assert not any(path.startswith('docs' + os.sep) for _, path in events)
+
+
+def test_known_listing_replaces_reading_a_directory(tree, monkeypatch):
+    scandir = os.scandir
+    read = []
+
+    def recording_scandir(path):
+        read.append(os.path.relpath(path, tree))
+        return scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', recording_scandir)
+
+    def listing(path, stat_result):
+        if path == str(tree / 'docs'):
+            return [('b.txt', False), ('drafts', True)], 3
+        return None
+
+    events = _events(TreeScanner(), tree, listing=listing)
+    assert 'docs' not in read
+    assert os.path.join('docs', 'drafts') in read
+    # keep.log is not in the listing; drafts is still descended into
+    assert [path for path in _files(events) if path.startswith('docs')] == \
+        [os.path.join('docs', 'b.txt'), os.path.join('docs', 'drafts', 'c.txt')]
+
+
+def test_unreadable_directory_is_reported(tree, monkeypatch):
+    scandir = os.scandir
+
+    def failing_scandir(path):
+        if path == str(tree / 'docs'):
+            raise PermissionError(13, 'Permission denied', path)
+        return scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', failing_scandir)
+    events = _events(TreeScanner(), tree)
+    assert ('unreadable', 'docs') in events
+    assert ('listed', 'docs') not in events
+    assert not any(path.startswith('docs' + os.sep) for _, path in events)
@@ -0,0 +1,135 @@
+import os
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+import walk_file_system
+from crawl_journal import CrawlJournal
+from sqlite_graph import SQLiteGraph
+from path_identity import node_id
+from walk_file_system import walk_file_system as walk
+
+
+class PlainTextDetector:
+    """
+    Detects every file as plain text, without libmagic.
+    """
+
+    def detect(self, path, stat_result=None):
+        return 'text/plain'
+
+    def stats(self):
+        return {}
+
+
+@pytest.fixture
+def graph(tmp_path):
+    graph = SQLiteGraph(str(tmp_path / 'graph.db'))
+    yield graph
+    graph.close()
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / 'tree'
+    (root / 'sub').mkdir(parents=True)
+    (root / 'good.txt').write_text('A quarterly budget.')
+    (root / 'sub' / 'bad.txt').write_bytes(b'\xff\xfe not UTF-8')
+    return root
+
+
+@pytest.fixture
+def analysed(monkeypatch):
+    """
+    Replaces the model calls with a fake analysis that fails for files that are not UTF-8, and returns
+    the paths analysed.
+    """
+    paths = []
+
+    def analyse_file(file_path, mime_type, text_cache=None, digest=None, defer_embedding=False):
+        paths.append(file_path)
+        with open(file_path, 'rb') as file:
+            file.read().decode('utf-8')
+        if not defer_embedding:
+            return 3, 'A summary.', [1.0, 0.0], ['budget']
+        # Resolved later, like an embedding sent in a batch
+        embedding = Future()
+        threading.Timer(0.05, embedding.set_result, ([1.0, 0.0],)).start()
+        return 3, 'A summary.', embedding, ['budget']
+
+    async def aanalyse_file(file_path, mime_type, text_cache=None, digest=None, defer_embedding=False):
+        return analyse_file(file_path, mime_type, text_cache, digest, defer_embedding)
+
+    monkeypatch.setattr(walk_file_system, 'analyse_file', analyse_file)
+    monkeypatch.setattr(walk_file_system, 'aanalyse_file', aanalyse_file)
+    return paths
+
+
+@pytest.mark.parametrize('workers,async_analysis', [(1, False), (4, False), (4, True)])
+def test_failed_analysis_does_not_stop_the_walk(graph, tree, analysed, workers, async_analysis):
+    walk(str(tree), graph, workers=workers, async_analysis=async_analysis, mime_detector=PlainTextDetector())
+    good = graph.get_file_node(node_id(str(tree / 'good.txt')))
+    assert (good['analysis_status'], good['summary']) == ('analysed', 'A summary.')
+    bad = graph.get_file_node(node_id(str(tree / 'sub' / 'bad.txt')))
+    assert bad['analysis_status'] == 'failed'
+    assert bad['mime_type'] == 'text/plain'
+    # No lastmodified, so the next walk tries again
+    assert 'lastmodified' not in bad
+
+    analysed.clear()
+    walk(str(tree), graph, mime_detector=PlainTextDetector())
+    assert analysed == [str(tree / 'sub' / 'bad.txt')]
+
+
+def test_failing_file_is_skipped_after_max_attempts(graph, tree, analysed, tmp_path):
+    bad_path = str(tree / 'sub' / 'bad.txt')
+    bad_id = node_id(bad_path)
+    for attempt in range(2):
+        with CrawlJournal(str(tmp_path / 'journal.db'), max_attempts=2) as journal:
+            walk(str(tree), graph, mime_detector=PlainTextDetector(), journal=journal)
+        assert graph.get_file_node(bad_id)['analysis_status'] == 'failed'
+
+    analysed.clear()
+    with CrawlJournal(str(tmp_path / 'journal.db'), max_attempts=2) as journal:
+        walk(str(tree), graph, mime_detector=PlainTextDetector(), journal=journal)
+    assert analysed == []
+    assert graph.get_file_node(bad_id)['analysis_status'] == 'skipped'
+
+    # A successful analysis clears the file's attempts
+    (tree / 'sub' / 'bad.txt').write_text('Fixed.')
+    with CrawlJournal(str(tmp_path / 'journal.db'), max_attempts=2) as journal:
+        walk(str(tree), graph, mime_detector=PlainTextDetector(), journal=journal)
+        assert journal._conn.execute("SELECT COUNT(*) FROM in_flight").fetchone()[0] == 0
+    assert graph.get_file_node(bad_id)['analysis_status'] == 'analysed'
+
+
+def test_unreadable_directory_keeps_its_nodes(graph, tree, analysed, monkeypatch):
+    (tree / 'sub' / 'deeper').mkdir()
+    (tree / 'sub' / 'deeper' / 'c.txt').write_text('A contract.')
+    walk(str(tree), graph, mime_detector=PlainTextDetector())
+    count = graph.count_nodes()
+    scandir = os.scandir
+
+    def failing_scandir(path):
+        if path == str(tree / 'sub'):
+            raise PermissionError(13, 'Permission denied', path)
+        return scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', failing_scandir)
+    walk(str(tree), graph, mime_detector=PlainTextDetector())
+    # The cleanup removed nothing below the directory it could not read
+    assert graph.count_nodes() == count
+    assert graph.get_file_node(node_id(str(tree / 'sub' / 'deeper' / 'c.txt'))) is not None
+
+
+@pytest.mark.parametrize('use_inode', [False, True])
+def test_unchanged_files_are_not_analysed_again(graph, tree, analysed, use_inode):
+    (tree / 'sub' / 'bad.txt').write_text('A contract.')
+    walk(str(tree), graph, use_inode=use_inode, mime_detector=PlainTextDetector())
+    assert len(analysed) == 2
+    count = graph.count_nodes()
+    analysed.clear()
+    walk(str(tree), graph, use_inode=use_inode, mime_detector=PlainTextDetector())
+    assert analysed == []
+    assert graph.count_nodes() == count
@@ -0,0 +1,186 @@
+import os
+
+import pytest
+
+import walk_file_system
+from linux_inotify import (InotifyEvent, IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_ISDIR, IN_MOVED_FROM,
+                           IN_MOVED_TO, IN_Q_OVERFLOW)
+from path_identity import node_id
+from sqlite_graph import SQLiteGraph
+from watch_file_system import ChangeSet, FileSystemWatcher
+
+
+class PlainTextDetector:
+    """
+    Detects every file as plain text, without libmagic.
+    """
+
+    def detect(self, path, stat_result=None):
+        return 'text/plain'
+
+    def stats(self):
+        return {}
+
+
+class FakeInotify:
+    """
+    Hands out watch descriptors without watching anything; the tests deliver the events themselves.
+    """
+
+    def __init__(self):
+        self.next_wd = 0
+
+    def add_watch(self, path, mask):
+        self.next_wd += 1
+        return self.next_wd
+
+    def rm_watch(self, wd):
+        pass
+
+
+
+
+def test_change_set_coalesces_a_burst():
+    changes = ChangeSet()
+    changes.file_changed('/t/a.txt')
+    changes.file_changed('/t/a.txt')
+    changes.file_changed('/t/tmp.txt')
+    changes.removed('/t/tmp.txt', False)
+    changes.directory_created('/t/new')
+    changes.file_changed('/t/new/b.txt')
+    # The new directory is renamed before anything was applied
+    changes.moved_from(1, '/t/new', True)
+    assert changes.moved_to(1, '/t/renamed', True) == '/t/new'
+    changes.moved_from(2, '/t/gone.txt', False)
+    changes.finish()
+    assert changes.changed_files == {'/t/a.txt', '/t/renamed/b.txt'}
+    assert changes.created_dirs == {'/t/renamed'}
+    assert changes.moves == [('/t/new', '/t/renamed', True)]
+    # A move whose other half never arrived left the tree
+    assert changes.deleted == {'/t/tmp.txt': False, '/t/gone.txt': False}
+
+
+def test_move_into_the_tree_is_a_creation():
+    changes = ChangeSet()
+    assert changes.moved_to(7, '/t/in.txt', False) is None
+    assert changes.moved_to(8, '/t/indir', True) is None
+    assert (changes.changed_files, changes.created_dirs, changes.moves) == ({'/t/in.txt'}, {'/t/indir'}, [])
+
+
+@pytest.fixture
+def analysed(monkeypatch):
+    """
+    Replaces the model calls with a fake analysis and returns the paths analysed.
+    """
+    paths = []
+
+    def analyse_file(file_path, mime_type, text_cache=None, digest=None, defer_embedding=False):
+        paths.append(file_path)
+        return 3, f"Summary of {os.path.basename(file_path)}.", [1.0, 0.0], ['budget']
+
+    monkeypatch.setattr(walk_file_system, 'analyse_file', analyse_file)
+    return paths
+
+
+@pytest.fixture
+def watcher(tmp_path, analysed):
+    """
+    A watcher on a crawled tree holding a.txt, docs/b.txt and docs/old/c.txt, with fake watches.
+    """
+    root = tmp_path / 'tree'
+    (root / 'docs' / 'old').mkdir(parents=True)
+    for name in ('a.txt', 'docs/b.txt', 'docs/old/c.txt'):
+        (root / name).write_text(f"The content of {name}.")
+    graph = SQLiteGraph(str(tmp_path / 'graph.db'))
+    watcher = FileSystemWatcher(str(root), graph, mime_detector=PlainTextDetector())
+    watcher._inotify = FakeInotify()
+    watcher._watch_tree(watcher.root_dir)
+    watcher._walk()
+    analysed.clear()
+    yield watcher
+    graph.close()
+
+
+def _deliver(watcher, *events):
+    """
+    Handles (directory relative to the root, mask, name[, cookie]) events in order, as the kernel would
+    report them on the watch of the directory, and applies the change set.
+    """
+    changes = ChangeSet()
+    for directory, mask, name, *cookie in events:
+        wd = watcher._watched_paths[os.path.normpath(os.path.join(watcher.root_dir, directory))]
+        watcher._handle_event(InotifyEvent(wd, mask, cookie[0] if cookie else 0, name), changes)
+    watcher._apply(changes)
+
+
+def _node(watcher, *parts):
+    return watcher.fs_graph.get_file_node(node_id(os.path.join(watcher.root_dir, *parts)))
+
+
+def test_moved_directory_keeps_its_analysis(watcher, analysed):
+    root = watcher.root_dir
+    os.rename(os.path.join(root, 'docs'), os.path.join(root, 'papers'))
+    _deliver(watcher, ('', IN_MOVED_FROM | IN_ISDIR, 'docs', 5),
+             ('', IN_MOVED_TO | IN_ISDIR, 'papers', 5))
+    assert analysed == []
+    assert _node(watcher, 'docs', 'b.txt') is None
+    moved = _node(watcher, 'papers', 'old', 'c.txt')
+    assert (moved['summary'], moved['path']) == ('Summary of c.txt.', os.path.join(root, 'papers', 'old', 'c.txt'))
+    assert sorted(path for _, _, path in watcher.fs_graph.subtree_nodes(node_id(os.path.join(root, 'papers')))) == \
+        sorted(os.path.join(root, 'papers', *parts) for parts in [(), ('old',), ('b.txt',), ('old', 'c.txt')])
+    # The watches follow the directory
+    assert os.path.join(root, 'papers', 'old') in watcher._watched_paths
+
+
+def test_moved_file_keeps_its_analysis_and_hashtags(watcher, analysed):
+    root = watcher.root_dir
+    os.rename(os.path.join(root, 'a.txt'), os.path.join(root, 'docs', 'renamed.txt'))
+    _deliver(watcher, ('', IN_MOVED_FROM, 'a.txt', 9),
+             ('docs', IN_MOVED_TO, 'renamed.txt', 9))
+    assert analysed == []
+    assert _node(watcher, 'a.txt') is None
+    assert _node(watcher, 'docs', 'renamed.txt')['summary'] == 'Summary of a.txt.'
+    assert watcher.fs_graph.get_file_hashtags(node_id(os.path.join(root, 'docs', 'renamed.txt'))) == ['budget']
+
+
+def test_deletes_remove_files_and_subtrees(watcher, analysed):
+    root = watcher.root_dir
+    os.remove(os.path.join(root, 'docs', 'old', 'c.txt'))
+    os.rmdir(os.path.join(root, 'docs', 'old'))
+    os.remove(os.path.join(root, 'a.txt'))
+    _deliver(watcher, ('docs/old', IN_DELETE, 'c.txt'),
+             ('docs', IN_DELETE | IN_ISDIR, 'old'),
+             ('', IN_DELETE, 'a.txt'))
+    assert _node(watcher, 'a.txt') is None
+    assert _node(watcher, 'docs', 'old', 'c.txt') is None
+    assert _node(watcher, 'docs', 'b.txt') is not None
+    assert watcher.fs_graph.count_nodes() == 2 + 1 + 1
+    assert os.path.join(root, 'docs', 'old') not in watcher._watched_paths
+
+
+def test_moved_out_of_the_tree_is_deleted(watcher, tmp_path):
+    os.rename(os.path.join(watcher.root_dir, 'docs'), str(tmp_path / 'outside'))
+    _deliver(watcher, ('', IN_MOVED_FROM | IN_ISDIR, 'docs', 3))
+    assert _node(watcher, 'docs', 'b.txt') is None
+    assert watcher.fs_graph.count_nodes() == 1 + 1 + 1
+
+
+def test_new_and_changed_files_are_analysed(watcher, analysed):
+    root = watcher.root_dir
+    os.makedirs(os.path.join(root, 'new'))
+    with open(os.path.join(root, 'new', 'd.txt'), 'w') as file:
+        file.write('A new file.')
+    with open(os.path.join(root, 'a.txt'), 'a') as file:
+        file.write(' Edited.')
+    _deliver(watcher, ('', IN_CREATE | IN_ISDIR, 'new'),
+             ('new', IN_CLOSE_WRITE, 'd.txt'),
+             ('', IN_CLOSE_WRITE, 'a.txt'))
+    assert sorted(analysed) == [os.path.join(root, 'a.txt'), os.path.join(root, 'new', 'd.txt')]
+    assert _node(watcher, 'new', 'd.txt')['summary'] == 'Summary of d.txt.'
+
+
+def test_queue_overflow_requests_a_full_walk(watcher):
+    changes = ChangeSet()
+    watcher._handle_event(InotifyEvent(-1, IN_Q_OVERFLOW, 0, ''), changes)
+    assert watcher._reconcile_due
+    assert not changes